@@ -6,10 +6,51 @@
 #                                                                                                                      #
 # #################################################################################################################### #
 import os
+import sys
+import abc
 from socket import *
 import struct
+import math
+import random
 import time
 import select
+import asyncio
+import bisect
+import heapq
+import itertools
+import ipaddress
+import argparse
+import signal
+import json
+import csv
+import datetime
+import io
+import mmap
+import threading
+import http.server
+import concurrent.futures
+import multiprocessing
+import queue
+import ctypes
+import errno
+from array import array
+from collections import OrderedDict, deque
+
+try:
+    import numpy                # Optional, used to checksum large buffers and to query result archives
+except ImportError:
+    numpy = None
+
+
+# #################################################################################################################### #
+# Platform Constants                                                                                                   #
+#                                                                                                                      #
+# Linux socket options and flags the socket module only exports on some builds. Each comes from the socket module      #
+# where it has it, falls back to the Linux value on Linux, and is None elsewhere, which turns the feature off.         #
+#                                                                                                                      #
+# #################################################################################################################### #
+def getSocketConstant(name, linuxValue):
+    return getattr(sys.modules["socket"], name, linuxValue if sys.platform.startswith("linux") else None)
 
 
 # #################################################################################################################### #
@@ -61,13 +102,21 @@ class IcmpHelperLibrary:
         __header = b''                  # Header after byte packing
         __data = b''                    # Data after encoding
         __dataRaw = ""                  # Raw string data before encoding
+        __dataRawEncoded = b''          # Raw data after encoding, without the timestamp
         __icmpType = 0                  # Valid values are 0-255 (unsigned int, 8 bits)
         __icmpCode = 0                  # Valid values are 0-255 (unsigned int, 8 bits)
         __packetChecksum = 0            # Valid values are 0-65535 (unsigned short, 16 bits)
         __packetIdentifier = 0          # Valid values are 0-65535 (unsigned short, 16 bits)
         __packetSequenceNumber = 0      # Valid values are 0-65535 (unsigned short, 16 bits)
         __ipTimeout = 60
+        __timeout = 30                  # Seconds to wait for the reply
         __ttl = 255                     # Time to live
+        __resolver = None               # IcmpResolver, the shared default one when not set
+
+        __HEADER_STRUCT = struct.Struct("!BBHHH")   # Compiled once instead of parsing the format for every packet
+        __TIME_STRUCT = struct.Struct("d")
+        __DATA_RAW_ECHO_REQUEST = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+        __DATA_ENCODED_ECHO_REQUEST = __DATA_RAW_ECHO_REQUEST.encode("utf-8")
 
         __DEBUG_IcmpPacket = False     # Allows for debug output
 
@@ -84,6 +133,9 @@ class IcmpHelperLibrary:
         def getDataRaw(self):
             return self.__dataRaw
 
+        def getDataRawEncoded(self):
+            return self.__dataRawEncoded
+
         def getIcmpType(self):
             return self.__icmpType
 
@@ -102,6 +154,12 @@ class IcmpHelperLibrary:
         def getTtl(self):
             return self.__ttl
 
+        def getTimeout(self):
+            return self.__timeout
+
+        def getPacketBytes(self):
+            return b''.join([self.__header, self.__data])
+
         # ############################################################################################################ #
         # IcmpPacket Class Setters                                                                                     #
         #                                                                                                              #
@@ -114,7 +172,9 @@ class IcmpHelperLibrary:
 
             # Only attempt to get destination address if it is not whitespace
             if len(self.__icmpTarget.strip()) > 0:
-                self.__destinationIpAddress = gethostbyname(self.__icmpTarget.strip())
+                resolver = self.__resolver if self.__resolver is not None else \
+                    IcmpHelperLibrary.IcmpResolver.getDefaultResolver()
+                self.__destinationIpAddress = resolver.resolve(self.__icmpTarget)
 
         def setIcmpType(self, icmpType):
             self.__icmpType = icmpType
@@ -134,6 +194,12 @@ class IcmpHelperLibrary:
         def setTtl(self, ttl):
             self.__ttl = ttl
 
+        def setTimeout(self, timeout):
+            self.__timeout = timeout
+
+        def setResolver(self, resolver):
+            self.__resolver = resolver
+
         # ############################################################################################################ #
         # IcmpPacket Class Private Functions                                                                           #
         #                                                                                                              #
@@ -144,37 +210,11 @@ class IcmpHelperLibrary:
         def __recalculateChecksum(self):
             print("calculateChecksum Started...") if self.__DEBUG_IcmpPacket else 0
             packetAsByteData = b''.join([self.__header, self.__data])
-            checksum = 0
-
-            # This checksum function will work with pairs of values with two separate 16 bit segments. Any remaining
-            # 16 bit segment will be handled on the upper end of the 32 bit segment.
-            countTo = (len(packetAsByteData) // 2) * 2
 
-            # Calculate checksum for all paired segments
-            print(f'{"Count":10} {"Value":10} {"Sum":10}') if self.__DEBUG_IcmpPacket else 0
-            count = 0
-            while count < countTo:
-                thisVal = packetAsByteData[count + 1] * 256 + packetAsByteData[count]
-                checksum = checksum + thisVal
-                checksum = checksum & 0xffffffff        # Capture 16 bit checksum as 32 bit value
-                print(f'{count:10} {hex(thisVal):10} {hex(checksum):10}') if self.__DEBUG_IcmpPacket else 0
-                count = count + 2
-
-            # Calculate checksum for remaining segment (if there are any)
-            if countTo < len(packetAsByteData):
-                thisVal = packetAsByteData[len(packetAsByteData) - 1]
-                checksum = checksum + thisVal
-                checksum = checksum & 0xffffffff        # Capture as 32 bit value
-                print(count, "\t", hex(thisVal), "\t", hex(checksum)) if self.__DEBUG_IcmpPacket else 0
-
-            # Add 1's Complement Rotation to original checksum
-            checksum = (checksum >> 16) + (checksum & 0xffff)   # Rotate and add to base 16 bits
-            checksum = (checksum >> 16) + checksum              # Rotate and add
-
-            answer = ~checksum                  # Invert bits
-            answer = answer & 0xffff            # Trim to 16 bit value
-            answer = answer >> 8 | (answer << 8 & 0xff00)
+            answer = IcmpHelperLibrary.IcmpChecksum.calculate(packetAsByteData)
             print("Checksum: ", hex(answer)) if self.__DEBUG_IcmpPacket else 0
+            print("Reference Checksum: ", hex(IcmpHelperLibrary.IcmpChecksum.calculateReference(packetAsByteData))) \
+                if self.__DEBUG_IcmpPacket else 0
 
             self.setPacketChecksum(answer)
 
@@ -185,7 +225,7 @@ class IcmpHelperLibrary:
             # ICMP Header Checksum = 16 bits
             # Identifier = 16 bits
             # Sequence Number = 16 bits
-            self.__header = struct.pack("!BBHHH",
+            self.__header = self.__HEADER_STRUCT.pack(
                                    self.getIcmpType(),              #  8 bits / 1 byte  / Format code B
                                    self.getIcmpCode(),              #  8 bits / 1 byte  / Format code B
                                    self.getPacketChecksum(),        # 16 bits / 2 bytes / Format code H
@@ -194,10 +234,14 @@ class IcmpHelperLibrary:
                                    )
 
         def __encodeData(self):
-            data_time = struct.pack("d", time.time())               # Used to track overall round trip time
+            data_time = self.__TIME_STRUCT.pack(time.time())        # Used to track overall round trip time
                                                                     # time.time() creates a 64 bit value of 8 bytes
-            dataRawEncoded = self.getDataRaw().encode("utf-8")
+            if self.getDataRaw() is self.__DATA_RAW_ECHO_REQUEST:
+                dataRawEncoded = self.__DATA_ENCODED_ECHO_REQUEST   # Constant payload is only encoded once
+            else:
+                dataRawEncoded = self.getDataRaw().encode("utf-8")
 
+            self.__dataRawEncoded = dataRawEncoded
             self.__data = data_time + dataRawEncoded
 
         def __packAndRecalculateChecksum(self):
@@ -237,7 +281,7 @@ class IcmpHelperLibrary:
                     if self.__DEBUG_IcmpPacket else 0
             
             # check if packet raw data are the same
-            if icmpReplyPacket.getIcmpData() == self.getDataRaw():
+            if icmpReplyPacket.getIcmpDataBytes() == self.getDataRawEncoded():
                 icmpReplyPacket.setIcmpData_isValid(True)
             else:
                 icmpReplyPacket.setIcmpData_isValid(False)
@@ -256,7 +300,19 @@ class IcmpHelperLibrary:
                 icmpReplyPacket.setIsValidResponse(True)
             else:
                 icmpReplyPacket.setIsValidResponse(False)
-            
+
+        def __describeInvalidReply(self, icmpReplyPacket):
+            # Expected and actual values of whatever did not match, for the result's message
+            mismatches = []
+            if not icmpReplyPacket.getIcmpIdentifier_isValid():
+                mismatches.append("Identifier expected %d, got %d" %
+                                  (self.getPacketIdentifier(), icmpReplyPacket.getIcmpIdentifier()))
+            if not icmpReplyPacket.getIcmpSequenceNumber_isValid():
+                mismatches.append("SequenceNumber expected %d, got %d" %
+                                  (self.getPacketSequenceNumber(), icmpReplyPacket.getIcmpSequenceNumber()))
+            if not icmpReplyPacket.getIcmpData_isValid():
+                mismatches.append("RawData expected %r, got %r" % (self.getDataRaw(), icmpReplyPacket.getIcmpData()))
+            return "; ".join(mismatches)
 
         # ############################################################################################################ #
         # IcmpPacket Class Public Functions                                                                            #
@@ -266,14 +322,37 @@ class IcmpHelperLibrary:
         #                                                                                                              #
         # ############################################################################################################ #
         def buildPacket_echoRequest(self, packetIdentifier, packetSequenceNumber):
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            startNs = time.perf_counter_ns() if metrics is not None else 0
             self.setIcmpType(8)
             self.setIcmpCode(0)
             self.setPacketIdentifier(packetIdentifier)
             self.setPacketSequenceNumber(packetSequenceNumber)
-            self.__dataRaw = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+            self.__dataRaw = self.__DATA_RAW_ECHO_REQUEST
             self.__packAndRecalculateChecksum()
+            if metrics is not None:
+                metrics.recordTiming("build", time.perf_counter_ns() - startNs)
+
+        def updatePacketSequenceNumber(self, sequenceNumber):
+            # Changes the sequence number of an already built packet, adjusting the checksum in O(1) (RFC 1624)
+            checksum = IcmpHelperLibrary.IcmpChecksum.update(self.getPacketChecksum(),
+                                                             self.getPacketSequenceNumber(),
+                                                             sequenceNumber)
+            self.setPacketSequenceNumber(sequenceNumber)
+            self.setPacketChecksum(checksum)
+            self.__packHeader()
 
-        def sendEchoRequest(self):
+        def updateTimestamp(self):
+            # Restamps the send time of an already built packet without rescanning the payload. The timestamp sits
+            # directly after the 8 byte header, so it starts on an even offset as the incremental update requires.
+            oldTime = self.__data[:8]
+            newTime = self.__TIME_STRUCT.pack(time.time())
+            self.__data = newTime + self.__data[8:]
+            self.setPacketChecksum(IcmpHelperLibrary.IcmpChecksum.updateBytes(self.getPacketChecksum(), oldTime, newTime))
+            self.__packHeader()
+
+        def sendEchoRequest(self, icmpSocket=None):
+            # Returns an IcmpProbeResult (None when the TTL is negative); nothing is printed here
             if len(self.__icmpTarget.strip()) <= 0 | len(self.__destinationIpAddress.strip()) <= 0:
                 self.setIcmpTarget("127.0.0.1")
 
@@ -281,127 +360,44 @@ class IcmpHelperLibrary:
                 print("Pinging (" + self.__icmpTarget + ") " + self.__destinationIpAddress)\
                     if self.__DEBUG_IcmpPacket else 0
                 
-                mySocket = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)
-                mySocket.settimeout(self.__ipTimeout)
-                mySocket.bind(("", 0))
-                #print("Ttl: ", self.getTtl())
-                mySocket.setsockopt(IPPROTO_IP, IP_TTL, struct.pack('I', self.getTtl()))  # Unsigned int - 4 bytes
+                # A caller supplied socket is reused as is, otherwise one is opened just for this probe
+                ownsSocket = icmpSocket is None
+                if ownsSocket:
+                    icmpSocket = IcmpHelperLibrary.openTransport(ipTimeout=self.__ipTimeout)
                 try:
-                    mySocket.sendto(b''.join([self.__header, self.__data]), (self.__destinationIpAddress, 0))
-                    timeLeft = 30
+                    timeLeft = self.__timeout
                     pingStartTime = time.time()
-                    startedSelect = time.time()
-                    whatReady = select.select([mySocket], [], [], timeLeft)     #return three new lists: readable, writable, exceptional
-                    endSelect = time.time()
-                    howLongInSelect = (endSelect - startedSelect)
-                    if whatReady[0] == []:  # Timeout
-                        print("  *        *        *        *        *    Request timed out.")
-                    recvPacket, addr = mySocket.recvfrom(1024)  # recvPacket - bytes object representing data received
-                    # addr  - address of socket sending data
-                    timeReceived = time.time()
-                    timeLeft = timeLeft - howLongInSelect
-                    
-                    packets_received = 0
-
-                    if timeLeft <= 0:
-                        print("  *        *        *        *        *    Request timed out (By no remaining time left).")
-
-                    else:
-                        # Fetch the ICMP type and code from the received packet
-                        #print("recvPacket: ", recvPacket)
-                        icmpType, icmpCode = recvPacket[20:22]
-
-                        
-                        if icmpType == 11:                          # Time Exceeded
-                            # error message for type 11
-                            if self.getIcmpCode() == 0:
-                                error_message = "Time to Live exceeded in Transit"
-                            elif self.getIcmpCode() == 1:
-                                error_message = "Fragment Reassembly Time Exceeded"
-                            
-                            RTT = (timeReceived - pingStartTime) * 1000
-                            print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d    Identifier=%d    Sequence=%d    %s" %
-                                    (
-                                        self.getTtl(),
-                                        (timeReceived - pingStartTime) * 1000,
-                                        icmpType,
-                                        icmpCode,
-                                        self.getPacketIdentifier(),
-                                        self.getPacketSequenceNumber(),
-                                        addr[0]
-                                    )
-                                    + "    Error: " + error_message
-                                   )
-                            
-                            return RTT, packets_received, addr[0]
-
-                        elif icmpType == 3:                         # Destination Unreachable
-                            # error message
-                            if self.getIcmpCode() == 0:
-                                error_message = "Net Unreachable"
-                            elif self.getIcmpCode() == 1:
-                                error_message = "Host Unreachable"
-                            elif self.getIcmpCode() == 2:
-                                error_message = "Protocol Unreachable"
-                            elif self.getIcmpCode() == 3:
-                                error_message = "Port Unreachable"
-                            elif self.getIcmpCode() == 4:
-                                error_message = "Fragmentation Needed and Don't Fragment was Set"
-                            elif self.getIcmpCode() == 5:
-                                error_message = "Source Route Failed"
-                            elif self.getIcmpCode() == 6:
-                                error_message = "Destination Network Unknown"
-                            elif self.getIcmpCode() == 7:
-                                error_message = "Destination Host Unknown"
-                            elif self.getIcmpCode() == 8:
-                                error_message = "Source Host Isolated"
-                            elif self.getIcmpCode() == 9:
-                                error_message = "Communication with Destination Network is Administratively Prohibited"
-                            elif self.getIcmpCode() == 10:
-                                error_message = "Communication with Destination Host is Administratively Prohibited"
-                            elif self.getIcmpCode() == 11:
-                                error_message = "Destination Network Unreachable for Type of Service"
-                            elif self.getIcmpCode() == 12:
-                                error_message = "Destination Host Unreachable for Type of Service"
-                            elif self.getIcmpCode() == 13:
-                                error_message = "Communication Administratively Prohibited"
-                            elif self.getIcmpCode() == 14:
-                                error_message = "Host Precedence Violation"
-                            elif self.getIcmpCode() == 15:
-                                error_message = "Precedence cutoff in effect"
-
-                            RTT = (timeReceived - pingStartTime) * 1000
-                            print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d    Identifier=%d    Sequence=%d    %s" %
-                                      (
-                                          self.getTtl(),
-                                          (timeReceived - pingStartTime) * 1000,
-                                          icmpType,
-                                          icmpCode,
-                                          self.getPacketIdentifier(),
-                                          self.getPacketSequenceNumber(),
-                                          addr[0]
-                                          ) 
-                                      + "    Error: " + error_message
-                                  )
-                        
-                            return RTT, packets_received, addr[0]
-                        
-                        if icmpType == 0:                         # Echo Reply
-                            # increment packets received
-                            packets_received += 1
-                            RTT = (timeReceived - pingStartTime) * 1000
-                            icmpReplyPacket = IcmpHelperLibrary.IcmpPacket_EchoReply(recvPacket)
-                            self.__validateIcmpReplyPacketWithOriginalPingData(icmpReplyPacket)
-                            icmpReplyPacket.printResultToConsole(self.getTtl(), timeReceived, addr)
-                            
-                            return RTT, packets_received, addr[0]   # Echo reply is the end and therefore should return
+                    # The reply is matched on identifier/sequence number, anything else read meanwhile is routed to
+                    # the probe it belongs to (or dropped) instead of being taken as this probe's answer.
+                    # A plain ping (TTL 255) only takes an echo reply from the host it pinged
+                    expectedSource = self.__destinationIpAddress if self.getTtl() == 255 else None
+                    pendingProbe = icmpSocket.getDispatcher().register(self.getPacketIdentifier(),
+                                                                       self.getPacketSequenceNumber(),
+                                                                       pingStartTime,
+                                                                       timeLeft,
+                                                                       expectedSource=expectedSource)
+                    icmpSocket.sendTo(b''.join([self.__header, self.__data]), self.__destinationIpAddress, self.getTtl())
+                    icmpSocket.waitFor(pendingProbe)
 
-                        else:
-                            print("error")
+                    probeResult = IcmpHelperLibrary.IcmpProbeResult.fromPendingProbe(pendingProbe, self.__icmpTarget,
+                                                                                     self.__destinationIpAddress,
+                                                                                     self.getTtl())
+                    if probeResult.isReply():                   # Echo Reply, check it really answers this request
+                        icmpReplyPacket = IcmpHelperLibrary.IcmpPacket_EchoReply(pendingProbe.getRecvPacket())
+                        self.__validateIcmpReplyPacketWithOriginalPingData(icmpReplyPacket)
+                        if not icmpReplyPacket.isValidResponse():
+                            probeResult.setStatus(IcmpHelperLibrary.IcmpProbeResult.STATUS_INVALID,
+                                                  self.__describeInvalidReply(icmpReplyPacket))
+                    return probeResult
                 except timeout:
-                    print("  *        *        *        *        *    Request timed out (By Exception).")
+                    return IcmpHelperLibrary.IcmpProbeResult(self.__icmpTarget, self.__destinationIpAddress,
+                                                             self.getTtl(), self.getPacketIdentifier(),
+                                                             self.getPacketSequenceNumber(),
+                                                             IcmpHelperLibrary.IcmpProbeResult.STATUS_TIMEOUT,
+                                                             message="By Exception", timeSent=pingStartTime)
                 finally:
-                    mySocket.close()
+                    if ownsSocket:
+                        icmpSocket.close()
 
         def printIcmpPacketHeader_hex(self):
             print("Header Size: ", len(self.__header))
@@ -418,6 +414,155 @@ class IcmpHelperLibrary:
             self.printIcmpPacketHeader_hex()
             self.printIcmpPacketData_hex()
 
+    # ################################################################################################################ #
+    # Class IcmpPacketTemplate                                                                                         #
+    #                                                                                                                  #
+    # Preassembled echo request in one reusable bytearray. Each probe only patches identifier, sequence number,        #
+    # timestamp and checksum in place with pack_into, and the checksum is derived from the precomputed sum of the      #
+    # constant bytes instead of rescanning the payload. The returned memoryview aliases the buffer, so it has to be    #
+    # sent before the next call to build().                                                                            #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpPacketTemplate:
+        # ############################################################################################################ #
+        # IcmpPacketTemplate Class Scope Variables                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __CHECKSUM_STRUCT = struct.Struct("!H")             # Offset 2
+        __IDENTIFIER_SEQUENCE_STRUCT = struct.Struct("!HH") # Offset 4
+        __TIME_STRUCT = struct.Struct("d")                  # Offset 8, same native double IcmpPacket writes
+        __PATCHED_WORDS_STRUCT = struct.Struct("!6H")       # Offsets 4 - 15 as network order words
+        __PADDING_STRUCT = struct.Struct("!H")              # Last payload word, rewritten to pin the checksum
+
+        __buffer = None
+        __view = None
+        __baseSum = 0                   # One's complement sum of the packet with all patched fields zeroed
+        __paddingOffset = 0
+        __paddingWord = 0               # Payload word at __paddingOffset as IcmpPacket built it
+        __paddingChanged = False        # The last build() replaced it to hold a flow checksum
+        __flowChecksum = None           # Checksum every build() pins the packet to (Paris mode), None to leave it be
+        __packetIdentifier = 0
+        __packetSequenceNumber = 0
+        __timeSent = 0.0
+        __timeSentNs = 0                # perf_counter_ns() at build time, what RTTs are measured against
+
+        # ############################################################################################################ #
+        # IcmpPacketTemplate Constructors                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, packetIdentifier=0):
+            # The layout and payload come from a regular IcmpPacket so both always put the same bytes on the wire
+            icmpPacket = IcmpHelperLibrary.IcmpPacket()
+            icmpPacket.buildPacket_echoRequest(0, 0)
+            self.__buffer = bytearray(icmpPacket.getPacketBytes())
+            self.__CHECKSUM_STRUCT.pack_into(self.__buffer, 2, 0)
+            self.__TIME_STRUCT.pack_into(self.__buffer, 8, 0.0)
+            self.__view = memoryview(self.__buffer)
+
+            checksum = IcmpHelperLibrary.IcmpChecksum.calculate(self.__buffer)
+            self.__baseSum = ~checksum & 0xffff
+            self.__paddingOffset = len(self.__buffer) - 2
+            self.__paddingWord = self.__PADDING_STRUCT.unpack_from(self.__buffer, self.__paddingOffset)[0]
+            self.__packetIdentifier = packetIdentifier
+
+        # ############################################################################################################ #
+        # IcmpPacketTemplate Getters                                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getPacketIdentifier(self):
+            return self.__packetIdentifier
+
+        def getPacketSequenceNumber(self):
+            return self.__packetSequenceNumber
+
+        def getTimeSent(self):
+            return self.__timeSent
+
+        def getTimeSentNs(self):
+            return self.__timeSentNs
+
+        def getPacketLength(self):
+            return len(self.__buffer)
+
+        def getFlowChecksum(self):
+            return self.__flowChecksum
+
+        # ############################################################################################################ #
+        # IcmpPacketTemplate Setters                                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setPacketIdentifier(self, packetIdentifier):
+            self.__packetIdentifier = packetIdentifier
+
+        def setFlowChecksum(self, flowChecksum):
+            self.__flowChecksum = flowChecksum
+
+        # ############################################################################################################ #
+        # IcmpPacketTemplate Public Functions                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def getFlowChecksumFor(flowId):
+            # Checksum that stands for flow flowId, between 1 and 0xfffe. 0 is left out, and so is 0xffff, whose sum
+            # folds to the other zero and comes out as checksum 0 as well.
+            return flowId % 0xfffe + 1
+
+        def build(self, packetSequenceNumber, timeSent=None, flowChecksum=None):
+            # flowChecksum (or the template's own) pins the checksum to that value whatever the sequence number and
+            # timestamp are, so per-flow load balancers, which hash the checksum along with type and code, keep every
+            # probe of one flow on one path (Paris traceroute). The last payload word absorbs the difference.
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            startNs = time.perf_counter_ns() if metrics is not None else 0
+            if timeSent is None:
+                timeSent = time.time()
+            if flowChecksum is None:
+                flowChecksum = self.__flowChecksum
+            buffer = self.__buffer
+            self.__IDENTIFIER_SEQUENCE_STRUCT.pack_into(buffer, 4, self.__packetIdentifier, packetSequenceNumber)
+            self.__TIME_STRUCT.pack_into(buffer, 8, timeSent)
+
+            # Base sum (taken in network order) plus the patched words, folded and inverted
+            checksum = self.__baseSum + sum(self.__PATCHED_WORDS_STRUCT.unpack_from(buffer, 4))
+            if flowChecksum is None:
+                if self.__paddingChanged:
+                    self.__PADDING_STRUCT.pack_into(buffer, self.__paddingOffset, self.__paddingWord)
+                    self.__paddingChanged = False
+                checksum = (checksum >> 16) + (checksum & 0xffff)
+                checksum = (checksum >> 16) + (checksum & 0xffff)
+                self.__CHECKSUM_STRUCT.pack_into(buffer, 2, ~checksum & 0xffff)
+            else:
+                # Sum without the padding word, then the padding that brings it to ~flowChecksum (RFC 1624 style)
+                checksum = checksum + (~self.__paddingWord & 0xffff)
+                checksum = (checksum >> 16) + (checksum & 0xffff)
+                checksum = (checksum >> 16) + (checksum & 0xffff)
+                padding = (~flowChecksum & 0xffff) + (~checksum & 0xffff)
+                padding = (padding >> 16) + (padding & 0xffff)
+                self.__PADDING_STRUCT.pack_into(buffer, self.__paddingOffset, padding)
+                self.__CHECKSUM_STRUCT.pack_into(buffer, 2, flowChecksum)
+                self.__paddingChanged = True
+
+            self.__packetSequenceNumber = packetSequenceNumber
+            self.__timeSent = timeSent
+            self.__timeSentNs = time.perf_counter_ns()
+            if metrics is not None:
+                metrics.recordTiming("build", self.__timeSentNs - startNs)
+            return self.__view
+
     # ################################################################################################################ #
     # Class IcmpPacket_EchoReply                                                                                       #
     #                                                                                                                  #
@@ -438,15 +583,25 @@ class IcmpHelperLibrary:
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Class Scope Variables                                                                   #
         #                                                                                                              #
-        #                                                                                                              #
-        #                                                                                                              #
+        # Replies are parsed once in the constructor over a memoryview of the received bytes. __slots__ keeps each     #
+        # record small and the payload is only ever sliced as a view, so parsing does not copy the datagram.           #
         #                                                                                                              #
         # ############################################################################################################ #
-        __recvPacket = b''
-        __isValidResponse = False
-        __IcmpIdentifier_isValid = False
-        __IcmpSequenceNumber_isValid = False
-        __IcmpData_isValid = False
+        __slots__ = ("__recvPacket",
+                     "__ipHeaderLength",
+                     "__icmpType",
+                     "__icmpCode",
+                     "__icmpHeaderChecksum",
+                     "__icmpIdentifier",
+                     "__icmpSequenceNumber",
+                     "__dateTimeSent",
+                     "__isValidResponse",
+                     "__IcmpIdentifier_isValid",
+                     "__IcmpSequenceNumber_isValid",
+                     "__IcmpData_isValid")
+
+        __HEADER_STRUCT = struct.Struct("!BBHHH")   # Type, code, checksum, identifier, sequence number
+        __TIME_STRUCT = struct.Struct("d")          # Send time exactly as IcmpPacket packed it (native double)
 
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Constructors                                                                            #
@@ -456,7 +611,31 @@ class IcmpHelperLibrary:
         #                                                                                                              #
         # ############################################################################################################ #
         def __init__(self, recvPacket):
+            recvPacket = memoryview(recvPacket)
+            ipHeaderLength = (recvPacket[0] & 0x0f) * 4 if len(recvPacket) > 0 else 0  # IHL counts 32 bit words
+
             self.__recvPacket = recvPacket
+            self.__ipHeaderLength = ipHeaderLength
+            if len(recvPacket) >= ipHeaderLength + self.__HEADER_STRUCT.size:
+                (self.__icmpType,
+                 self.__icmpCode,
+                 self.__icmpHeaderChecksum,
+                 self.__icmpIdentifier,
+                 self.__icmpSequenceNumber) = self.__HEADER_STRUCT.unpack_from(recvPacket, ipHeaderLength)
+            else:
+                # Truncated before the end of the ICMP header: -1 never matches a probe, so validation fails
+                self.__icmpType = self.__icmpCode = self.__icmpHeaderChecksum = -1
+                self.__icmpIdentifier = self.__icmpSequenceNumber = -1
+
+            if len(recvPacket) >= ipHeaderLength + 16:
+                self.__dateTimeSent = self.__TIME_STRUCT.unpack_from(recvPacket, ipHeaderLength + 8)[0]
+            else:
+                self.__dateTimeSent = 0.0
+
+            self.__isValidResponse = False
+            self.__IcmpIdentifier_isValid = False
+            self.__IcmpSequenceNumber_isValid = False
+            self.__IcmpData_isValid = False
 
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Getters                                                                                 #
@@ -465,54 +644,35 @@ class IcmpHelperLibrary:
         #                                                                                                              #
         #                                                                                                              #
         # ############################################################################################################ #
-        def getIcmpType(self):
-            # Method 1
-            # bytes = struct.calcsize("B")        # Format code B is 1 byte
-            # return struct.unpack("!B", self.__recvPacket[20:20 + bytes])[0]
+        def getIpHeaderLength(self):
+            return self.__ipHeaderLength
 
-            # Method 2
-            return self.__unpackByFormatAndPosition("B", 20)
+        def getIcmpType(self):
+            return self.__icmpType
 
         def getIcmpCode(self):
-            # Method 1
-            # bytes = struct.calcsize("B")        # Format code B is 1 byte
-            # return struct.unpack("!B", self.__recvPacket[21:21 + bytes])[0]
-
-            # Method 2
-            return self.__unpackByFormatAndPosition("B", 21)
+            return self.__icmpCode
 
         def getIcmpHeaderChecksum(self):
-            # Method 1
-            # bytes = struct.calcsize("H")        # Format code H is 2 bytes
-            # return struct.unpack("!H", self.__recvPacket[22:22 + bytes])[0]
-
-            # Method 2
-            return self.__unpackByFormatAndPosition("H", 22)
+            return self.__icmpHeaderChecksum
 
         def getIcmpIdentifier(self):
-            # Method 1
-            # bytes = struct.calcsize("H")        # Format code H is 2 bytes
-            # return struct.unpack("!H", self.__recvPacket[24:24 + bytes])[0]
-
-            # Method 2
-            return self.__unpackByFormatAndPosition("H", 24)
+            return self.__icmpIdentifier
 
         def getIcmpSequenceNumber(self):
-            # Method 1
-            # bytes = struct.calcsize("H")        # Format code H is 2 bytes
-            # return struct.unpack("!H", self.__recvPacket[26:26 + bytes])[0]
-
-            # Method 2
-            return self.__unpackByFormatAndPosition("H", 26)
+            return self.__icmpSequenceNumber
 
         def getDateTimeSent(self):
-            # This accounts for bytes 28 through 35 = 64 bits
-            return self.__unpackByFormatAndPosition("d", 28)   # Used to track overall round trip time
-                                                               # time.time() creates a 64 bit value of 8 bytes
+            # The 8 bytes following the ICMP header = 64 bits
+            return self.__dateTimeSent     # Used to track overall round trip time
+
+        def getIcmpDataBytes(self):
+            # Payload after the timestamp as a view into the received packet, compared without decoding
+            return self.__recvPacket[self.__ipHeaderLength + 16:]
 
         def getIcmpData(self):
-            # This accounts for bytes 36 to the end of the packet.
-            return self.__recvPacket[36:].decode('utf-8')
+            # Decoded payload, only meant for display
+            return bytes(self.getIcmpDataBytes()).decode('utf-8', 'replace')
 
         def getIcmpIdentifier_isValid(self):
             return self.__IcmpIdentifier_isValid
@@ -548,16 +708,6 @@ class IcmpHelperLibrary:
 
         def setIcmpData_isValid(self, booleanValue):
             self.__IcmpData_isValid = booleanValue
-        # ############################################################################################################ #
-        # IcmpPacket_EchoReply Private Functions                                                                       #
-        #                                                                                                              #
-        #                                                                                                              #
-        #                                                                                                              #
-        #                                                                                                              #
-        # ############################################################################################################ #
-        def __unpackByFormatAndPosition(self, formatCode, basePosition):
-            numberOfbytes = struct.calcsize(formatCode)
-            return struct.unpack("!" + formatCode, self.__recvPacket[basePosition:basePosition + numberOfbytes])[0]
 
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Public Functions                                                                        #
@@ -566,15 +716,16 @@ class IcmpHelperLibrary:
         #                                                                                                              #
         #                                                                                                              #
         # ############################################################################################################ #
-        def printResultToConsole(self, ttl, timeReceived, addr):
-            bytes = struct.calcsize("d")
-            timeSent = struct.unpack("d", self.__recvPacket[28:28 + bytes])[0]
-            
+        def printResultToConsole(self, ttl, timeReceived, addr, icmpPacket, rtt=None):
+            # rtt (ms, monotonic clock) wins over the wall clock send time echoed back in the payload
+            if rtt is None:
+                rtt = (timeReceived - self.getDateTimeSent()) * 1000
+
             if self.isValidResponse():
                 print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d    Identifier=%d    SequenceNumber=%d    %s" %
                       (
                           ttl,
-                          (timeReceived - timeSent) * 1000,
+                          rtt,
                           self.getIcmpType(),
                           self.getIcmpCode(),
                           self.getIcmpIdentifier(),
@@ -586,157 +737,7558 @@ class IcmpHelperLibrary:
             else:
                 if not self.getIcmpIdentifier_isValid():
                     print("----------Identifier Error-----------")
-                    print("Expected value: ", IcmpPacket.getPacketIdentifier())
+                    print("Expected value: ", icmpPacket.getPacketIdentifier())
                     print("Actual value: ", self.getIcmpIdentifier())
                 if not self.getIcmpSequenceNumber_isValid():
                     print("----------SequenceNumber Error----------")
-                    print("Expected value: ", IcmpPacket.getPacketSequenceNumber())
+                    print("Expected value: ", icmpPacket.getPacketSequenceNumber())
                     print("Actual value: ", self.getIcmpSequenceNumber())
                 if not self.getIcmpData_isValid():
                     print("----------RawData Error----------")
-                    print("Expected value: ", IcmpPacket.getDataRaw())
+                    print("Expected value: ", icmpPacket.getDataRaw())
                     print("Actual value: ", self.getIcmpData())
 
     # ################################################################################################################ #
-    # Class IcmpHelperLibrary                                                                                          #
-    #                                                                                                                  #
-    #                                                                                                                  #
-    #                                                                                                                  #
+    # Class IcmpTransport                                                                                              #
     #                                                                                                                  #
+    # What probes are sent and replies read through. Every transport hands the datagrams it reads to its own           #
+    # IcmpReplyDispatcher as a raw socket would have read them, IP header first, so matching and decoding are the same #
+    # whichever one is used: IcmpSocket (raw socket, needs privileges), IcmpDatagramSocket (Linux ping socket, no      #
+    # privileges) or IcmpSimulatedSocket (in memory network). IcmpHelperLibrary.openTransport() picks one by name.     #
     # ################################################################################################################ #
+    class IcmpTransport(abc.ABC):
+        # ############################################################################################################ #
+        # IcmpTransport Class Scope Variables                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        TRANSPORT_NAME = None           # Name openTransport() knows the transport by
 
-    # ################################################################################################################ #
-    # IcmpHelperLibrary Class Scope Variables                                                                          #
-    #                                                                                                                  #
-    #                                                                                                                  #
-    #                                                                                                                  #
-    #                                                                                                                  #
-    # ################################################################################################################ #
+        __dispatcher = None             # Routes every datagram read here to the probe it answers
+        __kernelTimestamps = False      # SO_TIMESTAMPNS enabled, receive times come from recvmsg ancillary data
+        __ancillaryBufferSize = 0
 
-    __DEBUG_IcmpHelperLibrary = False                  # Allows for debug output
-    # ################################################################################################################ #
-    # IcmpHelperLibrary Private Functions                                                                              #
-    #                                                                                                                  #
-    #                                                                                                                  #
-    #                                                                                                                  #
-    #                                                                                                                  #
-    # ################################################################################################################ #
-    def __sendIcmpEchoRequest(self, host, Ttl):
-        print("sendIcmpEchoRequest Started...") if self.__DEBUG_IcmpHelperLibrary else 0
-        
+        __SO_TIMESTAMPNS = getSocketConstant("SO_TIMESTAMPNS", 35)     # Also SCM_TIMESTAMPNS
+        __TIMESPEC_STRUCT = struct.Struct("@ll")
+
+        # ############################################################################################################ #
+        # IcmpTransport Constructors                                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self):
+            self.__dispatcher = IcmpHelperLibrary.IcmpReplyDispatcher()
 
-        # array of RTTs
-        RTTs = []
-        packets_received = 0
+        def __enter__(self):
+            return self
 
-        destination = None
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
 
-        print("Ping 4 packets to ", gethostbyname(host.strip()))
-        for i in range(4):
-            # Build packet
-            icmpPacket = IcmpHelperLibrary.IcmpPacket()
-            icmpPacket.setTtl(Ttl)
-            
-            randomIdentifier = (os.getpid() & 0xffff)      # Get as 16 bit number - Limit based on ICMP header standards
-                                                           # Some PIDs are larger than 16 bit
+        # ############################################################################################################ #
+        # IcmpTransport Getters                                                                                        #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getSocket(self):
+            return None
 
-            packetIdentifier = randomIdentifier
-            packetSequenceNumber = i
+        def getDispatcher(self):
+            return self.__dispatcher
 
-            icmpPacket.buildPacket_echoRequest(packetIdentifier, packetSequenceNumber)  # Build ICMP for IP payload
-            icmpPacket.setIcmpTarget(host)
-            temp = icmpPacket.sendEchoRequest()
-            
-            if temp != None:
-                RTT, num, destination = temp                                            # Build IP
+        def getTtl(self):
+            return None
 
-                RTTs.append(RTT)
-                packets_received += num
+        def isClosed(self):
+            return False
 
-            icmpPacket.printIcmpPacketHeader_hex() if self.__DEBUG_IcmpHelperLibrary else 0
-            icmpPacket.printIcmpPacket_hex() if self.__DEBUG_IcmpHelperLibrary else 0
-            # we should be confirming values are correct, such as identifier and sequence number and data
-
-        # initialize value
-        min_RTT = float("inf")
-        max_RTT = float("-inf")
-        average_RTT = 0
-
-        if len(RTTs) != 0:
-            min_RTT = min(RTTs)
-            max_RTT = max(RTTs)
-            average_RTT = sum(RTTs)/len(RTTs)
-
-        packet_loss_rate = (4 - packets_received) / 4
-
-        #print("-------------Ping Info-------------")
-        print("Min=%.0f ms  Max=%.0f ms  Average=%.0f ms  Packet_Loss=%.2f"%
-                  (
-                      min_RTT,
-                      max_RTT,
-                      average_RTT,
-                      packet_loss_rate,
-                  )
-                  + "  Addr=", destination
-              )
-        return destination
-
-    def __sendIcmpTraceRoute(self, host):
-        print("sendIcmpTraceRoute Started...") if self.__DEBUG_IcmpHelperLibrary else 0
-        # Build code for trace route here
+        def isBatchable(self):
+            # Whether IcmpBatchIo may move this transport's datagrams with sendmmsg/recvmmsg as they are
+            return False
 
-        host_ip = gethostbyname(host.strip())
-        Ttl = 1
-        destination = None
+        def hasKernelTimestamps(self):
+            return self.__kernelTimestamps
 
-        while destination != host_ip and Ttl <= 255:
-            
-            destination = self.__sendIcmpEchoRequest(host, Ttl)
-            #print("Host: ", host_ip)
-            #print("Destination: ", destination)
-            Ttl += 1
+        def getAncillaryBufferSize(self):
+            # recvmsg() control buffer size needed for the kernel timestamp, 0 without kernel timestamps
+            return self.__ancillaryBufferSize
+
+        def getKernelDelayNs(self, ancillaryData, realtimeNs):
+            # Time between the kernel stamping a datagram and realtimeNs, from (level, type, data) control messages
+            for level, messageType, data in ancillaryData:
+                if level == SOL_SOCKET and messageType == self.__SO_TIMESTAMPNS and \
+                        len(data) >= self.__TIMESPEC_STRUCT.size:
+                    seconds, nanoseconds = self.__TIMESPEC_STRUCT.unpack_from(data)
+                    return max(realtimeNs - (seconds * 1000000000 + nanoseconds), 0)
+            return 0
+
+        def fileno(self):
+            # Descriptor to wait on with select(), -1 for transports without one
+            return -1 if self.getSocket() is None else self.getSocket().fileno()
+
+        # ############################################################################################################ #
+        # IcmpTransport Setters                                                                                        #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setBlocking(self, flag):
+            if self.getSocket() is not None:
+                self.getSocket().setblocking(flag)
+
+        @abc.abstractmethod
+        def setTtl(self, ttl):
+            pass
+
+        def setKernelTimestamps(self, flag):
+            # Asks the kernel to stamp every datagram it queues; stays off (userspace timestamps) where unsupported
+            if self.__SO_TIMESTAMPNS is None:
+                return False
+            try:
+                self.getSocket().setsockopt(SOL_SOCKET, self.__SO_TIMESTAMPNS, 1 if flag else 0)
+            except (OSError, AttributeError):
+                return False
+            self.__kernelTimestamps = flag
+            self.__ancillaryBufferSize = CMSG_SPACE(self.__TIMESPEC_STRUCT.size) if flag else 0
+            return True
+
+        def setIdentifierFilter(self, firstIdentifier, lastIdentifier):
+            # Narrows what reaches this transport to replies for the given identifiers, False where not supported
+            return False
+
+        # ############################################################################################################ #
+        # IcmpTransport Public Functions                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @abc.abstractmethod
+        def sendTo(self, packetBytes, destinationIpAddress, ttl):
+            pass
+
+        @abc.abstractmethod
+        def receiveDatagram(self, bufferSize=1024):
+            # Returns (recvPacket, addr, timeReceived, timeReceivedNs, kernelDelayNs) as IcmpSocket documents it.
+            # Raises BlockingIOError when nothing is left to read.
+            pass
+
+        def receiveAvailable(self, timeLeft):
+            # Waits up to timeLeft seconds for the transport to become readable, then drains every queued datagram
+            # through the dispatcher. Returns the number of datagrams read.
+            received = 0
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            startNs = time.perf_counter_ns() if metrics is not None else 0
+            whatReady = select.select([self], [], [], max(timeLeft, 0))
+            if metrics is not None:
+                metrics.recordTiming("wait", time.perf_counter_ns() - startNs)
+            while whatReady[0] != []:
+                try:
+                    recvPacket, addr, timeReceived, timeReceivedNs, kernelDelayNs = self.receiveDatagram(1024)
+                except BlockingIOError:
+                    break
+                received += 1
+                self.__dispatcher.dispatch(recvPacket, addr, timeReceived, timeReceivedNs, kernelDelayNs)
+                whatReady = select.select([self], [], [], 0)    # Only drain what is already queued
+            return received
+
+        def waitFor(self, pendingProbe):
+            # Reads and routes replies (including those for other probes) until pendingProbe is answered or expired
+            while pendingProbe.isPending():
+                timeLeft = pendingProbe.getDeadline() - time.monotonic()
+                if timeLeft > 0:
+                    self.receiveAvailable(timeLeft)
+                self.__dispatcher.expire(time.monotonic())
 
+        def close(self):
+            self.__dispatcher.cancelAll()
 
     # ################################################################################################################ #
-    # IcmpHelperLibrary Public Functions                                                                               #
-    #                                                                                                                  #
-    #                                                                                                                  #
+    # Class IcmpSocket                                                                                                 #
     #                                                                                                                  #
+    # Long-lived raw ICMP socket shared by many probes. The TTL socket option is only changed when the requested TTL   #
+    # differs from the one currently configured, so a ping run costs one socket instead of one per packet. Needs       #
+    # privileges and sees every ICMP message the host receives (see setIdentifierFilter()).                            #
     #                                                                                                                  #
     # ################################################################################################################ #
-    def sendPing(self, targetHost):
-        print("ping Started...") if self.__DEBUG_IcmpHelperLibrary else 0
-        self.__sendIcmpEchoRequest(targetHost, 255)
+    class IcmpSocket(IcmpTransport):
+        # ############################################################################################################ #
+        # IcmpSocket Class Scope Variables                                                                             #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        TRANSPORT_NAME = "raw"
 
-    def traceRoute(self, targetHost):
-        print("traceRoute Started...") if self.__DEBUG_IcmpHelperLibrary else 0
-        self.__sendIcmpTraceRoute(targetHost)
+        __socket = None
+        __ttl = None                    # TTL currently configured on the socket
+        __ipTimeout = 60
 
+        __SO_ATTACH_FILTER = getSocketConstant("SO_ATTACH_FILTER", 26)
+        __SOCK_FILTER_STRUCT = struct.Struct("@HBBI")       # struct sock_filter: code, jt, jf, k
+        __SOCK_FPROG_STRUCT = struct.Struct("@HP")          # struct sock_fprog: length, filter pointer
 
-# #################################################################################################################### #
-# main()                                                                                                               #
-#                                                                                                                      #
-#                                                                                                                      #
-#                                                                                                                      #
-#                                                                                                                      #
-# #################################################################################################################### #
-def main():
-    icmpHelperPing = IcmpHelperLibrary()
-
-
-    # Choose one of the following by uncommenting out the line
-    icmpHelperPing.sendPing("209.233.126.254")
-    # icmpHelperPing.sendPing("www.google.com")
-    # icmpHelperPing.sendPing("oregonstate.edu")
-    # icmpHelperPing.sendPing("gaia.cs.umass.edu")
-    #icmpHelperPing.sendPing("256.123.1.1")
-    # icmpHelperPing.traceRoute("oregonstate.edu")
-    # icmpHelperPing.traceRoute("209.233.126.254")
-    #icmpHelperPing.traceRoute("www.google.com")
-    # icmpHelperPing.traceRoute("www.sousou.co.jp")
-    #icmpHelperPing.traceRoute("australia.gov.au")
-    # icmpHelperPing.traceRoute("256.123.1.1")
-    #icmpHelperPing.traceRoute("facebook.com")
+        __DEBUG_IcmpSocket = False      # Allows for debug output
+
+        # ############################################################################################################ #
+        # IcmpSocket Constructors                                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, ipTimeout=60, receiveBufferSize=None, kernelTimestamps=False):
+            super().__init__()
+            self.__ipTimeout = ipTimeout
+            self.__socket = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)
+            self.__socket.settimeout(self.__ipTimeout)
+            if receiveBufferSize is not None:
+                # Many probes in flight need room for a burst of replies, the kernel default only holds a few hundred
+                self.__socket.setsockopt(SOL_SOCKET, SO_RCVBUF, receiveBufferSize)
+            if kernelTimestamps:
+                self.setKernelTimestamps(True)
+            self.__socket.bind(("", 0))
+
+        # ############################################################################################################ #
+        # IcmpSocket Getters                                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getSocket(self):
+            return self.__socket
+
+        def getTtl(self):
+            return self.__ttl
+
+        def isClosed(self):
+            return self.__socket is None
+
+        def isBatchable(self):
+            return True
+
+        def fileno(self):
+            return self.__socket.fileno()   # Lets the object itself be handed to select.select()
+
+        # ############################################################################################################ #
+        # IcmpSocket Setters                                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setTtl(self, ttl):
+            if ttl != self.__ttl:
+                print("IcmpSocket TTL: ", ttl) if self.__DEBUG_IcmpSocket else 0
+                self.__socket.setsockopt(IPPROTO_IP, IP_TTL, struct.pack('I', ttl))  # Unsigned int - 4 bytes
+                self.__ttl = ttl
+
+        def setIdentifierFilter(self, firstIdentifier, lastIdentifier):
+            # Attaches a classic BPF program so the kernel only queues echo replies, and errors quoting an echo
+            # request, whose identifier lies in firstIdentifier - lastIdentifier. Every raw ICMP socket sees every
+            # ICMP message, so sockets sharing a host otherwise each parse all of the others' replies. Errors behind
+            # an IP header with options are let through. Returns False where socket filters are not supported.
+            if self.__SO_ATTACH_FILTER is None:
+                return False
+            program = [
+                (0xb1, 0, 0, 0),                # ldxb 4 * ([0] & 0xf)      X = IP header length
+                (0x50, 0, 0, 0),                # ldb [x + 0]               ICMP type
+                (0x15, 0, 2, 0),                # jeq #0 (echo reply)
+                (0x48, 0, 0, 4),                # ldh [x + 4]               identifier
+                (0x05, 0, 0, 7),                # ja check
+                (0x15, 8, 0, 8),                # jeq #8 (echo request) -> drop
+                (0x87, 0, 0, 0),                # txa
+                (0x15, 0, 7, 20),               # jeq #20, else accept
+                (0x30, 0, 0, 37),               # ldb [37]                  quoted protocol
+                (0x15, 0, 4, IPPROTO_ICMP),     # jeq #1, else drop
+                (0xb1, 0, 0, 28),               # ldxb 4 * ([28] & 0xf)     X = quoted IP header length
+                (0x48, 0, 0, 32),               # ldh [x + 32]              quoted identifier
+                (0x35, 0, 1, firstIdentifier),  # check: jge #first, else drop
+                (0x25, 0, 1, lastIdentifier),   # jgt #last -> drop, else accept
+                (0x06, 0, 0, 0),                # drop
+                (0x06, 0, 0, 0x40000),          # accept
+            ]
+            filterBuffer = ctypes.create_string_buffer(b"".join(self.__SOCK_FILTER_STRUCT.pack(*instruction)
+                                                                for instruction in program))
+            try:
+                self.__socket.setsockopt(SOL_SOCKET, self.__SO_ATTACH_FILTER,
+                                         self.__SOCK_FPROG_STRUCT.pack(len(program), ctypes.addressof(filterBuffer)))
+            except OSError:
+                return False
+            return True
+
+        # ############################################################################################################ #
+        # IcmpSocket Public Functions                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def sendTo(self, packetBytes, destinationIpAddress, ttl):
+            self.setTtl(ttl)
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            if metrics is None:
+                return self.__socket.sendto(packetBytes, (destinationIpAddress, 0))
+            startNs = time.perf_counter_ns()
+            try:
+                return self.__socket.sendto(packetBytes, (destinationIpAddress, 0))
+            except OSError:
+                metrics.count("socket_errors")
+                raise
+            finally:
+                metrics.recordTiming("send", time.perf_counter_ns() - startNs)
+
+        def receiveFrom(self, bufferSize=1024):
+            return self.__socket.recvfrom(bufferSize)
+
+        def receiveDatagram(self, bufferSize=1024):
+            # Returns (recvPacket, addr, timeReceived, timeReceivedNs, kernelDelayNs). timeReceivedNs is read from
+            # perf_counter_ns() right after the syscall; kernelDelayNs is how long before that the kernel stamped
+            # the datagram (0 without kernel timestamps), i.e. our own receive overhead.
+            if not self.hasKernelTimestamps():
+                recvPacket, addr = self.__socket.recvfrom(bufferSize)
+                return recvPacket, addr, time.time(), time.perf_counter_ns(), 0
+
+            recvPacket, ancillaryData, flags, addr = self.__socket.recvmsg(bufferSize, self.getAncillaryBufferSize())
+            timeReceivedNs = time.perf_counter_ns()
+            realtimeNs = time.time_ns()
+            return recvPacket, addr, realtimeNs / 1e9, timeReceivedNs, self.getKernelDelayNs(ancillaryData, realtimeNs)
+
+        def close(self):
+            if self.__socket is not None:
+                self.__socket.close()
+                self.__socket = None
+                self.__ttl = None
+                super().close()
+
+    # ################################################################################################################ #
+    # Class IcmpDatagramSocket                                                                                         #
+    #                                                                                                                  #
+    # Linux "ping socket" (SOCK_DGRAM, IPPROTO_ICMP): no privileges needed, only net.ipv4.ping_group_range to include  #
+    # the user's group. The kernel sets the identifier to the socket's own and only queues replies carrying it, so     #
+    # nothing else on the host reaches this socket. ICMP errors arrive on the error queue (IP_RECVERR) as the request  #
+    # we sent plus who complained. Both are rebuilt into the datagrams a raw socket would have read, with the          #
+    # identifier the probe was registered under, so the dispatcher cannot tell the transports apart.                   #
+    # ################################################################################################################ #
+    class IcmpDatagramSocket(IcmpTransport):
+        # ############################################################################################################ #
+        # IcmpDatagramSocket Class Scope Variables                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        TRANSPORT_NAME = "dgram"
+
+        __socket = None
+        __ttl = None
+        __sendTimeout = 1               # Seconds a send may wait for room in a full send buffer
+        __sentIdentifiers = None        # (sequence, destination) -> identifier last sent with, to undo the kernel's
+        __errorBufferSize = 0
+
+        __IP_RECVERR = getSocketConstant("IP_RECVERR", 11)
+        __MSG_ERRQUEUE = getSocketConstant("MSG_ERRQUEUE", 0x2000)
+        __SO_EE_ORIGIN_ICMP = 2
+        __ICMP_ERRNOS = (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ECONNREFUSED, errno.EPROTO, errno.EACCES,
+                         errno.EOPNOTSUPP)                  # What the kernel turns ICMP errors into (icmp_err_convert)
+        __EXTENDED_ERROR_STRUCT = struct.Struct("@IBBBBII")     # struct sock_extended_err, then the offender address
+        __SOCKADDR_IN_STRUCT = struct.Struct("!2xH4s8x")       # struct sockaddr_in: port and address
+        __IP_HEADER_STRUCT = struct.Struct("!BBHHHBBH4s4s")
+        __IDENTIFIER_STRUCT = struct.Struct("!H")
+        __MAX_SENT_IDENTIFIERS = 0x10000    # Oldest entries go beyond this, their replies are long overdue
+
+        # ############################################################################################################ #
+        # IcmpDatagramSocket Constructors                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, receiveBufferSize=None, kernelTimestamps=False):
+            super().__init__()
+            self.__socket = socket(AF_INET, SOCK_DGRAM, IPPROTO_ICMP)
+            self.__socket.setblocking(False)    # Reads always follow select(), and the error queue must not block
+            if receiveBufferSize is not None:
+                self.__socket.setsockopt(SOL_SOCKET, SO_RCVBUF, receiveBufferSize)
+            if kernelTimestamps:
+                self.setKernelTimestamps(True)
+            if self.hasErrorQueue():
+                self.__socket.setsockopt(IPPROTO_IP, self.__IP_RECVERR, 1)
+            self.__socket.bind(("", 0))
+            self.__sentIdentifiers = OrderedDict()
+            self.__errorBufferSize = CMSG_SPACE(self.__EXTENDED_ERROR_STRUCT.size + self.__SOCKADDR_IN_STRUCT.size)
+
+        # ############################################################################################################ #
+        # IcmpDatagramSocket Getters                                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getSocket(self):
+            return self.__socket
+
+        def getTtl(self):
+            return self.__ttl
+
+        def getKernelIdentifier(self):
+            # Identifier the kernel puts in every request sent from this socket
+            return self.__socket.getsockname()[1]
+
+        def hasErrorQueue(self):
+            # Whether ICMP errors reach this socket (IP_RECVERR, Linux only); elsewhere only echo replies do
+            return self.__IP_RECVERR is not None and self.__MSG_ERRQUEUE is not None
+
+        def isClosed(self):
+            return self.__socket is None
+
+        def fileno(self):
+            return self.__socket.fileno()
+
+        # ############################################################################################################ #
+        # IcmpDatagramSocket Setters                                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setBlocking(self, flag):
+            pass                                # Always non-blocking, see the constructor
+
+        def setTtl(self, ttl):
+            if ttl != self.__ttl:
+                self.__socket.setsockopt(IPPROTO_IP, IP_TTL, struct.pack('I', ttl))
+                self.__ttl = ttl
+
+        # ############################################################################################################ #
+        # IcmpDatagramSocket Private Functions                                                                         #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __restoreIdentifier(self, icmpBytes, destinationIpAddress):
+            # Puts the identifier the request was sent with back in place of the kernel's one (checksum included).
+            # Replies only carry the kernel's identifier, so the request is told apart by its sequence number and the
+            # address it went to: callers sharing the socket may use the same sequence numbers with other identifiers.
+            icmpBytes = bytearray(icmpBytes)
+            if len(icmpBytes) >= 8:
+                kernelIdentifier, sequenceNumber = struct.unpack_from("!HH", icmpBytes, 4)
+                packetIdentifier = self.__sentIdentifiers.get((sequenceNumber, destinationIpAddress))
+                if packetIdentifier is None:
+                    return icmpBytes            # Not sent from here (or long ago), left to go unmatched
+                checksum = self.__IDENTIFIER_STRUCT.unpack_from(icmpBytes, 2)[0]
+                self.__IDENTIFIER_STRUCT.pack_into(icmpBytes, 2, IcmpHelperLibrary.IcmpChecksum.update(
+                    checksum, kernelIdentifier, packetIdentifier))
+                self.__IDENTIFIER_STRUCT.pack_into(icmpBytes, 4, packetIdentifier)
+            return icmpBytes
+
+        def __packIpHeader(self, payloadLength, sourceAddress, destinationAddress):
+            return self.__IP_HEADER_STRUCT.pack(0x45, 0, 20 + payloadLength, 0, 0, 64, IPPROTO_ICMP, 0,
+                                                sourceAddress, destinationAddress)
+
+        def __receiveError(self, bufferSize):
+            # Rebuilds the next ICMP error from the error queue into (type, code, offender IP header, quoted request)
+            while True:
+                recvPacket, ancillaryData, flags, addr = self.__socket.recvmsg(
+                    bufferSize, self.__errorBufferSize + self.getAncillaryBufferSize(), self.__MSG_ERRQUEUE)
+                for level, messageType, data in ancillaryData:
+                    if level != IPPROTO_IP or messageType != self.__IP_RECVERR or \
+                            len(data) < self.__EXTENDED_ERROR_STRUCT.size + self.__SOCKADDR_IN_STRUCT.size:
+                        continue
+                    errorNumber, origin, icmpType, icmpCode, pad, info, errorData = \
+                        self.__EXTENDED_ERROR_STRUCT.unpack_from(data)
+                    if origin != self.__SO_EE_ORIGIN_ICMP:
+                        continue
+                    offenderAddress = self.__SOCKADDR_IN_STRUCT.unpack_from(data, self.__EXTENDED_ERROR_STRUCT.size)[1]
+                    quotedRequest = self.__restoreIdentifier(recvPacket[:8], addr[0])
+                    message = struct.pack("!BBHI", icmpType, icmpCode, 0, 0) + \
+                        self.__packIpHeader(len(recvPacket), b"\0\0\0\0", inet_aton(addr[0])) + quotedRequest
+                    return self.__packIpHeader(len(message), offenderAddress, b"\0\0\0\0") + message, \
+                        (inet_ntoa(offenderAddress), 0), ancillaryData
+                # Local errors (e.g. EMSGSIZE) have no ICMP message behind them, move on to the next one
+
+        def __send(self, packetBytes, destinationIpAddress):
+            try:
+                return self.__socket.sendto(packetBytes, (destinationIpAddress, 0))
+            except BlockingIOError:
+                select.select([], [self.__socket], [], self.__sendTimeout)
+            except OSError as error:
+                # An ICMP error queued for an earlier probe fails the next send, which then never left. The error
+                # itself stays on the error queue for receiveDatagram().
+                if error.errno not in self.__ICMP_ERRNOS:
+                    raise
+            return self.__socket.sendto(packetBytes, (destinationIpAddress, 0))
+
+        # ############################################################################################################ #
+        # IcmpDatagramSocket Public Functions                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def sendTo(self, packetBytes, destinationIpAddress, ttl):
+            self.setTtl(ttl)
+            packetIdentifier, sequenceNumber = struct.unpack_from("!HH", packetBytes, 4)
+            sentIdentifiers = self.__sentIdentifiers
+            key = (sequenceNumber, destinationIpAddress)
+            sentIdentifiers[key] = packetIdentifier
+            sentIdentifiers.move_to_end(key)
+            if len(sentIdentifiers) > self.__MAX_SENT_IDENTIFIERS:
+                sentIdentifiers.popitem(last=False)
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            if metrics is None:
+                return self.__send(packetBytes, destinationIpAddress)
+            startNs = time.perf_counter_ns()
+            try:
+                return self.__send(packetBytes, destinationIpAddress)
+            except OSError:
+                metrics.count("socket_errors")
+                raise
+            finally:
+                metrics.recordTiming("send", time.perf_counter_ns() - startNs)
+
+        def receiveDatagram(self, bufferSize=1024):
+            # Echo replies come from the normal queue, errors from the error queue; the socket error (or EAGAIN) the
+            # normal read raises only says to look there. Raises BlockingIOError when both are empty.
+            try:
+                recvPacket, ancillaryData, flags, addr = self.__socket.recvmsg(
+                    bufferSize, self.getAncillaryBufferSize())
+                recvPacket = self.__packIpHeader(len(recvPacket), inet_aton(addr[0]), b"\0\0\0\0") + \
+                    self.__restoreIdentifier(recvPacket, addr[0])
+            except OSError:
+                if not self.hasErrorQueue():
+                    raise
+                recvPacket, addr, ancillaryData = self.__receiveError(bufferSize)
+            timeReceivedNs = time.perf_counter_ns()
+            realtimeNs = time.time_ns()
+            return recvPacket, addr, realtimeNs / 1e9, timeReceivedNs, self.getKernelDelayNs(ancillaryData, realtimeNs)
+
+        def close(self):
+            if self.__socket is not None:
+                self.__socket.close()
+                self.__socket = None
+                self.__ttl = None
+                super().close()
+
+    # ################################################################################################################ #
+    # Class IcmpSimulatedHop                                                                                           #
+    #                                                                                                                  #
+    # One hop of an IcmpSimulatedNetwork route: the interface address(es) it answers from, the one way latency of the  #
+    # link into it, the share of probes it drops and how many ICMP messages per second it generates (a token bucket    #
+    # of burst messages refilled at rateLimit). Several addresses make it a per-flow load balanced hop.                #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpSimulatedHop:
+        __slots__ = ("__addresses",
+                     "__latency",
+                     "__lossRate",
+                     "__replyBucket",
+                     "__responds")
+
+        def __init__(self, addresses=None, latency=0.001, lossRate=0.0, rateLimit=None, burst=None, responds=True):
+            # addresses None answers from the destination address itself (for the host at the end of a route)
+            if isinstance(addresses, str):
+                addresses = [addresses]
+            self.__addresses = addresses
+            self.__latency = latency
+            self.__lossRate = lossRate
+            self.__replyBucket = IcmpHelperLibrary.IcmpTokenBucket(rateLimit, burst) if rateLimit is not None else None
+            self.__responds = responds
+
+        def getAddresses(self):
+            return self.__addresses
+
+        def getAddress(self, flowKey, ttl):
+            # Interface a flow is sent through: a multiplicative hash of the flow key salted with the TTL, so each
+            # load balanced hop spreads flows independently of the others
+            if self.__addresses is None:
+                return None
+            flowHash = ((flowKey * 0x9e3779b1 + ttl * 0x85ebca77) & 0xffffffff) >> 16
+            return self.__addresses[flowHash % len(self.__addresses)]
+
+        def getLatency(self):
+            return self.__latency
+
+        def getLossRate(self):
+            return self.__lossRate
+
+        def isResponding(self):
+            return self.__responds
+
+        def allowReply(self, now):
+            # Takes a token when one is left; rate limited routers stay silent otherwise
+            return self.__replyBucket is None or self.__replyBucket.take(now)
+
+    # ################################################################################################################ #
+    # Class IcmpSimulatedNetwork                                                                                       #
+    #                                                                                                                  #
+    # Topology an IcmpSimulatedSocket answers from: routes by destination prefix (longest match wins), each a list of  #
+    # IcmpSimulatedHops for TTL 1, 2... and the hop of the destination host itself. Destinations without a route       #
+    # never answer. The random source behind losses is seeded, so a run can be repeated exactly.                       #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpSimulatedNetwork:
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Class Scope Variables                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __IP_HEADER_STRUCT = struct.Struct("!BBHHHBBH4s4s")
+        __FLOW_KEY_STRUCT = struct.Struct("!I")             # Type, code and checksum, what per-flow balancers hash
+        __SOURCE_ADDRESS = inet_aton("127.0.0.1")           # Where the simulated probes come from
+
+        __routes = None                 # [(IPv4Network, [IcmpSimulatedHop], destination IcmpSimulatedHop)]
+        __random = None
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Constructors                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, seed=None):
+            self.__routes = []
+            self.__random = random.Random(seed)
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Getters                                                                                 #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getRoute(self, destinationIpAddress):
+            # (hops, destination hop) of the longest prefix holding destinationIpAddress, None without one
+            address = ipaddress.ip_address(destinationIpAddress)
+            for network, hops, destinationHop in self.__routes:
+                if address in network:
+                    return hops, destinationHop
+            return None
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Private Functions                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def __packIpHeader(payloadLength, sourceAddress, destinationAddress):
+            return IcmpHelperLibrary.IcmpSimulatedNetwork.__IP_HEADER_STRUCT.pack(
+                0x45, 0, 20 + payloadLength, 0, 0, 64, IPPROTO_ICMP, 0, sourceAddress, destinationAddress)
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Public Functions                                                                        #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def buildEchoReply(packetBytes, destinationIpAddress):
+            # Echo reply to the request packetBytes from destinationIpAddress, IP header first as a raw socket reads it
+            network = IcmpHelperLibrary.IcmpSimulatedNetwork
+            reply = bytearray(packetBytes)
+            checksum = struct.unpack_from("!H", reply, 2)[0]
+            reply[0] = 0
+            struct.pack_into("!H", reply, 2, IcmpHelperLibrary.IcmpChecksum.update(checksum, 0x0800, 0x0000))
+            return network.__packIpHeader(len(reply), inet_aton(destinationIpAddress), network.__SOURCE_ADDRESS) + reply
+
+        @staticmethod
+        def buildTimeExceeded(packetBytes, destinationIpAddress, routerIpAddress):
+            # Time Exceeded from routerIpAddress quoting the request packetBytes sent towards destinationIpAddress
+            network = IcmpHelperLibrary.IcmpSimulatedNetwork
+            quoted = network.__packIpHeader(len(packetBytes), network.__SOURCE_ADDRESS,
+                                            inet_aton(destinationIpAddress)) + bytes(packetBytes[:8])
+            message = bytearray(struct.pack("!BBHI", 11, 0, 0, 0) + quoted)
+            struct.pack_into("!H", message, 2, IcmpHelperLibrary.IcmpChecksum.calculate(message))
+            return network.__packIpHeader(len(message), inet_aton(routerIpAddress), network.__SOURCE_ADDRESS) + message
+
+        def addRoute(self, prefix, hops, destinationHop=None):
+            # hops are the IcmpSimulatedHops for TTL 1 up to the last router, destinationHop the host at the end
+            if destinationHop is None:
+                destinationHop = IcmpHelperLibrary.IcmpSimulatedHop()
+            self.__routes.append((ipaddress.ip_network(prefix, strict=False), list(hops), destinationHop))
+            self.__routes.sort(key=lambda route: route[0].prefixlen, reverse=True)
+
+        def respond(self, packetBytes, destinationIpAddress, ttl, now):
+            # Walks the probe down its route for ttl hops. Returns (round trip time, reply datagram, address
+            # answering), or None when a hop dropped the probe or the one it reached did not answer.
+            route = self.getRoute(destinationIpAddress)
+            if route is None:
+                return None
+            hops, destinationHop = route
+            traversedHops = hops[:ttl]
+            if ttl > len(hops):
+                traversedHops = traversedHops + [destinationHop]
+            for hop in traversedHops:
+                if hop.getLossRate() > 0 and self.__random.random() < hop.getLossRate():
+                    return None
+            answeringHop = traversedHops[-1]
+            if not answeringHop.isResponding() or not answeringHop.allowReply(now):
+                return None
+
+            roundTripTime = 2 * sum(hop.getLatency() for hop in traversedHops)
+            flowKey = self.__FLOW_KEY_STRUCT.unpack_from(packetBytes)[0]
+            address = answeringHop.getAddress(flowKey, ttl) or destinationIpAddress
+            if answeringHop is destinationHop:
+                return roundTripTime, self.buildEchoReply(packetBytes, address), address
+            return roundTripTime, self.buildTimeExceeded(packetBytes, destinationIpAddress, address), address
+
+    # ################################################################################################################ #
+    # Class IcmpSimulatedSocket                                                                                        #
+    #                                                                                                                  #
+    # Transport over an IcmpSimulatedNetwork, no network access or privileges needed: every probe sent is answered in  #
+    # process, after the round trip time of its route, as the network decides. Without a network one route to every    #
+    # destination is made up: hopCount - 1 routers (192.0.2.<ttl>) then the destination, delay seconds round trip and  #
+    # lossRate probes lost at the destination. There is no file descriptor, so I/O is never batched over it.           #
+    # ################################################################################################################ #
+    class IcmpSimulatedSocket(IcmpTransport):
+        # ############################################################################################################ #
+        # IcmpSimulatedSocket Class Scope Variables                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        TRANSPORT_NAME = "simulated"
+
+        __ttl = None
+        __network = None
+        __replies = None                # Heap of (due time, order, reply datagram, (address, 0))
+        __order = 0
+        __packetsSent = 0
+        __closed = False
+
+        # ############################################################################################################ #
+        # IcmpSimulatedSocket Constructors                                                                             #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, delay=0.0, hopCount=1, lossRate=0.0, seed=None, network=None):
+            super().__init__()
+            if hopCount < 1:
+                raise ValueError("hopCount must be at least 1")
+            if network is None:
+                linkLatency = delay / (2 * hopCount)
+                network = IcmpHelperLibrary.IcmpSimulatedNetwork(seed)
+                network.addRoute("0.0.0.0/0",
+                                 [IcmpHelperLibrary.IcmpSimulatedHop("192.0.2.%d" % ttl, linkLatency)
+                                  for ttl in range(1, hopCount)],
+                                 IcmpHelperLibrary.IcmpSimulatedHop(None, linkLatency, lossRate))
+            self.__network = network
+            self.__replies = []
+
+        # ############################################################################################################ #
+        # IcmpSimulatedSocket Getters                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getNetwork(self):
+            return self.__network
+
+        def getTtl(self):
+            return self.__ttl
+
+        def getPacketsSent(self):
+            return self.__packetsSent
+
+        def getPendingReplyCount(self):
+            return len(self.__replies)
+
+        def getNextReplyTime(self):
+            # time.monotonic() at which the next reply becomes due, None when none is on its way
+            return self.__replies[0][0] if len(self.__replies) > 0 else None
+
+        def isClosed(self):
+            return self.__closed
+
+        # ############################################################################################################ #
+        # IcmpSimulatedSocket Setters                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setTtl(self, ttl):
+            self.__ttl = ttl
+
+        # ############################################################################################################ #
+        # IcmpSimulatedSocket Public Functions                                                                         #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def sendTo(self, packetBytes, destinationIpAddress, ttl):
+            if self.__closed:
+                raise OSError(errno.EBADF, "simulated socket is closed")
+            self.setTtl(ttl)
+            self.__packetsSent += 1
+            now = time.monotonic()
+            response = self.__network.respond(bytes(packetBytes), destinationIpAddress, ttl, now)
+            if response is not None:
+                roundTripTime, recvPacket, address = response
+                self.__order += 1
+                heapq.heappush(self.__replies, (now + roundTripTime, self.__order, recvPacket, (address, 0)))
+            return len(packetBytes)
+
+        def receiveDatagram(self, bufferSize=1024):
+            # Next reply that is already due, BlockingIOError when there is none
+            if len(self.__replies) == 0 or self.__replies[0][0] > time.monotonic():
+                raise BlockingIOError(errno.EAGAIN, "no simulated reply due")
+            dueTime, order, recvPacket, addr = heapq.heappop(self.__replies)
+            return recvPacket[:bufferSize], addr, time.time(), time.perf_counter_ns(), 0
+
+        def receiveAvailable(self, timeLeft):
+            # Sleeps until the next reply is due or timeLeft runs out, then dispatches every reply that is due
+            now = time.monotonic()
+            wakeTime = now + max(timeLeft, 0)
+            if len(self.__replies) > 0:
+                wakeTime = min(wakeTime, self.__replies[0][0])
+            if wakeTime > now:
+                metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+                startNs = time.perf_counter_ns() if metrics is not None else 0
+                time.sleep(wakeTime - now)
+                now = time.monotonic()
+                if metrics is not None:
+                    metrics.recordTiming("wait", time.perf_counter_ns() - startNs)
+            received = 0
+            dispatcher = self.getDispatcher()
+            while len(self.__replies) > 0 and self.__replies[0][0] <= now:
+                dueTime, order, recvPacket, addr = heapq.heappop(self.__replies)
+                received += 1
+                dispatcher.dispatch(recvPacket, addr, time.time(), time.perf_counter_ns(), 0)
+            return received
+
+        def close(self):
+            if not self.__closed:
+                self.__closed = True
+                self.__ttl = None
+                del self.__replies[:]
+                super().close()
+
+    # ################################################################################################################ #
+    # Class IcmpBatchIo                                                                                                #
+    #                                                                                                                  #
+    # Batched I/O for an IcmpSocket: queued probes leave in one sendmmsg() per batch (per run of equal TTL) and        #
+    # replies are drained with recvmmsg() into a preallocated ring of batchSize receive buffers, both called through   #
+    # ctypes. Where libc lacks the calls (not Linux, no glibc) every operation falls back to the per-packet path of    #
+    # the socket. Syscalls are counted either way so the two paths can be compared.                                    #
+    # ################################################################################################################ #
+    class IcmpBatchIo:
+        # ############################################################################################################ #
+        # IcmpBatchIo Class Scope Variables                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        class __SockaddrIn(ctypes.Structure):
+            _fields_ = [("sin_family", ctypes.c_ushort),
+                        ("sin_port", ctypes.c_ushort),
+                        ("sin_addr", ctypes.c_ubyte * 4),
+                        ("sin_zero", ctypes.c_ubyte * 8)]
+
+        class __Iovec(ctypes.Structure):
+            _fields_ = [("iov_base", ctypes.c_void_p),
+                        ("iov_len", ctypes.c_size_t)]
+
+        class __Msghdr(ctypes.Structure):
+            _fields_ = [("msg_name", ctypes.c_void_p),
+                        ("msg_namelen", ctypes.c_uint32),
+                        ("msg_iov", ctypes.c_void_p),
+                        ("msg_iovlen", ctypes.c_size_t),
+                        ("msg_control", ctypes.c_void_p),
+                        ("msg_controllen", ctypes.c_size_t),
+                        ("msg_flags", ctypes.c_int)]
+
+        class __Mmsghdr(ctypes.Structure):
+            pass
+        __Mmsghdr._fields_ = [("msg_hdr", __Msghdr),
+                              ("msg_len", ctypes.c_uint)]
+
+        __CMSG_HEADER_STRUCT = struct.Struct("@Nii")            # cmsg_len, cmsg_level, cmsg_type
+        __CMSG_ALIGNMENT = ctypes.sizeof(ctypes.c_size_t)
+        __MSG_DONTWAIT = getSocketConstant("MSG_DONTWAIT", 0x40)
+        __SEND_WAIT = 1.0               # Seconds a full send buffer may take to drain before the rest is dropped
+
+        __libc = None                   # (sendmmsg, recvmmsg) once looked up, False if unavailable
+
+        __icmpSocket = None
+        __batchSize = 64
+        __bufferSize = 1024
+        __batched = False
+        __sendBuffers = None            # Ring of send slots: packet buffer, iovec, sockaddr and mmsghdr each
+        __sendIovecs = None
+        __sendAddresses = None
+        __sendMessages = None
+        __sendQueued = 0
+        __sendTtl = None                # TTL of the queued run, a different TTL flushes first
+        __receiveBuffers = None         # Ring of receive slots
+        __receiveIovecs = None
+        __receiveAddresses = None
+        __receiveControls = None
+        __receiveMessages = None
+        __controlBufferSize = 0
+        __syscalls = 0
+        __packetsSent = 0
+        __packetsReceived = 0           # Replies the dispatcher matched to a probe, stray ICMP is not counted
+        __sendErrors = 0
+
+        # ############################################################################################################ #
+        # IcmpBatchIo Constructors                                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, icmpSocket, batchSize=64, bufferSize=1024, forceFallback=False):
+            self.__icmpSocket = icmpSocket
+            self.__batchSize = max(batchSize, 1)
+            self.__bufferSize = bufferSize
+            self.__batched = not forceFallback and IcmpHelperLibrary.IcmpBatchIo.isAvailable() and \
+                icmpSocket.isBatchable()
+            self.__sendQueued = 0
+            self.__sendTtl = None
+            self.__syscalls = 0
+            self.__packetsSent = 0
+            self.__packetsReceived = 0
+            self.__sendErrors = 0
+            if self.__batched:
+                self.__allocateRings()
+
+        # ############################################################################################################ #
+        # IcmpBatchIo Getters                                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def isAvailable():
+            return IcmpHelperLibrary.IcmpBatchIo.__MSG_DONTWAIT is not None and \
+                IcmpHelperLibrary.IcmpBatchIo.__loadLibc() is not False
+
+        def isBatched(self):
+            return self.__batched
+
+        def getBatchSize(self):
+            return self.__batchSize
+
+        def getSyscallCount(self):
+            return self.__syscalls
+
+        def getPacketsSent(self):
+            return self.__packetsSent
+
+        def getPacketsReceived(self):
+            return self.__packetsReceived
+
+        def getSendErrors(self):
+            return self.__sendErrors
+
+        def getSyscallsPerProbe(self):
+            if self.__packetsSent == 0:
+                return 0.0
+            return self.__syscalls / self.__packetsSent
+
+        # ############################################################################################################ #
+        # IcmpBatchIo Private Functions                                                                                #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def __loadLibc():
+            if IcmpHelperLibrary.IcmpBatchIo.__libc is None:
+                try:
+                    libc = ctypes.CDLL(None, use_errno=True)
+                    sendmmsg, recvmmsg = libc.sendmmsg, libc.recvmmsg
+                    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+                    recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+                    IcmpHelperLibrary.IcmpBatchIo.__libc = (sendmmsg, recvmmsg)
+                except (OSError, AttributeError, TypeError):
+                    IcmpHelperLibrary.IcmpBatchIo.__libc = False
+            return IcmpHelperLibrary.IcmpBatchIo.__libc
+
+        def __allocateRings(self):
+            # Everything the kernel reads or writes is allocated once and only patched per call
+            batchSize = self.__batchSize
+            self.__sendBuffers = [ctypes.create_string_buffer(self.__bufferSize) for i in range(batchSize)]
+            self.__sendIovecs = (self.__Iovec * batchSize)()
+            self.__sendAddresses = (self.__SockaddrIn * batchSize)()
+            self.__sendMessages = (self.__Mmsghdr * batchSize)()
+            self.__receiveBuffers = [ctypes.create_string_buffer(self.__bufferSize) for i in range(batchSize)]
+            self.__receiveIovecs = (self.__Iovec * batchSize)()
+            self.__receiveAddresses = (self.__SockaddrIn * batchSize)()
+            self.__receiveMessages = (self.__Mmsghdr * batchSize)()
+            self.__controlBufferSize = self.__icmpSocket.getAncillaryBufferSize()
+            self.__receiveControls = [ctypes.create_string_buffer(max(self.__controlBufferSize, 1))
+                                      for i in range(batchSize)]
+            for i in range(batchSize):
+                self.__sendIovecs[i].iov_base = ctypes.addressof(self.__sendBuffers[i])
+                self.__sendAddresses[i].sin_family = AF_INET
+                header = self.__sendMessages[i].msg_hdr
+                header.msg_name = ctypes.addressof(self.__sendAddresses[i])
+                header.msg_namelen = ctypes.sizeof(self.__SockaddrIn)
+                header.msg_iov = ctypes.addressof(self.__sendIovecs[i])
+                header.msg_iovlen = 1
+
+                self.__receiveIovecs[i].iov_base = ctypes.addressof(self.__receiveBuffers[i])
+                self.__receiveIovecs[i].iov_len = self.__bufferSize
+                header = self.__receiveMessages[i].msg_hdr
+                header.msg_name = ctypes.addressof(self.__receiveAddresses[i])
+                header.msg_iov = ctypes.addressof(self.__receiveIovecs[i])
+                header.msg_iovlen = 1
+                if self.__controlBufferSize > 0:
+                    header.msg_control = ctypes.addressof(self.__receiveControls[i])
+
+        def __parseControlMessages(self, slot, controlLength):
+            # (level, type, data) tuples like socket.recvmsg() returns them
+            control = ctypes.string_at(ctypes.addressof(self.__receiveControls[slot]), controlLength)
+            headerSize = self.__CMSG_HEADER_STRUCT.size
+            alignment = self.__CMSG_ALIGNMENT
+            dataOffset = (headerSize + alignment - 1) & ~(alignment - 1)
+            ancillaryData = []
+            offset = 0
+            while offset + headerSize <= controlLength:
+                length, level, messageType = self.__CMSG_HEADER_STRUCT.unpack_from(control, offset)
+                if length < headerSize:
+                    break
+                ancillaryData.append((level, messageType, control[offset + dataOffset:offset + length]))
+                offset += (length + alignment - 1) & ~(alignment - 1)
+            return ancillaryData
+
+        # ############################################################################################################ #
+        # IcmpBatchIo Public Functions                                                                                 #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def queueSend(self, packetBytes, destinationIpAddress, ttl):
+            # The packet is copied, so a template's reused buffer may be rebuilt right away. Without batching it is
+            # sent immediately. A probe whose send fails is not reported; it simply goes unanswered.
+            if not self.__batched:
+                self.__syscalls += 1
+                try:
+                    self.__icmpSocket.sendTo(packetBytes, destinationIpAddress, ttl)
+                    self.__packetsSent += 1
+                except OSError:
+                    self.__sendErrors += 1      # The transport counted it in the metrics
+                return
+
+            if self.__sendQueued == self.__batchSize or (self.__sendQueued > 0 and ttl != self.__sendTtl):
+                self.flushSends()
+            slot = self.__sendQueued
+            packetLength = len(packetBytes)
+            ctypes.memmove(self.__sendBuffers[slot], bytes(packetBytes), packetLength)
+            self.__sendIovecs[slot].iov_len = packetLength
+            ctypes.memmove(self.__sendAddresses[slot].sin_addr, inet_aton(destinationIpAddress), 4)
+            self.__sendQueued += 1
+            self.__sendTtl = ttl
+
+        def flushSends(self):
+            # Hands every queued probe to the kernel. Returns the number actually sent.
+            if not self.__batched or self.__sendQueued == 0:
+                return 0
+            sendmmsg = self.__loadLibc()[0]
+            if self.__sendTtl != self.__icmpSocket.getTtl():
+                self.__syscalls += 1
+                self.__icmpSocket.setTtl(self.__sendTtl)
+            fileDescriptor = self.__icmpSocket.fileno()
+            messageSize = ctypes.sizeof(self.__Mmsghdr)
+            baseAddress = ctypes.addressof(self.__sendMessages)
+            queued = self.__sendQueued
+            sent = 0
+            offset = 0
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            startNs = time.perf_counter_ns() if metrics is not None else 0
+            while offset < queued:
+                self.__syscalls += 1
+                count = sendmmsg(fileDescriptor, baseAddress + offset * messageSize, queued - offset, 0)
+                if count < 0:
+                    error = ctypes.get_errno()
+                    if error == errno.EINTR:
+                        continue
+                    if error == errno.EAGAIN:
+                        # The send buffer is full: wait until it has room rather than spin, and drop what is left if
+                        # it does not drain in time (those probes go unanswered)
+                        self.__syscalls += 1
+                        if select.select([], [self.__icmpSocket], [], self.__SEND_WAIT)[1] != []:
+                            continue
+                        self.__sendErrors += queued - offset
+                        if metrics is not None:
+                            metrics.count("socket_errors", queued - offset)
+                        break
+                    self.__sendErrors += 1      # The first message failed (e.g. no route), skip it
+                    if metrics is not None:
+                        metrics.count("socket_errors")
+                    offset += 1
+                    continue
+                sent += count
+                offset += count
+            if metrics is not None:
+                metrics.recordTiming("send", time.perf_counter_ns() - startNs)
+            self.__packetsSent += sent
+            self.__sendQueued = 0
+            return sent
+
+        def receiveAvailable(self, timeLeft):
+            # Same contract as IcmpSocket.receiveAvailable(): waits up to timeLeft seconds for the socket to become
+            # readable, then routes every queued datagram through the socket's dispatcher, batchSize per syscall.
+            self.flushSends()
+            if not self.__batched:
+                dispatcher = self.__icmpSocket.getDispatcher()
+                matchedCount = dispatcher.getMatchedCount()
+                received = self.__icmpSocket.receiveAvailable(timeLeft)
+                # Estimated: the socket makes the calls itself, at least a select, then a read and a select(0) for
+                # every datagram
+                self.__syscalls += 1 + 2 * received
+                self.__packetsReceived += dispatcher.getMatchedCount() - matchedCount
+                return received
+
+            self.__syscalls += 1
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            startNs = time.perf_counter_ns() if metrics is not None else 0
+            readable = select.select([self.__icmpSocket], [], [], max(timeLeft, 0))[0] != []
+            if metrics is not None:
+                metrics.recordTiming("wait", time.perf_counter_ns() - startNs)
+            if not readable:
+                return 0
+            recvmmsg = self.__loadLibc()[1]
+            dispatcher = self.__icmpSocket.getDispatcher()
+            fileDescriptor = self.__icmpSocket.fileno()
+            kernelTimestamps = self.__controlBufferSize > 0
+            received = 0
+            while True:
+                for i in range(self.__batchSize):
+                    header = self.__receiveMessages[i].msg_hdr
+                    header.msg_namelen = ctypes.sizeof(self.__SockaddrIn)
+                    header.msg_controllen = self.__controlBufferSize
+                self.__syscalls += 1
+                count = recvmmsg(fileDescriptor, self.__receiveMessages, self.__batchSize, self.__MSG_DONTWAIT, None)
+                if count <= 0:
+                    break
+                timeReceivedNs = time.perf_counter_ns()
+                realtimeNs = time.time_ns()
+                for i in range(count):
+                    message = self.__receiveMessages[i]
+                    recvPacket = ctypes.string_at(ctypes.addressof(self.__receiveBuffers[i]), message.msg_len)
+                    addr = (inet_ntoa(bytes(self.__receiveAddresses[i].sin_addr)), 0)
+                    kernelDelayNs = 0
+                    if kernelTimestamps:
+                        kernelDelayNs = self.__icmpSocket.getKernelDelayNs(
+                            self.__parseControlMessages(i, message.msg_hdr.msg_controllen), realtimeNs)
+                    if dispatcher.dispatch(recvPacket, addr, realtimeNs / 1e9, timeReceivedNs,
+                                           kernelDelayNs) is not None:
+                        self.__packetsReceived += 1
+                received += count
+                if count < self.__batchSize:
+                    break               # Queue drained, a further call would only return EAGAIN
+            return received
+
+    # ################################################################################################################ #
+    # Class IcmpIoReport                                                                                               #
+    #                                                                                                                  #
+    # Throughput of a run: probes per second and syscalls per probe, and whether sendmmsg/recvmmsg were used.          #
+    # Without them the syscalls are an estimate, as the transport reads the replies itself.                            #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpIoReport:
+        __slots__ = ("__batched",
+                     "__packetsSent",
+                     "__packetsReceived",
+                     "__syscalls",
+                     "__elapsed")
+
+        RECORD_TYPE = "io"
+        FIELDS = ("record", "batched", "sent", "received", "syscalls", "syscalls_estimated", "elapsed_s",
+                  "probes_per_second", "syscalls_per_probe")
+
+        def __init__(self, batchIo, elapsed):
+            self.__batched = batchIo.isBatched()
+            self.__packetsSent = batchIo.getPacketsSent()
+            self.__packetsReceived = batchIo.getPacketsReceived()
+            self.__syscalls = batchIo.getSyscallCount()
+            self.__elapsed = elapsed
+
+        def getPacketsSent(self):
+            return self.__packetsSent
+
+        def getPacketsReceived(self):
+            return self.__packetsReceived
+
+        def getSyscallCount(self):
+            return self.__syscalls
+
+        def getElapsed(self):
+            return self.__elapsed
+
+        def getProbesPerSecond(self):
+            if self.__elapsed <= 0:
+                return 0.0
+            return self.__packetsSent / self.__elapsed
+
+        def getSyscallsPerProbe(self):
+            if self.__packetsSent == 0:
+                return 0.0
+            return self.__syscalls / self.__packetsSent
+
+        def isSyscallCountEstimated(self):
+            return not self.__batched
+
+        def toRow(self):
+            return (self.RECORD_TYPE, self.__batched, self.__packetsSent, self.__packetsReceived, self.__syscalls,
+                    self.isSyscallCountEstimated(), self.__elapsed, self.getProbesPerSecond(),
+                    self.getSyscallsPerProbe())
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            return "I/O    %s    Sent=%d    Received=%d    Syscalls=%s%d    Probes/s=%.0f    Syscalls/probe=%.2f" % \
+                   (
+                       "sendmmsg/recvmmsg" if self.__batched else "sendto/recvfrom",
+                       self.__packetsSent,
+                       self.__packetsReceived,
+                       "~" if self.isSyscallCountEstimated() else "",
+                       self.__syscalls,
+                       self.getProbesPerSecond(),
+                       self.getSyscallsPerProbe()
+                   )
+
+    # ################################################################################################################ #
+    # Class IcmpShardReport                                                                                            #
+    #                                                                                                                  #
+    # What one sweepSharded() worker did: its identifier range, the statistics of all its targets merged and its I/O.  #
+    # The reports of all workers merge into one for the whole sweep (shard None).                                      #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpShardReport:
+        __slots__ = ("__shardIndex",
+                     "__packetIdentifiers",
+                     "__targetCount",
+                     "__statistics",
+                     "__packetsSent",
+                     "__syscalls",
+                     "__elapsed",
+                     "__error")
+
+        RECORD_TYPE = "shard"
+        FIELDS = ("record", "shard", "identifiers", "targets", "sent", "received", "packet_loss", "average_ms",
+                  "p50_ms", "p99_ms", "syscalls", "elapsed_s", "probes_per_second", "error")
+
+        def __init__(self, shardIndex, packetIdentifiers):
+            self.__shardIndex = shardIndex
+            self.__packetIdentifiers = packetIdentifiers
+            self.__targetCount = 0
+            self.__statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            self.__packetsSent = 0      # As counted by the I/O layer, i.e. including probes whose send failed
+            self.__syscalls = 0
+            self.__elapsed = 0.0
+            self.__error = None
+
+        def getShardIndex(self):
+            return self.__shardIndex
+
+        def getPacketIdentifiers(self):
+            return self.__packetIdentifiers
+
+        def getTargetCount(self):
+            return self.__targetCount
+
+        def getStatistics(self):
+            return self.__statistics
+
+        def getElapsed(self):
+            return self.__elapsed
+
+        def getProbesPerSecond(self):
+            if self.__elapsed <= 0:
+                return 0.0
+            return self.__packetsSent / self.__elapsed
+
+        def getError(self):
+            return self.__error
+
+        def setElapsed(self, elapsed):
+            self.__elapsed = elapsed
+
+        def setError(self, error):
+            self.__error = error
+
+        def recordTarget(self, sweepTarget):
+            self.__targetCount += 1
+            self.__statistics.merge(sweepTarget.getStatistics())
+
+        def recordIo(self, ioReport):
+            self.__packetsSent += ioReport.getPacketsSent()
+            self.__syscalls += ioReport.getSyscallCount()
+            self.__elapsed += ioReport.getElapsed()
+
+        def merge(self, other):
+            # Workers run side by side, so the elapsed time is the longest of them rather than the sum
+            self.__targetCount += other.getTargetCount()
+            self.__statistics.merge(other.getStatistics())
+            self.__packetsSent += other.__packetsSent
+            self.__syscalls += other.__syscalls
+            self.__elapsed = max(self.__elapsed, other.getElapsed())
+            if self.__error is None:
+                self.__error = other.getError()
+
+        def toRow(self):
+            shard = "total" if self.__shardIndex is None else self.__shardIndex
+            identifiers = "%d-%d" % (self.__packetIdentifiers[0], self.__packetIdentifiers[-1])
+            statistics = self.__statistics
+            packetLoss = statistics.getPacketLoss() if statistics.getPacketsSent() > 0 else None    # Nothing to lose
+            averageRtt = statistics.getAverageRtt() if statistics.getSampleCount() > 0 else None
+            return (self.RECORD_TYPE, shard, identifiers, self.__targetCount, statistics.getPacketsSent(),
+                    statistics.getPacketsReceived(), packetLoss, averageRtt, statistics.getPercentile(50),
+                    statistics.getPercentile(99), self.__syscalls, self.__elapsed, self.getProbesPerSecond(),
+                    self.__error)
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            row = self.toRow()
+            line = "Shard %s    Identifiers=%s    Targets=%d    Sent=%d    Received=%d    Packet_Loss=%.2f    " \
+                   "Average=%.0f ms    Probes/s=%.0f" % \
+                   (
+                       row[1],
+                       row[2],
+                       self.__targetCount,
+                       self.__statistics.getPacketsSent(),
+                       self.__statistics.getPacketsReceived(),
+                       0.0 if row[6] is None else row[6],
+                       0.0 if row[7] is None else row[7],
+                       self.getProbesPerSecond()
+                   )
+            if self.__error is not None:
+                line += "    Error: %s" % self.__error
+            return line
+
+    # ################################################################################################################ #
+    # Class IcmpSweepShard                                                                                             #
+    #                                                                                                                  #
+    # The part of sweepSharded() that runs in a worker process: a sweep over its own transport, filtered down to its   #
+    # identifier range in the kernel (in its dispatcher where the transport takes no socket filter), fed chunks of     #
+    # targets through one queue and sending back completed IcmpSweepTargets in batches, then its IcmpShardReport,      #
+    # through another.                                                                                                 #
+    # ################################################################################################################ #
+    class IcmpSweepShard:
+        # ############################################################################################################ #
+        # IcmpSweepShard Class Scope Variables                                                                         #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        IDENTIFIERS_PER_SHARD = 16
+        MESSAGE_TARGETS = "targets"     # (MESSAGE_TARGETS, shard index, [IcmpSweepTarget, ...])
+        MESSAGE_DONE = "done"           # (MESSAGE_DONE, shard index, IcmpShardReport), always the last message
+
+        __RESULT_BATCH_SIZE = 64
+        __RESULT_BATCH_INTERVAL = 0.2   # Seconds a completed target may wait for its batch to fill
+
+        __shardIndex = 0
+        __packetIdentifiers = None
+        __sweepArguments = None         # (count, timeout, interval, rate, maxInFlight, batchSize) for sweep()
+        __transport = "auto"
+
+        # ############################################################################################################ #
+        # IcmpSweepShard Constructors                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, shardIndex, packetIdentifiers, count, timeout, interval, rate, maxInFlight, batchSize,
+                     transport="auto"):
+            self.__shardIndex = shardIndex
+            self.__packetIdentifiers = packetIdentifiers
+            self.__sweepArguments = (count, timeout, interval, rate, maxInFlight, batchSize)
+            self.__transport = transport
+
+        # ############################################################################################################ #
+        # IcmpSweepShard Getters                                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getShardIndex(self):
+            return self.__shardIndex
+
+        def getPacketIdentifiers(self):
+            return self.__packetIdentifiers
+
+        def getTransport(self):
+            return self.__transport
+
+        # ############################################################################################################ #
+        # IcmpSweepShard Private Functions                                                                             #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def __iterateQueue(targetQueue):
+            # Targets from the chunks put on targetQueue until the None that ends them
+            while True:
+                chunk = targetQueue.get()
+                if chunk is None:
+                    return
+                yield from chunk
+
+        # ############################################################################################################ #
+        # IcmpSweepShard Public Functions                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def run(self, targetQueue, resultQueue):
+            # Process entry point. Interrupts are left to the parent, which stops the workers itself.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            shardReport = IcmpHelperLibrary.IcmpShardReport(self.__shardIndex, self.__packetIdentifiers)
+            completedTargets = []
+            icmpSocket = None
+            try:
+                icmpSocket = IcmpHelperLibrary.openTransport(self.__transport, receiveBufferSize=4 * 1024 * 1024)
+                if not icmpSocket.setIdentifierFilter(self.__packetIdentifiers[0], self.__packetIdentifiers[-1]):
+                    # No socket filter here, so the dispatcher drops the other workers' replies instead
+                    icmpSocket.getDispatcher().setIdentifierRange(self.__packetIdentifiers)
+                sink = IcmpHelperLibrary.IcmpMemorySink()
+                icmpHelperLibrary = IcmpHelperLibrary(icmpSocket, sink=sink)
+                lastBatchTime = time.monotonic()
+                targets = IcmpHelperLibrary.IcmpSweepShard.__iterateQueue(targetQueue)
+                for sweepTarget in icmpHelperLibrary.sweep(targets, *self.__sweepArguments,
+                                                           packetIdentifiers=self.__packetIdentifiers):
+                    shardReport.recordTarget(sweepTarget)
+                    completedTargets.append(sweepTarget)
+                    if len(completedTargets) >= self.__RESULT_BATCH_SIZE or \
+                            time.monotonic() - lastBatchTime >= self.__RESULT_BATCH_INTERVAL:
+                        resultQueue.put((self.MESSAGE_TARGETS, self.__shardIndex, completedTargets))
+                        completedTargets = []
+                        lastBatchTime = time.monotonic()
+                shardReport.recordIo(icmpHelperLibrary.getLastIoReport())
+            except Exception as error:
+                shardReport.setError(str(error))
+            finally:
+                if len(completedTargets) > 0:
+                    resultQueue.put((self.MESSAGE_TARGETS, self.__shardIndex, completedTargets))
+                resultQueue.put((self.MESSAGE_DONE, self.__shardIndex, shardReport))
+                if icmpSocket is not None:
+                    icmpSocket.close()
+
+    # ################################################################################################################ #
+    # Class IcmpMessage                                                                                                #
+    #                                                                                                                  #
+    # Compact result of IcmpMessageDecoder.decode(). Numeric fields are unpacked once, addresses are only turned into  #
+    # dotted strings when asked for.                                                                                   #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMessage:
+        # ############################################################################################################ #
+        # IcmpMessage Class Scope Variables                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__recvPacket",
+                     "__ipHeaderLength",
+                     "__icmpType",
+                     "__icmpCode",
+                     "__identifier",
+                     "__sequenceNumber",
+                     "__quotedPosition",
+                     "__quotedProtocol",
+                     "__quotedIcmpType")
+
+        # ############################################################################################################ #
+        # IcmpMessage Constructors                                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, recvPacket, ipHeaderLength, icmpType, icmpCode, identifier, sequenceNumber,
+                     quotedPosition, quotedProtocol, quotedIcmpType):
+            self.__recvPacket = recvPacket
+            self.__ipHeaderLength = ipHeaderLength
+            self.__icmpType = icmpType
+            self.__icmpCode = icmpCode
+            self.__identifier = identifier              # From the echo header, or the quoted one for errors
+            self.__sequenceNumber = sequenceNumber
+            self.__quotedPosition = quotedPosition      # Offset of the quoted IP header, -1 when there is none
+            self.__quotedProtocol = quotedProtocol
+            self.__quotedIcmpType = quotedIcmpType      # Type of a quoted ICMP message, -1 when not ICMP
+
+        # ############################################################################################################ #
+        # IcmpMessage Getters                                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getIcmpType(self):
+            return self.__icmpType
+
+        def getIcmpCode(self):
+            return self.__icmpCode
+
+        def getIdentifier(self):
+            return self.__identifier
+
+        def getSequenceNumber(self):
+            return self.__sequenceNumber
+
+        def getIpHeaderLength(self):
+            return self.__ipHeaderLength
+
+        def getTypeName(self):
+            return IcmpHelperLibrary.IcmpMessageDecoder.getTypeName(self.__icmpType)
+
+        def getMessage(self):
+            return IcmpHelperLibrary.IcmpMessageDecoder.getMessageText(self.__icmpType, self.__icmpCode)
+
+        def isError(self):
+            return self.__quotedPosition >= 0
+
+        def isEchoReply(self):
+            return self.__icmpType == 0
+
+        def isProbeReply(self):
+            # Echo reply, or an error about one of our echo requests; identifier/sequence are meaningful for both
+            return self.__icmpType == 0 or self.__quotedIcmpType == 8
+
+        def getSourceAddress(self):
+            return inet_ntoa(self.__recvPacket[12:16])
+
+        def getQuotedProtocol(self):
+            return self.__quotedProtocol
+
+        def getQuotedIcmpType(self):
+            return self.__quotedIcmpType
+
+        def getQuotedDestinationAddress(self):
+            if self.__quotedPosition < 0:
+                return None
+            return inet_ntoa(self.__recvPacket[self.__quotedPosition + 16:self.__quotedPosition + 20])
+
+        def getGatewayAddress(self):
+            # Redirect only: router the datagram should have been sent to
+            if self.__icmpType != 5:
+                return None
+            return inet_ntoa(self.__recvPacket[self.__ipHeaderLength + 4:self.__ipHeaderLength + 8])
+
+        def getPointer(self):
+            # Parameter Problem only: offset of the octet in the quoted datagram that caused the error
+            if self.__icmpType != 12:
+                return None
+            return self.__recvPacket[self.__ipHeaderLength + 4]
+
+    # ################################################################################################################ #
+    # Class IcmpMessageDecoder                                                                                         #
+    #                                                                                                                  #
+    # References:                                                                                                      #
+    # https://www.iana.org/assignments/icmp-parameters/icmp-parameters.xhtml                                           #
+    # https://www.rfc-editor.org/rfc/rfc792                                                                            #
+    #                                                                                                                  #
+    # Classifies received ICMP datagrams through precomputed tables: one lookup tells whether the type quotes the      #
+    # offending datagram and one more gives the text for a type/code pair. Error messages have the embedded IP header  #
+    # and the first 8 bytes of the original ICMP header unpacked at fixed offsets.                                     #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMessageDecoder:
+        # ############################################################################################################ #
+        # IcmpMessageDecoder Class Scope Variables                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __ICMP_HEADER_STRUCT = struct.Struct("!BBHHH")      # Type, code, checksum, identifier, sequence number
+        __QUOTED_IP_STRUCT = struct.Struct("!B8xB")         # Version/IHL and protocol of the quoted IP header
+
+        __TYPE_NAMES = {
+            0: "Echo Reply",
+            3: "Destination Unreachable",
+            4: "Source Quench",
+            5: "Redirect",
+            8: "Echo Request",
+            11: "Time Exceeded",
+            12: "Parameter Problem",
+        }
+
+        __CODE_MESSAGES = {
+            (0, 0): "Echo Reply",
+            (3, 0): "Net Unreachable",
+            (3, 1): "Host Unreachable",
+            (3, 2): "Protocol Unreachable",
+            (3, 3): "Port Unreachable",
+            (3, 4): "Fragmentation Needed and Don't Fragment was Set",
+            (3, 5): "Source Route Failed",
+            (3, 6): "Destination Network Unknown",
+            (3, 7): "Destination Host Unknown",
+            (3, 8): "Source Host Isolated",
+            (3, 9): "Communication with Destination Network is Administratively Prohibited",
+            (3, 10): "Communication with Destination Host is Administratively Prohibited",
+            (3, 11): "Destination Network Unreachable for Type of Service",
+            (3, 12): "Destination Host Unreachable for Type of Service",
+            (3, 13): "Communication Administratively Prohibited",
+            (3, 14): "Host Precedence Violation",
+            (3, 15): "Precedence cutoff in effect",
+            (4, 0): "Source Quench",
+            (5, 0): "Redirect Datagram for the Network (or subnet)",
+            (5, 1): "Redirect Datagram for the Host",
+            (5, 2): "Redirect Datagram for the Type of Service and Network",
+            (5, 3): "Redirect Datagram for the Type of Service and Host",
+            (8, 0): "Echo Request",
+            (11, 0): "Time to Live exceeded in Transit",
+            (11, 1): "Fragment Reassembly Time Exceeded",
+            (12, 0): "Pointer indicates the error",
+            (12, 1): "Missing a Required Option",
+            (12, 2): "Bad Length",
+        }
+
+        # Flattened lookup tables: a tuple indexed by type and a dict keyed by (type << 8 | code)
+        __TYPE_NAME_TABLE = (lambda names: tuple(names.get(icmpType, "Type %d" % icmpType)
+                                                 for icmpType in range(256)))(__TYPE_NAMES)
+        __MESSAGE_TABLE = (lambda messages: {icmpType << 8 | icmpCode: message
+                                             for (icmpType, icmpCode), message in messages.items()})(__CODE_MESSAGES)
+        __QUOTES_DATAGRAM = tuple(icmpType in (3, 4, 5, 11, 12) for icmpType in range(256))
+
+        # ############################################################################################################ #
+        # IcmpMessageDecoder Public Functions                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def getTypeName(icmpType):
+            return IcmpHelperLibrary.IcmpMessageDecoder.__TYPE_NAME_TABLE[icmpType]
+
+        @staticmethod
+        def getMessageText(icmpType, icmpCode):
+            message = IcmpHelperLibrary.IcmpMessageDecoder.__MESSAGE_TABLE.get(icmpType << 8 | icmpCode)
+            if message is None:
+                message = "%s (Code %d)" % (IcmpHelperLibrary.IcmpMessageDecoder.__TYPE_NAME_TABLE[icmpType], icmpCode)
+            return message
+
+        @staticmethod
+        def decode(recvPacket):
+            # recvPacket is a whole IP datagram as read from a raw socket. Returns an IcmpMessage, or None when the
+            # datagram is too short to hold the headers it announces.
+            decoder = IcmpHelperLibrary.IcmpMessageDecoder
+            recvPacket = memoryview(recvPacket)
+            if len(recvPacket) < 28:
+                return None
+            ipHeaderLength = (recvPacket[0] & 0x0f) * 4
+            if len(recvPacket) < ipHeaderLength + 8:
+                return None
+            icmpType, icmpCode, checksum, identifier, sequenceNumber = \
+                decoder.__ICMP_HEADER_STRUCT.unpack_from(recvPacket, ipHeaderLength)
+
+            if not decoder.__QUOTES_DATAGRAM[icmpType]:
+                return IcmpHelperLibrary.IcmpMessage(recvPacket, ipHeaderLength, icmpType, icmpCode,
+                                                     identifier, sequenceNumber, -1, -1, -1)
+
+            # Error message: the offending IP header follows our 8 byte ICMP header, then its first 8 payload bytes
+            quotedPosition = ipHeaderLength + 8
+            if len(recvPacket) < quotedPosition + 20:
+                return None
+            quotedVersionIhl, quotedProtocol = decoder.__QUOTED_IP_STRUCT.unpack_from(recvPacket, quotedPosition)
+            quotedPayloadPosition = quotedPosition + (quotedVersionIhl & 0x0f) * 4
+            quotedIcmpType = -1
+            identifier = -1
+            sequenceNumber = -1
+            if quotedProtocol == IPPROTO_ICMP and len(recvPacket) >= quotedPayloadPosition + 8:
+                quotedIcmpType, quotedIcmpCode, checksum, identifier, sequenceNumber = \
+                    decoder.__ICMP_HEADER_STRUCT.unpack_from(recvPacket, quotedPayloadPosition)
+            return IcmpHelperLibrary.IcmpMessage(recvPacket, ipHeaderLength, icmpType, icmpCode, identifier,
+                                                 sequenceNumber, quotedPosition, quotedProtocol, quotedIcmpType)
+
+    # ################################################################################################################ #
+    # Class IcmpPendingProbe                                                                                           #
+    #                                                                                                                  #
+    # One probe waiting for its reply in an IcmpReplyDispatcher. The dispatcher fills in the reply (or marks it        #
+    # expired/cancelled) and then calls the optional callback with the probe.                                          #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpPendingProbe:
+        # ############################################################################################################ #
+        # IcmpPendingProbe Class Scope Variables                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__packetIdentifier",
+                     "__packetSequenceNumber",
+                     "__timeSent",
+                     "__timeSentNs",
+                     "__deadline",
+                     "__callback",
+                     "__context",
+                     "__state",
+                     "__recvPacket",
+                     "__address",
+                     "__timeReceived",
+                     "__timeReceivedNs",
+                     "__kernelDelayNs",
+                     "__message",
+                     "__expectedSource")
+
+        STATE_PENDING = 0
+        STATE_ANSWERED = 1
+        STATE_EXPIRED = 2
+        STATE_CANCELLED = 3
+
+        # ############################################################################################################ #
+        # IcmpPendingProbe Constructors                                                                                #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, packetIdentifier, packetSequenceNumber, timeSent, deadline, callback, context, timeSentNs,
+                     expectedSource=None):
+            self.__packetIdentifier = packetIdentifier
+            self.__packetSequenceNumber = packetSequenceNumber
+            self.__timeSent = timeSent
+            self.__timeSentNs = timeSentNs
+            self.__deadline = deadline
+            self.__callback = callback
+            self.__context = context
+            self.__state = self.STATE_PENDING
+            self.__recvPacket = None
+            self.__address = None
+            self.__timeReceived = 0.0
+            self.__timeReceivedNs = 0
+            self.__kernelDelayNs = 0
+            self.__message = None
+            self.__expectedSource = expectedSource
+
+        # ############################################################################################################ #
+        # IcmpPendingProbe Getters                                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getKey(self):
+            return self.__packetIdentifier, self.__packetSequenceNumber
+
+        def getPacketIdentifier(self):
+            return self.__packetIdentifier
+
+        def getPacketSequenceNumber(self):
+            return self.__packetSequenceNumber
+
+        def getTimeSent(self):
+            return self.__timeSent
+
+        def getDeadline(self):
+            # On the time.monotonic() clock
+            return self.__deadline
+
+        def getContext(self):
+            return self.__context
+
+        def getExpectedSource(self):
+            # Address an echo reply has to come from, None when any may answer (TTL probes)
+            return self.__expectedSource
+
+        def getState(self):
+            return self.__state
+
+        def isPending(self):
+            return self.__state == self.STATE_PENDING
+
+        def isAnswered(self):
+            return self.__state == self.STATE_ANSWERED
+
+        def getRecvPacket(self):
+            return self.__recvPacket
+
+        def getAddress(self):
+            return self.__address
+
+        def getTimeReceived(self):
+            return self.__timeReceived
+
+        def getMessage(self):
+            return self.__message           # Decoded IcmpMessage once answered
+
+        def getIcmpType(self):
+            return self.__message.getIcmpType() if self.__message is not None else -1
+
+        def getIcmpCode(self):
+            return self.__message.getIcmpCode() if self.__message is not None else -1
+
+        def getRttNs(self):
+            # Integer nanoseconds on the monotonic clock. With kernel timestamps the receive side is moved back to
+            # when the kernel got the datagram, so our own scheduling delay is not counted.
+            # Clamped at 0: the correction mixes realtime and monotonic readings, which may drift apart slightly.
+            return max(self.__timeReceivedNs - self.__kernelDelayNs - self.__timeSentNs, 0)
+
+        def getUserRttNs(self):
+            # RTT as seen from userspace, including the time the reply waited for us to read it
+            return self.__timeReceivedNs - self.__timeSentNs
+
+        def getKernelDelayNs(self):
+            return self.__kernelDelayNs
+
+        def getRtt(self):
+            # Milliseconds, same unit the console output uses
+            return self.getRttNs() / 1000000
+
+        # ############################################################################################################ #
+        # IcmpPendingProbe Public Functions                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def complete(self, state, recvPacket=None, address=None, timeReceived=0.0, message=None, timeReceivedNs=0,
+                     kernelDelayNs=0):
+            self.__state = state
+            self.__recvPacket = recvPacket
+            self.__address = address
+            self.__timeReceived = timeReceived
+            self.__timeReceivedNs = timeReceivedNs
+            self.__kernelDelayNs = kernelDelayNs
+            self.__message = message
+            if self.__callback is not None:
+                self.__callback(self)
+
+    # ################################################################################################################ #
+    # Class IcmpReplyDispatcher                                                                                        #
+    #                                                                                                                  #
+    # Routes every datagram read from a socket to the pending probe it answers. Echo replies are matched on their own  #
+    # identifier/sequence number, Time Exceeded and Destination Unreachable on the echo header they quote. Deadlines   #
+    # live in a heap with lazy deletion, so expiring probes costs O(log n) no matter how many are in flight. A probe   #
+    # registered with an expectedSource only takes an echo reply from that address, whatever its identifier says.      #
+    # Deadlines and expire(now) use time.monotonic(): a wall clock step neither expires nor strands probes.            #
+    # ################################################################################################################ #
+    class IcmpReplyDispatcher:
+        # ############################################################################################################ #
+        # IcmpReplyDispatcher Class Scope Variables                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __pending = None                # (identifier, sequence) -> IcmpPendingProbe
+        __deadlines = None              # Heap of (deadline, order, IcmpPendingProbe), answered entries are skipped
+        __order = 0                     # Tie breaker so the heap never compares probes
+        __matchedCount = 0
+        __unmatchedCount = 0
+        __expiredCount = 0
+        __identifierRange = None        # Identifiers replies are routed for, None for any (see setIdentifierRange())
+        __filteredCount = 0
+
+        __DEBUG_IcmpReplyDispatcher = False     # Allows for debug output
+
+        # ############################################################################################################ #
+        # IcmpReplyDispatcher Constructors                                                                             #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self):
+            self.__pending = {}
+            self.__deadlines = []
+
+        # ############################################################################################################ #
+        # IcmpReplyDispatcher Getters                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getPendingCount(self):
+            return len(self.__pending)
+
+        def getMatchedCount(self):
+            return self.__matchedCount
+
+        def getUnmatchedCount(self):
+            return self.__unmatchedCount
+
+        def getExpiredCount(self):
+            return self.__expiredCount
+
+        def getFilteredCount(self):
+            return self.__filteredCount
+
+        def isPending(self, packetIdentifier, packetSequenceNumber):
+            return (packetIdentifier, packetSequenceNumber) in self.__pending
+
+        def getNextDeadline(self):
+            # Earliest deadline of a still pending probe, or None when nothing is waiting
+            deadlines = self.__deadlines
+            while len(deadlines) > 0 and not deadlines[0][2].isPending():
+                heapq.heappop(deadlines)
+            return deadlines[0][0] if len(deadlines) > 0 else None
+
+        # ############################################################################################################ #
+        # IcmpReplyDispatcher Setters                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setIdentifierRange(self, identifiers):
+            # User space counterpart of IcmpTransport.setIdentifierFilter(): replies and errors for identifiers outside
+            # identifiers (a range, None for all) are dropped before matching and only counted as filtered
+            self.__identifierRange = identifiers
+
+        # ############################################################################################################ #
+        # IcmpReplyDispatcher Public Functions                                                                         #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def register(self, packetIdentifier, packetSequenceNumber, timeSent, timeout, callback=None, context=None,
+                     timeSentNs=None, expectedSource=None):
+            key = (packetIdentifier, packetSequenceNumber)
+            previous = self.__pending.get(key)
+            if previous is not None:
+                self.cancel(previous)       # A reused sequence number supersedes the older probe
+
+            if timeSentNs is None:
+                timeSentNs = time.perf_counter_ns()
+            # timeSent is the wall clock time kept with the result, the deadline runs on the monotonic clock
+            pendingProbe = IcmpHelperLibrary.IcmpPendingProbe(packetIdentifier, packetSequenceNumber, timeSent,
+                                                              time.monotonic() + timeout, callback, context, timeSentNs,
+                                                              expectedSource)
+            self.__pending[key] = pendingProbe
+            self.__order += 1
+            heapq.heappush(self.__deadlines, (pendingProbe.getDeadline(), self.__order, pendingProbe))
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            if metrics is not None:
+                metrics.count("probes_sent")
+                metrics.setGauge("probes_in_flight", len(self.__pending))
+
+            # Drop answered entries in bulk when they dominate the heap, otherwise they wait for their deadline
+            if len(self.__deadlines) > 4 * len(self.__pending) + 1024:
+                self.__deadlines = [entry for entry in self.__deadlines if entry[2].isPending()]
+                heapq.heapify(self.__deadlines)
+            return pendingProbe
+
+        def cancel(self, pendingProbe):
+            if pendingProbe.isPending():
+                del self.__pending[pendingProbe.getKey()]
+                pendingProbe.complete(IcmpHelperLibrary.IcmpPendingProbe.STATE_CANCELLED)
+
+        def dispatch(self, recvPacket, addr, timeReceived, timeReceivedNs=None, kernelDelayNs=0):
+            # Returns the probe the datagram answered, or None for stray ICMP and late or duplicate replies
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            startNs = time.perf_counter_ns() if metrics is not None else 0
+            message = IcmpHelperLibrary.IcmpMessageDecoder.decode(recvPacket)
+            pendingProbe = None
+            if message is not None and message.isProbeReply():
+                if self.__identifierRange is not None and message.getIdentifier() not in self.__identifierRange:
+                    self.__filteredCount += 1
+                    return None
+                key = (message.getIdentifier(), message.getSequenceNumber())
+                pendingProbe = self.__pending.get(key)
+                if pendingProbe is not None and message.isEchoReply() and \
+                        pendingProbe.getExpectedSource() not in (None, addr[0]):
+                    pendingProbe = None     # Another host's reply to an identifier that happens to be the same
+                elif pendingProbe is not None:
+                    del self.__pending[key]
+            if metrics is not None:
+                metrics.recordTiming("parse", time.perf_counter_ns() - startNs)
+                metrics.count("unmatched_replies" if pendingProbe is None else "replies_received")
+                metrics.setGauge("probes_in_flight", len(self.__pending))
+            if pendingProbe is None:
+                self.__unmatchedCount += 1
+                print("IcmpReplyDispatcher unmatched datagram from ", addr[0]) \
+                    if self.__DEBUG_IcmpReplyDispatcher else 0
+                return None
+
+            self.__matchedCount += 1
+            if timeReceivedNs is None:
+                timeReceivedNs = time.perf_counter_ns()
+            pendingProbe.complete(IcmpHelperLibrary.IcmpPendingProbe.STATE_ANSWERED,
+                                  recvPacket, addr, timeReceived, message, timeReceivedNs, kernelDelayNs)
+            return pendingProbe
+
+        def expire(self, now):
+            # Times out every pending probe whose deadline has passed and returns how many that were
+            expired = 0
+            deadlines = self.__deadlines
+            while len(deadlines) > 0 and deadlines[0][0] <= now:
+                pendingProbe = heapq.heappop(deadlines)[2]
+                if pendingProbe.isPending():
+                    del self.__pending[pendingProbe.getKey()]
+                    pendingProbe.complete(IcmpHelperLibrary.IcmpPendingProbe.STATE_EXPIRED)
+                    expired += 1
+            self.__expiredCount += expired
+            if expired > 0:
+                metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+                if metrics is not None:
+                    metrics.count("timeouts", expired)
+                    metrics.setGauge("probes_in_flight", len(self.__pending))
+            return expired
+
+        def cancelAll(self):
+            for pendingProbe in list(self.__pending.values()):
+                self.cancel(pendingProbe)
+
+    # ################################################################################################################ #
+    # Class IcmpRttHistogram                                                                                           #
+    #                                                                                                                  #
+    # Log-bucketed (HDR style) histogram of integer nanosecond values. Every power of two is split into                #
+    # 2 ** SUB_BUCKET_BITS linear sub-buckets, so any value is recorded within 1 / 128 of itself. Buckets live in a    #
+    # dict and only occupied ones cost memory, a few thousand at most whatever the number of samples. Histograms with  #
+    # the same layout merge by adding counts.                                                                          #
+    # ################################################################################################################ #
+    class IcmpRttHistogram:
+        # ############################################################################################################ #
+        # IcmpRttHistogram Class Scope Variables                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__counts",
+                     "__totalCount")
+
+        SUB_BUCKET_BITS = 7
+        __SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+
+        # ############################################################################################################ #
+        # IcmpRttHistogram Constructors                                                                                #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self):
+            self.__counts = {}          # bucket index -> count
+            self.__totalCount = 0
+
+        # ############################################################################################################ #
+        # IcmpRttHistogram Getters                                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getTotalCount(self):
+            return self.__totalCount
+
+        def getBucketCount(self):
+            return len(self.__counts)
+
+        def getCounts(self):
+            return self.__counts
+
+        # ############################################################################################################ #
+        # IcmpRttHistogram Private Functions                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def __bucketIndex(value):
+            # Values below 2 * SUB_BUCKET_COUNT get a bucket each; above that the top SUB_BUCKET_BITS + 1 bits select
+            # the bucket, so the index is continuous across powers of two.
+            subBucketCount = IcmpHelperLibrary.IcmpRttHistogram.__SUB_BUCKET_COUNT
+            shift = value.bit_length() - IcmpHelperLibrary.IcmpRttHistogram.SUB_BUCKET_BITS - 1
+            if shift <= 0:
+                return value
+            return (shift + 1) * subBucketCount + (value >> shift) - subBucketCount
+
+        @staticmethod
+        def __bucketRange(index):
+            # (lowest, highest) value recorded into bucket index
+            subBucketCount = IcmpHelperLibrary.IcmpRttHistogram.__SUB_BUCKET_COUNT
+            shift = index // subBucketCount - 1
+            if shift <= 0:
+                return index, index
+            lowest = (index % subBucketCount + subBucketCount) << shift
+            return lowest, lowest + (1 << shift) - 1
+
+        # ############################################################################################################ #
+        # IcmpRttHistogram Public Functions                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def record(self, value, count=1):
+            index = self.__bucketIndex(max(int(value), 0))
+            self.__counts[index] = self.__counts.get(index, 0) + count
+            self.__totalCount += count
+
+        def merge(self, other):
+            for index, count in other.getCounts().items():
+                self.__counts[index] = self.__counts.get(index, 0) + count
+            self.__totalCount += other.getTotalCount()
+
+        def getValueAtPercentile(self, percentile):
+            # Midpoint of the bucket holding the given percentile (0-100), None when empty
+            if self.__totalCount == 0:
+                return None
+            rank = max(1, -(-self.__totalCount * percentile // 100))
+            seen = 0
+            for index in sorted(self.__counts):
+                seen += self.__counts[index]
+                if seen >= rank:
+                    lowest, highest = self.__bucketRange(index)
+                    return (lowest + highest) // 2
+            lowest, highest = self.__bucketRange(max(self.__counts))
+            return (lowest + highest) // 2
+
+        def copy(self):
+            # Safe while another thread records: the dict is copied in one step
+            histogram = IcmpHelperLibrary.IcmpRttHistogram()
+            histogram.__counts = dict(self.__counts)
+            histogram.__totalCount = sum(histogram.__counts.values())
+            return histogram
+
+        def clear(self):
+            self.__counts.clear()
+            self.__totalCount = 0
+
+    # ################################################################################################################ #
+    # Class IcmpRttStatistics                                                                                          #
+    #                                                                                                                  #
+    # Running statistics of a probe stream in constant memory: counts and loss, min/max, mean and variance (Welford),  #
+    # RFC 3550 interarrival jitter of consecutive RTTs and percentiles from an IcmpRttHistogram. Samples are integer   #
+    # nanoseconds, the getters report milliseconds like the rest of the library. merge() combines the statistics of    #
+    # several targets or workers; jitter is per stream, so the merged value is the sample weighted mean.               #
+    # ################################################################################################################ #
+    class IcmpRttStatistics:
+        # ############################################################################################################ #
+        # IcmpRttStatistics Class Scope Variables                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__packetsSent",
+                     "__packetsReceived",
+                     "__sampleCount",
+                     "__minRttNs",
+                     "__maxRttNs",
+                     "__meanNs",
+                     "__m2",
+                     "__jitterNs",
+                     "__lastRttNs",
+                     "__histogram")
+
+        # ############################################################################################################ #
+        # IcmpRttStatistics Constructors                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self):
+            self.__packetsSent = 0
+            self.__packetsReceived = 0
+            self.__sampleCount = 0
+            self.__minRttNs = None
+            self.__maxRttNs = None
+            self.__meanNs = 0.0
+            self.__m2 = 0.0             # Sum of squared differences from the mean
+            self.__jitterNs = 0.0
+            self.__lastRttNs = None
+            self.__histogram = IcmpHelperLibrary.IcmpRttHistogram()
+
+        # ############################################################################################################ #
+        # IcmpRttStatistics Getters                                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getPacketsSent(self):
+            return self.__packetsSent
+
+        def getPacketsReceived(self):
+            return self.__packetsReceived
+
+        def getSampleCount(self):
+            return self.__sampleCount
+
+        def getHistogram(self):
+            return self.__histogram
+
+        def getMinRttNs(self):
+            return self.__minRttNs
+
+        def getMaxRttNs(self):
+            return self.__maxRttNs
+
+        def getMeanNs(self):
+            return self.__meanNs
+
+        def getM2(self):
+            return self.__m2
+
+        def getJitterNs(self):
+            return self.__jitterNs
+
+        def getPacketLoss(self):
+            if self.__packetsSent == 0:
+                return 1.0
+            return (self.__packetsSent - self.__packetsReceived) / self.__packetsSent
+
+        def getMinRtt(self):
+            return float("inf") if self.__minRttNs is None else self.__minRttNs / 1000000
+
+        def getMaxRtt(self):
+            return float("-inf") if self.__maxRttNs is None else self.__maxRttNs / 1000000
+
+        def getAverageRtt(self):
+            return self.__meanNs / 1000000
+
+        def getVariance(self):
+            # Sample variance in ms^2
+            if self.__sampleCount < 2:
+                return 0.0
+            return self.__m2 / (self.__sampleCount - 1) / 1e12
+
+        def getStandardDeviation(self):
+            return self.getVariance() ** 0.5
+
+        def getJitter(self):
+            return self.__jitterNs / 1000000
+
+        def getPercentile(self, percentile):
+            # Milliseconds, None without samples. p0/p100 are the exact min/max rather than bucket midpoints, and no
+            # percentile falls outside them.
+            valueNs = self.__histogram.getValueAtPercentile(percentile)
+            if valueNs is None:
+                return None
+            if percentile <= 0:
+                return self.__minRttNs / 1000000
+            if percentile >= 100:
+                return self.__maxRttNs / 1000000
+            return min(max(valueNs, self.__minRttNs), self.__maxRttNs) / 1000000
+
+        # ############################################################################################################ #
+        # IcmpRttStatistics Public Functions                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def toRow(self):
+            # (sent, received, packet_loss, min_ms, max_ms, average_ms, stddev_ms, jitter_ms, p50_ms, p90_ms, p99_ms)
+            # for the records' FIELDS, RTT columns are None without samples
+            if self.__sampleCount == 0:
+                return (self.__packetsSent, self.__packetsReceived, self.getPacketLoss()) + (None,) * 8
+            return (self.__packetsSent, self.__packetsReceived, self.getPacketLoss(), self.getMinRtt(),
+                    self.getMaxRtt(), self.getAverageRtt(), self.getStandardDeviation(), self.getJitter(),
+                    self.getPercentile(50), self.getPercentile(90), self.getPercentile(99))
+
+        def recordSent(self, count=1):
+            self.__packetsSent += count
+
+        def recordRtt(self, rttNs, isReply=True):
+            # isReply counts the probe as received; ICMP errors contribute their RTT but count as lost
+            if isReply:
+                self.__packetsReceived += 1
+            self.__sampleCount += 1
+            if self.__minRttNs is None or rttNs < self.__minRttNs:
+                self.__minRttNs = rttNs
+            if self.__maxRttNs is None or rttNs > self.__maxRttNs:
+                self.__maxRttNs = rttNs
+
+            delta = rttNs - self.__meanNs
+            self.__meanNs += delta / self.__sampleCount
+            self.__m2 += delta * (rttNs - self.__meanNs)
+
+            # RFC 3550 6.4.1: J += (|D| - J) / 16, D being the change in transit time between consecutive packets
+            if self.__lastRttNs is not None:
+                self.__jitterNs += (abs(rttNs - self.__lastRttNs) - self.__jitterNs) / 16
+            self.__lastRttNs = rttNs
+
+            self.__histogram.record(rttNs)
+
+        def merge(self, other):
+            # Chan et al. pairwise combination of mean and M2
+            otherSampleCount = other.getSampleCount()
+            self.__packetsSent += other.getPacketsSent()
+            self.__packetsReceived += other.getPacketsReceived()
+            if otherSampleCount == 0:
+                return
+            sampleCount = self.__sampleCount + otherSampleCount
+            delta = other.getMeanNs() - self.__meanNs
+            self.__m2 += other.getM2() + delta * delta * self.__sampleCount * otherSampleCount / sampleCount
+            self.__meanNs += delta * otherSampleCount / sampleCount
+            self.__jitterNs = (self.__jitterNs * self.__sampleCount +
+                               other.getJitterNs() * otherSampleCount) / sampleCount
+            self.__sampleCount = sampleCount
+
+            if self.__minRttNs is None or other.getMinRttNs() < self.__minRttNs:
+                self.__minRttNs = other.getMinRttNs()
+            if self.__maxRttNs is None or other.getMaxRttNs() > self.__maxRttNs:
+                self.__maxRttNs = other.getMaxRttNs()
+            self.__histogram.merge(other.getHistogram())
+
+    # ################################################################################################################ #
+    # Class IcmpSweepTarget                                                                                            #
+    #                                                                                                                  #
+    # Per-target state of a sweep while its probes are in flight, handed back to the caller once the target is done.  #
+    # Only running totals are kept, so a target costs the same memory however many probes it gets.                     #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpSweepTarget:
+        # ############################################################################################################ #
+        # IcmpSweepTarget Class Scope Variables                                                                        #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__target",
+                     "__destinationIpAddress",
+                     "__error",
+                     "__packetsOutstanding",
+                     "__statistics",
+                     "__probes")
+
+        RECORD_TYPE = "sweep"
+        FIELDS = ("record", "target", "destination", "sent", "received", "packet_loss", "min_ms", "max_ms",
+                  "average_ms", "stddev_ms", "jitter_ms", "p50_ms", "p90_ms", "p99_ms", "error")
+
+        # ############################################################################################################ #
+        # IcmpSweepTarget Constructors                                                                                 #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress, error=None):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__error = error
+            self.__packetsOutstanding = 0
+            self.__statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            self.__probes = []
+
+        # ############################################################################################################ #
+        # IcmpSweepTarget Getters                                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getError(self):
+            return self.__error
+
+        def getStatistics(self):
+            return self.__statistics
+
+        def getProbes(self):
+            # IcmpProbeResult of every probe finished so far, in the order they finished
+            return self.__probes
+
+        def getPacketsSent(self):
+            return self.__statistics.getPacketsSent()
+
+        def getPacketsReceived(self):
+            return self.__statistics.getPacketsReceived()
+
+        def getPacketsOutstanding(self):
+            return self.__packetsOutstanding
+
+        def getPacketLoss(self):
+            return self.__statistics.getPacketLoss()
+
+        def getMinRtt(self):
+            return self.__statistics.getMinRtt()
+
+        def getMaxRtt(self):
+            return self.__statistics.getMaxRtt()
+
+        def getAverageRtt(self):
+            return self.__statistics.getAverageRtt()
+
+        # ############################################################################################################ #
+        # IcmpSweepTarget Public Functions                                                                             #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def recordSent(self):
+            self.__statistics.recordSent()
+            self.__packetsOutstanding += 1
+
+        def recordFinished(self, pendingProbe):
+            self.__packetsOutstanding -= 1
+            if pendingProbe.isAnswered() and pendingProbe.getIcmpType() == 0:
+                self.__statistics.recordRtt(pendingProbe.getRttNs())
+            self.__probes.append(IcmpHelperLibrary.IcmpProbeResult.fromPendingProbe(pendingProbe, self.__target,
+                                                                                    self.__destinationIpAddress, 255))
+
+        def toRow(self):
+            return (self.RECORD_TYPE, self.__target, self.__destinationIpAddress) + \
+                self.__statistics.toRow() + (self.__error,)
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            if self.__error is not None:
+                return "%s    Error: %s" % (self.__target, self.__error)
+            return "%s    Addr=%s    Sent=%d    Received=%d    Packet_Loss=%.2f    " \
+                   "Min=%.0f ms  Max=%.0f ms  Average=%.0f ms" % \
+                   (
+                       self.__target,
+                       self.__destinationIpAddress,
+                       self.getPacketsSent(),
+                       self.getPacketsReceived(),
+                       self.getPacketLoss(),
+                       self.getMinRtt(),
+                       self.getMaxRtt(),
+                       self.getAverageRtt()
+                   )
+
+        def printResultToConsole(self):
+            print(self.formatConsoleLine())
+
+    # ################################################################################################################ #
+    # Class IcmpProbeResult                                                                                            #
+    #                                                                                                                  #
+    # Outcome of a single probe: who answered, with what and how fast. Produced by IcmpPacket.sendEchoRequest() and    #
+    # the trace routes, and handed to the library's result sink instead of being printed where it is measured.         #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpProbeResult:
+        # ############################################################################################################ #
+        # IcmpProbeResult Class Scope Variables                                                                        #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__target",
+                     "__destinationIpAddress",
+                     "__ttl",
+                     "__packetIdentifier",
+                     "__packetSequenceNumber",
+                     "__status",
+                     "__address",
+                     "__hostName",
+                     "__icmpType",
+                     "__icmpCode",
+                     "__rttNs",
+                     "__message",
+                     "__timeSent")
+
+        STATUS_REPLY = "reply"          # Echo reply
+        STATUS_ERROR = "error"          # ICMP error quoting the probe (unreachable, time exceeded, ...)
+        STATUS_INVALID = "invalid"      # Echo reply whose identifier, sequence number or data does not match
+        STATUS_TIMEOUT = "timeout"
+
+        RECORD_TYPE = "probe"
+        FIELDS = ("record", "target", "destination", "ttl", "identifier", "sequence", "status", "address", "host_name",
+                  "type", "code", "rtt_ms", "message")
+
+        # ############################################################################################################ #
+        # IcmpProbeResult Constructors                                                                                 #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress, ttl, packetIdentifier, packetSequenceNumber, status,
+                     address=None, icmpType=-1, icmpCode=-1, rttNs=-1, message=None, hostName=None, timeSent=None):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__ttl = ttl
+            self.__packetIdentifier = packetIdentifier
+            self.__packetSequenceNumber = packetSequenceNumber
+            self.__status = status
+            self.__address = address
+            self.__hostName = hostName
+            self.__icmpType = icmpType
+            self.__icmpCode = icmpCode
+            self.__rttNs = rttNs
+            self.__message = message
+            self.__timeSent = timeSent
+
+        @staticmethod
+        def fromPendingProbe(pendingProbe, target, destinationIpAddress, ttl):
+            if not pendingProbe.isAnswered():
+                return IcmpHelperLibrary.IcmpProbeResult(target, destinationIpAddress, ttl,
+                                                         pendingProbe.getPacketIdentifier(),
+                                                         pendingProbe.getPacketSequenceNumber(),
+                                                         IcmpHelperLibrary.IcmpProbeResult.STATUS_TIMEOUT,
+                                                         timeSent=pendingProbe.getTimeSent())
+            message = pendingProbe.getMessage()
+            if message.isEchoReply():
+                status, text = IcmpHelperLibrary.IcmpProbeResult.STATUS_REPLY, None
+            else:
+                status, text = IcmpHelperLibrary.IcmpProbeResult.STATUS_ERROR, message.getMessage()
+            return IcmpHelperLibrary.IcmpProbeResult(target, destinationIpAddress, ttl,
+                                                     pendingProbe.getPacketIdentifier(),
+                                                     pendingProbe.getPacketSequenceNumber(), status,
+                                                     pendingProbe.getAddress()[0], message.getIcmpType(),
+                                                     message.getIcmpCode(), pendingProbe.getRttNs(), text,
+                                                     timeSent=pendingProbe.getTimeSent())
+
+        # ############################################################################################################ #
+        # IcmpProbeResult Getters                                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getTtl(self):
+            return self.__ttl
+
+        def getPacketIdentifier(self):
+            return self.__packetIdentifier
+
+        def getPacketSequenceNumber(self):
+            return self.__packetSequenceNumber
+
+        def getStatus(self):
+            return self.__status
+
+        def getAddress(self):
+            return self.__address
+
+        def getHostName(self):
+            return self.__hostName
+
+        def getIcmpType(self):
+            return self.__icmpType
+
+        def getIcmpCode(self):
+            return self.__icmpCode
+
+        def getRttNs(self):
+            return self.__rttNs
+
+        def getTimeSent(self):
+            # Seconds since the epoch the probe was sent at, None when not known
+            return self.__timeSent
+
+        def getRtt(self):
+            # Milliseconds, None when nothing answered
+            if self.__rttNs < 0:
+                return None
+            return self.__rttNs / 1000000
+
+        def getMessage(self):
+            return self.__message
+
+        def isReply(self):
+            return self.__status == IcmpHelperLibrary.IcmpProbeResult.STATUS_REPLY
+
+        def isAnswered(self):
+            return self.__status != IcmpHelperLibrary.IcmpProbeResult.STATUS_TIMEOUT
+
+        # ############################################################################################################ #
+        # IcmpProbeResult Setters                                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setStatus(self, status, message=None):
+            self.__status = status
+            self.__message = message
+
+        def setHostName(self, hostName):
+            self.__hostName = hostName
+
+        # ############################################################################################################ #
+        # IcmpProbeResult Public Functions                                                                             #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def toRow(self):
+            # Values in FIELDS order
+            return (self.RECORD_TYPE, self.__target, self.__destinationIpAddress, self.__ttl, self.__packetIdentifier,
+                    self.__packetSequenceNumber, self.__status, self.__address, self.__hostName, self.__icmpType,
+                    self.__icmpCode, self.getRtt(), self.__message)
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            if not self.isAnswered():
+                return "  TTL=%d    *        *        *        *        *    Request timed out.%s" % \
+                       (self.__ttl, "" if self.__message is None else " (%s)" % self.__message)
+
+            address = self.__address
+            if self.__hostName is not None:
+                address = "%s (%s)" % (address, self.__hostName)
+            line = "  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d    Identifier=%d    SequenceNumber=%d    %s" % \
+                   (
+                       self.__ttl,
+                       self.getRtt(),
+                       self.__icmpType,
+                       self.__icmpCode,
+                       self.__packetIdentifier,
+                       self.__packetSequenceNumber,
+                       address
+                   )
+            if self.__status == IcmpHelperLibrary.IcmpProbeResult.STATUS_ERROR:
+                line += "    Error: " + self.__message
+            elif self.__status == IcmpHelperLibrary.IcmpProbeResult.STATUS_INVALID:
+                line += "    Invalid: " + self.__message
+            return line
+
+    # ################################################################################################################ #
+    # Class IcmpPingResult                                                                                             #
+    #                                                                                                                  #
+    # One ping (or one hop of traceRoute) as IcmpRttStatistics. Like the original summary line, RTT statistics cover   #
+    # every answered probe while only echo replies count as received. The individual probes are kept only when         #
+    # keepProbes is set, so a ping of any length runs in constant memory otherwise.                                    #
+    # ################################################################################################################ #
+    class IcmpPingResult:
+        # ############################################################################################################ #
+        # IcmpPingResult Class Scope Variables                                                                         #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__target",
+                     "__destinationIpAddress",
+                     "__ttl",
+                     "__probes",
+                     "__statistics",
+                     "__address",
+                     "__error")
+
+        RECORD_TYPE = "ping"
+        FIELDS = ("record", "target", "destination", "ttl", "sent", "received", "packet_loss", "min_ms", "max_ms",
+                  "average_ms", "stddev_ms", "jitter_ms", "p50_ms", "p90_ms", "p99_ms", "address", "error")
+
+        # ############################################################################################################ #
+        # IcmpPingResult Constructors                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress, ttl=255, keepProbes=True, error=None):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__ttl = ttl
+            self.__probes = [] if keepProbes else None
+            self.__statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            self.__address = None
+            self.__error = error
+
+        # ############################################################################################################ #
+        # IcmpPingResult Getters                                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getTtl(self):
+            return self.__ttl
+
+        def getProbes(self):
+            # None unless the result was created with keepProbes
+            return self.__probes
+
+        def getStatistics(self):
+            return self.__statistics
+
+        def getAddress(self):
+            # Last host that answered, None if nothing did
+            return self.__address
+
+        def getError(self):
+            # Why the target could not be pinged at all (e.g. it did not resolve), None if it was
+            return self.__error
+
+        def getPacketsSent(self):
+            return self.__statistics.getPacketsSent()
+
+        def getPacketsReceived(self):
+            return self.__statistics.getPacketsReceived()
+
+        def getPacketLoss(self):
+            return self.__statistics.getPacketLoss()
+
+        def getMinRtt(self):
+            return self.__statistics.getMinRtt()
+
+        def getMaxRtt(self):
+            return self.__statistics.getMaxRtt()
+
+        def getAverageRtt(self):
+            return self.__statistics.getAverageRtt()
+
+        # ############################################################################################################ #
+        # IcmpPingResult Public Functions                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def addProbe(self, probeResult):
+            if self.__probes is not None:
+                self.__probes.append(probeResult)
+            self.__statistics.recordSent()
+            if probeResult.isAnswered():
+                self.__address = probeResult.getAddress()
+                self.__statistics.recordRtt(probeResult.getRttNs(), probeResult.isReply())
+
+        def toRow(self):
+            return (self.RECORD_TYPE, self.__target, self.__destinationIpAddress, self.__ttl) + \
+                self.__statistics.toRow() + (self.__address, self.__error)
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            if self.__error is not None:
+                return "%s    Error: %s" % (self.__target, self.__error)
+            line = "Min=%.0f ms  Max=%.0f ms  Average=%.0f ms  Packet_Loss=%.2f" % \
+                   (
+                       self.getMinRtt(),
+                       self.getMaxRtt(),
+                       self.getAverageRtt(),
+                       self.getPacketLoss()
+                   )
+            if self.__statistics.getSampleCount() > 1:
+                line += "  StdDev=%.0f ms  Jitter=%.0f ms  P50=%.0f ms  P90=%.0f ms  P99=%.0f ms" % \
+                        (
+                            self.__statistics.getStandardDeviation(),
+                            self.__statistics.getJitter(),
+                            self.__statistics.getPercentile(50),
+                            self.__statistics.getPercentile(90),
+                            self.__statistics.getPercentile(99)
+                        )
+            return line + "  Addr= %s" % self.__address
+
+    # ################################################################################################################ #
+    # Class IcmpResultSink                                                                                             #
+    #                                                                                                                  #
+    # Where result records go. Subclasses turn a record into text in formatRecord(); the text is collected and written #
+    # to the stream in one call once batchSize records are pending or flushInterval seconds have passed, and on        #
+    # flush()/close(). stream may be a file object or a path, which is then opened (and closed) by the sink.           #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpResultSink:
+        # ############################################################################################################ #
+        # IcmpResultSink Class Scope Variables                                                                         #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __stream = None                 # None writes to whatever sys.stdout is at flush time
+        __ownsStream = False
+        __buffer = None                 # Formatted text not written yet
+        __batchSize = 64
+        __flushInterval = 0.5
+        __lastFlush = 0.0
+
+        # ############################################################################################################ #
+        # IcmpResultSink Constructors                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, stream=None, batchSize=64, flushInterval=0.5):
+            if isinstance(stream, str):
+                stream = open(stream, "w", newline="")
+                self.__ownsStream = True
+            self.__stream = stream
+            self.__buffer = []
+            self.__batchSize = max(batchSize, 1)
+            self.__flushInterval = flushInterval
+            self.__lastFlush = time.monotonic()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpResultSink Getters                                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getStream(self):
+            return self.__stream if self.__stream is not None else sys.stdout
+
+        def getBatchSize(self):
+            return self.__batchSize
+
+        # ############################################################################################################ #
+        # IcmpResultSink Public Functions                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def formatRecord(self, record):
+            # Text written for record, None to skip it. Overridden by the concrete sinks.
+            return None
+
+        def begin(self, command, target, destinationIpAddress, count=None):
+            # Called before the records of one ping ("ping") or trace route ("trace")
+            pass
+
+        def write(self, record):
+            text = self.formatRecord(record)
+            if text is not None:
+                self.writeText(text)
+
+        def writeText(self, text):
+            self.__buffer.append(text)
+            if len(self.__buffer) >= self.__batchSize or time.monotonic() - self.__lastFlush >= self.__flushInterval:
+                self.flush()
+
+        def flush(self):
+            if len(self.__buffer) > 0:
+                metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+                startNs = time.perf_counter_ns() if metrics is not None else 0
+                stream = self.getStream()
+                stream.write("".join(self.__buffer))
+                stream.flush()
+                del self.__buffer[:]
+                if metrics is not None:
+                    metrics.recordTiming("output", time.perf_counter_ns() - startNs)
+            self.__lastFlush = time.monotonic()
+
+        def close(self):
+            self.flush()
+            if self.__ownsStream:
+                self.__stream.close()
+                self.__ownsStream = False
+
+    # ################################################################################################################ #
+    # Class IcmpConsoleSink                                                                                            #
+    #                                                                                                                  #
+    # The human readable lines the library always printed. Writes every line as it comes by default; pass a larger     #
+    # batchSize when the output is piped somewhere and latency does not matter.                                        #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpConsoleSink(IcmpResultSink):
+        def __init__(self, stream=None, batchSize=1, flushInterval=0.5):
+            super().__init__(stream, batchSize, flushInterval)
+
+        def formatRecord(self, record):
+            return record.formatConsoleLine() + "\n"
+
+        def begin(self, command, target, destinationIpAddress, count=None):
+            if command == "ping" and count is None:
+                self.writeText("Ping  %s\n" % destinationIpAddress)
+            elif command == "ping":
+                self.writeText("Ping %d packets to  %s\n" % (count, destinationIpAddress))
+            else:
+                self.writeText("Trace route to  %s\n" % destinationIpAddress)
+
+    # ################################################################################################################ #
+    # Class IcmpJsonLinesSink                                                                                          #
+    #                                                                                                                  #
+    # One compact JSON object per record and line, tagged with its "record" type.                                      #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpJsonLinesSink(IcmpResultSink):
+        def formatRecord(self, record):
+            return json.dumps(record.toDict(), separators=(",", ":")) + "\n"
+
+    # ################################################################################################################ #
+    # Class IcmpCsvSink                                                                                                #
+    #                                                                                                                  #
+    # CSV with a header row. Record types have different columns, so only records of recordType ("probe", "ping" or    #
+    # "sweep") are written.                                                                                            #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpCsvSink(IcmpResultSink):
+        __recordType = "probe"
+        __headerWritten = False
+        __rowBuffer = None              # Scratch buffer the csv module quotes each row into
+        __rowWriter = None
+
+        def __init__(self, stream=None, recordType="probe", batchSize=64, flushInterval=0.5):
+            super().__init__(stream, batchSize, flushInterval)
+            self.__recordType = recordType
+            self.__headerWritten = False
+            self.__rowBuffer = io.StringIO()
+            self.__rowWriter = csv.writer(self.__rowBuffer, lineterminator="\n")
+
+        def formatRecord(self, record):
+            if record.RECORD_TYPE != self.__recordType:
+                return None
+            if not self.__headerWritten:
+                self.__rowWriter.writerow(record.FIELDS)
+                self.__headerWritten = True
+            self.__rowWriter.writerow(record.toRow())
+            text = self.__rowBuffer.getvalue()
+            self.__rowBuffer.seek(0)
+            self.__rowBuffer.truncate()
+            return text
+
+    # ################################################################################################################ #
+    # Class IcmpMemorySink                                                                                             #
+    #                                                                                                                  #
+    # Keeps the records themselves, nothing is formatted.                                                              #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMemorySink(IcmpResultSink):
+        __records = None
+
+        def __init__(self):
+            super().__init__()
+            self.__records = []
+
+        def getRecords(self, recordType=None):
+            if recordType is None:
+                return self.__records
+            return [record for record in self.__records if record.RECORD_TYPE == recordType]
+
+        def write(self, record):
+            self.__records.append(record)
+
+        def clear(self):
+            del self.__records[:]
+
+    # ################################################################################################################ #
+    # Class IcmpQuietSink                                                                                              #
+    #                                                                                                                  #
+    # Drops everything without formatting it; results are only available from the return values.                       #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpQuietSink(IcmpResultSink):
+        def write(self, record):
+            pass
+
+        def begin(self, command, target, destinationIpAddress, count=None):
+            pass
+
+    # ################################################################################################################ #
+    # Class IcmpTeeSink                                                                                                #
+    #                                                                                                                  #
+    # Hands every record to each of several sinks, e.g. the console and an IcmpArchiveSink.                            #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpTeeSink(IcmpResultSink):
+        __sinks = None
+
+        def __init__(self, *sinks):
+            super().__init__()
+            self.__sinks = list(sinks)
+
+        def getSinks(self):
+            return self.__sinks
+
+        def begin(self, command, target, destinationIpAddress, count=None):
+            for sink in self.__sinks:
+                sink.begin(command, target, destinationIpAddress, count)
+
+        def write(self, record):
+            for sink in self.__sinks:
+                sink.write(record)
+
+        def flush(self):
+            for sink in self.__sinks:
+                sink.flush()
+
+        def close(self):
+            for sink in self.__sinks:
+                sink.close()
+
+    # ################################################################################################################ #
+    # Class IcmpArchiveSink                                                                                            #
+    #                                                                                                                  #
+    # Appends every IcmpProbeResult, and the probes of every IcmpSweepTarget, to an IcmpResultArchive file as a fixed  #
+    # width binary record stamped with the time the probe was sent, batchSize records per write. Other records are     #
+    # ignored. A record cut short by a crash is truncated away when the file is opened again, so appending always      #
+    # resumes on a record boundary.                                                                                    #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpArchiveSink(IcmpResultSink):
+        __file = None
+        __buffer = None                 # Packed records not written yet
+        __recordCount = 0               # Records in __buffer
+        __recordsWritten = 0
+        __flushInterval = 1.0
+        __lastFlush = 0.0
+
+        def __init__(self, path, batchSize=4096, flushInterval=1.0):
+            super().__init__(None, batchSize, flushInterval)
+            self.__flushInterval = flushInterval
+            self.__lastFlush = time.monotonic()
+            archive = IcmpHelperLibrary.IcmpResultArchive
+            self.__file = open(path, "a+b")
+            size = self.__file.seek(0, os.SEEK_END)
+            if size == 0:
+                self.__file.write(archive.packHeader())
+            else:
+                self.__file.seek(0)
+                archive.checkHeader(self.__file.read(archive.HEADER_SIZE))
+                excess = (size - archive.HEADER_SIZE) % archive.RECORD_SIZE
+                if excess > 0:
+                    self.__file.truncate(size - excess)
+            self.__buffer = bytearray()
+
+        def getRecordsWritten(self):
+            return self.__recordsWritten
+
+        def write(self, record):
+            if record.RECORD_TYPE == IcmpHelperLibrary.IcmpProbeResult.RECORD_TYPE:
+                probeResults = (record,)
+            elif record.RECORD_TYPE == IcmpHelperLibrary.IcmpSweepTarget.RECORD_TYPE:
+                probeResults = record.getProbes()   # Sweeps hand over targets only, never their probes one by one
+            else:
+                return
+            for probeResult in probeResults:
+                timeSent = probeResult.getTimeSent()
+                timeNs = int(timeSent * 1e9) if timeSent is not None else time.time_ns()
+                self.__buffer += IcmpHelperLibrary.IcmpResultArchive.packRecord(probeResult, timeNs)
+                self.__recordCount += 1
+            if self.__recordCount >= self.getBatchSize() or \
+                    time.monotonic() - self.__lastFlush >= self.__flushInterval:
+                self.flush()
+
+        def flush(self):
+            if self.__recordCount > 0:
+                metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+                startNs = time.perf_counter_ns() if metrics is not None else 0
+                self.__file.write(self.__buffer)
+                self.__file.flush()
+                self.__recordsWritten += self.__recordCount
+                self.__recordCount = 0
+                del self.__buffer[:]
+                if metrics is not None:
+                    metrics.recordTiming("output", time.perf_counter_ns() - startNs)
+            self.__lastFlush = time.monotonic()
+
+        def close(self):
+            if self.__file is not None:
+                self.flush()
+                self.__file.close()
+                self.__file = None
+
+    # ################################################################################################################ #
+    # Class IcmpArchiveAggregate                                                                                       #
+    #                                                                                                                  #
+    # One target over one time bucket of an IcmpResultArchive: echo probes sent (TTL 255) and answered, RTT            #
+    # percentiles of the replies, and how often a trace hop (TTL below 255) answered from a different address than     #
+    # the time before, i.e. path changes.                                                                              #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpArchiveAggregate:
+        __slots__ = ("__target",
+                     "__startTime",
+                     "__packetsSent",
+                     "__packetsReceived",
+                     "__percentiles",
+                     "__pathChanges")
+
+        RECORD_TYPE = "archive_aggregate"
+        FIELDS = ("record", "target", "start", "sent", "received", "loss", "p50_ms", "p90_ms", "p99_ms",
+                  "path_changes")
+
+        def __init__(self, target, startTime, packetsSent, packetsReceived, percentiles, pathChanges):
+            self.__target = target
+            self.__startTime = startTime
+            self.__packetsSent = packetsSent
+            self.__packetsReceived = packetsReceived
+            self.__percentiles = percentiles   # (p50, p90, p99) nanoseconds, None without replies
+            self.__pathChanges = pathChanges
+
+        def getTarget(self):
+            return self.__target
+
+        def getStartTime(self):
+            # Seconds since the epoch at which the bucket starts
+            return self.__startTime
+
+        def getPacketsSent(self):
+            return self.__packetsSent
+
+        def getPacketsReceived(self):
+            return self.__packetsReceived
+
+        def getPacketLoss(self):
+            if self.__packetsSent == 0:
+                return None
+            return 1 - min(self.__packetsReceived / self.__packetsSent, 1)
+
+        def getPercentile(self, percentile):
+            # Milliseconds for percentile 50, 90 or 99, None without replies
+            value = self.__percentiles[IcmpHelperLibrary.IcmpResultArchive.PERCENTILES.index(percentile)]
+            return value / 1000000 if value is not None else None
+
+        def getPathChanges(self):
+            return self.__pathChanges
+
+        def toRow(self):
+            return (self.RECORD_TYPE, self.__target, self.__startTime, self.__packetsSent, self.__packetsReceived,
+                    self.getPacketLoss(), self.getPercentile(50), self.getPercentile(90), self.getPercentile(99),
+                    self.__pathChanges)
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            loss = self.getPacketLoss()
+            percentiles = tuple("%.3f" % self.getPercentile(percentile) if self.getPercentile(percentile) is not None
+                                else "-" for percentile in (50, 90, 99))
+            return "%s    Start=%s    Sent=%d    Received=%d    Packet_Loss=%s    P50=%s ms  P90=%s ms  " \
+                   "P99=%s ms    Path_Changes=%d" % (
+                       (self.__target,
+                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.__startTime)),
+                        self.__packetsSent,
+                        self.__packetsReceived,
+                        "%.2f" % loss if loss is not None else "-") +
+                       percentiles +
+                       (self.__pathChanges,)
+                   )
+
+    # ################################################################################################################ #
+    # Class IcmpResultArchive                                                                                          #
+    #                                                                                                                  #
+    # Reads an archive IcmpArchiveSink wrote: a 16 byte header, then 32 byte records (time sent and RTT in ns,         #
+    # target and responder IPv4 addresses, TTL, type, code, status). The file is mapped, and with numpy the records    #
+    # are a structured array over the mapping itself, so nothing is copied or parsed up front. A per block min/max of  #
+    # times narrows time ranges and a target sorted permutation finds the records of a target; both are built on       #
+    # first use. Without numpy the same queries run over columns decoded into arrays, fine for smaller archives.       #
+    # ################################################################################################################ #
+    class IcmpResultArchive:
+        # ############################################################################################################ #
+        # IcmpResultArchive Class Scope Variables                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        MAGIC = b"ICMPARCH"
+        VERSION = 1
+        __HEADER_STRUCT = struct.Struct("<8sII")            # Magic, version, record size
+        __RECORD_STRUCT = struct.Struct("<qqIIBBBB4x")      # Padded to 32 bytes so numpy fields stay aligned
+        HEADER_SIZE = __HEADER_STRUCT.size
+        RECORD_SIZE = __RECORD_STRUCT.size
+        COLUMNS = ("time_ns", "rtt_ns", "target", "responder", "ttl", "type", "code", "status")
+        STATUSES = ("reply", "error", "invalid", "timeout")  # IcmpProbeResult statuses in the order stored
+        PERCENTILES = (50, 90, 99)
+        BLOCK_RECORDS = 65536           # Records per time index block
+        CHUNK_RECORDS = 1 << 22         # Records aggregated at a time (about), bounding the memory a query needs
+
+        __path = None
+        __file = None
+        __map = None
+        __recordCount = 0
+        __records = None                # numpy structured array over __map, or dict of decoded array columns
+        __blockTimes = None             # (min time, max time) per block
+        __targetOrder = None            # Record numbers sorted by target (stable, so in file order per target)
+        __sortedTargets = None
+
+        # ############################################################################################################ #
+        # IcmpResultArchive Constructors                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, path):
+            self.__path = path
+            self.__file = open(path, "rb")
+            self.checkHeader(self.__file.read(self.HEADER_SIZE))
+            self.refresh()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        @staticmethod
+        def packHeader():
+            archive = IcmpHelperLibrary.IcmpResultArchive
+            return archive.__HEADER_STRUCT.pack(archive.MAGIC, archive.VERSION, archive.RECORD_SIZE)
+
+        @staticmethod
+        def checkHeader(header):
+            archive = IcmpHelperLibrary.IcmpResultArchive
+            if len(header) != archive.HEADER_SIZE:
+                raise ValueError("not an ICMP result archive: header too short")
+            magic, version, recordSize = archive.__HEADER_STRUCT.unpack(header)
+            if magic != archive.MAGIC:
+                raise ValueError("not an ICMP result archive")
+            if version != archive.VERSION or recordSize != archive.RECORD_SIZE:
+                raise ValueError("unsupported ICMP result archive version %d" % version)
+
+        @staticmethod
+        def packRecord(probeResult, timeNs):
+            archive = IcmpHelperLibrary.IcmpResultArchive
+            return archive.__RECORD_STRUCT.pack(timeNs,
+                                                probeResult.getRttNs(),
+                                                archive.encodeAddress(probeResult.getDestinationIpAddress()),
+                                                archive.encodeAddress(probeResult.getAddress()),
+                                                min(max(probeResult.getTtl(), 0), 255),
+                                                probeResult.getIcmpType() & 0xff,
+                                                probeResult.getIcmpCode() & 0xff,
+                                                archive.STATUSES.index(probeResult.getStatus()))
+
+        @staticmethod
+        def encodeAddress(ipAddress):
+            # Dotted quad -> integer as stored, 0 for None
+            if ipAddress is None:
+                return 0
+            return struct.unpack("!I", inet_aton(ipAddress))[0]
+
+        @staticmethod
+        def decodeAddress(value):
+            if value == 0:
+                return None
+            return inet_ntoa(struct.pack("!I", int(value)))
+
+        # ############################################################################################################ #
+        # IcmpResultArchive Getters                                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getPath(self):
+            return self.__path
+
+        def getRecordCount(self):
+            return self.__recordCount
+
+        def getColumn(self, name):
+            # numpy view over the mapping (no copy), or an array decoded from it without numpy
+            return self.__records[name]
+
+        # ############################################################################################################ #
+        # IcmpResultArchive Private Functions                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __unmap(self):
+            self.__records = None
+            self.__blockTimes = None
+            self.__targetOrder = None
+            self.__sortedTargets = None
+            if self.__map is not None:
+                try:
+                    self.__map.close()
+                except BufferError:
+                    pass                # A caller still holds a column; the mapping goes when that does
+                self.__map = None
+
+        @staticmethod
+        def __timeRange(startTime, endTime):
+            # [startNs, endNs) for seconds since the epoch, None meaning open ended
+            return (int(startTime * 1e9) if startTime is not None else -(1 << 63),
+                    int(endTime * 1e9) if endTime is not None else (1 << 63) - 1)
+
+        def __getBlockTimes(self):
+            if self.__blockTimes is None:
+                times = self.__records["time_ns"]
+                starts = range(0, self.__recordCount, self.BLOCK_RECORDS)
+                if numpy is not None:
+                    startArray = numpy.fromiter(starts, dtype=numpy.int64)
+                    self.__blockTimes = (numpy.minimum.reduceat(times, startArray),
+                                         numpy.maximum.reduceat(times, startArray))
+                else:
+                    self.__blockTimes = ([min(times[start:start + self.BLOCK_RECORDS]) for start in starts],
+                                         [max(times[start:start + self.BLOCK_RECORDS]) for start in starts])
+            return self.__blockTimes
+
+        def __getTargetIndex(self):
+            if self.__targetOrder is None:
+                targets = self.__records["target"]
+                if numpy is not None and self.__recordCount < 1 << 32:
+                    # One sort of target << 32 | record number: faster than a stable argsort, same order
+                    keys = numpy.sort((targets.astype(numpy.uint64) << numpy.uint64(32)) |
+                                      numpy.arange(self.__recordCount, dtype=numpy.uint64))
+                    self.__targetOrder = (keys & numpy.uint64(0xffffffff)).astype(numpy.int64)
+                    self.__sortedTargets = (keys >> numpy.uint64(32)).astype(numpy.uint32)
+                elif numpy is not None:
+                    self.__targetOrder = numpy.argsort(targets, kind="stable")
+                    self.__sortedTargets = targets[self.__targetOrder]
+                else:
+                    self.__targetOrder = sorted(range(self.__recordCount), key=targets.__getitem__)
+                    self.__sortedTargets = [targets[position] for position in self.__targetOrder]
+            return self.__targetOrder, self.__sortedTargets
+
+        def __selectTarget(self, target):
+            # Record numbers of target in file order
+            order, sortedTargets = self.__getTargetIndex()
+            value = self.encodeAddress(target)
+            if numpy is not None:
+                low, high = numpy.searchsorted(sortedTargets, [value, value + 1])
+                return order[low:high]
+            return order[bisect.bisect_left(sortedTargets, value):bisect.bisect_left(sortedTargets, value + 1)]
+
+        def __selectTime(self, startNs, endNs, positions=None):
+            # Record numbers written in [startNs, endNs) among positions (default: all), in file order
+            times = self.__records["time_ns"]
+            if positions is None:
+                minimumTimes, maximumTimes = self.__getBlockTimes()
+                if numpy is not None:
+                    selected = []
+                    for block in numpy.flatnonzero((maximumTimes >= startNs) & (minimumTimes < endNs)):
+                        first = int(block) * self.BLOCK_RECORDS
+                        blockTimes = times[first:first + self.BLOCK_RECORDS]
+                        if minimumTimes[block] >= startNs and maximumTimes[block] < endNs:
+                            selected.append(numpy.arange(first, first + len(blockTimes)))
+                        else:
+                            selected.append(numpy.flatnonzero((blockTimes >= startNs) & (blockTimes < endNs)) + first)
+                    return numpy.concatenate(selected) if len(selected) > 0 else numpy.zeros(0, dtype=numpy.int64)
+                return [position for block in range(len(minimumTimes))
+                        if maximumTimes[block] >= startNs and minimumTimes[block] < endNs
+                        for position in range(block * self.BLOCK_RECORDS,
+                                              min((block + 1) * self.BLOCK_RECORDS, self.__recordCount))
+                        if startNs <= times[position] < endNs]
+            if numpy is not None:
+                positionTimes = times[positions]
+                return positions[(positionTimes >= startNs) & (positionTimes < endNs)]
+            return [position for position in positions if startNs <= times[position] < endNs]
+
+        @staticmethod
+        def __sortPairs(high, low, lowBits):
+            # (high, low) pairs sorted by high then low, as the two arrays. Packing both into one int64 and sorting
+            # that is many times faster than lexsort; lexsort is left for values that do not fit.
+            if len(high) == 0 or int(high.max()).bit_length() + lowBits <= 63:
+                keys = numpy.sort((high.astype(numpy.int64) << lowBits) | low)
+                return keys >> lowBits, keys & ((1 << lowBits) - 1)
+            order = numpy.lexsort((low, high))
+            return high[order], low[order]
+
+        @staticmethod
+        def __encodeTargets(values):
+            # (distinct targets sorted, each value's index into them), as numpy.unique(return_inverse=True) but by
+            # sorting target << 32 | record number once, which is faster
+            keys = numpy.sort((values.astype(numpy.uint64) << numpy.uint64(32)) |
+                              numpy.arange(len(values), dtype=numpy.uint64))
+            sortedValues = (keys >> numpy.uint64(32)).astype(numpy.uint32)
+            firsts = numpy.ones(len(keys), dtype=bool)
+            firsts[1:] = sortedValues[1:] != sortedValues[:-1]
+            codes = numpy.empty(len(keys), dtype=numpy.int64)
+            codes[(keys & numpy.uint64(0xffffffff)).astype(numpy.int64)] = numpy.cumsum(firsts) - 1
+            return sortedValues[firsts], codes
+
+        def __aggregateChunk(self, positions, bucketNs, lastResponders):
+            # Aggregates of the records at positions (None: all), which hold every record of their buckets.
+            # lastResponders carries the last answer per hop (target << 8 | TTL) across chunks as two sorted arrays.
+            if positions is None:
+                records = self.__records
+            elif len(positions) > 0 and positions[-1] - positions[0] + 1 == len(positions):
+                records = self.__records[positions[0]:positions[-1] + 1]   # One run, as written in time order: a view
+            else:
+                records = self.__records[positions]
+            if len(records) == 0:
+                return []
+            targets, targetCodes = self.__encodeTargets(records["target"])
+            buckets = records["time_ns"] // bucketNs
+            firstBucket = int(buckets.min())
+            bucketCount = int(buckets.max()) - firstBucket + 1
+            groups = targetCodes.astype(numpy.int64) * bucketCount + (buckets - firstBucket)
+            groupCount = len(targets) * bucketCount
+
+            # Echo probes and their replies
+            echoes = records["ttl"] == 255
+            replies = echoes & (records["status"] == self.STATUSES.index("reply"))
+            sent = numpy.bincount(groups[echoes], minlength=groupCount)
+            received = numpy.bincount(groups[replies], minlength=groupCount)
+
+            # Nearest rank percentiles: reply RTTs sorted by group then RTT, ranks counted from each group's start
+            rtts = numpy.minimum(records["rtt_ns"][replies], (1 << 40) - 1)
+            sortedRtts = self.__sortPairs(groups[replies], rtts, 40)[1]
+            groupStarts = numpy.cumsum(received) - received
+            percentiles = []
+            for percentile in self.PERCENTILES:
+                ranks = numpy.maximum(-(-received * percentile // 100), 1)
+                indices = numpy.minimum(groupStarts + ranks - 1, max(len(sortedRtts) - 1, 0))
+                percentiles.append(sortedRtts[indices] if len(sortedRtts) > 0 else received)
+
+            # Path changes: successive answers of one hop (target, TTL) from different addresses, in file order.
+            # Sorting the hops paired with their record numbers groups them and keeps file order inside each.
+            hopPositions = numpy.flatnonzero((records["ttl"] < 255) & (records["responder"] != 0))
+            pathChanges = numpy.zeros(groupCount, dtype=numpy.int64)
+            if len(hopPositions) > 0:
+                hopCodes = (targetCodes[hopPositions].astype(numpy.int64) << 8) | records["ttl"][hopPositions]
+                hopCodes, order = self.__sortPairs(hopCodes, numpy.arange(len(hopPositions)),
+                                                   len(hopPositions).bit_length())
+                hopPositions = hopPositions[order]
+                responders = records["responder"][hopPositions]
+                firsts = numpy.ones(len(hopCodes), dtype=bool)
+                firsts[1:] = hopCodes[1:] != hopCodes[:-1]
+                changed = numpy.zeros(len(hopCodes), dtype=bool)
+                changed[1:] = ~firsts[1:] & (responders[1:] != responders[:-1])
+
+                # The first answer of each hop compares against the previous chunk's last one. Carried hops are keyed
+                # by target address rather than code, which is only valid within the chunk; the order is the same.
+                carriedHops, carriedResponders = lastResponders
+                heads = numpy.flatnonzero(firsts)
+                hops = (targets[hopCodes >> 8].astype(numpy.int64) << 8) | (hopCodes & 0xff)
+                found = numpy.minimum(numpy.searchsorted(carriedHops, hops[heads]), max(len(carriedHops) - 1, 0))
+                if len(carriedHops) > 0:
+                    changed[heads] = (carriedHops[found] == hops[heads]) & \
+                                     (carriedResponders[found] != responders[heads])
+                pathChanges = numpy.bincount(groups[hopPositions[changed]], minlength=groupCount)
+
+                tails = numpy.append(heads[1:] - 1, len(hops) - 1)
+                allHops = numpy.concatenate((carriedHops, hops[tails]))
+                allResponders = numpy.concatenate((carriedResponders, responders[tails]))
+                order = numpy.argsort(allHops, kind="stable")
+                allHops, allResponders = allHops[order], allResponders[order]
+                lasts = numpy.ones(len(allHops), dtype=bool)
+                lasts[:-1] = allHops[1:] != allHops[:-1]
+                lastResponders[:] = [allHops[lasts], allResponders[lasts]]
+
+            # Plain lists from here on; numpy scalars are slow to handle one at a time
+            names = [self.decodeAddress(target) for target in targets.tolist()]
+            used = numpy.flatnonzero((sent > 0) | (pathChanges > 0))
+            columns = [used // bucketCount, firstBucket + used % bucketCount, sent[used], received[used],
+                       pathChanges[used]] + [values[used] for values in percentiles]
+            noPercentiles = (None,) * len(self.PERCENTILES)
+            aggregates = []
+            for targetCode, bucket, sentCount, replyCount, changes, *groupPercentiles in \
+                    zip(*(column.tolist() for column in columns)):
+                aggregates.append(IcmpHelperLibrary.IcmpArchiveAggregate(
+                    names[targetCode], bucket * bucketNs / 1e9, sentCount, replyCount,
+                    tuple(groupPercentiles) if replyCount > 0 else noPercentiles, changes))
+            return aggregates
+
+        def __aggregateNumpy(self, target, startNs, endNs, bucketNs):
+            lastResponders = [numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.uint32)]
+            if target is not None:
+                # One target's records are few enough to take at once
+                return self.__aggregateChunk(self.__selectTime(startNs, endNs, self.__selectTarget(target)),
+                                             bucketNs, lastResponders)
+
+            # Everything else a run of whole buckets at a time, about CHUNK_RECORDS records each, so memory stays
+            # bounded however large the archive is. No aggregate spans two chunks.
+            minimumTimes, maximumTimes = self.__getBlockTimes()
+            if len(minimumTimes) == 0:
+                return []
+            firstNs = max(startNs, int(minimumTimes.min()))
+            lastNs = min(endNs, int(maximumTimes.max()) + 1)
+            bucketsPerChunk = max(self.CHUNK_RECORDS * max(lastNs - firstNs, 1) // (self.__recordCount * bucketNs), 1)
+            aggregates = []
+            chunkStartNs = firstNs // bucketNs * bucketNs
+            while chunkStartNs < lastNs:
+                chunkEndNs = chunkStartNs + bucketsPerChunk * bucketNs
+                positions = self.__selectTime(max(chunkStartNs, startNs), min(chunkEndNs, endNs))
+                aggregates += self.__aggregateChunk(positions, bucketNs, lastResponders)
+                chunkStartNs = chunkEndNs
+            aggregates.sort(key=lambda aggregate: (self.encodeAddress(aggregate.getTarget()), aggregate.getStartTime()))
+            return aggregates
+
+        def __aggregatePython(self, positions, bucketNs):
+            records = self.__records
+            if positions is None:
+                positions = range(self.__recordCount)
+            replyStatus = self.STATUSES.index("reply")
+            groups = {}                 # (target, bucket) -> [sent, [reply RTTs], path changes]
+            lastResponders = {}         # (target, TTL) -> responder last seen, walked in file order
+            for position in positions:
+                target = records["target"][position]
+                ttl = records["ttl"][position]
+                group = groups.setdefault((target, records["time_ns"][position] // bucketNs), [0, [], 0])
+                if ttl == 255:
+                    group[0] += 1
+                    if records["status"][position] == replyStatus:
+                        group[1].append(records["rtt_ns"][position])
+                elif records["responder"][position] != 0:
+                    responder = records["responder"][position]
+                    previous = lastResponders.get((target, ttl))
+                    if previous is not None and previous != responder:
+                        group[2] += 1
+                    lastResponders[(target, ttl)] = responder
+
+            aggregates = []
+            for (target, bucket), (sent, rtts, pathChanges) in sorted(groups.items()):
+                if sent == 0 and pathChanges == 0:
+                    continue
+                rtts.sort()
+                percentiles = tuple(rtts[max(-(-len(rtts) * percentile // 100), 1) - 1] if len(rtts) > 0 else None
+                                    for percentile in self.PERCENTILES)
+                aggregates.append(IcmpHelperLibrary.IcmpArchiveAggregate(
+                    self.decodeAddress(target), bucket * bucketNs / 1e9, sent, len(rtts), percentiles, pathChanges))
+            return aggregates
+
+        # ############################################################################################################ #
+        # IcmpResultArchive Public Functions                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def refresh(self):
+            # Maps the file again to take in records appended since it was opened; indexes are rebuilt on next use
+            self.__unmap()
+            size = os.fstat(self.__file.fileno()).st_size
+            self.__recordCount = max(size - self.HEADER_SIZE, 0) // self.RECORD_SIZE
+            if self.__recordCount > 0:
+                self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            if numpy is not None:
+                dtype = numpy.dtype({"names": list(self.COLUMNS),
+                                     "formats": ["<i8", "<i8", "<u4", "<u4", "u1", "u1", "u1", "u1"],
+                                     "offsets": [0, 8, 16, 20, 24, 25, 26, 27],
+                                     "itemsize": self.RECORD_SIZE})
+                if self.__recordCount > 0:
+                    self.__records = numpy.frombuffer(self.__map, dtype, self.__recordCount, self.HEADER_SIZE)
+                else:
+                    self.__records = numpy.zeros(0, dtype)
+            else:
+                columns = [array(typeCode) for typeCode in "qqIIBBBB"]
+                if self.__recordCount > 0:
+                    view = memoryview(self.__map)[self.HEADER_SIZE:self.HEADER_SIZE +
+                                                  self.__recordCount * self.RECORD_SIZE]
+                    for values in self.__RECORD_STRUCT.iter_unpack(view):
+                        for column, value in zip(columns, values):
+                            column.append(value)
+                    view.release()
+                self.__records = dict(zip(self.COLUMNS, columns))
+            return self.__recordCount
+
+        def select(self, target=None, startTime=None, endTime=None):
+            # Record numbers (file order) for target (None: all) written in [startTime, endTime) seconds since the
+            # epoch (None: open ended). Returns None when nothing is filtered, meaning every record.
+            positions = self.__selectTarget(target) if target is not None else None
+            if startTime is not None or endTime is not None:
+                positions = self.__selectTime(*self.__timeRange(startTime, endTime), positions)
+            return positions
+
+        def iterateRecords(self, target=None, startTime=None, endTime=None):
+            # Yields (time sent in s, RTT in ns, target, responder, ttl, type, code, status) tuples
+            positions = self.select(target, startTime, endTime)
+            columns = [self.__records[name] for name in self.COLUMNS]
+            for position in (positions if positions is not None else range(self.__recordCount)):
+                timeNs, rttNs, targetValue, responder, ttl, icmpType, icmpCode, status = \
+                    (column[position] for column in columns)
+                yield (int(timeNs) / 1e9, int(rttNs), self.decodeAddress(targetValue), self.decodeAddress(responder),
+                       int(ttl), int(icmpType), int(icmpCode), self.STATUSES[status])
+
+        def aggregate(self, target=None, startTime=None, endTime=None, bucketSeconds=3600):
+            # One IcmpArchiveAggregate per target and bucketSeconds long bucket with something in it, in target then
+            # time order
+            bucketNs = int(bucketSeconds * 1e9)
+            if numpy is not None:
+                return self.__aggregateNumpy(target, *self.__timeRange(startTime, endTime), bucketNs)
+            return self.__aggregatePython(self.select(target, startTime, endTime), bucketNs)
+
+        def close(self):
+            if self.__file is not None:
+                self.__unmap()
+                self.__file.close()
+                self.__file = None
+
+    # ################################################################################################################ #
+    # Class IcmpMetricsHook                                                                                            #
+    #                                                                                                                  #
+    # Receives every update of an IcmpMetrics it is added to, e.g. to forward them to another metrics system. The      #
+    # methods do nothing here; override the ones needed. They run inline on the hot path, so they should be cheap.     #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMetricsHook:
+        def onCount(self, name, amount):
+            pass
+
+        def onGauge(self, name, value):
+            pass
+
+        def onTiming(self, phase, durationNs):
+            pass
+
+    # ################################################################################################################ #
+    # Class IcmpMetrics                                                                                                #
+    #                                                                                                                  #
+    # Counters, gauges and per phase latency histograms of everything probing does. Instrumented code looks up the     #
+    # active instance with getActive() and skips all work when it is None, which is the default, so metrics cost one   #
+    # check per site until setActive() turns them on. Readers (snapshot(), formatPrometheus()) may run on another      #
+    # thread: they work on copies, so the hot path takes no lock.                                                      #
+    # ################################################################################################################ #
+    class IcmpMetrics:
+        # ############################################################################################################ #
+        # IcmpMetrics Class Scope Variables                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        COUNTERS = ("probes_sent",          # Probes registered with a dispatcher
+                    "replies_received",     # Datagrams matched to a probe (echo replies and ICMP errors)
+                    "timeouts",             # Probes expired unanswered
+                    "unmatched_replies",    # Datagrams read that answered no pending probe
+                    "socket_errors",        # Sends and reads that failed
+                    "rate_limits_detected", # Responders whose send rate IcmpPacer cut
+                    "sweep_syscalls")       # Socket calls of sweep() runs (estimated without sendmmsg/recvmmsg)
+        GAUGES = ("probes_in_flight",)      # Probes pending in the dispatcher last updated
+        PHASES = ("resolve",                # Name to address, cache hits included
+                  "socket_setup",           # Opening a transport
+                  "build",                  # Packing a probe and its checksum
+                  "send",                   # Handing probes to the kernel
+                  "wait",                   # Blocked waiting for replies
+                  "parse",                  # Decoding and matching one datagram
+                  "pace",                   # Held back by IcmpPacer
+                  "output")                 # Writing results out
+        PERCENTILES = (50, 90, 99)
+
+        __active = None                 # Instance instrumented code reports to, None when disabled
+
+        __counters = None
+        __gauges = None
+        __histograms = None             # phase -> IcmpRttHistogram of nanosecond durations
+        __sums = None                   # phase -> total nanoseconds
+        __hooks = None
+        __startTime = 0.0
+
+        # ############################################################################################################ #
+        # IcmpMetrics Constructors                                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self):
+            self.__counters = dict.fromkeys(self.COUNTERS, 0)
+            self.__gauges = dict.fromkeys(self.GAUGES, 0)
+            self.__histograms = {phase: IcmpHelperLibrary.IcmpRttHistogram() for phase in self.PHASES}
+            self.__sums = dict.fromkeys(self.PHASES, 0)
+            self.__hooks = []
+            self.__startTime = time.time()
+
+        @staticmethod
+        def getActive():
+            return IcmpHelperLibrary.IcmpMetrics.__active
+
+        @staticmethod
+        def setActive(metrics):
+            # Starts reporting to metrics, None stops. Returns the instance that was active before.
+            previous = IcmpHelperLibrary.IcmpMetrics.__active
+            IcmpHelperLibrary.IcmpMetrics.__active = metrics
+            return previous
+
+        # ############################################################################################################ #
+        # IcmpMetrics Getters                                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getCounter(self, name):
+            return self.__counters.get(name, 0)
+
+        def getGauge(self, name):
+            return self.__gauges.get(name, 0)
+
+        def getHistogram(self, phase):
+            return self.__histograms[phase]
+
+        def getHooks(self):
+            return self.__hooks
+
+        def getStartTime(self):
+            return self.__startTime
+
+        # ############################################################################################################ #
+        # IcmpMetrics Public Functions                                                                                 #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def count(self, name, amount=1):
+            self.__counters[name] = self.__counters.get(name, 0) + amount
+            for hook in self.__hooks:
+                hook.onCount(name, amount)
+
+        def setGauge(self, name, value):
+            self.__gauges[name] = value
+            for hook in self.__hooks:
+                hook.onGauge(name, value)
+
+        def recordTiming(self, phase, durationNs):
+            self.__histograms[phase].record(durationNs)
+            self.__sums[phase] += durationNs
+            for hook in self.__hooks:
+                hook.onTiming(phase, durationNs)
+
+        def addHook(self, hook):
+            self.__hooks = self.__hooks + [hook]        # Replaced, not changed, so a running update keeps its list
+
+        def removeHook(self, hook):
+            self.__hooks = [other for other in self.__hooks if other is not hook]
+
+        def snapshot(self):
+            # Plain dict of the current values (durations in seconds), ready for json.dumps()
+            phases = {}
+            for phase in self.PHASES:
+                histogram = self.__histograms[phase].copy()     # Recording may go on meanwhile
+                phaseSnapshot = {"count": histogram.getTotalCount(), "sum_s": self.__sums[phase] / 1e9}
+                for percentile in self.PERCENTILES:
+                    value = histogram.getValueAtPercentile(percentile)
+                    phaseSnapshot["p%d_s" % percentile] = value / 1e9 if value is not None else None
+                phases[phase] = phaseSnapshot
+            return {"time": time.time(),
+                    "uptime_s": time.time() - self.__startTime,
+                    "counters": dict(self.__counters),
+                    "gauges": dict(self.__gauges),
+                    "phases": phases}
+
+        def formatPrometheus(self):
+            # Prometheus text exposition format (version 0.0.4); phase latencies as summaries with quantiles
+            snapshot = self.snapshot()
+            lines = []
+            for name, value in snapshot["counters"].items():
+                lines.append("# TYPE icmp_%s_total counter" % name)
+                lines.append("icmp_%s_total %d" % (name, value))
+            for name, value in snapshot["gauges"].items():
+                lines.append("# TYPE icmp_%s gauge" % name)
+                lines.append("icmp_%s %s" % (name, value))
+            lines.append("# TYPE icmp_phase_duration_seconds summary")
+            for phase, phaseSnapshot in snapshot["phases"].items():
+                for percentile in self.PERCENTILES:
+                    value = phaseSnapshot["p%d_s" % percentile]
+                    lines.append('icmp_phase_duration_seconds{phase="%s",quantile="%s"} %s' %
+                                 (phase, percentile / 100, repr(value) if value is not None else "NaN"))
+                lines.append('icmp_phase_duration_seconds_sum{phase="%s"} %r' % (phase, phaseSnapshot["sum_s"]))
+                lines.append('icmp_phase_duration_seconds_count{phase="%s"} %d' % (phase, phaseSnapshot["count"]))
+            lines.append("# TYPE icmp_uptime_seconds gauge")
+            lines.append("icmp_uptime_seconds %r" % snapshot["uptime_s"])
+            return "\n".join(lines) + "\n"
+
+    # ################################################################################################################ #
+    # Class IcmpMetricsServer                                                                                          #
+    #                                                                                                                  #
+    # Serves an IcmpMetrics over HTTP from a background thread: /metrics in the Prometheus text format and             #
+    # /metrics.json as the snapshot() dict. Listens on localhost only unless told otherwise; port 0 picks a free one.  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMetricsServer:
+        # ############################################################################################################ #
+        # IcmpMetricsServer Class Scope Variables                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __metrics = None
+        __server = None
+        __thread = None
+
+        # ############################################################################################################ #
+        # IcmpMetricsServer Constructors                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, metrics, port=9464, address="127.0.0.1"):
+            self.__metrics = metrics
+            server = self
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    server.handleRequest(self)
+
+                def log_message(self, format, *args):
+                    pass                # Scrapes every few seconds would flood stderr
+
+            self.__server = http.server.ThreadingHTTPServer((address, port), Handler)
+            self.__server.daemon_threads = True
+            self.__thread = threading.Thread(target=self.__server.serve_forever, name="IcmpMetricsServer",
+                                             daemon=True)
+            self.__thread.start()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpMetricsServer Getters                                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getMetrics(self):
+            return self.__metrics
+
+        def getAddress(self):
+            # (address, port) actually listened on
+            return self.__server.server_address
+
+        # ############################################################################################################ #
+        # IcmpMetricsServer Public Functions                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def handleRequest(self, handler):
+            path = handler.path.split("?", 1)[0]
+            if path == "/metrics":
+                body = self.__metrics.formatPrometheus().encode("utf-8")
+                contentType = "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/metrics.json":
+                body = json.dumps(self.__metrics.snapshot()).encode("utf-8")
+                contentType = "application/json"
+            else:
+                handler.send_error(404)
+                return
+            handler.send_response(200)
+            handler.send_header("Content-Type", contentType)
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+
+        def close(self):
+            if self.__thread is not None:
+                self.__server.shutdown()
+                self.__server.server_close()
+                self.__thread.join()
+                self.__thread = None
+
+    # ################################################################################################################ #
+    # Class IcmpMetricsSnapshotWriter                                                                                  #
+    #                                                                                                                  #
+    # Appends an IcmpMetrics snapshot() as one JSON line to a file (or stream) every interval seconds from a           #
+    # background thread, and a last one when closed, so a long sweep can be followed with tail -f.                     #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMetricsSnapshotWriter:
+        # ############################################################################################################ #
+        # IcmpMetricsSnapshotWriter Class Scope Variables                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __metrics = None
+        __stream = None
+        __ownsStream = False
+        __interval = 10
+        __stopEvent = None
+        __thread = None
+
+        # ############################################################################################################ #
+        # IcmpMetricsSnapshotWriter Constructors                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, metrics, stream, interval=10):
+            if isinstance(stream, str):
+                stream = open(stream, "a")
+                self.__ownsStream = True
+            self.__metrics = metrics
+            self.__stream = stream
+            self.__interval = interval
+            self.__stopEvent = threading.Event()
+            self.__thread = threading.Thread(target=self.__run, name="IcmpMetricsSnapshotWriter", daemon=True)
+            self.__thread.start()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpMetricsSnapshotWriter Private Functions                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __run(self):
+            while not self.__stopEvent.wait(self.__interval):
+                self.writeSnapshot()
+
+        # ############################################################################################################ #
+        # IcmpMetricsSnapshotWriter Public Functions                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def writeSnapshot(self):
+            self.__stream.write(json.dumps(self.__metrics.snapshot()) + "\n")
+            self.__stream.flush()
+
+        def close(self):
+            if self.__thread is not None:
+                self.__stopEvent.set()
+                self.__thread.join()
+                self.__thread = None
+                self.writeSnapshot()
+                if self.__ownsStream:
+                    self.__stream.close()
+
+    # ################################################################################################################ #
+    # Class IcmpTimingWheel                                                                                            #
+    #                                                                                                                  #
+    # Hierarchical timing wheel (Varghese & Lauck). Level 0 has wheelSize slots of tickDuration seconds, every higher  #
+    # level wheelSize slots each spanning a whole turn of the level below; entries cascade down as their turn comes.   #
+    # Scheduling is O(1) however many entries are pending. Entries beyond the top level wait in a heap. Times are      #
+    # time.monotonic() seconds.                                                                                        #
+    # ################################################################################################################ #
+    class IcmpTimingWheel:
+        # ############################################################################################################ #
+        # IcmpTimingWheel Class Scope Variables                                                                        #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __tickDuration = 0.01
+        __wheelBits = 8                 # wheelSize is a power of two so slots are picked with shifts and masks
+        __levels = 3
+        __wheels = None                 # __wheels[level][slot] -> list of (tick, order, item)
+        __overflow = None               # Heap of (tick, order, item) past the top level
+        __startTime = 0.0
+        __currentTick = 0               # Last tick advance() has processed
+        __order = 0
+        __count = 0
+
+        # ############################################################################################################ #
+        # IcmpTimingWheel Constructors                                                                                 #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, tickDuration=0.01, wheelSize=256, levels=3, startTime=None):
+            self.__tickDuration = tickDuration
+            self.__wheelBits = max(wheelSize - 1, 1).bit_length()
+            self.__levels = levels
+            self.__wheels = [[[] for slot in range(1 << self.__wheelBits)] for level in range(levels)]
+            self.__overflow = []
+            self.__startTime = time.monotonic() if startTime is None else startTime
+            self.__currentTick = 0
+            self.__order = 0
+            self.__count = 0
+
+        # ############################################################################################################ #
+        # IcmpTimingWheel Getters                                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getTickDuration(self):
+            return self.__tickDuration
+
+        def getCount(self):
+            return self.__count
+
+        def getNextTickTime(self):
+            return self.__startTime + (self.__currentTick + 1) * self.__tickDuration
+
+        # ############################################################################################################ #
+        # IcmpTimingWheel Private Functions                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __place(self, entry):
+            # Lowest level whose span still covers the entry's tick, relative to the current one
+            tick = entry[0]
+            delta = tick - self.__currentTick
+            for level in range(self.__levels):
+                if delta < 1 << (self.__wheelBits * (level + 1)):
+                    slot = (tick >> (self.__wheelBits * level)) & ((1 << self.__wheelBits) - 1)
+                    self.__wheels[level][slot].append(entry)
+                    return
+            heapq.heappush(self.__overflow, entry)
+
+        def __cascade(self):
+            # Called after __currentTick moved to a multiple of wheelSize: redistribute the slot of every level whose
+            # turn has come, highest first, so entries end up in level 0 in time for their tick
+            slotMask = (1 << self.__wheelBits) - 1
+            for level in range(self.__levels - 1, 0, -1):
+                if self.__currentTick & ((1 << (self.__wheelBits * level)) - 1) != 0:
+                    continue
+                if level == self.__levels - 1:
+                    topSpan = 1 << (self.__wheelBits * self.__levels)
+                    while len(self.__overflow) > 0 and self.__overflow[0][0] - self.__currentTick < topSpan:
+                        self.__place(heapq.heappop(self.__overflow))
+                slot = self.__wheels[level][(self.__currentTick >> (self.__wheelBits * level)) & slotMask]
+                entries = slot[:]
+                del slot[:]
+                for entry in entries:
+                    self.__place(entry)
+
+        # ############################################################################################################ #
+        # IcmpTimingWheel Public Functions                                                                             #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def schedule(self, deadline, item):
+            # Fires item on the first tick at or after deadline, never on the tick already processed
+            tick = max(-int((self.__startTime - deadline) // self.__tickDuration), self.__currentTick + 1)
+            self.__order += 1
+            self.__count += 1
+            self.__place((tick, self.__order, item))
+
+        def advance(self, now):
+            # Returns the items that came due up to now, earliest first
+            dueItems = []
+            lastTick = int((now - self.__startTime) / self.__tickDuration)
+            slotMask = (1 << self.__wheelBits) - 1
+            while self.__currentTick < lastTick:
+                self.__currentTick += 1
+                if self.__currentTick & slotMask == 0:
+                    self.__cascade()
+                slot = self.__wheels[0][self.__currentTick & slotMask]
+                if len(slot) > 0:
+                    slot.sort()
+                    dueItems.extend(entry[2] for entry in slot)
+                    self.__count -= len(slot)
+                    del slot[:]
+                if self.__count == 0 and len(self.__overflow) == 0:
+                    self.__currentTick = lastTick       # Nothing pending, skip the empty ticks at once
+            return dueItems
+
+    # ################################################################################################################ #
+    # Class IcmpMonitorTarget                                                                                          #
+    #                                                                                                                  #
+    # A monitored target: its schedule and its running IcmpPingResult.                                                 #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMonitorTarget:
+        # ############################################################################################################ #
+        # IcmpMonitorTarget Class Scope Variables                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__target",
+                     "__nextDueTime",
+                     "__pingResult",
+                     "__active")
+
+        # ############################################################################################################ #
+        # IcmpMonitorTarget Constructors                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress, firstDueTime):
+            self.__target = target
+            self.__nextDueTime = firstDueTime
+            self.__pingResult = IcmpHelperLibrary.IcmpPingResult(target, destinationIpAddress, 255, False)
+            self.__active = True
+
+        # ############################################################################################################ #
+        # IcmpMonitorTarget Getters                                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__pingResult.getDestinationIpAddress()
+
+        def getNextDueTime(self):
+            return self.__nextDueTime
+
+        def getPingResult(self):
+            return self.__pingResult
+
+        def isActive(self):
+            return self.__active
+
+        # ############################################################################################################ #
+        # IcmpMonitorTarget Setters                                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setNextDueTime(self, nextDueTime):
+            self.__nextDueTime = nextDueTime
+
+        def setActive(self, booleanValue):
+            self.__active = booleanValue
+
+    # ################################################################################################################ #
+    # Class IcmpMonitorReport                                                                                          #
+    #                                                                                                                  #
+    # Periodic health record of an IcmpMonitor: how late the scheduler fired probes (lag) and how many intervals it    #
+    # had to skip because it was more than a whole interval behind (overruns), over the last report period.            #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMonitorReport:
+        # ############################################################################################################ #
+        # IcmpMonitorReport Class Scope Variables                                                                      #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__targetCount",
+                     "__probesSent",
+                     "__probesPending",
+                     "__overruns",
+                     "__lagStatistics")
+
+        RECORD_TYPE = "monitor"
+        FIELDS = ("record", "targets", "sent", "pending", "overruns", "lag_p50_ms", "lag_p99_ms", "lag_max_ms")
+
+        # ############################################################################################################ #
+        # IcmpMonitorReport Constructors                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, targetCount, probesSent, probesPending, overruns, lagStatistics):
+            self.__targetCount = targetCount
+            self.__probesSent = probesSent
+            self.__probesPending = probesPending
+            self.__overruns = overruns
+            self.__lagStatistics = lagStatistics
+
+        # ############################################################################################################ #
+        # IcmpMonitorReport Getters                                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getTargetCount(self):
+            return self.__targetCount
+
+        def getProbesSent(self):
+            return self.__probesSent
+
+        def getOverruns(self):
+            return self.__overruns
+
+        def getLagStatistics(self):
+            return self.__lagStatistics
+
+        # ############################################################################################################ #
+        # IcmpMonitorReport Public Functions                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def toRow(self):
+            lagStatistics = self.__lagStatistics
+            if lagStatistics.getSampleCount() == 0:
+                lags = (None, None, None)
+            else:
+                lags = (lagStatistics.getPercentile(50), lagStatistics.getPercentile(99), lagStatistics.getMaxRtt())
+            return (self.RECORD_TYPE, self.__targetCount, self.__probesSent, self.__probesPending,
+                    self.__overruns) + lags
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            row = self.toRow()
+            return "Monitor    Targets=%d    Sent=%d    Pending=%d    Overruns=%d    Lag P50=%.1f ms  P99=%.1f ms  " \
+                   "Max=%.1f ms" % (row[1:5] + tuple(0.0 if lag is None else lag for lag in row[5:]))
+
+    # ################################################################################################################ #
+    # Class IcmpMonitor                                                                                                #
+    #                                                                                                                  #
+    # Long running probe scheduler over one shared IcmpSocket. Every target is probed every interval seconds on a      #
+    # fixed grid (start + k * interval, so a slow iteration never shifts later probes); targets get evenly spread      #
+    # phases so a large target set does not send in bursts. Probe results stream to the sink as they finish, followed  #
+    # by an IcmpMonitorReport every reportInterval seconds and a target's summary when it is removed or the monitor    #
+    # stops. setTargets(), requestReload() and stop() may be called from other threads or signal handlers.             #
+    # ################################################################################################################ #
+    class IcmpMonitor:
+        # ############################################################################################################ #
+        # IcmpMonitor Class Scope Variables                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __icmpSocket = None
+        __resolver = None
+        __sink = None
+        __targetSpecification = None   # What reload() expands again, e.g. a file name
+        __interval = 1.0
+        __timeout = 1.0
+        __reportInterval = 10.0
+        __wheel = None
+        __targets = None                # target -> IcmpMonitorTarget
+        __resolvingTargets = None       # target -> (Future of its address, first due time), not probed yet
+        __pendingTargets = None         # Target list handed to setTargets(), applied by the run loop
+        __reloadRequested = False
+        __stopRequested = False
+        __probesSent = 0
+        __overruns = 0
+        __lagStatistics = None
+        __ownsSocket = False            # The socket was opened for this monitor and is closed when run() returns
+
+        # ############################################################################################################ #
+        # IcmpMonitor Constructors                                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, icmpSocket, targets, interval=1, timeout=1, reportInterval=10, resolver=None, sink=None,
+                     tickDuration=0.01, ownsSocket=False):
+            self.__icmpSocket = icmpSocket
+            self.__ownsSocket = ownsSocket
+            self.__resolver = resolver if resolver is not None else IcmpHelperLibrary.IcmpResolver.getDefaultResolver()
+            self.__sink = sink if sink is not None else IcmpHelperLibrary.IcmpConsoleSink()
+            self.__targetSpecification = targets
+            self.__interval = interval
+            self.__timeout = min(timeout, interval)     # A probe never outlives the next one to the same target
+            self.__reportInterval = reportInterval
+            self.__wheel = IcmpHelperLibrary.IcmpTimingWheel(tickDuration)
+            self.__targets = {}
+            self.__resolvingTargets = {}
+            self.__pendingTargets = None
+            self.__reloadRequested = True               # The first iteration loads the targets
+            self.__stopRequested = False
+            self.__probesSent = 0
+            self.__overruns = 0
+            self.__lagStatistics = IcmpHelperLibrary.IcmpRttStatistics()
+
+        # ############################################################################################################ #
+        # IcmpMonitor Getters                                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getTargets(self):
+            return list(self.__targets.values())
+
+        def getTargetCount(self):
+            return len(self.__targets)
+
+        # ############################################################################################################ #
+        # IcmpMonitor Private Functions                                                                                #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __applyTargets(self, targets, now):
+            # Keeps the statistics of targets that stay, spreads new ones evenly over one interval. Names resolve on
+            # the resolver's threads; __admitResolvedTargets() starts probing each one once its address is known.
+            wanted = OrderedDict.fromkeys(IcmpHelperLibrary.iterateTargets(targets))
+            for target in list(self.__targets):
+                if target not in wanted:
+                    monitorTarget = self.__targets.pop(target)
+                    monitorTarget.setActive(False)      # Its wheel entry is dropped when it comes due
+                    self.__sink.write(monitorTarget.getPingResult())
+            for target in list(self.__resolvingTargets):
+                if target not in wanted:
+                    del self.__resolvingTargets[target]
+
+            newTargets = [target for target in wanted
+                          if target not in self.__targets and target not in self.__resolvingTargets]
+            for i, target in enumerate(newTargets):
+                self.__resolvingTargets[target] = (self.__resolver.resolveInBackground(target),
+                                                   now + self.__interval * i / len(newTargets))
+
+        def __admitResolvedTargets(self, now):
+            for target, (addressFuture, firstDueTime) in list(self.__resolvingTargets.items()):
+                if not addressFuture.done():
+                    continue
+                del self.__resolvingTargets[target]
+                try:
+                    destinationIpAddress = addressFuture.result()
+                except (OSError, UnicodeError) as error:
+                    self.__sink.write(IcmpHelperLibrary.IcmpSweepTarget(target, None, str(error)))
+                    continue
+                firstDueTime = max(firstDueTime, now)
+                monitorTarget = IcmpHelperLibrary.IcmpMonitorTarget(target, destinationIpAddress, firstDueTime)
+                self.__targets[target] = monitorTarget
+                self.__wheel.schedule(firstDueTime, monitorTarget)
+
+        def __recordFinishedProbes(self, finishedProbes):
+            # Adds the probes the dispatcher finished to their targets and the sink; cancelled ones count as lost
+            for pendingProbe in finishedProbes:
+                monitorTarget = pendingProbe.getContext()
+                probeResult = IcmpHelperLibrary.IcmpProbeResult.fromPendingProbe(
+                    pendingProbe, monitorTarget.getTarget(), monitorTarget.getDestinationIpAddress(), 255)
+                monitorTarget.getPingResult().addProbe(probeResult)
+                self.__sink.write(probeResult)
+            del finishedProbes[:]
+
+        def __writeReport(self):
+            self.__sink.write(IcmpHelperLibrary.IcmpMonitorReport(len(self.__targets), self.__probesSent,
+                                                                  self.__icmpSocket.getDispatcher().getPendingCount(),
+                                                                  self.__overruns, self.__lagStatistics))
+            self.__sink.flush()
+            self.__probesSent = 0
+            self.__overruns = 0
+            self.__lagStatistics = IcmpHelperLibrary.IcmpRttStatistics()
+
+        # ############################################################################################################ #
+        # IcmpMonitor Public Functions                                                                                 #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def setTargets(self, targets):
+            # Replaces the monitored set from the next iteration on
+            self.__pendingTargets = targets
+
+        def requestReload(self):
+            # Expands the original target specification again (re-reading files) on the next iteration
+            self.__reloadRequested = True
+
+        def stop(self):
+            self.__stopRequested = True
+
+        def run(self, duration=None):
+            icmpSocket = self.__icmpSocket
+            dispatcher = icmpSocket.getDispatcher()
+            packetIdentifier = IcmpHelperLibrary.allocatePacketIdentifiers()[0]
+            packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(packetIdentifier)
+            finishedProbes = []
+            nextSequenceNumber = 0
+            startTime = time.monotonic()
+            endTime = None if duration is None else startTime + duration
+            nextReportTime = startTime + self.__reportInterval
+
+            try:
+                while not self.__stopRequested:
+                    now = time.monotonic()
+                    if endTime is not None and now >= endTime:
+                        break
+                    if self.__pendingTargets is not None:
+                        targets, self.__pendingTargets = self.__pendingTargets, None
+                        self.__targetSpecification = targets
+                        self.__applyTargets(targets, now)
+                    elif self.__reloadRequested:
+                        self.__reloadRequested = False
+                        self.__applyTargets(self.__targetSpecification, now)
+                    if len(self.__resolvingTargets) > 0:
+                        self.__admitResolvedTargets(now)
+
+                    for monitorTarget in self.__wheel.advance(now):
+                        if not monitorTarget.isActive():
+                            continue
+                        dueTime = monitorTarget.getNextDueTime()
+                        self.__lagStatistics.recordRtt(int((now - dueTime) * 1e9))
+
+                        while dispatcher.isPending(packetIdentifier, nextSequenceNumber):
+                            nextSequenceNumber = (nextSequenceNumber + 1) & 0xffff
+                        packetView = packetTemplate.build(nextSequenceNumber)
+                        pendingProbe = dispatcher.register(packetIdentifier, nextSequenceNumber,
+                                                           packetTemplate.getTimeSent(), self.__timeout,
+                                                           finishedProbes.append, monitorTarget,
+                                                           packetTemplate.getTimeSentNs(),
+                                                           monitorTarget.getDestinationIpAddress())
+                        nextSequenceNumber = (nextSequenceNumber + 1) & 0xffff
+                        try:
+                            icmpSocket.sendTo(packetView, monitorTarget.getDestinationIpAddress(), 255)
+                        except OSError:
+                            dispatcher.cancel(pendingProbe)     # Counted as lost
+                        self.__probesSent += 1
+
+                        # Next slot on the fixed grid; slots already missed are skipped rather than sent in a burst
+                        nextDueTime = dueTime + self.__interval
+                        if nextDueTime <= now:
+                            missed = int((now - nextDueTime) / self.__interval) + 1
+                            self.__overruns += missed
+                            nextDueTime += missed * self.__interval
+                        monitorTarget.setNextDueTime(nextDueTime)
+                        self.__wheel.schedule(nextDueTime, monitorTarget)
+
+                    # Wait for replies until the next wheel tick, then time out whatever is overdue
+                    icmpSocket.receiveAvailable(self.__wheel.getNextTickTime() - time.monotonic())
+                    dispatcher.expire(time.monotonic())
+                    self.__recordFinishedProbes(finishedProbes)
+
+                    if time.monotonic() >= nextReportTime:
+                        self.__writeReport()
+                        nextReportTime += self.__reportInterval
+            except KeyboardInterrupt:
+                pass
+            finally:
+                dispatcher.cancelAll()
+                self.__recordFinishedProbes(finishedProbes)     # Probes still in flight go into the summaries as lost
+                for monitorTarget in self.__targets.values():
+                    self.__sink.write(monitorTarget.getPingResult())
+                self.__writeReport()
+                if self.__ownsSocket:
+                    icmpSocket.close()
+
+    # ################################################################################################################ #
+    # Class IcmpHopCache                                                                                               #
+    #                                                                                                                  #
+    # Doubletree stop sets (Donnet et al.) shared by the traces of traceRouteMany(). The local stop set holds every    #
+    # interface seen from here: backward probing towards the source stops on one, the rest of the path being known.    #
+    # The global stop set holds (interface, destination prefix) pairs with the hops that followed: forward probing     #
+    # stops on one, as another destination in the prefix already went on from there. Entries expire after ttl seconds  #
+    # so route changes are picked up, and the least recently used ones go beyond maxEntries.                           #
+    # ################################################################################################################ #
+    class IcmpHopCache:
+        # ############################################################################################################ #
+        # IcmpHopCache Class Scope Variables                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __localStopSet = None           # interface -> expiry
+        __globalStopSet = None          # (interface, prefix) -> (expiry, hops from the interface to the destination)
+        __prefixLength = 24
+        __ttl = 3600
+        __maxEntries = 65536
+        __probesSaved = 0
+        __lock = None
+
+        # ############################################################################################################ #
+        # IcmpHopCache Constructors                                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, prefixLength=24, ttl=3600, maxEntries=65536):
+            self.__localStopSet = OrderedDict()
+            self.__globalStopSet = OrderedDict()
+            self.__prefixLength = prefixLength
+            self.__ttl = ttl
+            self.__maxEntries = maxEntries
+            self.__probesSaved = 0
+            self.__lock = threading.Lock()
+
+        # ############################################################################################################ #
+        # IcmpHopCache Getters                                                                                         #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getPrefix(self, destinationIpAddress):
+            return str(ipaddress.ip_network("%s/%d" % (destinationIpAddress, self.__prefixLength), strict=False))
+
+        def getProbesSaved(self):
+            return self.__probesSaved
+
+        def getSize(self):
+            return len(self.__localStopSet) + len(self.__globalStopSet)
+
+        def isInLocalStopSet(self, interface):
+            with self.__lock:
+                expiry = self.__localStopSet.get(interface)
+                if expiry is None:
+                    return False
+                if expiry <= time.monotonic():
+                    del self.__localStopSet[interface]
+                    return False
+                return True
+
+        def getRemainingHops(self, interface, prefix):
+            # Hops an earlier trace into prefix took after interface, None if interface is not in the global stop set
+            with self.__lock:
+                entry = self.__globalStopSet.get((interface, prefix))
+                if entry is None:
+                    return None
+                if entry[0] <= time.monotonic():
+                    del self.__globalStopSet[(interface, prefix)]
+                    return None
+                return entry[1]
+
+        # ############################################################################################################ #
+        # IcmpHopCache Private Functions                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __store(self, cache, key, entry):
+            cache[key] = entry
+            cache.move_to_end(key)
+            while len(cache) > self.__maxEntries:
+                cache.popitem(last=False)
+
+        # ############################################################################################################ #
+        # IcmpHopCache Public Functions                                                                                #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def addPath(self, prefix, interfaces, lastTtl):
+            # interfaces: (ttl, address) of every responding hop of one trace, lastTtl the hop it ended at
+            expiry = time.monotonic() + self.__ttl
+            with self.__lock:
+                for ttl, interface in interfaces:
+                    self.__store(self.__localStopSet, interface, expiry)
+                    self.__store(self.__globalStopSet, (interface, prefix), (expiry, max(lastTtl - ttl, 0)))
+
+        def recordProbesSaved(self, probes):
+            with self.__lock:
+                self.__probesSaved += probes
+
+        def purgeExpired(self):
+            now = time.monotonic()
+            with self.__lock:
+                for interface in [key for key, expiry in self.__localStopSet.items() if expiry <= now]:
+                    del self.__localStopSet[interface]
+                for key in [key for key, entry in self.__globalStopSet.items() if entry[0] <= now]:
+                    del self.__globalStopSet[key]
+
+        def clear(self):
+            with self.__lock:
+                self.__localStopSet.clear()
+                self.__globalStopSet.clear()
+                self.__probesSaved = 0
+
+    # ################################################################################################################ #
+    # Class IcmpTraceResult                                                                                            #
+    #                                                                                                                  #
+    # One destination of traceRouteParallel(), traceRouteAsync(), traceRouteMany() or traceRouteManyAsync(): the hops  #
+    # it probed, why it stopped and the probes the stop sets saved compared to a full trace from TTL 1 (an estimate    #
+    # where the stop sets cut the trace short, always 0 for the windowed traces).                                      #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpTraceResult:
+        __slots__ = ("__target",
+                     "__destinationIpAddress",
+                     "__hops",
+                     "__probesSent",
+                     "__probesSaved",
+                     "__stopReason",
+                     "__error")
+
+        STOP_DESTINATION = "destination"        # Forward probing reached the destination
+        STOP_STOP_SET = "stop_set"              # Forward probing reached an interface known for this prefix
+        STOP_GAP = "gap"                        # Too many silent hops in a row
+        STOP_MAX_TTL = "max_ttl"
+        STOP_DEADLINE = "deadline"              # The time allowed for the trace ran out
+
+        RECORD_TYPE = "trace"
+        FIELDS = ("record", "target", "destination", "hops", "last_ttl", "sent", "saved", "stop", "error")
+
+        def __init__(self, target, destinationIpAddress, error=None):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__hops = {}            # ttl -> [IcmpProbeResult]
+            self.__probesSent = 0
+            self.__probesSaved = 0
+            self.__stopReason = None
+            self.__error = error
+
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getHops(self):
+            # [(ttl, [IcmpProbeResult, ...]), ...] in TTL order
+            return sorted(self.__hops.items())
+
+        def getLastTtl(self):
+            return max(self.__hops) if len(self.__hops) > 0 else 0
+
+        def getProbesSent(self):
+            return self.__probesSent
+
+        def getProbesSaved(self):
+            return self.__probesSaved
+
+        def getStopReason(self):
+            return self.__stopReason
+
+        def getError(self):
+            return self.__error
+
+        def setStopReason(self, stopReason):
+            self.__stopReason = stopReason
+
+        def addHop(self, ttl, probeResults):
+            self.__hops[ttl] = probeResults
+            self.__probesSent += len(probeResults)
+
+        def removeHopsAbove(self, ttl):
+            for hopTtl in [hopTtl for hopTtl in self.__hops if hopTtl > ttl]:
+                del self.__hops[hopTtl]
+
+        def addProbesSaved(self, probes):
+            self.__probesSaved += probes
+
+        def toRow(self):
+            return (self.RECORD_TYPE, self.__target, self.__destinationIpAddress, len(self.__hops), self.getLastTtl(),
+                    self.__probesSent, self.__probesSaved, self.__stopReason, self.__error)
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            if self.__error is not None:
+                return "%s    Error: %s" % (self.__target, self.__error)
+            return "%s    Addr=%s    Hops=%d    Probes=%d    Saved=%d    Stop=%s" % \
+                   (
+                       self.__target,
+                       self.__destinationIpAddress,
+                       self.getLastTtl(),
+                       self.__probesSent,
+                       self.__probesSaved,
+                       self.__stopReason
+                   )
+
+    # ################################################################################################################ #
+    # Class IcmpRetransmissionTimer                                                                                    #
+    #                                                                                                                  #
+    # How long to wait for the reply to a probe, learnt from the RTTs seen so far as TCP does (RFC 6298): a smoothed   #
+    # RTT and its variation give timeout = SRTT + 4 * RTTVAR, kept between minimumTimeout and maximumTimeout. Each     #
+    # probe that times out doubles it (capped at maximumTimeout) until a reply brings it back to the estimate.         #
+    # ################################################################################################################ #
+    class IcmpRetransmissionTimer:
+        __slots__ = ("__smoothedRtt",
+                     "__rttVariation",
+                     "__timeout",
+                     "__initialTimeout",
+                     "__minimumTimeout",
+                     "__maximumTimeout",
+                     "__sampleCount",
+                     "__backoffCount")
+
+        __ALPHA = 1 / 8                 # Gain of the smoothed RTT
+        __BETA = 1 / 4                  # Gain of the RTT variation
+        __K = 4
+
+        def __init__(self, initialTimeout=1.0, minimumTimeout=0.2, maximumTimeout=10.0):
+            if not 0 < minimumTimeout <= maximumTimeout:
+                raise ValueError("timeouts must satisfy 0 < minimumTimeout <= maximumTimeout")
+            self.__smoothedRtt = None
+            self.__rttVariation = None
+            self.__initialTimeout = initialTimeout
+            self.__minimumTimeout = minimumTimeout
+            self.__maximumTimeout = maximumTimeout
+            self.__timeout = min(max(initialTimeout, minimumTimeout), maximumTimeout)
+            self.__sampleCount = 0
+            self.__backoffCount = 0
+
+        def getSmoothedRtt(self):
+            # Seconds, None before the first sample
+            return self.__smoothedRtt
+
+        def getRttVariation(self):
+            return self.__rttVariation
+
+        def getTimeout(self):
+            return self.__timeout
+
+        def getMaximumTimeout(self):
+            return self.__maximumTimeout
+
+        def getSampleCount(self):
+            return self.__sampleCount
+
+        def getBackoffCount(self):
+            # Timeouts in a row since the last sample
+            return self.__backoffCount
+
+        def __estimate(self):
+            if self.__smoothedRtt is None:
+                timeout = self.__initialTimeout
+            else:
+                timeout = self.__smoothedRtt + self.__K * self.__rttVariation
+            return min(max(timeout, self.__minimumTimeout), self.__maximumTimeout)
+
+        def addSample(self, rtt):
+            # rtt in seconds. Sequence numbers tell every probe apart, so unlike TCP every answer is a valid sample.
+            if self.__smoothedRtt is None:
+                self.__smoothedRtt = rtt
+                self.__rttVariation = rtt / 2
+            else:
+                self.__rttVariation = (1 - self.__BETA) * self.__rttVariation + \
+                    self.__BETA * abs(self.__smoothedRtt - rtt)
+                self.__smoothedRtt = (1 - self.__ALPHA) * self.__smoothedRtt + self.__ALPHA * rtt
+            self.__sampleCount += 1
+            self.__backoffCount = 0
+            self.__timeout = self.__estimate()
+
+        def backOff(self):
+            self.__backoffCount += 1
+            self.__timeout = min(self.__timeout * 2, self.__maximumTimeout)
+
+        def resetBackoff(self):
+            # Back to the estimate, e.g. when a new run starts: silence then says little about the target now
+            self.__backoffCount = 0
+            self.__timeout = self.__estimate()
+
+        def derive(self):
+            # New timer starting from this one's estimate without its backoff, e.g. for the next hop of a trace
+            timer = IcmpHelperLibrary.IcmpRetransmissionTimer(self.__initialTimeout, self.__minimumTimeout,
+                                                              self.__maximumTimeout)
+            timer.__smoothedRtt = self.__smoothedRtt
+            timer.__rttVariation = self.__rttVariation
+            timer.__timeout = timer.__estimate()
+            return timer
+
+    # ################################################################################################################ #
+    # Class IcmpTokenBucket                                                                                            #
+    #                                                                                                                  #
+    # rate tokens per second, held up to burst; one per probe sent (or per reply, for a simulated router). The caller  #
+    # passes time.monotonic() in, so one clock read serves every bucket a probe has to pass.                           #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpTokenBucket:
+        __slots__ = ("__rate",
+                     "__burst",
+                     "__tokens",
+                     "__lastRefill")
+
+        def __init__(self, rate, burst=None):
+            if rate <= 0:
+                raise ValueError("rate must be positive")
+            self.__rate = rate
+            self.__burst = burst if burst is not None else max(rate, 1)
+            self.__tokens = self.__burst
+            self.__lastRefill = None
+
+        def getRate(self):
+            return self.__rate
+
+        def getBurst(self):
+            return self.__burst
+
+        def setRate(self, rate, burst=None):
+            # Tokens already held are kept, up to the new burst
+            if rate <= 0:
+                raise ValueError("rate must be positive")
+            self.__rate = rate
+            if burst is not None:
+                self.__burst = burst
+                self.__tokens = min(self.__tokens, burst)
+
+        def __refill(self, now):
+            if self.__lastRefill is not None:
+                self.__tokens = min(self.__burst, self.__tokens + (now - self.__lastRefill) * self.__rate)
+            self.__lastRefill = now
+
+        def getWaitTime(self, now):
+            # Seconds until a token is there, 0 when one is now
+            self.__refill(now)
+            if self.__tokens >= 1:
+                return 0.0
+            return (1 - self.__tokens) / self.__rate
+
+        def take(self, now):
+            # Takes a token when one is left, False otherwise
+            self.__refill(now)
+            if self.__tokens < 1:
+                return False
+            self.__tokens -= 1
+            return True
+
+        def consume(self, now):
+            # Takes a token even when none is left, for a probe that goes anyway; the debt delays the ones after it
+            self.__refill(now)
+            self.__tokens -= 1
+
+    # ################################################################################################################ #
+    # Class IcmpHopPacing                                                                                              #
+    #                                                                                                                  #
+    # Send rate towards one responder. When some probes go unanswered, it is paced for a trial at half the rate it was #
+    # sent at, or twice the rate answered when lower: a router limiting the ICMP it generates keeps answering about as #
+    # many per second, so the share of probes answered grows as the rate shrinks, while plain loss answers the same    #
+    # share at any rate. A sequential probability ratio test (Wald) weighs every trial outcome between the two until   #
+    # either is FALSE_LIMIT_PROBABILITY or MISSED_LIMIT_PROBABILITY unlikely. Plain loss is taken as the share seen    #
+    # over a full window plus one and a half standard errors, so a window that came out low does not pass for a rate   #
+    # limit. A limit cuts the rate to the answer rate seen; anything else, or TRIAL_MAXIMUM outcomes without a         #
+    # verdict, restores it. Runs of answers double the rate until a limit was found, then raise it by an eighth while  #
+    # staying below it.                                                                                                #
+    # ################################################################################################################ #
+    class IcmpHopPacing:
+        __slots__ = ("__bucket",
+                     "__minimumRate",
+                     "__maximumRate",
+                     "__lastSendTime",
+                     "__outcomes",
+                     "__answersInRow",
+                     "__ceiling",
+                     "__trial",
+                     "__trialEvidence",
+                     "__trialOutcomes",
+                     "__trialPending",
+                     "__cooldown",
+                     "__rateLimitCount")
+
+        SAMPLE_WINDOW = 64              # Outcomes kept, (send gap, answered), since the rate last changed
+        MINIMUM_SAMPLES = 8             # Outcomes a rate is judged on
+        INCREASE_AFTER = 8              # Answers in a row before the rate goes up
+        FALSE_LIMIT_PROBABILITY = 0.001     # Chance a trial takes plain loss for a rate limit
+        MISSED_LIMIT_PROBABILITY = 0.05     # Chance a trial takes a rate limit for plain loss
+        TRIAL_MAXIMUM = 128             # Outcomes a trial may take before it is given up as inconclusive
+        __LIMIT_EVIDENCE = math.log((1 - MISSED_LIMIT_PROBABILITY) / FALSE_LIMIT_PROBABILITY)
+        __LOSS_EVIDENCE = math.log(MISSED_LIMIT_PROBABILITY / (1 - FALSE_LIMIT_PROBABILITY))
+
+        def __init__(self, rate, burst, minimumRate, maximumRate):
+            self.__bucket = IcmpHelperLibrary.IcmpTokenBucket(rate, burst)
+            self.__minimumRate = minimumRate
+            self.__maximumRate = maximumRate
+            self.__lastSendTime = None
+            self.__outcomes = deque(maxlen=self.SAMPLE_WINDOW)
+            self.__answersInRow = 0
+            self.__ceiling = None       # Rate the responder was seen limiting at, not reached again
+            self.__trial = None         # (rate, burst, send rate, trial rate, loss share, limit share) of the trial
+            self.__trialEvidence = 0.0  # Log likelihood ratio, rate limit over plain loss, of the trial outcomes
+            self.__trialOutcomes = 0
+            self.__trialPending = 0     # Probes sent during the trial with no outcome yet
+            self.__cooldown = 0         # Outcomes to wait for before the next trial, after one showed plain loss
+            self.__rateLimitCount = 0
+
+        def getRate(self):
+            return self.__bucket.getRate()
+
+        def getBurst(self):
+            return self.__bucket.getBurst()
+
+        def getRateLimitCount(self):
+            # Times the rate was cut because the responder was found rate limiting
+            return self.__rateLimitCount
+
+        def isRateLimited(self):
+            return self.__rateLimitCount > 0
+
+        def isTrialRunning(self):
+            return self.__trial is not None
+
+        def getWaitTime(self, now):
+            return self.__bucket.getWaitTime(now)
+
+        def recordSend(self, now):
+            # Takes a token for a probe sent now and returns the seconds since the one before (inf for the first)
+            sendGap = now - self.__lastSendTime if self.__lastSendTime is not None else math.inf
+            self.__lastSendTime = now
+            self.__bucket.consume(now)
+            if self.__trial is not None:
+                self.__trialPending += 1
+            return sendGap
+
+        def __getRates(self):
+            # (probes sent, answers) per second over the outcomes kept, None before there are enough. The first probe
+            # to the responder has no gap before it and is left out.
+            timedOutcomes = [(sendGap, answered) for sendGap, answered in self.__outcomes if sendGap != math.inf]
+            span = sum(sendGap for sendGap, answered in timedOutcomes)
+            if len(timedOutcomes) < self.MINIMUM_SAMPLES or span <= 0:
+                return None
+            return len(timedOutcomes) / span, sum(1 for sendGap, answered in timedOutcomes if answered) / span
+
+        def __setRate(self, rate, burst=None):
+            self.__bucket.setRate(min(max(rate, self.__minimumRate), self.__maximumRate), burst)
+            self.__outcomes.clear()     # New rate, new evidence
+            self.__answersInRow = 0
+
+        def recordOutcome(self, answered, sendGap):
+            # Returns True when this outcome showed the responder rate limiting (and the rate was cut)
+            self.__outcomes.append((sendGap, answered))
+            self.__cooldown = max(self.__cooldown - 1, 0)
+            self.__answersInRow = self.__answersInRow + 1 if answered else 0
+            rates = self.__getRates()
+
+            if self.__trial is not None:
+                rate, burst, sendRate, trialRate, lossShare, limitShare = self.__trial
+                missEvidence = math.log((1 - limitShare) / (1 - lossShare))
+                self.__trialOutcomes += 1
+                if sendGap >= 0.75 / trialRate:
+                    # Only probes that really went at the trial rate count, not those sent before it or held to a
+                    # faster schedule by the caller
+                    self.__trialPending = max(self.__trialPending - 1, 0)
+                    self.__trialEvidence += math.log(limitShare / lossShare) if answered else missEvidence
+                # Answers come back before the losses time out, so probes still out are taken as lost until they are in
+                if self.__trialEvidence + self.__trialPending * missEvidence >= self.__LIMIT_EVIDENCE:
+                    # Fewer probes, about as many answers: the responder limits its rate
+                    self.__trial = None
+                    self.__ceiling = min(rate, sendRate)
+                    answerRate = rates[1] if rates is not None else lossShare * sendRate
+                    self.__setRate(min(answerRate, self.__ceiling / 2), 1)
+                    self.__rateLimitCount += 1
+                    return True
+                if self.__trialEvidence <= self.__LOSS_EVIDENCE or self.__trialOutcomes >= self.TRIAL_MAXIMUM:
+                    self.__trial = None
+                    self.__setRate(rate, burst)         # Loss did not follow the rate, nothing to gain here
+                    self.__cooldown = self.SAMPLE_WINDOW
+                return False
+
+            if self.__answersInRow >= self.INCREASE_AFTER:
+                increasedRate = self.getRate() * 2 if self.__ceiling is None else self.getRate() * 9 / 8
+                if self.__ceiling is not None:
+                    increasedRate = min(increasedRate, (self.getRate() + self.__ceiling) / 2)
+                if increasedRate > self.getRate() and self.getRate() < self.__maximumRate:
+                    self.__setRate(increasedRate)
+                return False
+
+            # Partial loss (not a silent responder) over a full window at the rate it was actually sent at: try a lower
+            # rate, evenly spaced. Plain loss keeps answering the share seen, a rate limit the answer rate over the
+            # trial rate; when the two are too close there is nothing to tell apart.
+            if not answered and rates is not None and self.__cooldown == 0 and 0 < rates[1] < rates[0] and \
+                    len(self.__outcomes) == self.SAMPLE_WINDOW and rates[0] / 2 >= self.__minimumRate:
+                share = rates[1] / rates[0]
+                shareError = math.sqrt(share * (1 - share) / self.SAMPLE_WINDOW)
+                trialRate = max(min(rates[0] / 2, rates[1] * 2), self.__minimumRate)
+                lossShare = min(max(share + 1.5 * shareError, 0.02), 0.98)
+                limitShare = min(rates[1] / trialRate, 0.98)
+                if limitShare > lossShare:
+                    self.__trial = (self.getRate(), self.getBurst(), rates[0], trialRate, lossShare, limitShare)
+                    self.__trialEvidence = 0.0
+                    self.__trialOutcomes = 0
+                    self.__trialPending = 0
+                    self.__setRate(trialRate, 1)
+            return False
+
+    # ################################################################################################################ #
+    # Class IcmpPacer                                                                                                  #
+    #                                                                                                                  #
+    # Spaces probes so routers that rate limit ICMP do not turn a burst into fake loss. A probe passes a global token  #
+    # bucket (rate, None for no limit), one per destination (destinationRate) and an IcmpHopPacing per responder: the  #
+    # address that last answered that destination at that TTL, or the destination itself for echo requests. Results   #
+    # fed back through recordResult() let each responder find the highest rate it answers at.                          #
+    # ################################################################################################################ #
+    class IcmpPacer:
+        # ############################################################################################################ #
+        # IcmpPacer Class Scope Variables                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __globalBucket = None
+        __destinationRate = None
+        __destinationBuckets = None     # address -> IcmpTokenBucket, oldest use first
+        __hopRate = 50.0                # Probes per second a responder starts out with
+        __hopBurst = 8
+        __minimumHopRate = 0.5
+        __maximumHopRate = 1000.0
+        __hops = None                   # responder address, (destination, ttl) until known -> IcmpHopPacing, LRU order
+        __hopResponders = None          # (destination, ttl) -> address that last answered there, oldest use first
+        __rateLimitCount = 0
+        __MAX_ENTRIES = 4096            # Per table, the least recently used goes first
+
+        # ############################################################################################################ #
+        # IcmpPacer Constructors                                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, rate=None, destinationRate=None, hopRate=50, hopBurst=8, minimumHopRate=0.5,
+                     maximumHopRate=1000):
+            if not 0 < minimumHopRate <= hopRate <= maximumHopRate:
+                raise ValueError("hop rates must satisfy 0 < minimumHopRate <= hopRate <= maximumHopRate")
+            self.__globalBucket = IcmpHelperLibrary.IcmpTokenBucket(rate) if rate is not None else None
+            self.__destinationRate = destinationRate
+            self.__destinationBuckets = OrderedDict()
+            self.__hopRate = hopRate
+            self.__hopBurst = hopBurst
+            self.__minimumHopRate = minimumHopRate
+            self.__maximumHopRate = maximumHopRate
+            self.__hops = OrderedDict()
+            self.__hopResponders = OrderedDict()
+
+        # ############################################################################################################ #
+        # IcmpPacer Getters                                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getRate(self):
+            return self.__globalBucket.getRate() if self.__globalBucket is not None else None
+
+        def getDestinationRate(self):
+            return self.__destinationRate
+
+        def getHopPacing(self, destinationIpAddress, ttl=255):
+            # IcmpHopPacing the next probe to destinationIpAddress with this TTL goes through
+            return self.__getHop(self.__getHopKey(destinationIpAddress, ttl))
+
+        def getRateLimitCount(self):
+            # Rate cuts over all responders
+            return self.__rateLimitCount
+
+        def getRateLimitedResponders(self):
+            # {address: current rate} of the responders seen rate limiting
+            return {key: hop.getRate() for key, hop in self.__hops.items()
+                    if isinstance(key, str) and hop.isRateLimited()}
+
+        # ############################################################################################################ #
+        # IcmpPacer Private Functions                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __getHopKey(self, destinationIpAddress, ttl):
+            if ttl >= 255:
+                return destinationIpAddress
+            responder = self.__hopResponders.get((destinationIpAddress, ttl))
+            return responder if responder is not None else (destinationIpAddress, ttl)
+
+        def __getHop(self, key):
+            hop = self.__hops.get(key)
+            if hop is not None:
+                self.__hops.move_to_end(key)
+                return hop
+            hop = IcmpHelperLibrary.IcmpHopPacing(self.__hopRate, self.__hopBurst, self.__minimumHopRate,
+                                                  self.__maximumHopRate)
+            self.__hops[key] = hop
+            if len(self.__hops) > self.__MAX_ENTRIES:
+                self.__hops.popitem(last=False)
+            return hop
+
+        def __getDestinationBucket(self, destinationIpAddress):
+            if self.__destinationRate is None:
+                return None
+            bucket = self.__destinationBuckets.get(destinationIpAddress)
+            if bucket is not None:
+                self.__destinationBuckets.move_to_end(destinationIpAddress)
+                return bucket
+            bucket = IcmpHelperLibrary.IcmpTokenBucket(self.__destinationRate)
+            self.__destinationBuckets[destinationIpAddress] = bucket
+            if len(self.__destinationBuckets) > self.__MAX_ENTRIES:
+                self.__destinationBuckets.popitem(last=False)
+            return bucket
+
+        # ############################################################################################################ #
+        # IcmpPacer Public Functions                                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getDelay(self, destinationIpAddress, ttl=255, now=None, hopPacing=True):
+            # Seconds before a probe to destinationIpAddress with this TTL may go, 0 when it may go now. hopPacing
+            # False leaves the rate of the responder out and keeps only the global and destination rates.
+            if now is None:
+                now = time.monotonic()
+            delay = self.getHopPacing(destinationIpAddress, ttl).getWaitTime(now) if hopPacing else 0
+            for bucket in (self.__globalBucket, self.__getDestinationBucket(destinationIpAddress)):
+                if bucket is not None:
+                    delay = max(delay, bucket.getWaitTime(now))
+            return delay
+
+        def take(self, destinationIpAddress, ttl=255, now=None):
+            # Accounts for a probe sent now, whether getDelay() allowed it or not. Returns the seconds since the last
+            # probe to the same responder; hand that to recordResult() with the outcome.
+            if now is None:
+                now = time.monotonic()
+            for bucket in (self.__globalBucket, self.__getDestinationBucket(destinationIpAddress)):
+                if bucket is not None:
+                    bucket.consume(now)
+            return self.getHopPacing(destinationIpAddress, ttl).recordSend(now)
+
+        def wait(self, destinationIpAddress, ttl=255, waitFunction=time.sleep, hopPacing=True):
+            # Blocks until a probe may go, then take()s it. waitFunction(seconds) does the waiting; passing the
+            # socket's receiveAvailable keeps replies flowing in meanwhile. hopPacing as for getDelay().
+            delay = self.getDelay(destinationIpAddress, ttl, hopPacing=hopPacing)
+            if delay > 0:
+                metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+                startNs = time.perf_counter_ns() if metrics is not None else 0
+                while delay > 0:
+                    waitFunction(delay)
+                    delay = self.getDelay(destinationIpAddress, ttl, hopPacing=hopPacing)
+                if metrics is not None:
+                    metrics.recordTiming("pace", time.perf_counter_ns() - startNs)
+            return self.take(destinationIpAddress, ttl)
+
+        def recordResult(self, probeResult, sendGap):
+            # Feeds an IcmpProbeResult back with what take() returned for its probe
+            destinationIpAddress = probeResult.getDestinationIpAddress()
+            ttl = probeResult.getTtl()
+            if ttl < 255 and probeResult.isAnswered():
+                hopKey = (destinationIpAddress, ttl)
+                responder = probeResult.getAddress()
+                self.__hopResponders[hopKey] = responder
+                self.__hopResponders.move_to_end(hopKey)
+                if len(self.__hopResponders) > self.__MAX_ENTRIES:
+                    self.__hopResponders.popitem(last=False)
+                hop = self.__hops.pop(hopKey, None)
+                if hop is not None and responder not in self.__hops:
+                    self.__hops[responder] = hop        # What was sent before the responder was known counts for it
+            if self.getHopPacing(destinationIpAddress, ttl).recordOutcome(probeResult.isAnswered(), sendGap):
+                self.__rateLimitCount += 1
+                metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+                if metrics is not None:
+                    metrics.count("rate_limits_detected")
+
+    # ################################################################################################################ #
+    # Class IcmpMdaStoppingRule                                                                                        #
+    #                                                                                                                  #
+    # Multipath Detection Algorithm stopping points: with k next hops of an interface seen, n(k) probes over distinct  #
+    # flows rule out a (k+1)th next hop with the given confidence, assuming the load balancer spreads flows uniformly. #
+    # n(k) = ceil(ln(alpha / (k + 1)) / ln(k / (k + 1))) with alpha = 1 - confidence; 95% gives 6, 11, 16, 21, 27...   #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMdaStoppingRule:
+        # ############################################################################################################ #
+        # IcmpMdaStoppingRule Class Scope Variables                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __confidence = 0.95
+        __probesNeeded = None           # n(k) for k = 0, 1, 2... computed as far as asked for
+
+        # ############################################################################################################ #
+        # IcmpMdaStoppingRule Constructors                                                                             #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, confidence=0.95):
+            if not 0 < confidence < 1:
+                raise ValueError("confidence must be between 0 and 1")
+            self.__confidence = confidence
+            self.__probesNeeded = []
+
+        # ############################################################################################################ #
+        # IcmpMdaStoppingRule Getters                                                                                  #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getConfidence(self):
+            return self.__confidence
+
+        def getProbesNeeded(self, successorCount):
+            # Probes an interface needs before its successorCount next hops are taken as all of them. Nothing seen
+            # yet needs as many as one next hop does.
+            alpha = 1 - self.__confidence
+            while len(self.__probesNeeded) <= successorCount:
+                k = max(len(self.__probesNeeded), 1)
+                self.__probesNeeded.append(int(math.ceil(math.log(alpha / (k + 1)) / math.log(k / (k + 1)))))
+            return self.__probesNeeded[successorCount]
+
+    # ################################################################################################################ #
+    # Class IcmpMultipathResult                                                                                        #
+    #                                                                                                                  #
+    # traceRouteMultipath() of one destination: every interface answering at each TTL and the successor graph between  #
+    # them. Interface None stands for the source at TTL 0 and for hops that stayed silent.                             #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMultipathResult:
+        __slots__ = ("__target",
+                     "__destinationIpAddress",
+                     "__confidence",
+                     "__successors",
+                     "__probesSent",
+                     "__flowCount",
+                     "__stopReason",
+                     "__error")
+
+        RECORD_TYPE = "multipath"
+        FIELDS = ("record", "target", "destination", "hops", "interfaces", "edges", "sent", "flows", "confidence",
+                  "stop", "error")
+
+        def __init__(self, target, destinationIpAddress, confidence, error=None):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__confidence = confidence
+            self.__successors = {}      # ttl -> {interface: set of interfaces at ttl + 1}
+            self.__probesSent = 0
+            self.__flowCount = 0
+            self.__stopReason = None
+            self.__error = error
+
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getConfidence(self):
+            return self.__confidence
+
+        def getInterfaces(self, ttl):
+            return sorted(interface for interface in self.__successors.get(ttl, {}) if interface is not None)
+
+        def getSuccessors(self, ttl, interface):
+            return sorted(self.__successors.get(ttl, {}).get(interface, ()), key=lambda address: address or "")
+
+        def getSuccessorGraph(self):
+            # {ttl: {interface: [next hop interfaces]}} for ttl 0 (the source) up to the last hop
+            return {ttl: {interface: self.getSuccessors(ttl, interface) for interface in interfaces}
+                    for ttl, interfaces in sorted(self.__successors.items())}
+
+        def getEdges(self):
+            # [(ttl, interface, next hop interface), ...] in TTL order, None for the source and silent hops
+            return [(ttl, interface, successor) for ttl, interfaces in sorted(self.__successors.items())
+                    for interface in sorted(interfaces, key=lambda address: address or "")
+                    for successor in self.getSuccessors(ttl, interface)]
+
+        def getLastTtl(self):
+            return max(self.__successors) if len(self.__successors) > 0 else 0
+
+        def getProbesSent(self):
+            return self.__probesSent
+
+        def getFlowCount(self):
+            return self.__flowCount
+
+        def getStopReason(self):
+            return self.__stopReason
+
+        def getError(self):
+            return self.__error
+
+        def setStopReason(self, stopReason):
+            self.__stopReason = stopReason
+
+        def setFlowCount(self, flowCount):
+            self.__flowCount = flowCount
+
+        def addInterface(self, ttl, interface):
+            self.__successors.setdefault(ttl, {}).setdefault(interface, set())
+
+        def addEdge(self, ttl, interface, successor):
+            self.addInterface(ttl + 1, successor)
+            self.__successors.setdefault(ttl, {}).setdefault(interface, set()).add(successor)
+
+        def addProbesSent(self, probes):
+            self.__probesSent += probes
+
+        def toRow(self):
+            return (self.RECORD_TYPE, self.__target, self.__destinationIpAddress, self.getLastTtl(),
+                    sum(len(self.getInterfaces(ttl)) for ttl in self.__successors),
+                    [list(edge) for edge in self.getEdges()], self.__probesSent, self.__flowCount, self.__confidence,
+                    self.__stopReason, self.__error)
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            if self.__error is not None:
+                return "%s    Error: %s" % (self.__target, self.__error)
+            lines = ["%s    Addr=%s    Hops=%d    Probes=%d    Flows=%d    Stop=%s" %
+                     (
+                         self.__target,
+                         self.__destinationIpAddress,
+                         self.getLastTtl(),
+                         self.__probesSent,
+                         self.__flowCount,
+                         self.__stopReason
+                     )]
+            for ttl, interfaces in sorted(self.__successors.items()):
+                for interface in sorted(interfaces, key=lambda address: address or ""):
+                    successors = self.getSuccessors(ttl, interface)
+                    if len(successors) > 0:
+                        lines.append("  TTL=%d    %s -> %s" % (ttl, interface or ("Source" if ttl == 0 else "*"),
+                                                            ", ".join(successor or "*" for successor in successors)))
+            return "\n".join(lines)
+
+    # ################################################################################################################ #
+    # Class IcmpAsyncSession                                                                                           #
+    #                                                                                                                  #
+    # Non-blocking raw socket registered with the running asyncio loop through add_reader(). The reader callback       #
+    # drains the socket into the socket's IcmpReplyDispatcher, which resolves one future per probe, and a single loop  #
+    # timer follows the dispatcher's earliest deadline. A simulated socket, having no descriptor, is read by a second  #
+    # timer set to its next reply instead. Must be created from inside a running event loop.                           #
+    # ################################################################################################################ #
+    class IcmpAsyncSession:
+        # ############################################################################################################ #
+        # IcmpAsyncSession Class Scope Variables                                                                       #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __loop = None
+        __icmpSocket = None
+        __dispatcher = None
+        __packetTemplate = None
+        __nextSequenceNumber = 0
+        __timerHandle = None
+        __timerDeadline = None
+        __pollHandle = None             # Reads a simulated socket, which has no descriptor, when its next reply is due
+        __pollDeadline = None
+
+        __DEBUG_IcmpAsyncSession = False    # Allows for debug output
+
+        # ############################################################################################################ #
+        # IcmpAsyncSession Constructors                                                                                #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, packetIdentifier=None, receiveBufferSize=4 * 1024 * 1024, kernelTimestamps=False,
+                     transport="auto"):
+            if packetIdentifier is None:
+                packetIdentifier = IcmpHelperLibrary.allocatePacketIdentifiers()[0]
+            self.__loop = asyncio.get_running_loop()
+            self.__icmpSocket = IcmpHelperLibrary.openTransport(transport, receiveBufferSize, kernelTimestamps)
+            if self.__icmpSocket.fileno() < 0 and \
+                    not isinstance(self.__icmpSocket, IcmpHelperLibrary.IcmpSimulatedSocket):
+                # The loop only wakes up on file descriptors or on timers for replies whose arrival time is known,
+                # other transports cannot be driven from it
+                self.__icmpSocket.close()
+                raise ValueError("transport %s cannot be used from an event loop" % transport)
+            self.__icmpSocket.setBlocking(False)
+            self.__dispatcher = self.__icmpSocket.getDispatcher()
+            self.__packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(packetIdentifier)
+            if self.__icmpSocket.fileno() >= 0:
+                self.__loop.add_reader(self.__icmpSocket.fileno(), self.__onReadable)
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpAsyncSession Getters                                                                                     #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getPacketIdentifier(self):
+            return self.__packetTemplate.getPacketIdentifier()
+
+        def getPendingCount(self):
+            return self.__dispatcher.getPendingCount()
+
+        def getIcmpSocket(self):
+            return self.__icmpSocket
+
+        # ############################################################################################################ #
+        # IcmpAsyncSession Private Functions                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __allocateSequenceNumber(self):
+            packetIdentifier = self.getPacketIdentifier()
+            for i in range(65536):
+                packetSequenceNumber = self.__nextSequenceNumber
+                self.__nextSequenceNumber = (self.__nextSequenceNumber + 1) & 0xffff
+                if not self.__dispatcher.isPending(packetIdentifier, packetSequenceNumber):
+                    return packetSequenceNumber
+            raise RuntimeError("All 65536 sequence numbers are in flight")
+
+        def __onReadable(self):
+            while True:
+                try:
+                    recvPacket, addr, timeReceived, timeReceivedNs, kernelDelayNs = \
+                        self.__icmpSocket.receiveDatagram(1024)
+                except (BlockingIOError, InterruptedError):
+                    return
+                if self.__dispatcher.dispatch(recvPacket, addr, timeReceived, timeReceivedNs, kernelDelayNs) is None:
+                    print("IcmpAsyncSession unmatched reply from ", addr[0]) if self.__DEBUG_IcmpAsyncSession else 0
+
+        def __onTimer(self):
+            self.__timerHandle = None
+            self.__timerDeadline = None
+            self.__dispatcher.expire(time.monotonic())
+            self.__armTimer()
+
+        def __armTimer(self):
+            # One timer for the whole session, always set to the earliest deadline still pending
+            nextDeadline = self.__dispatcher.getNextDeadline()
+            if nextDeadline is None or (self.__timerDeadline is not None and self.__timerDeadline <= nextDeadline):
+                return
+            if self.__timerHandle is not None:
+                self.__timerHandle.cancel()
+            self.__timerDeadline = nextDeadline
+            self.__timerHandle = self.__loop.call_later(max(nextDeadline - time.monotonic(), 0), self.__onTimer)
+
+        def __onPoll(self):
+            self.__pollHandle = None
+            self.__pollDeadline = None
+            self.__onReadable()
+            self.__armPoll()
+
+        def __armPoll(self):
+            # Simulated sockets only: one timer set to the earliest reply still on its way, standing in for add_reader()
+            if self.__icmpSocket.fileno() >= 0 or self.__icmpSocket.isClosed():
+                return
+            nextReplyTime = self.__icmpSocket.getNextReplyTime()
+            if nextReplyTime is None or (self.__pollDeadline is not None and self.__pollDeadline <= nextReplyTime):
+                return
+            if self.__pollHandle is not None:
+                self.__pollHandle.cancel()
+            self.__pollDeadline = nextReplyTime
+            self.__pollHandle = self.__loop.call_later(max(nextReplyTime - time.monotonic(), 0), self.__onPoll)
+
+        @staticmethod
+        def __onProbeFinished(pendingProbe):
+            future = pendingProbe.getContext()
+            if not future.done():
+                future.set_result(pendingProbe)
+
+        async def __sendProbe(self, destinationIpAddress, ttl, timeout):
+            # The IcmpPendingProbe once it is answered, timed out or cancelled by close()
+            packetSequenceNumber = self.__allocateSequenceNumber()
+            future = self.__loop.create_future()
+            packetView = self.__packetTemplate.build(packetSequenceNumber)
+            pendingProbe = self.__dispatcher.register(self.getPacketIdentifier(), packetSequenceNumber,
+                                                      self.__packetTemplate.getTimeSent(), max(timeout, 0),
+                                                      self.__onProbeFinished, future,
+                                                      self.__packetTemplate.getTimeSentNs(),
+                                                      destinationIpAddress if ttl == 255 else None)
+            self.__armTimer()
+            try:
+                self.__icmpSocket.sendTo(packetView, destinationIpAddress, ttl)
+                self.__armPoll()
+                return await future
+            finally:
+                self.__dispatcher.cancel(pendingProbe)
+
+        # ############################################################################################################ #
+        # IcmpAsyncSession Public Functions                                                                            #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        async def probe(self, destinationIpAddress, ttl=255, timeout=1):
+            # Resolves to (RTT, address, type, code), or None when nothing matched within timeout seconds
+            pendingProbe = await self.__sendProbe(destinationIpAddress, ttl, timeout)
+            if not pendingProbe.isAnswered():
+                return None
+            return (pendingProbe.getRtt(), pendingProbe.getAddress()[0], pendingProbe.getIcmpType(),
+                    pendingProbe.getIcmpCode())
+
+        async def probeResult(self, target, destinationIpAddress, ttl=255, timeout=1):
+            # Resolves to an IcmpProbeResult, a timeout included, for records that go to a result sink
+            pendingProbe = await self.__sendProbe(destinationIpAddress, ttl, timeout)
+            return IcmpHelperLibrary.IcmpProbeResult.fromPendingProbe(pendingProbe, target, destinationIpAddress, ttl)
+
+        def close(self):
+            if self.__timerHandle is not None:
+                self.__timerHandle.cancel()
+                self.__timerHandle = None
+                self.__timerDeadline = None
+            if self.__pollHandle is not None:
+                self.__pollHandle.cancel()
+                self.__pollHandle = None
+                self.__pollDeadline = None
+            if not self.__icmpSocket.isClosed():
+                if self.__icmpSocket.fileno() >= 0:
+                    self.__loop.remove_reader(self.__icmpSocket.fileno())
+                self.__icmpSocket.close()   # Cancels whatever is still pending, which resolves the futures
+
+    # ################################################################################################################ #
+    # Class IcmpResolver                                                                                               #
+    #                                                                                                                  #
+    # Forward and reverse name lookups behind a TTL-bounded LRU cache shared by every entry point. Failures are        #
+    # cached for negativeTtl seconds. Reverse lookups for hop addresses can be handed to a small thread pool so they   #
+    # never hold up probing. The lookup functions are injectable, which lets tests run against a stub resolver.        #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpResolver:
+        # ############################################################################################################ #
+        # IcmpResolver Class Scope Variables                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __defaultResolver = None        # Shared instance used when no resolver is passed in
+
+        __forwardResolver = None        # host name -> IPv4 address string, raises OSError on failure
+        __reverseResolver = None        # IPv4 address string -> host name, raises OSError on failure
+        __forwardCache = None           # host -> (expiry, address, error)
+        __reverseCache = None           # address -> (expiry, host name, error)
+        __maxEntries = 4096
+        __ttl = 300
+        __negativeTtl = 30
+        __maxWorkers = 8
+        __executor = None               # Created on first background lookup
+        __lock = None
+        __hits = 0
+        __misses = 0
+
+        __DEBUG_IcmpResolver = False    # Allows for debug output
+
+        # ############################################################################################################ #
+        # IcmpResolver Constructors                                                                                    #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, maxEntries=4096, ttl=300, negativeTtl=30, forwardResolver=None, reverseResolver=None,
+                     maxWorkers=8):
+            self.__forwardResolver = forwardResolver if forwardResolver is not None else gethostbyname
+            self.__reverseResolver = reverseResolver if reverseResolver is not None else \
+                (lambda address: gethostbyaddr(address)[0])
+            self.__forwardCache = OrderedDict()
+            self.__reverseCache = OrderedDict()
+            self.__maxEntries = maxEntries
+            self.__ttl = ttl
+            self.__negativeTtl = negativeTtl
+            self.__maxWorkers = maxWorkers
+            self.__lock = threading.Lock()
+
+        @staticmethod
+        def getDefaultResolver():
+            if IcmpHelperLibrary.IcmpResolver.__defaultResolver is None:
+                IcmpHelperLibrary.IcmpResolver.__defaultResolver = IcmpHelperLibrary.IcmpResolver()
+            return IcmpHelperLibrary.IcmpResolver.__defaultResolver
+
+        # ############################################################################################################ #
+        # IcmpResolver Getters                                                                                         #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getHits(self):
+            return self.__hits
+
+        def getMisses(self):
+            return self.__misses
+
+        def getSize(self):
+            return len(self.__forwardCache) + len(self.__reverseCache)
+
+        # ############################################################################################################ #
+        # IcmpResolver Private Functions                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __lookup(self, cache, resolver, key):
+            now = time.monotonic()
+            with self.__lock:
+                entry = cache.get(key)
+                if entry is not None and entry[0] > now:
+                    cache.move_to_end(key)
+                    self.__hits += 1
+                    if entry[2] is not None:
+                        raise entry[2]
+                    return entry[1]
+                self.__misses += 1
+
+            # Resolve outside the lock so one slow lookup does not stall the others
+            print("IcmpResolver lookup: ", key) if self.__DEBUG_IcmpResolver else 0
+            try:
+                value = resolver(key)
+                entry = (now + self.__ttl, value, None)
+            except (OSError, UnicodeError) as error:
+                entry = (now + self.__negativeTtl, None, error)
+
+            with self.__lock:
+                cache[key] = entry
+                cache.move_to_end(key)
+                while len(cache) > self.__maxEntries:
+                    cache.popitem(last=False)
+            if entry[2] is not None:
+                raise entry[2]
+            return entry[1]
+
+        def __getExecutor(self):
+            with self.__lock:
+                if self.__executor is None:
+                    self.__executor = concurrent.futures.ThreadPoolExecutor(self.__maxWorkers, "IcmpResolver")
+                return self.__executor
+
+        # ############################################################################################################ #
+        # IcmpResolver Public Functions                                                                                #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def resolve(self, host):
+            # Host name or address -> IPv4 address string; raises OSError when it cannot be resolved
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            if metrics is None:
+                return self.__lookup(self.__forwardCache, self.__forwardResolver, host.strip())
+            startNs = time.perf_counter_ns()
+            try:
+                return self.__lookup(self.__forwardCache, self.__forwardResolver, host.strip())
+            finally:
+                metrics.recordTiming("resolve", time.perf_counter_ns() - startNs)
+
+        def reverse(self, address):
+            # IPv4 address string -> host name, or None when there is no PTR record
+            try:
+                return self.__lookup(self.__reverseCache, self.__reverseResolver, address)
+            except (OSError, UnicodeError):
+                return None
+
+        def resolveInBackground(self, host):
+            # concurrent.futures.Future of resolve(host), run on the resolver's thread pool. An IPv4 address needs no
+            # lookup and comes back as a future that is already done, without a round trip through the pool.
+            host = host.strip()
+            try:
+                address = str(ipaddress.IPv4Address(host))
+            except ValueError:
+                return self.__getExecutor().submit(self.resolve, host)
+            future = concurrent.futures.Future()
+            future.set_result(address)
+            return future
+
+        def reverseInBackground(self, address):
+            # concurrent.futures.Future of reverse(address), run on the resolver's thread pool
+            return self.__getExecutor().submit(self.reverse, address)
+
+        async def resolveAsync(self, host):
+            return await asyncio.get_running_loop().run_in_executor(self.__getExecutor(), self.resolve, host)
+
+        async def reverseAsync(self, address):
+            return await asyncio.get_running_loop().run_in_executor(self.__getExecutor(), self.reverse, address)
+
+        def clear(self):
+            with self.__lock:
+                self.__forwardCache.clear()
+                self.__reverseCache.clear()
+
+        def close(self):
+            with self.__lock:
+                executor = self.__executor
+                self.__executor = None
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    # ################################################################################################################ #
+    # Class IcmpBenchmarkResult                                                                                        #
+    #                                                                                                                  #
+    # One IcmpBenchmark measurement: repeat timings of the same number of iterations, reported as the best and median  #
+    # time and the rate the best one achieved. The Python version and whether numpy was used are recorded with it so   #
+    # results from different versions and hosts can be told apart.                                                     #
+    # ################################################################################################################ #
+    class IcmpBenchmarkResult:
+        __slots__ = ("__name",
+                     "__parameter",
+                     "__unit",
+                     "__iterations",
+                     "__unitsPerIteration",
+                     "__timings")
+
+        RECORD_TYPE = "benchmark"
+        FIELDS = ("record", "name", "parameter", "unit", "iterations", "repeat", "best_s", "median_s", "rate",
+                  "python", "numpy")
+
+        def __init__(self, name, parameter, unit, iterations, unitsPerIteration, timings):
+            self.__name = name
+            self.__parameter = parameter
+            self.__unit = unit
+            self.__iterations = iterations
+            self.__unitsPerIteration = unitsPerIteration
+            self.__timings = sorted(timings)
+
+        def getName(self):
+            return self.__name
+
+        def getParameter(self):
+            return self.__parameter
+
+        def getBestTime(self):
+            return self.__timings[0]
+
+        def getMedianTime(self):
+            return self.__timings[len(self.__timings) // 2]
+
+        def getRate(self):
+            # Units (bytes, packets, probes) per second in the best run
+            if self.__timings[0] <= 0:
+                return 0.0
+            return self.__iterations * self.__unitsPerIteration / self.__timings[0]
+
+        def toRow(self):
+            return (self.RECORD_TYPE, self.__name, self.__parameter, self.__unit, self.__iterations,
+                    len(self.__timings), self.getBestTime(), self.getMedianTime(), self.getRate(),
+                    "%d.%d.%d" % sys.version_info[:3], numpy is not None)
+
+        def toDict(self):
+            return dict(zip(self.FIELDS, self.toRow()))
+
+        def formatConsoleLine(self):
+            return "%-20s %-8s    Iterations=%d    Best=%.6f s    Median=%.6f s    Rate=%.0f %s/s" % \
+                   (
+                       self.__name,
+                       "" if self.__parameter is None else self.__parameter,
+                       self.__iterations,
+                       self.getBestTime(),
+                       self.getMedianTime(),
+                       self.getRate(),
+                       self.__unit
+                   )
+
+    # ################################################################################################################ #
+    # Class IcmpBenchmark                                                                                              #
+    #                                                                                                                  #
+    # Micro and end to end benchmarks of the hot paths: checksum throughput by payload size, echo request build rate,  #
+    # reply parse rate and probes per second through whole pings and sweeps against an IcmpSimulatedSocket. Nothing    #
+    # touches the network or needs privileges. Iterations are scaled until one run takes minimumTime, then the run is  #
+    # repeated and every IcmpBenchmarkResult goes to the sink (IcmpJsonLinesSink to track them between versions).      #
+    # ################################################################################################################ #
+    class IcmpBenchmark:
+        # ############################################################################################################ #
+        # IcmpBenchmark Class Scope Variables                                                                          #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        CHECKSUM_SIZES = (64, 512, 1500, 9000, 65000)
+        SUITES = ("checksum", "build", "parse", "end-to-end")
+
+        __repeat = 5
+        __minimumTime = 0.2
+        __sink = None
+        __results = None
+
+        # ############################################################################################################ #
+        # IcmpBenchmark Constructors                                                                                   #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def __init__(self, repeat=5, minimumTime=0.2, sink=None):
+            self.__repeat = max(repeat, 1)
+            self.__minimumTime = minimumTime
+            self.__sink = sink if sink is not None else IcmpHelperLibrary.IcmpQuietSink()
+            self.__results = []
+
+        # ############################################################################################################ #
+        # IcmpBenchmark Getters                                                                                        #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def getResults(self):
+            return list(self.__results)
+
+        # ############################################################################################################ #
+        # IcmpBenchmark Private Functions                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def __time(function, iterations):
+            startTime = time.perf_counter()
+            for i in range(iterations):
+                function()
+            return time.perf_counter() - startTime
+
+        def __measure(self, name, parameter, unit, unitsPerIteration, function):
+            # Grows iterations until one run takes minimumTime (as timeit's autorange does), then repeats that run
+            iterations = 1
+            elapsed = self.__time(function, iterations)
+            while elapsed < self.__minimumTime:
+                iterations = max(iterations * 2, int(iterations * self.__minimumTime * 1.2 / max(elapsed, 1e-9)))
+                elapsed = self.__time(function, iterations)
+            timings = [elapsed] + [self.__time(function, iterations) for i in range(self.__repeat - 1)]
+            benchmarkResult = IcmpHelperLibrary.IcmpBenchmarkResult(name, parameter, unit, iterations,
+                                                                    unitsPerIteration, timings)
+            self.__results.append(benchmarkResult)
+            self.__sink.write(benchmarkResult)
+            return benchmarkResult
+
+        @staticmethod
+        def __sampleReplies():
+            # An echo reply and a Time Exceeded the way a raw socket reads them
+            simulatedNetwork = IcmpHelperLibrary.IcmpSimulatedNetwork
+            packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(0x1234)
+            echoReply = simulatedNetwork.buildEchoReply(bytes(packetTemplate.build(1)), "10.0.0.1")
+            timeExceeded = simulatedNetwork.buildTimeExceeded(bytes(packetTemplate.build(2)), "10.0.0.1", "192.0.2.1")
+            return echoReply, timeExceeded
+
+        # ############################################################################################################ #
+        # IcmpBenchmark Public Functions                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        def benchmarkChecksum(self, sizes=CHECKSUM_SIZES):
+            results = []
+            for size in sizes:
+                packetBytes = bytes(bytearray(i & 0xff for i in range(size)))
+                results.append(self.__measure("checksum", size, "bytes", size,
+                                              lambda: IcmpHelperLibrary.IcmpChecksum.calculate(packetBytes)))
+                results.append(self.__measure("checksum_reference", size, "bytes", size,
+                                              lambda: IcmpHelperLibrary.IcmpChecksum.calculateReference(packetBytes)))
+            return results
+
+        def benchmarkPacketBuild(self):
+            icmpPacket = IcmpHelperLibrary.IcmpPacket()
+            packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(0x1234)
+            return [self.__measure("packet_build", None, "packets", 1,
+                                   lambda: icmpPacket.buildPacket_echoRequest(0x1234, 1)),
+                    self.__measure("packet_template", None, "packets", 1, lambda: packetTemplate.build(1)),
+                    self.__measure("packet_template_flow", None, "packets", 1,
+                                   lambda: packetTemplate.build(1, None, 7))]
+
+        def benchmarkReplyParse(self):
+            echoReply, timeExceeded = self.__sampleReplies()
+            return [self.__measure("reply_parse", "echo", "packets", 1,
+                                   lambda: IcmpHelperLibrary.IcmpPacket_EchoReply(echoReply)),
+                    self.__measure("reply_decode", "echo", "packets", 1,
+                                   lambda: IcmpHelperLibrary.IcmpMessageDecoder.decode(echoReply)),
+                    self.__measure("reply_decode", "error", "packets", 1,
+                                   lambda: IcmpHelperLibrary.IcmpMessageDecoder.decode(timeExceeded))]
+
+        def benchmarkEndToEnd(self, targetCount=1024, count=4, pingCount=256):
+            # Whole probes through the library against a responder answering at once: the sweep loop (which falls
+            # back to per packet I/O without a file descriptor) and the one probe at a time ping loop
+            quietSink = IcmpHelperLibrary.IcmpQuietSink()
+
+            targets = ["10.%d.%d.1" % (i >> 8 & 0xff, i & 0xff) for i in range(targetCount)]
+
+            def runSweep():
+                icmpHelperLibrary = IcmpHelperLibrary(IcmpHelperLibrary.IcmpSimulatedSocket(), sink=quietSink)
+                for sweepTarget in icmpHelperLibrary.sweep(targets, count, 1, 0, 0, targetCount):
+                    pass
+
+            def runPing():
+                icmpHelperLibrary = IcmpHelperLibrary(IcmpHelperLibrary.IcmpSimulatedSocket(), sink=quietSink)
+                icmpHelperLibrary.sendPing("10.0.0.1", pingCount, 0, False)
+
+            return [self.__measure("sweep_simulated", targetCount, "probes", targetCount * count, runSweep),
+                    self.__measure("ping_simulated", pingCount, "probes", pingCount, runPing)]
+
+        def run(self, suites=SUITES):
+            # Runs the named suites (all by default) and returns their IcmpBenchmarkResults
+            results = []
+            for suite in suites:
+                if suite == "checksum":
+                    results.extend(self.benchmarkChecksum())
+                elif suite == "build":
+                    results.extend(self.benchmarkPacketBuild())
+                elif suite == "parse":
+                    results.extend(self.benchmarkReplyParse())
+                elif suite == "end-to-end":
+                    results.extend(self.benchmarkEndToEnd())
+                else:
+                    raise ValueError("unknown benchmark suite: %s" % suite)
+            self.__sink.flush()
+            return results
+
+    # ################################################################################################################ #
+    # Class IcmpChecksum                                                                                               #
+    #                                                                                                                  #
+    # References:                                                                                                      #
+    # https://www.rfc-editor.org/rfc/rfc1071 (Computing the Internet Checksum)                                         #
+    # https://www.rfc-editor.org/rfc/rfc1624 (Incremental Update)                                                      #
+    #                                                                                                                  #
+    # Checksum values are returned exactly as IcmpPacket stores them, ready to be packed with "!H".                    #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpChecksum:
+        # ############################################################################################################ #
+        # IcmpChecksum Class Scope Variables                                                                           #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        __NUMPY_MINIMUM_LENGTH = 4096               # Below this numpy's call overhead costs more than it saves
+        __SWAP_WORDS = sys.byteorder == "big"       # array("H") is native order, the sum is over little-endian words
+
+        # ############################################################################################################ #
+        # IcmpChecksum Private Functions                                                                               #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def __finish(checksum):
+            # Add 1's Complement Rotation, invert and swap to network order (same steps as the reference loop)
+            checksum = checksum & 0xffffffff
+            checksum = (checksum >> 16) + (checksum & 0xffff)
+            checksum = (checksum >> 16) + checksum
+            answer = ~checksum & 0xffff
+            return answer >> 8 | (answer << 8 & 0xff00)
+
+        @staticmethod
+        def __sumWords(packetBytes):
+            view = memoryview(packetBytes).cast("B")
+            countTo = (len(view) // 2) * 2
+
+            if numpy is not None and countTo >= IcmpHelperLibrary.IcmpChecksum.__NUMPY_MINIMUM_LENGTH:
+                checksum = int(numpy.frombuffer(view[:countTo], dtype="<u2").sum(dtype=numpy.uint64))
+            else:
+                words = array("H")
+                words.frombytes(view[:countTo])
+                if IcmpHelperLibrary.IcmpChecksum.__SWAP_WORDS:
+                    words.byteswap()
+                checksum = sum(words)
+
+            # Remaining odd byte is handled as the low byte of a final word
+            if countTo < len(view):
+                checksum = checksum + view[len(view) - 1]
+            return checksum
+
+        # ############################################################################################################ #
+        # IcmpChecksum Public Functions                                                                                #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        #                                                                                                              #
+        # ############################################################################################################ #
+        @staticmethod
+        def calculate(packetBytes):
+            # Whole buffer checksum, summed as 16 bit words with array (or numpy for large buffers when installed)
+            return IcmpHelperLibrary.IcmpChecksum.__finish(IcmpHelperLibrary.IcmpChecksum.__sumWords(packetBytes))
+
+        @staticmethod
+        def calculateReference(packetAsByteData):
+            # Byte pair loop the checksum was originally computed with, kept to verify calculate() against
+            checksum = 0
+            countTo = (len(packetAsByteData) // 2) * 2
+            count = 0
+            while count < countTo:
+                thisVal = packetAsByteData[count + 1] * 256 + packetAsByteData[count]
+                checksum = checksum + thisVal
+                checksum = checksum & 0xffffffff
+                count = count + 2
+            if countTo < len(packetAsByteData):
+                checksum = checksum + packetAsByteData[len(packetAsByteData) - 1]
+            return IcmpHelperLibrary.IcmpChecksum.__finish(checksum)
+
+        @staticmethod
+        def update(checksum, oldWord, newWord):
+            # RFC 1624 eqn. 3: HC' = ~(~HC + ~m + m') for one 16 bit word at an even offset (network order values).
+            # Matches calculate() for every buffer that is not all zeros, which an echo request never is.
+            total = (~checksum & 0xffff) + (~oldWord & 0xffff) + newWord
+            total = (total & 0xffff) + (total >> 16)
+            total = (total & 0xffff) + (total >> 16)
+            return ~total & 0xffff
+
+        @staticmethod
+        def updateBytes(checksum, oldBytes, newBytes):
+            # Same as update() for an equally sized span starting at an even offset, e.g. the 8 byte timestamp
+            total = ~checksum & 0xffff
+            for position in range(0, len(oldBytes) - 1, 2):
+                total = total + (~(oldBytes[position] << 8 | oldBytes[position + 1]) & 0xffff) + \
+                        (newBytes[position] << 8 | newBytes[position + 1])
+            if len(oldBytes) % 2 == 1:
+                total = total + (~(oldBytes[-1] << 8) & 0xffff) + (newBytes[-1] << 8)
+            while total > 0xffff:
+                total = (total & 0xffff) + (total >> 16)
+            return ~total & 0xffff
+
+    # ################################################################################################################ #
+    # Class IcmpHelperLibrary                                                                                          #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Class Scope Variables                                                                          #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+
+    __icmpSocket = None                                # Shared IcmpTransport, opened per call when not set
+    __transport = "auto"                               # openTransport() name of the transports opened per call
+    __resolver = None                                  # IcmpResolver shared by every entry point
+    __kernelTimestamps = False                         # Sockets opened here take receive times from the kernel
+    __sink = None                                      # IcmpResultSink every result record is written to
+    __hopCache = None                                  # IcmpHopCache kept across traceRouteMany() calls
+    __timerTemplate = None                             # IcmpRetransmissionTimer new timers start out as
+    __retransmissionTimers = None                      # (address, ttl) -> IcmpRetransmissionTimer, oldest use first
+    __MAX_RETRANSMISSION_TIMERS = 4096
+    __RESOLVE_POLL_INTERVAL = 0.01                     # How often sweep() looks for names resolved in the background
+    __pacer = None                                     # IcmpPacer spacing probes, kept across calls
+    __pacing = True                                    # Probes go through the pacer; off sends them as fast as asked
+    __nextPacketIdentifier = None                      # Process wide, see allocatePacketIdentifiers()
+    __packetIdentifierLock = threading.Lock()
+    __lastIoReport = None                              # IcmpIoReport of the last sweep() run
+    __lastShardReports = None                          # IcmpShardReports of the last sweepSharded() run
+    __SHARD_CHUNK_SIZE = 256                           # Most targets sweepSharded() hands a worker at once
+
+    __DEBUG_IcmpHelperLibrary = False                  # Allows for debug output
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Constructors                                                                                   #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    def __init__(self, icmpSocket=None, resolver=None, kernelTimestamps=False, sink=None, transport="auto"):
+        self.__icmpSocket = icmpSocket
+        self.__transport = transport
+        self.__kernelTimestamps = kernelTimestamps
+        self.__sink = sink if sink is not None else IcmpHelperLibrary.IcmpConsoleSink()
+        self.__resolver = resolver if resolver is not None else IcmpHelperLibrary.IcmpResolver.getDefaultResolver()
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Getters                                                                                        #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    def getIcmpSocket(self):
+        return self.__icmpSocket
+
+    def getTransport(self):
+        return self.__transport
+
+    def getResolver(self):
+        return self.__resolver
+
+    def getSink(self):
+        return self.__sink
+
+    def getHopCache(self):
+        if self.__hopCache is None:
+            self.__hopCache = IcmpHelperLibrary.IcmpHopCache()
+        return self.__hopCache
+
+    def getTimerTemplate(self):
+        if self.__timerTemplate is None:
+            self.__timerTemplate = IcmpHelperLibrary.IcmpRetransmissionTimer()
+        return self.__timerTemplate
+
+    def getPacer(self):
+        if self.__pacer is None:
+            self.__pacer = IcmpHelperLibrary.IcmpPacer()
+        return self.__pacer
+
+    def isPacing(self):
+        return self.__pacing
+
+    def getLastIoReport(self):
+        # IcmpIoReport of the last sweep() to finish, None before the first
+        return self.__lastIoReport
+
+    def getLastShardReports(self):
+        # IcmpShardReport of every worker of the last sweepSharded() to finish and the merged one last, None before
+        # the first
+        return self.__lastShardReports
+
+    def getRetransmissionTimer(self, destinationIpAddress, ttl=255):
+        # Timer of the hop ttl on the way to destinationIpAddress (255 for the destination itself), kept across
+        # calls. A new hop starts from the estimate of the hop before it when there is one.
+        if self.__retransmissionTimers is None:
+            self.__retransmissionTimers = OrderedDict()
+        key = (destinationIpAddress, ttl)
+        timer = self.__retransmissionTimers.get(key)
+        if timer is not None:
+            self.__retransmissionTimers.move_to_end(key)
+            return timer
+        previousTimer = self.__retransmissionTimers.get((destinationIpAddress, ttl - 1))
+        timer = (previousTimer if previousTimer is not None else self.getTimerTemplate()).derive()
+        self.__retransmissionTimers[key] = timer
+        if len(self.__retransmissionTimers) > self.__MAX_RETRANSMISSION_TIMERS:
+            self.__retransmissionTimers.popitem(last=False)
+        return timer
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Setters                                                                                        #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    def setIcmpSocket(self, icmpSocket):
+        self.__icmpSocket = icmpSocket
+
+    def setTransport(self, transport):
+        self.__transport = transport
+
+    def setResolver(self, resolver):
+        self.__resolver = resolver
+
+    def setSink(self, sink):
+        self.__sink = sink
+
+    def setHopCache(self, hopCache):
+        self.__hopCache = hopCache
+
+    def setPacer(self, pacer):
+        self.__pacer = pacer
+
+    def setPacing(self, pacing):
+        self.__pacing = pacing
+
+    def setTimerTemplate(self, timerTemplate):
+        # Limits (initial, minimum and maximum timeout) of the timers made from now on
+        self.__timerTemplate = timerTemplate
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Private Functions                                                                              #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    def __acquireIcmpSocket(self, receiveBufferSize=None):
+        # Returns (icmpSocket, ownsSocket). A socket opened here lives for one public call and is closed by the caller.
+        if self.__icmpSocket is not None and not self.__icmpSocket.isClosed():
+            return self.__icmpSocket, False
+        return IcmpHelperLibrary.openTransport(self.__transport, receiveBufferSize, self.__kernelTimestamps), True
+
+    def __getActivePacer(self):
+        return self.getPacer() if self.__pacing else None
+
+    def __getProbeTimeout(self, timeout, destinationIpAddress, ttl):
+        # timeout when given, otherwise as long as the retransmission timer of the hop says
+        if timeout is not None:
+            return timeout
+        return self.getRetransmissionTimer(destinationIpAddress, ttl).getTimeout()
+
+    def __addTimerSample(self, destinationIpAddress, ttl, pendingProbe):
+        # Feeds an answered probe to the retransmission timer of its hop. Probes in flight together do not back the
+        # timer off: one of them timing out says nothing about the others, which were already sent.
+        if pendingProbe.isAnswered():
+            self.getRetransmissionTimer(destinationIpAddress, ttl).addSample(pendingProbe.getRttNs() / 1e9)
+
+    def __sendIcmpEchoRequest(self, host, Ttl, icmpSocket, count=4, interval=0, keepProbes=None, timeout=None,
+                              deadline=None, begin=True):
+        # timeout None waits as long as the retransmission timer of the hop says, deadline (time.monotonic()) ends
+        # the whole run, the reply wait of the last probe included. keepProbes None keeps them unless count is None.
+        # begin False leaves sink.begin() to the caller, as a trace route does once for all of its hops.
+        print("sendIcmpEchoRequest Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+
+        if keepProbes is None:
+            keepProbes = count is not None
+        destinationIpAddress = self.__resolver.resolve(host)
+        pingResult = IcmpHelperLibrary.IcmpPingResult(host, destinationIpAddress, Ttl, keepProbes)
+        timer = self.getRetransmissionTimer(destinationIpAddress, Ttl) if timeout is None else None
+        if timer is not None:
+            timer.resetBackoff()
+        pacer = self.__getActivePacer()
+        sendGap = None
+        packetIdentifier = IcmpHelperLibrary.allocatePacketIdentifiers()[0]  # Never shared with a concurrent ping
+
+        if begin:
+            self.__sink.begin("ping", host, destinationIpAddress, count)
+        startTime = time.monotonic()
+        i = 0
+        while count is None or i < count:
+            # Probes are sent at startTime + i * interval, a slow reply delays the next probe but not the ones after it
+            sleepTime = startTime + i * interval - time.monotonic()
+            if deadline is not None:
+                sleepTime = min(sleepTime, deadline - time.monotonic())
+            try:
+                if sleepTime > 0:
+                    time.sleep(sleepTime)
+                if pacer is not None:
+                    # An explicit interval is the caller's schedule: the rate of the responder only slows it once a
+                    # limit was confirmed, trials meanwhile see the probes as they go and stay inconclusive
+                    hopPacing = interval <= 0 or pacer.getHopPacing(destinationIpAddress, Ttl).isRateLimited()
+                    sendGap = pacer.wait(destinationIpAddress, Ttl, hopPacing=hopPacing)
+            except KeyboardInterrupt:
+                break                   # An endless ping ends with its summary, like ping(8)
+            probeTimeout = timer.getTimeout() if timer is not None else timeout
+            if deadline is not None:
+                probeTimeout = min(probeTimeout, deadline - time.monotonic())
+                if probeTimeout <= 0:
+                    break
+
+            # Build packet
+            icmpPacket = IcmpHelperLibrary.IcmpPacket()
+            icmpPacket.setTtl(Ttl)
+
+            packetSequenceNumber = i & 0xffff
+
+            icmpPacket.buildPacket_echoRequest(packetIdentifier, packetSequenceNumber)  # Build ICMP for IP payload
+            icmpPacket.setResolver(self.__resolver)
+            icmpPacket.setIcmpTarget(host)
+            icmpPacket.setTimeout(probeTimeout)
+            probeResult = icmpPacket.sendEchoRequest(icmpSocket)
+
+            if probeResult is not None:
+                pingResult.addProbe(probeResult)
+                self.__sink.write(probeResult)
+                if pacer is not None:
+                    pacer.recordResult(probeResult, sendGap)
+                if timer is not None and probeResult.isAnswered():
+                    timer.addSample(probeResult.getRttNs() / 1e9)
+                elif timer is not None and probeResult.getStatus() == IcmpHelperLibrary.IcmpProbeResult.STATUS_TIMEOUT:
+                    timer.backOff()
+
+            icmpPacket.printIcmpPacketHeader_hex() if self.__DEBUG_IcmpHelperLibrary else 0
+            icmpPacket.printIcmpPacket_hex() if self.__DEBUG_IcmpHelperLibrary else 0
+            i += 1
+
+        self.__sink.write(pingResult)
+        self.__sink.flush()
+        return pingResult
+
+    def __sendIcmpTraceRoute(self, host, icmpSocket, maxTtl, probesPerHop, gapLimit, timeout, deadline):
+        print("sendIcmpTraceRoute Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+
+        host_ip = self.__resolver.resolve(host)
+        Ttl = 1
+        hops = []                       # One IcmpPingResult per TTL
+        destination = None
+        silentHops = 0                  # Hops in a row nothing answered at
+        deadlineTime = time.monotonic() + deadline if deadline is not None else None
+
+        self.__sink.begin("trace", host, host_ip)
+        while destination != host_ip and Ttl <= maxTtl:
+            if deadlineTime is not None and time.monotonic() >= deadlineTime:
+                print("sendIcmpTraceRoute deadline reached at TTL", Ttl) if self.__DEBUG_IcmpHelperLibrary else 0
+                break
+            pingResult = self.__sendIcmpEchoRequest(host, Ttl, icmpSocket, probesPerHop, timeout=timeout,
+                                                    deadline=deadlineTime, begin=False)
+            hops.append(pingResult)
+            destination = pingResult.getAddress()
+            silentHops = silentHops + 1 if destination is None else 0
+            if gapLimit is not None and silentHops >= gapLimit:
+                print("sendIcmpTraceRoute", silentHops, "silent hops") if self.__DEBUG_IcmpHelperLibrary else 0
+                break
+            if any(probeResult.getIcmpType() == 3 for probeResult in pingResult.getProbes()):
+                break                   # Destination Unreachable, nothing lies behind this hop
+            Ttl += 1
+        return hops
+
+    def __sendIcmpTraceRouteParallel(self, host, windowSize, probesPerHop, timeout, resolveNames, flowId,
+                                     icmpSocket):
+        print("sendIcmpTraceRouteParallel Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+
+        host_ip = self.__resolver.resolve(host)
+        packetIdentifier = IcmpHelperLibrary.allocatePacketIdentifiers()[0]
+        packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(packetIdentifier)
+        if flowId is not None:
+            packetTemplate.setFlowChecksum(IcmpHelperLibrary.IcmpPacketTemplate.getFlowChecksumFor(flowId))
+        traceResult = IcmpHelperLibrary.IcmpTraceResult(host, host_ip)
+        hops = {}                       # ttl -> list of IcmpProbeResult, timeouts included
+        hostNames = {}                  # address -> Future of its reverse lookup, started as soon as a hop answers
+        destinationTtl = None           # Lowest TTL that reached the destination (or an unreachable answer)
+        pacer = self.__getActivePacer()
+        firstTtl = 1
+        lastTtl = 0
+
+        self.__sink.begin("trace", host, host_ip)
+        while destinationTtl is None and firstTtl <= 255:
+            lastTtl = min(firstTtl + windowSize - 1, 255)
+
+            # Fire every probe in the window before waiting for any reply, one round over the TTLs per probe so no
+            # router gets its probes back to back. A hop the pacer holds back does not hold up the others: the first
+            # probe in line it lets go is sent, and the socket is read while none may go. The sequence number encodes
+            # the TTL in its upper byte and the probe index in its lower byte so replies can be attributed to their hop.
+            dispatcher = icmpSocket.getDispatcher()
+            windowProbes = []
+            finishedProbes = []         # Filled by the dispatcher as probes are answered or expire
+            unsentProbes = [(i, ttl) for i in range(probesPerHop) for ttl in range(firstTtl, lastTtl + 1)]
+            while len(unsentProbes) > 0:
+                position = 0
+                if pacer is not None:
+                    now = time.monotonic()
+                    shortestDelay = math.inf
+                    for position, (i, ttl) in enumerate(unsentProbes):
+                        shortestDelay = min(shortestDelay, pacer.getDelay(host_ip, ttl, now))
+                        if shortestDelay <= 0:
+                            break
+                    if shortestDelay > 0:
+                        icmpSocket.receiveAvailable(shortestDelay)
+                        continue
+                i, ttl = unsentProbes.pop(position)
+                sendGap = pacer.take(host_ip, ttl) if pacer is not None else None
+                packetSequenceNumber = (ttl << 8) | i
+                packetView = packetTemplate.build(packetSequenceNumber)
+                windowProbes.append(dispatcher.register(packetIdentifier, packetSequenceNumber,
+                                                        packetTemplate.getTimeSent(),
+                                                        self.__getProbeTimeout(timeout, host_ip, ttl),
+                                                        finishedProbes.append, sendGap,
+                                                        packetTemplate.getTimeSentNs()))
+                icmpSocket.sendTo(packetView, host_ip, ttl)
+
+            # Collect replies as they arrive until everything up to the destination hop answered or time is up
+            outstanding = len(windowProbes)
+            deadline = max(pendingProbe.getDeadline() for pendingProbe in windowProbes)
+            try:
+                while outstanding > 0:
+                    timeLeft = deadline - time.monotonic()
+                    if timeLeft <= 0:
+                        break
+                    icmpSocket.receiveAvailable(timeLeft)
+                    dispatcher.expire(time.monotonic())
+
+                    for pendingProbe in finishedProbes:
+                        outstanding -= 1
+                        ttl = pendingProbe.getPacketSequenceNumber() >> 8
+                        probeResult = IcmpHelperLibrary.IcmpProbeResult.fromPendingProbe(pendingProbe, host, host_ip,
+                                                                                         ttl)
+                        if pacer is not None:
+                            pacer.recordResult(probeResult, pendingProbe.getContext())
+                        if timeout is None:
+                            self.__addTimerSample(host_ip, ttl, pendingProbe)
+                        hops.setdefault(ttl, []).append(probeResult)
+                        if not pendingProbe.isAnswered():
+                            continue
+                        address = pendingProbe.getAddress()[0]
+                        icmpType = pendingProbe.getIcmpType()
+                        if resolveNames and address not in hostNames:
+                            hostNames[address] = self.__resolver.reverseInBackground(address)
+
+                        if icmpType == 0 or icmpType == 3 or address == host_ip:
+                            if destinationTtl is None or ttl < destinationTtl:
+                                destinationTtl = ttl
+                    del finishedProbes[:]
+
+                    # Once the destination hop is known only probes at or below it are still worth waiting for
+                    if destinationTtl is not None and \
+                            all((pendingProbe.getPacketSequenceNumber() >> 8) > destinationTtl
+                                for pendingProbe in windowProbes if pendingProbe.isPending()):
+                        break
+            finally:
+                for pendingProbe in windowProbes:
+                    dispatcher.cancel(pendingProbe)
+                for pendingProbe in finishedProbes:
+                    # Probes the loop left waiting for, cancelled just above, go in as timeouts
+                    ttl = pendingProbe.getPacketSequenceNumber() >> 8
+                    hops.setdefault(ttl, []).append(
+                        IcmpHelperLibrary.IcmpProbeResult.fromPendingProbe(pendingProbe, host, host_ip, ttl))
+                del finishedProbes[:]
+
+            firstTtl = lastTtl + 1
+
+        traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION if destinationTtl is not None
+                                  else IcmpHelperLibrary.IcmpTraceResult.STOP_MAX_TTL)
+        lastHop = destinationTtl if destinationTtl is not None else lastTtl
+        for ttl in range(1, lastHop + 1):
+            probes = sorted(hops.get(ttl, []), key=IcmpHelperLibrary.IcmpProbeResult.getPacketSequenceNumber)
+            for probeResult in probes:
+                if probeResult.getAddress() in hostNames:
+                    probeResult.setHostName(hostNames[probeResult.getAddress()].result())
+                self.__sink.write(probeResult)
+            traceResult.addHop(ttl, probes)
+        self.__sink.write(traceResult)
+        self.__sink.flush()
+        return traceResult
+
+
+    def __probeHop(self, target, destinationIpAddress, ttl, probesPerHop, timeout, packetTemplate, icmpSocket):
+        # Sends probesPerHop probes with one TTL at once and returns their IcmpProbeResults once all have finished
+        dispatcher = icmpSocket.getDispatcher()
+        packetIdentifier = packetTemplate.getPacketIdentifier()
+        pacer = self.__getActivePacer()
+        finishedProbes = []
+        for i in range(probesPerHop):
+            # Replies arriving while the pacer holds a probe back are read meanwhile
+            sendGap = pacer.wait(destinationIpAddress, ttl, icmpSocket.receiveAvailable) \
+                if pacer is not None else None
+            packetSequenceNumber = ((ttl << 8) | i) & 0xffff
+            packetView = packetTemplate.build(packetSequenceNumber)
+            pendingProbe = dispatcher.register(packetIdentifier, packetSequenceNumber, packetTemplate.getTimeSent(),
+                                               self.__getProbeTimeout(timeout, destinationIpAddress, ttl),
+                                               finishedProbes.append, sendGap, packetTemplate.getTimeSentNs())
+            try:
+                icmpSocket.sendTo(packetView, destinationIpAddress, ttl)
+            except OSError:
+                dispatcher.cancel(pendingProbe)         # Counted as unanswered
+        while len(finishedProbes) < probesPerHop:
+            icmpSocket.receiveAvailable(dispatcher.getNextDeadline() - time.monotonic())
+            dispatcher.expire(time.monotonic())
+        probeResults = []
+        for pendingProbe in sorted(finishedProbes, key=IcmpHelperLibrary.IcmpPendingProbe.getKey):
+            probeResult = IcmpHelperLibrary.IcmpProbeResult.fromPendingProbe(pendingProbe, target,
+                                                                             destinationIpAddress, ttl)
+            if pacer is not None:
+                pacer.recordResult(probeResult, pendingProbe.getContext())
+            if timeout is None:
+                self.__addTimerSample(destinationIpAddress, ttl, pendingProbe)
+            probeResults.append(probeResult)
+        return probeResults
+
+    def __sendIcmpTraceRouteDoubletree(self, target, startTtl, probesPerHop, timeout, gapLimit, hopCache,
+                                       packetTemplate, icmpSocket):
+        try:
+            host_ip = self.__resolver.resolve(target)
+        except (OSError, UnicodeError) as error:
+            return IcmpHelperLibrary.IcmpTraceResult(target, None, str(error))
+        traceResult = IcmpHelperLibrary.IcmpTraceResult(target, host_ip)
+        prefix = hopCache.getPrefix(host_ip)
+        destinationTtl = None           # Hop the destination answered at, or where the stop set says it is
+
+        def reachedDestination(probeResults):
+            return any(probeResult.isAnswered() and (probeResult.getIcmpType() in (0, 3) or
+                                                     probeResult.getAddress() == host_ip)
+                       for probeResult in probeResults)
+
+        # Forward from startTtl until the destination, an interface the global stop set knows for this prefix, or
+        # gapLimit silent hops in a row
+        ttl = startTtl
+        silentHops = 0
+        traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_MAX_TTL)
+        while ttl <= 255:
+            probeResults = self.__probeHop(target, host_ip, ttl, probesPerHop, timeout, packetTemplate, icmpSocket)
+            traceResult.addHop(ttl, probeResults)
+            if reachedDestination(probeResults):
+                destinationTtl = ttl
+                traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION)
+                break
+            remainingHops = [hopCache.getRemainingHops(probeResult.getAddress(), prefix)
+                             for probeResult in probeResults if probeResult.isAnswered()]
+            remainingHops = [hops for hops in remainingHops if hops is not None]
+            if len(remainingHops) > 0:
+                destinationTtl = ttl + min(remainingHops)
+                traceResult.addProbesSaved(min(remainingHops) * probesPerHop)
+                traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_STOP_SET)
+                break
+            silentHops = silentHops + 1 if not any(probeResult.isAnswered() for probeResult in probeResults) else 0
+            if silentHops >= gapLimit:
+                traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_GAP)
+                break
+            ttl += 1
+
+        # Backward from startTtl - 1 towards the source until an interface of the local stop set answers. A closer
+        # answer from the destination itself means startTtl overshot it.
+        ttl = startTtl - 1
+        while ttl >= 1:
+            probeResults = self.__probeHop(target, host_ip, ttl, probesPerHop, timeout, packetTemplate, icmpSocket)
+            traceResult.addHop(ttl, probeResults)
+            if reachedDestination(probeResults):
+                destinationTtl = ttl
+                traceResult.removeHopsAbove(ttl)
+                traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION)
+            elif any(hopCache.isInLocalStopSet(probeResult.getAddress())
+                     for probeResult in probeResults if probeResult.isAnswered()):
+                traceResult.addProbesSaved((ttl - 1) * probesPerHop)
+                break
+            ttl -= 1
+
+        lastTtl = destinationTtl if destinationTtl is not None else traceResult.getLastTtl()
+        hopCache.addPath(prefix, [(hopTtl, probeResult.getAddress()) for hopTtl, probeResults in traceResult.getHops()
+                                  for probeResult in probeResults if probeResult.isAnswered()], lastTtl)
+        hopCache.recordProbesSaved(traceResult.getProbesSaved())
+        return traceResult
+
+    def __probeFlows(self, target, destinationIpAddress, probes, firstSequenceNumber, timeout, packetTemplate,
+                     icmpSocket):
+        # Sends one probe per (ttl, flowId) in probes at once (as fast as the pacer lets them go), each pinned to the
+        # checksum of its flow, and returns [(ttl, flowId, IcmpProbeResult), ...] once all have finished
+        dispatcher = icmpSocket.getDispatcher()
+        packetIdentifier = packetTemplate.getPacketIdentifier()
+        pacer = self.__getActivePacer()
+        finishedProbes = []
+        for i, (ttl, flowId) in enumerate(probes):
+            sendGap = pacer.wait(destinationIpAddress, ttl, icmpSocket.receiveAvailable) \
+                if pacer is not None else None
+            packetSequenceNumber = (firstSequenceNumber + i) & 0xffff
+            packetView = packetTemplate.build(packetSequenceNumber, None,
+                                              IcmpHelperLibrary.IcmpPacketTemplate.getFlowChecksumFor(flowId))
+            pendingProbe = dispatcher.register(packetIdentifier, packetSequenceNumber, packetTemplate.getTimeSent(),
+                                               self.__getProbeTimeout(timeout, destinationIpAddress, ttl),
+                                               finishedProbes.append, (ttl, flowId, sendGap),
+                                               packetTemplate.getTimeSentNs())
+            try:
+                icmpSocket.sendTo(packetView, destinationIpAddress, ttl)
+            except OSError:
+                dispatcher.cancel(pendingProbe)         # Counted as unanswered
+        while len(finishedProbes) < len(probes):
+            icmpSocket.receiveAvailable(dispatcher.getNextDeadline() - time.monotonic())
+            dispatcher.expire(time.monotonic())
+        flowResults = []
+        for pendingProbe in finishedProbes:
+            ttl, flowId, sendGap = pendingProbe.getContext()
+            probeResult = IcmpHelperLibrary.IcmpProbeResult.fromPendingProbe(pendingProbe, target,
+                                                                             destinationIpAddress, ttl)
+            if pacer is not None:
+                pacer.recordResult(probeResult, sendGap)
+            if timeout is None:
+                self.__addTimerSample(destinationIpAddress, ttl, pendingProbe)
+            flowResults.append((ttl, flowId, probeResult))
+        return flowResults
+
+    def __sendIcmpTraceRouteMultipath(self, target, stoppingRule, maxTtl, timeout, gapLimit, maxFlowsPerHop,
+                                      packetTemplate, icmpSocket):
+        try:
+            host_ip = self.__resolver.resolve(target)
+        except (OSError, UnicodeError) as error:
+            return IcmpHelperLibrary.IcmpMultipathResult(target, None, stoppingRule.getConfidence(), str(error))
+        multipathResult = IcmpHelperLibrary.IcmpMultipathResult(target, host_ip, stoppingRule.getConfidence())
+        flowInterfaces = {0: {}}        # ttl -> {flowId: interface that answered the flow at ttl, None if silent}
+        terminalInterfaces = set()      # The destination and whoever answered unreachable, nothing lies behind them
+        flowCount = 0
+        silentHops = 0
+
+        multipathResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_MAX_TTL)
+        for ttl in range(1, maxTtl + 1):
+            previousHop = flowInterfaces[ttl - 1]
+            currentHop = flowInterfaces.setdefault(ttl, {})
+            hopBefore = flowInterfaces.get(ttl - 2, {})     # New flows found at ttl - 1 hang off one of these
+            interfacesBefore = set(hopBefore.values())
+            interfacesBefore.discard(None)
+            newFlows = 0
+
+            # Rounds of probes until every interface at ttl - 1 has had as many flows sent through it as the
+            # stopping rule asks for its next hops seen so far. Flows are known to cross an interface from having
+            # been probed at ttl - 1; when too few are, new flows are probed at ttl - 1 first to find some.
+            while True:
+                if ttl == 1:
+                    predecessors = {None}                           # The source, every flow crosses it
+                else:
+                    predecessors = set(previousHop.values()).difference(terminalInterfaces)
+                    if predecessors != {None}:
+                        predecessors.discard(None)                  # Silent flows only matter on a silent hop
+                probes = []
+                flowsWanted = 0
+                for predecessor in predecessors:
+                    if ttl == 1:
+                        throughFlows = list(currentHop)
+                    else:
+                        throughFlows = [flowId for flowId, interface in previousHop.items()
+                                        if interface == predecessor]
+                    successors = set(currentHop[flowId] for flowId in throughFlows if flowId in currentHop)
+                    successors.discard(None)
+                    missing = stoppingRule.getProbesNeeded(len(successors)) - \
+                              sum(1 for flowId in throughFlows if flowId in currentHop)
+                    if missing <= 0:
+                        continue
+                    unprobedFlows = [flowId for flowId in throughFlows if flowId not in currentHop]
+                    probes.extend((ttl, flowId) for flowId in unprobedFlows[:missing])
+                    flowsWanted = max(flowsWanted, missing - len(unprobedFlows))
+
+                # A new flow lands on one of the interfaces at ttl - 1, so ask for enough to reach all of them. Where
+                # ttl - 2 has several interfaces the flow is probed there too, to tell which one it came through.
+                flowsWanted = min(flowsWanted * max(len(predecessors), 1), maxFlowsPerHop - newFlows)
+                roundFlows = range(flowCount, flowCount + flowsWanted) if ttl > 1 else range(0)
+                for i in range(flowsWanted):
+                    probes.append((ttl if ttl == 1 else ttl - 1, flowCount))
+                    if ttl > 2 and len(interfacesBefore) > 1:
+                        probes.append((ttl - 2, flowCount))
+                    flowCount += 1
+                newFlows += flowsWanted
+                if len(probes) == 0:
+                    break
+
+                for probeTtl, flowId, probeResult in self.__probeFlows(target, host_ip, probes,
+                                                                       multipathResult.getProbesSent(), timeout,
+                                                                       packetTemplate, icmpSocket):
+                    interface = probeResult.getAddress() if probeResult.isAnswered() else None
+                    flowInterfaces[probeTtl][flowId] = interface
+                    if interface is not None and (probeResult.getIcmpType() in (0, 3) or interface == host_ip):
+                        terminalInterfaces.add(interface)
+                    if probeTtl == ttl:
+                        multipathResult.addEdge(ttl - 1, previousHop.get(flowId), interface)
+                    elif interface is not None:
+                        multipathResult.addInterface(probeTtl, interface)
+                soleInterfaceBefore = next(iter(interfacesBefore)) if len(interfacesBefore) == 1 else None
+                for flowId in roundFlows:
+                    if previousHop.get(flowId) is not None:
+                        multipathResult.addEdge(ttl - 2, hopBefore.get(flowId, soleInterfaceBefore),
+                                                previousHop[flowId])
+                multipathResult.addProbesSent(len(probes))
+
+            flowInterfaces.pop(ttl - 2, None)
+            answered = set(currentHop.values())
+            answered.discard(None)
+            silentHops = silentHops + 1 if len(answered) == 0 else 0
+            if silentHops >= gapLimit:
+                multipathResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_GAP)
+                break
+            if len(answered) > 0 and answered.issubset(terminalInterfaces):
+                multipathResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION)
+                break
+
+        multipathResult.setFlowCount(flowCount)
+        return multipathResult
+
+    def __sendIcmpSweep(self, targets, count, timeout, interval, rate, maxInFlight, batchSize, packetIdentifiers,
+                        icmpSocket):
+        print("sendIcmpSweep Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+
+        batchIo = IcmpHelperLibrary.IcmpBatchIo(icmpSocket, batchSize, forceFallback=batchSize <= 1)
+        startTime = time.monotonic()
+        if packetIdentifiers is None:
+            packetIdentifiers = IcmpHelperLibrary.allocatePacketIdentifiers()
+        identifierIndex = 0             # The next identifier takes over each time the sequence numbers wrap
+        packetIdentifier = packetIdentifiers[identifierIndex]
+        packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(packetIdentifier)
+        dispatcher = icmpSocket.getDispatcher()
+        targetIterator = iter(IcmpHelperLibrary.iterateTargets(targets))
+        targetsExhausted = False
+        resolvingTargets = []           # (target, Future of its address) read but not admitted yet
+        activeCount = 0
+        sendQueue = []                  # Heap of (next send time, order, IcmpSweepTarget)
+        order = 0
+        finishedProbes = []             # Filled by the dispatcher as probes are answered or expire
+        sendGap = 1.0 / rate if rate > 0 else 0.0
+        nextSendSlot = 0.0              # Global pacing across all targets
+        sendAhead = 0.0                 # How early a probe may go so a batch fills up instead of leaving half empty
+        if batchIo.isBatched():
+            sendAhead = sendGap * (batchIo.getBatchSize() - 1)
+        nextSequenceNumber = 0
+
+        try:
+            while activeCount > 0 or len(resolvingTargets) > 0 or not targetsExhausted:
+                # Read targets lazily so memory follows maxInFlight, not the size of the target list. Names resolve on
+                # the resolver's threads, a slow one never holds up the probes in flight (nor inflates their RTTs),
+                # and a target is admitted once its address is known.
+                while activeCount + len(resolvingTargets) < maxInFlight and not targetsExhausted:
+                    target = next(targetIterator, None)
+                    if target is None:
+                        targetsExhausted = True
+                        break
+                    resolvingTargets.append((target, self.__resolver.resolveInBackground(target)))
+                failedTargets = []
+                stillResolving = []
+                for target, addressFuture in resolvingTargets:
+                    if not addressFuture.done():
+                        stillResolving.append((target, addressFuture))
+                        continue
+                    try:
+                        sweepTarget = IcmpHelperLibrary.IcmpSweepTarget(target, addressFuture.result())
+                    except (OSError, UnicodeError) as error:
+                        failedTargets.append(IcmpHelperLibrary.IcmpSweepTarget(target, None, str(error)))
+                        continue
+                    activeCount += 1
+                    order += 1
+                    heapq.heappush(sendQueue, (time.monotonic(), order, sweepTarget))
+                resolvingTargets = stillResolving
+                for sweepTarget in failedTargets:
+                    yield sweepTarget
+
+                # Send every probe that is due, never faster than the global rate allows
+                now = time.monotonic()
+                while len(sendQueue) > 0 and sendQueue[0][0] <= now + sendAhead and nextSendSlot <= now + sendAhead:
+                    sweepTarget = heapq.heappop(sendQueue)[2]
+                    while dispatcher.isPending(packetIdentifier, nextSequenceNumber):
+                        nextSequenceNumber = (nextSequenceNumber + 1) & 0xffff
+                    packetView = packetTemplate.build(nextSequenceNumber)
+                    dispatcher.register(packetIdentifier, nextSequenceNumber, packetTemplate.getTimeSent(),
+                                        self.__getProbeTimeout(timeout, sweepTarget.getDestinationIpAddress(), 255),
+                                        finishedProbes.append, sweepTarget, packetTemplate.getTimeSentNs(),
+                                        sweepTarget.getDestinationIpAddress())
+                    nextSequenceNumber = (nextSequenceNumber + 1) & 0xffff
+                    if nextSequenceNumber == 0 and len(packetIdentifiers) > 1:
+                        identifierIndex = (identifierIndex + 1) % len(packetIdentifiers)
+                        packetIdentifier = packetIdentifiers[identifierIndex]
+                        packetTemplate.setPacketIdentifier(packetIdentifier)
+                    sweepTarget.recordSent()
+                    batchIo.queueSend(packetView, sweepTarget.getDestinationIpAddress(), 255)
+                    if sweepTarget.getPacketsSent() < count:
+                        order += 1
+                        heapq.heappush(sendQueue, (now + interval, order, sweepTarget))
+                    nextSendSlot = max(nextSendSlot, now) + sendGap
+                    now = time.monotonic()
+
+                # Sleep in select until the next send, the next probe deadline or a reply, whichever comes first
+                wakeTimes = [nextDeadline for nextDeadline in (dispatcher.getNextDeadline(),)
+                             if nextDeadline is not None]
+                if len(sendQueue) > 0:
+                    wakeTimes.append(max(sendQueue[0][0], nextSendSlot) - sendAhead)
+                if len(resolvingTargets) > 0:
+                    wakeTimes.append(time.monotonic() + self.__RESOLVE_POLL_INTERVAL)
+                if len(wakeTimes) > 0:
+                    batchIo.receiveAvailable(min(wakeTimes) - time.monotonic())    # Sends what was queued first
+                dispatcher.expire(time.monotonic())
+
+                completedTargets = []
+                for pendingProbe in finishedProbes:
+                    sweepTarget = pendingProbe.getContext()
+                    sweepTarget.recordFinished(pendingProbe)
+                    if timeout is None:
+                        self.__addTimerSample(sweepTarget.getDestinationIpAddress(), 255, pendingProbe)
+                    if sweepTarget.getPacketsSent() >= count and sweepTarget.getPacketsOutstanding() == 0:
+                        completedTargets.append(sweepTarget)
+                del finishedProbes[:]
+                for sweepTarget in completedTargets:
+                    activeCount -= 1
+                    yield sweepTarget
+        finally:
+            # A probe whose send failed is not cancelled here; it expires and counts as lost like any other. The I/O
+            # report stays out of the sink, which only gets result records.
+            self.__lastIoReport = IcmpHelperLibrary.IcmpIoReport(batchIo, time.monotonic() - startTime)
+            metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+            if metrics is not None:
+                metrics.count("sweep_syscalls", self.__lastIoReport.getSyscallCount())
+            print(self.__lastIoReport.formatConsoleLine(), file=sys.stderr) if self.__DEBUG_IcmpHelperLibrary else 0
+            self.__sink.flush()
+
+    async def __traceRouteWindowedAsync(self, target, host_ip, windowSize, probesPerHop, timeout, endTime, session):
+        # The window loop of traceRouteAsync(): an IcmpTraceResult holding every probe up to the destination hop,
+        # timeouts included. endTime is on the loop's clock, None for no deadline.
+        loop = asyncio.get_running_loop()
+        traceResult = IcmpHelperLibrary.IcmpTraceResult(target, host_ip)
+        traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_MAX_TTL)
+        hops = {}
+        destinationTtl = None
+        firstTtl = 1
+        lastTtl = 0
+        pending = set()
+        try:
+            while destinationTtl is None and firstTtl <= 255:
+                windowTimeout = timeout
+                if endTime is not None:
+                    windowTimeout = min(timeout, endTime - loop.time())
+                if windowTimeout <= 0:
+                    traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_DEADLINE)
+                    break
+                lastTtl = min(firstTtl + windowSize - 1, 255)
+
+                probeTtls = {}
+                for ttl in range(firstTtl, lastTtl + 1):
+                    for i in range(probesPerHop):
+                        probeTtls[loop.create_task(session.probeResult(target, host_ip, ttl, windowTimeout))] = ttl
+                pending = set(probeTtls)
+
+                while len(pending) > 0:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        probeResult = task.result()
+                        ttl = probeTtls[task]
+                        hops.setdefault(ttl, []).append(probeResult)
+                        if probeResult.isAnswered() and (probeResult.getIcmpType() in (0, 3) or
+                                                         probeResult.getAddress() == host_ip):
+                            if destinationTtl is None or ttl < destinationTtl:
+                                destinationTtl = ttl
+
+                    if destinationTtl is not None:
+                        beyondDestination = [task for task in pending if probeTtls[task] > destinationTtl]
+                        for task in beyondDestination:
+                            task.cancel()
+                        pending = pending.difference(beyondDestination)
+                        await asyncio.gather(*beyondDestination, return_exceptions=True)
+
+                firstTtl = lastTtl + 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if destinationTtl is not None:
+            traceResult.setStopReason(IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION)
+        lastHop = destinationTtl if destinationTtl is not None else lastTtl
+        for ttl in range(1, lastHop + 1):
+            traceResult.addHop(ttl, hops.get(ttl, []))
+        return traceResult
+
+    async def __pingTargetAsync(self, target, count, timeout, interval, session):
+        # One target of pingManyAsync(): probes go out at start + i * interval, as in sendPing()
+        try:
+            destinationIpAddress = await self.__resolver.resolveAsync(target)
+        except (OSError, UnicodeError) as error:
+            return IcmpHelperLibrary.IcmpPingResult(target, None, 255, False, str(error))
+        pingResult = IcmpHelperLibrary.IcmpPingResult(target, destinationIpAddress, 255)
+        loop = asyncio.get_running_loop()
+        startTime = loop.time()
+        for i in range(count):
+            sleepTime = startTime + i * interval - loop.time()
+            if sleepTime > 0:
+                await asyncio.sleep(sleepTime)
+            pingResult.addProbe(await session.probeResult(target, destinationIpAddress, 255, timeout))
+        return pingResult
+
+    async def __traceTargetAsync(self, target, windowSize, probesPerHop, timeout, deadline, session):
+        # One target of traceRouteManyAsync()
+        loop = asyncio.get_running_loop()
+        endTime = None if deadline is None else loop.time() + deadline
+        try:
+            host_ip = await self.__resolver.resolveAsync(target)
+        except (OSError, UnicodeError) as error:
+            return IcmpHelperLibrary.IcmpTraceResult(target, None, str(error))
+        return await self.__traceRouteWindowedAsync(target, host_ip, windowSize, probesPerHop, timeout, endTime,
+                                                    session)
+
+    @staticmethod
+    async def __runManyAsync(targets, maxInFlight, runTarget):
+        # Async generator behind the *ManyAsync() calls: runs runTarget(target) for at most maxInFlight targets at once
+        # and yields each result as soon as it is done. A daemon thread expands the target specifications and takes a
+        # free slot before handing each target over, so input is read only as far as there is room for (a slow
+        # consumer holds the slots too) and a blocking read from a pipe never stalls the probes in flight.
+        loop = asyncio.get_running_loop()
+        arrivals = asyncio.Queue()      # (target, None), (None, None) at the end or (None, error) if reading failed
+        freeSlots = threading.Semaphore(max(maxInFlight, 1))
+        stopped = threading.Event()
+
+        def deliver(arrival):
+            try:
+                loop.call_soon_threadsafe(arrivals.put_nowait, arrival)
+            except RuntimeError:
+                pass                    # The loop is gone, nobody is waiting any more
+
+        def readTargets():
+            try:
+                for target in IcmpHelperLibrary.iterateTargets(targets):
+                    freeSlots.acquire()
+                    if stopped.is_set():
+                        return
+                    deliver((target, None))
+            except Exception as error:
+                deliver((None, error))
+                return
+            deliver((None, None))
+
+        threading.Thread(target=readTargets, name="IcmpTargetReader", daemon=True).start()
+        running = set()
+        arrival = None                  # Task waiting for the next target, None once they ran out
+        reading = True
+        try:
+            while reading or len(running) > 0:
+                if reading and arrival is None:
+                    arrival = loop.create_task(arrivals.get())
+                done, pending = await asyncio.wait(running if arrival is None else running | {arrival},
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if arrival in done:
+                    target, error = arrival.result()
+                    arrival = None
+                    if error is not None:
+                        raise error
+                    if target is None:
+                        reading = False
+                    else:
+                        running.add(loop.create_task(runTarget(target)))
+                for task in done.intersection(running):
+                    running.discard(task)
+                    freeSlots.release()
+                    yield task.result()
+        finally:
+            stopped.set()
+            freeSlots.release()         # Wakes the reader if it waits for a slot, it then sees stopped
+            for task in running:
+                task.cancel()
+            if arrival is not None:
+                arrival.cancel()
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Public Functions                                                                               #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    @staticmethod
+    def unpackProbeReply(recvPacket):
+        # Returns (type, code, identifier, sequence) of the echo request a reply belongs to, or None if it does not
+        # answer one. Echo replies carry identifier/sequence in their own header, error messages in the quoted one.
+        message = IcmpHelperLibrary.IcmpMessageDecoder.decode(recvPacket)
+        if message is None or not message.isProbeReply():
+            return None
+        return message.getIcmpType(), message.getIcmpCode(), message.getIdentifier(), message.getSequenceNumber()
+
+    @staticmethod
+    def allocatePacketIdentifiers(count=1):
+        # range of count echo identifiers no other session, socket or call in this process is using, until the 16 bit
+        # space wraps around. Raw sockets see every reply on the host, so probes that shared one identifier would
+        # answer each other. Starts at a random point so that other processes rarely pick the same ones.
+        with IcmpHelperLibrary.__packetIdentifierLock:
+            firstIdentifier = IcmpHelperLibrary.__nextPacketIdentifier
+            if firstIdentifier is None:
+                firstIdentifier = random.randrange(0x10000)
+            if firstIdentifier + count > 0x10000:
+                firstIdentifier = 0
+            IcmpHelperLibrary.__nextPacketIdentifier = (firstIdentifier + count) & 0xffff
+        return range(firstIdentifier, firstIdentifier + count)
+
+    @staticmethod
+    def openTransport(transport="auto", receiveBufferSize=None, kernelTimestamps=False, ipTimeout=60):
+        # Opens a transport by name: "raw" (IcmpSocket), "dgram" (IcmpDatagramSocket), "simulated"
+        # (IcmpSimulatedSocket over its default network) or "auto", a raw socket when privileged and a ping socket
+        # otherwise. An IcmpTransport passed in is returned as is.
+        if isinstance(transport, IcmpHelperLibrary.IcmpTransport):
+            return transport
+        metrics = IcmpHelperLibrary.IcmpMetrics.getActive()
+        startNs = time.perf_counter_ns() if metrics is not None else 0
+        if transport == "auto":
+            try:
+                icmpTransport = IcmpHelperLibrary.IcmpSocket(ipTimeout, receiveBufferSize, kernelTimestamps)
+            except PermissionError:
+                icmpTransport = IcmpHelperLibrary.IcmpDatagramSocket(receiveBufferSize, kernelTimestamps)
+        elif transport == IcmpHelperLibrary.IcmpSocket.TRANSPORT_NAME:
+            icmpTransport = IcmpHelperLibrary.IcmpSocket(ipTimeout, receiveBufferSize, kernelTimestamps)
+        elif transport == IcmpHelperLibrary.IcmpDatagramSocket.TRANSPORT_NAME:
+            icmpTransport = IcmpHelperLibrary.IcmpDatagramSocket(receiveBufferSize, kernelTimestamps)
+        elif transport == IcmpHelperLibrary.IcmpSimulatedSocket.TRANSPORT_NAME:
+            icmpTransport = IcmpHelperLibrary.IcmpSimulatedSocket()
+        else:
+            raise ValueError("unknown transport: %s" % transport)
+        if metrics is not None:
+            metrics.recordTiming("socket_setup", time.perf_counter_ns() - startNs)
+        return icmpTransport
+
+    @staticmethod
+    def iterateTargets(targets):
+        # Lazily expands a target specification: a host name or address, a CIDR block ("10.0.0.0/24"), a file with
+        # one specification per line ("-" reads stdin), or any iterable mixing those.
+        if isinstance(targets, str):
+            targets = targets.strip()
+            if targets == "-" or os.path.isfile(targets):
+                targetFile = sys.stdin if targets == "-" else open(targets)
+                try:
+                    for line in targetFile:
+                        line = line.split("#", 1)[0].strip()
+                        if len(line) > 0:
+                            yield from IcmpHelperLibrary.iterateTargets(line)
+                finally:
+                    if targetFile is not sys.stdin:
+                        targetFile.close()
+            elif "/" in targets:
+                network = ipaddress.ip_network(targets, strict=False)
+                if network.num_addresses == 1:
+                    yield str(network.network_address)
+                else:
+                    for address in network.hosts():
+                        yield str(address)
+            elif len(targets) > 0:
+                yield targets
+        else:
+            for target in targets:
+                yield from IcmpHelperLibrary.iterateTargets(target)
+
+    def sweep(self, targets, count=4, timeout=None, interval=1, rate=1000, maxInFlight=1024, batchSize=64,
+              packetIdentifiers=None):
+        # fping style sweep: probes to every target are interleaved over one socket, paced to at most rate probes per
+        # second overall and interval seconds per target. Yields an IcmpSweepTarget as soon as each target is done;
+        # at most maxInFlight targets are held at once. Probes go out and replies come in batchSize per syscall where
+        # sendmmsg/recvmmsg exist; getLastIoReport() then has the probes per second and syscalls per probe.
+        # packetIdentifiers is a range of identifiers to take turns with (default: a fresh one). Each reply is waited
+        # for as long as the target's retransmission timer says, or timeout seconds when given.
+        print("sweep Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        icmpSocket, ownsSocket = self.__acquireIcmpSocket(4 * 1024 * 1024)      # Room for a burst of replies
+        try:
+            yield from self.__sendIcmpSweep(targets, count, timeout, interval, rate, maxInFlight, batchSize,
+                                            packetIdentifiers, icmpSocket)
+        finally:
+            if ownsSocket:
+                icmpSocket.close()
+
+    def sweepSharded(self, targets, workers=None, count=4, timeout=None, interval=1, rate=1000, maxInFlight=1024,
+                     batchSize=64):
+        # sweep() split over workers processes (default: one per core), each with its own transport and its own
+        # range of identifiers, with rate and maxInFlight shared out between them. Targets are handed out in chunks
+        # to whichever worker has room and completed IcmpSweepTargets are yielded as the workers send them back.
+        # An IcmpShardReport per worker and one merged over all of them are left in getLastShardReports() at the end.
+        print("sweepSharded Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        if workers is None:
+            workers = os.cpu_count() or 1
+        identifiersPerShard = IcmpHelperLibrary.IcmpSweepShard.IDENTIFIERS_PER_SHARD
+        if workers < 1 or workers * identifiersPerShard > 0x10000:
+            raise ValueError("workers must be between 1 and %d" % (0x10000 // identifiersPerShard))
+        firstIdentifier = IcmpHelperLibrary.allocatePacketIdentifiers(workers * identifiersPerShard)[0]
+
+        startTime = time.monotonic()
+        resultQueue = multiprocessing.Queue()
+        targetQueues = []
+        processes = []
+        totalReport = IcmpHelperLibrary.IcmpShardReport(
+            None, range(firstIdentifier, firstIdentifier + workers * identifiersPerShard))
+        shardReports = []
+        try:
+            for shardIndex in range(workers):
+                shardIdentifier = firstIdentifier + shardIndex * identifiersPerShard
+                sweepShard = IcmpHelperLibrary.IcmpSweepShard(shardIndex,
+                                                              range(shardIdentifier,
+                                                                    shardIdentifier + identifiersPerShard),
+                                                              count, timeout, interval, rate / workers,
+                                                              max(maxInFlight // workers, 1), batchSize,
+                                                              self.__transport)
+                targetQueue = multiprocessing.Queue(4)              # Feeding stays a few chunks ahead, no more
+                process = multiprocessing.Process(target=sweepShard.run, args=(targetQueue, resultQueue),
+                                                  daemon=True)
+                process.start()
+                targetQueues.append(targetQueue)
+                processes.append(process)
+
+            # Read far enough ahead to tell a short target list from a long one: a short one is split evenly over the
+            # workers instead of going to the first one in a single chunk
+            targetIterator = iter(IcmpHelperLibrary.iterateTargets(targets))
+            lookahead = list(itertools.islice(targetIterator, workers * self.__SHARD_CHUNK_SIZE))
+            chunkSize = max(min(self.__SHARD_CHUNK_SIZE, -(-len(lookahead) // workers)), 1)
+            targetIterator = itertools.chain(lookahead, targetIterator)
+            chunk = []
+            nextQueue = 0
+            unterminatedQueues = None       # Queues still waiting for their closing None once targets run out
+            while len(shardReports) < workers:
+                # Top up whichever queues have room, never blocking on a busy worker
+                while unterminatedQueues is None:
+                    if len(chunk) == 0:
+                        chunk = [target for i, target in zip(range(chunkSize), targetIterator)]
+                    if len(chunk) == 0:
+                        unterminatedQueues = list(targetQueues)
+                        break
+                    for i in range(workers):
+                        try:
+                            targetQueues[(nextQueue + i) % workers].put_nowait(chunk)
+                        except queue.Full:
+                            continue
+                        nextQueue = (nextQueue + i + 1) % workers
+                        chunk = []
+                        break
+                    if len(chunk) > 0:
+                        break
+                if unterminatedQueues is not None:
+                    for targetQueue in list(unterminatedQueues):
+                        try:
+                            targetQueue.put_nowait(None)
+                            unterminatedQueues.remove(targetQueue)
+                        except queue.Full:
+                            pass
+
+                try:
+                    messageType, shardIndex, payload = resultQueue.get(timeout=0.05)
+                except queue.Empty:
+                    for shardIndex, process in enumerate(processes):
+                        if not process.is_alive() and shardIndex not in [shardReport.getShardIndex()
+                                                                         for shardReport in shardReports]:
+                            raise RuntimeError("sweep worker %d exited with code %s" % (shardIndex, process.exitcode))
+                    continue
+                if messageType == IcmpHelperLibrary.IcmpSweepShard.MESSAGE_TARGETS:
+                    yield from payload
+                    continue
+                if payload.getError() is not None:
+                    raise RuntimeError("sweep worker %d failed: %s" % (shardIndex, payload.getError()))
+                shardReports.append(payload)
+                totalReport.merge(payload)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            for targetQueue in targetQueues:
+                targetQueue.cancel_join_thread()
+                targetQueue.close()
+            resultQueue.cancel_join_thread()
+            resultQueue.close()
+
+        totalReport.setElapsed(time.monotonic() - startTime)
+        self.__lastShardReports = sorted(shardReports, key=IcmpHelperLibrary.IcmpShardReport.getShardIndex) + \
+            [totalReport]
+        for shardReport in self.__lastShardReports:
+            print(shardReport.formatConsoleLine(), file=sys.stderr) if self.__DEBUG_IcmpHelperLibrary else 0
+
+    def createMonitor(self, targets, interval=1, timeout=1, reportInterval=10, icmpSocket=None):
+        # IcmpMonitor over this library's resolver and sink; run() it, reload or stop it from elsewhere. Without
+        # icmpSocket it uses this library's socket, or opens a transport of its own that run() closes when it returns.
+        ownsSocket = False
+        if icmpSocket is None:
+            icmpSocket, ownsSocket = self.__acquireIcmpSocket()
+        return IcmpHelperLibrary.IcmpMonitor(icmpSocket, targets, interval, timeout, reportInterval, self.__resolver,
+                                             self.__sink, ownsSocket=ownsSocket)
+
+    def monitor(self, targets, interval=1, timeout=1, reportInterval=10, duration=None):
+        # Probes targets (same specifications as sweep()) every interval seconds until duration runs out or the
+        # process is interrupted. Use createMonitor() to keep a handle for reloading the targets.
+        print("monitor Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        icmpSocket, ownsSocket = self.__acquireIcmpSocket()
+        try:
+            self.createMonitor(targets, interval, timeout, reportInterval, icmpSocket).run(duration)
+        finally:
+            if ownsSocket:
+                icmpSocket.close()
+
+    def traceRouteMany(self, targets, startTtl=4, probesPerHop=1, timeout=None, gapLimit=5):
+        # Doubletree trace of many destinations (same target specifications as sweep()). Each trace starts at
+        # startTtl, probes forward until the destination or an interface already seen towards that /24, then backward
+        # until an interface already seen at all. The stop sets live in getHopCache() and outlast the call. Yields an
+        # IcmpTraceResult per destination, its probes and the trace also go to the sink. getHopCache().getProbesSaved()
+        # totals the probes the stop sets saved. Probes wait as long as each hop's retransmission timer says (or
+        # timeout seconds).
+        print("traceRouteMany Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        if probesPerHop < 1 or probesPerHop > 256:
+            raise ValueError("probesPerHop must be between 1 and 256")     # The sequence number is (ttl << 8) | probe
+        hopCache = self.getHopCache()
+        packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(IcmpHelperLibrary.allocatePacketIdentifiers()[0])
+        icmpSocket, ownsSocket = self.__acquireIcmpSocket()
+        try:
+            for target in IcmpHelperLibrary.iterateTargets(targets):
+                traceResult = self.__sendIcmpTraceRouteDoubletree(target, startTtl, probesPerHop, timeout, gapLimit,
+                                                                  hopCache, packetTemplate, icmpSocket)
+                if traceResult.getError() is None:
+                    self.__sink.begin("trace", target, traceResult.getDestinationIpAddress())
+                    for ttl, probeResults in traceResult.getHops():
+                        for probeResult in probeResults:
+                            self.__sink.write(probeResult)
+                self.__sink.write(traceResult)
+                self.__sink.flush()
+                yield traceResult
+        finally:
+            if ownsSocket:
+                icmpSocket.close()
+
+    def sendPing(self, targetHost, count=4, interval=0, keepProbes=None, timeout=None):
+        # Returns an IcmpPingResult; the probes and the summary also go to the sink. Sends count probes (None pings
+        # until interrupted) every interval seconds. The probes are kept unless count is None (keepProbes None) or
+        # keepProbes is False, so an endless ping runs in constant memory; pass keepProbes=True to keep them anyway.
+        # Each reply is waited for as long as the target's retransmission timer says, or timeout seconds when given.
+        print("ping Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        icmpSocket, ownsSocket = self.__acquireIcmpSocket()
+        try:
+            return self.__sendIcmpEchoRequest(targetHost, 255, icmpSocket, count, interval, keepProbes, timeout)
+        finally:
+            if ownsSocket:
+                icmpSocket.close()
+
+    def traceRoute(self, targetHost, maxTtl=255, probesPerHop=4, gapLimit=5, timeout=None, deadline=300):
+        # Returns one IcmpPingResult per hop, the last one being the destination unless the trace stopped first: at
+        # maxTtl, after gapLimit silent hops in a row (None never), at a Destination Unreachable or when deadline
+        # seconds ran out (None for no deadline). Probes wait as long as each hop's retransmission timer says (or
+        # timeout seconds), so a silent hop costs about (1 + 2 + 4 + 8) times the timeout of the hop before it.
+        print("traceRoute Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        icmpSocket, ownsSocket = self.__acquireIcmpSocket()
+        try:
+            return self.__sendIcmpTraceRoute(targetHost, icmpSocket, maxTtl, probesPerHop, gapLimit, timeout, deadline)
+        finally:
+            if ownsSocket:
+                icmpSocket.close()
+
+    def traceRouteParallel(self, targetHost, windowSize=32, probesPerHop=3, timeout=None, resolveNames=False,
+                           flowId=None):
+        # Sends the probes for windowSize TTLs at once (255 sends all of them) and returns an IcmpTraceResult holding
+        # every probe up to the destination hop, timeouts included. resolveNames looks hop names up in the background.
+        # flowId keeps every probe on that one flow (Paris traceroute) so hops of load balanced paths do not mix.
+        # Probes wait as long as each hop's retransmission timer says, or timeout seconds when given.
+        print("traceRouteParallel Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        if probesPerHop < 1 or probesPerHop > 256:
+            raise ValueError("probesPerHop must be between 1 and 256")     # The sequence number is (ttl << 8) | probe
+        icmpSocket, ownsSocket = self.__acquireIcmpSocket()
+        try:
+            return self.__sendIcmpTraceRouteParallel(targetHost, windowSize, probesPerHop, timeout, resolveNames,
+                                                     flowId, icmpSocket)
+        finally:
+            if ownsSocket:
+                icmpSocket.close()
+
+    def traceRouteMultipath(self, targetHost, confidence=0.95, maxTtl=32, timeout=None, gapLimit=3,
+                            maxFlowsPerHop=256):
+        # Multipath Detection Algorithm (MDA) over Paris traceroute probes. Every probe belongs to a flow whose
+        # checksum stays fixed, so load balancers send it down one path, and every interface gets as many flows as
+        # IcmpMdaStoppingRule needs to have found all its next hops with the given confidence. Returns an
+        # IcmpMultipathResult holding the per hop successor graph, which also goes to the sink. Probes wait as long
+        # as each hop's retransmission timer says, or timeout seconds when given.
+        print("traceRouteMultipath Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        stoppingRule = IcmpHelperLibrary.IcmpMdaStoppingRule(confidence)
+        packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(IcmpHelperLibrary.allocatePacketIdentifiers()[0])
+        icmpSocket, ownsSocket = self.__acquireIcmpSocket()
+        try:
+            multipathResult = self.__sendIcmpTraceRouteMultipath(targetHost, stoppingRule, maxTtl, timeout, gapLimit,
+                                                                 maxFlowsPerHop, packetTemplate, icmpSocket)
+        finally:
+            if ownsSocket:
+                icmpSocket.close()
+        if multipathResult.getError() is None:
+            self.__sink.begin("trace", targetHost, multipathResult.getDestinationIpAddress())
+        self.__sink.write(multipathResult)
+        self.__sink.flush()
+        return multipathResult
+
+    async def sendPingAsync(self, targetHost, count=4, timeout=None, interval=0, deadline=None, session=None):
+        # Awaitable ping returning an IcmpPingResult with its probes. deadline bounds the whole run in seconds; probes
+        # that no longer fit are not sent. Pass a shared IcmpAsyncSession to run many pings concurrently over one
+        # socket. Each reply is waited for as long as the target's retransmission timer says, or timeout seconds when
+        # given, as in sendPing(). Nothing goes to the sink.
+        print("sendPingAsync Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        loop = asyncio.get_running_loop()
+        endTime = None if deadline is None else loop.time() + deadline
+        destinationIpAddress = await self.__resolver.resolveAsync(targetHost)
+
+        timer = self.getRetransmissionTimer(destinationIpAddress) if timeout is None else None
+        if timer is not None:
+            timer.resetBackoff()
+
+        ownsSession = session is None
+        if ownsSession:
+            session = IcmpHelperLibrary.IcmpAsyncSession(transport=self.__transport,
+                                                         kernelTimestamps=self.__kernelTimestamps)
+        try:
+            pingResult = IcmpHelperLibrary.IcmpPingResult(targetHost, destinationIpAddress, 255)
+            for i in range(count):
+                probeTimeout = timer.getTimeout() if timer is not None else timeout
+                if endTime is not None:
+                    probeTimeout = min(probeTimeout, endTime - loop.time())
+                if probeTimeout <= 0:
+                    break
+                probeResult = await session.probeResult(targetHost, destinationIpAddress, 255, probeTimeout)
+                pingResult.addProbe(probeResult)
+                if timer is not None and probeResult.isAnswered():
+                    timer.addSample(probeResult.getRttNs() / 1e9)
+                elif timer is not None:
+                    timer.backOff()
+                if interval > 0 and i < count - 1:
+                    await asyncio.sleep(interval)
+            return pingResult
+        finally:
+            if ownsSession:
+                session.close()
+
+    async def traceRouteAsync(self, targetHost, windowSize=32, probesPerHop=3, timeout=5, deadline=None, session=None):
+        # Awaitable counterpart of traceRouteParallel(), returning an IcmpTraceResult the same way. Probes above the
+        # destination hop are cancelled as soon as the destination answers. Nothing goes to the sink.
+        print("traceRouteAsync Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        loop = asyncio.get_running_loop()
+        endTime = None if deadline is None else loop.time() + deadline
+        host_ip = await self.__resolver.resolveAsync(targetHost)
+
+        ownsSession = session is None
+        if ownsSession:
+            session = IcmpHelperLibrary.IcmpAsyncSession(transport=self.__transport,
+                                                         kernelTimestamps=self.__kernelTimestamps)
+        try:
+            return await self.__traceRouteWindowedAsync(targetHost, host_ip, windowSize, probesPerHop, timeout,
+                                                        endTime, session)
+        finally:
+            if ownsSession:
+                session.close()
+
+    async def pingManyAsync(self, targets, count=4, timeout=1, interval=1, maxInFlight=256, session=None):
+        # Async generator pinging targets (same specifications as sweep()) like sendPing(), up to maxInFlight of them
+        # at once over one IcmpAsyncSession. Yields an IcmpPingResult with its probes per target as soon as it is done,
+        # in completion order; a target that does not resolve yields one with getError() set. Targets are read lazily,
+        # never further ahead than there are free slots. Nothing goes to the sink.
+        print("pingManyAsync Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        ownsSession = session is None
+        if ownsSession:
+            session = IcmpHelperLibrary.IcmpAsyncSession(transport=self.__transport,
+                                                         kernelTimestamps=self.__kernelTimestamps)
+        pingResults = self.__runManyAsync(targets, maxInFlight,
+                                          lambda target: self.__pingTargetAsync(target, count, timeout, interval,
+                                                                                session))
+        try:
+            async for pingResult in pingResults:
+                yield pingResult
+        finally:
+            await pingResults.aclose()
+            if ownsSession:
+                session.close()
+
+    async def traceRouteManyAsync(self, targets, windowSize=32, probesPerHop=3, timeout=2, deadline=None,
+                                  maxInFlight=16, session=None):
+        # Async generator running traceRouteAsync() to up to maxInFlight targets at once over one IcmpAsyncSession.
+        # Yields an IcmpTraceResult holding every probe (timeouts included) per target as soon as it is done, with
+        # getError() set when the target does not resolve. deadline bounds each trace in seconds. Targets are read as
+        # in pingManyAsync(). Nothing goes to the sink.
+        print("traceRouteManyAsync Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        ownsSession = session is None
+        if ownsSession:
+            session = IcmpHelperLibrary.IcmpAsyncSession(transport=self.__transport,
+                                                         kernelTimestamps=self.__kernelTimestamps)
+        traceResults = self.__runManyAsync(targets, maxInFlight,
+                                           lambda target: self.__traceTargetAsync(target, windowSize, probesPerHop,
+                                                                                  timeout, deadline, session))
+        try:
+            async for traceResult in traceResults:
+                yield traceResult
+        finally:
+            await traceResults.aclose()
+            if ownsSession:
+                session.close()
+
+
+# #################################################################################################################### #
+# main()                                                                                                               #
+#                                                                                                                      #
+#                                                                                                                      #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+EXIT_SUCCESS = 0                # Every target answered (ping, sweep) or was reached (trace)
+EXIT_UNREACHABLE = 1            # At least one target did not
+EXIT_ERROR = 2                  # At least one target could not be probed (e.g. did not resolve), or bad arguments
+EXIT_INTERRUPTED = 130          # Stopped by Ctrl-C; what finished until then was written
+
+def parseTime(text):
+    # Seconds since the epoch from "1700000000" or an ISO 8601 date/time (local time unless it has an offset)
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a time: %s" % text)
+
+def addTargetArguments(subparser, maxInFlight):
+    # Arguments shared by the commands that stream one record per target
+    subparser.add_argument("targets", nargs="*",
+                           help="host names, addresses or CIDR blocks (none: read them from stdin)")
+    subparser.add_argument("-f", "--file", action="append", default=[],
+                           help="read targets from a file, one per line ('-' for stdin)")
+    subparser.add_argument("--max-in-flight", type=int, default=maxInFlight, help="targets probed concurrently")
+    subparser.add_argument("--format", choices=("jsonl", "console", "csv"), default="jsonl",
+                           help="output written as each target completes (csv only has the per target summaries)")
+
+def createSink(outputFormat, recordType):
+    if outputFormat == "jsonl":
+        return IcmpHelperLibrary.IcmpJsonLinesSink(sys.stdout)
+    if outputFormat == "csv":
+        return IcmpHelperLibrary.IcmpCsvSink(sys.stdout, recordType)
+    return IcmpHelperLibrary.IcmpConsoleSink()
+
+def writeResult(sink, result):
+    # Writes a finished target (its probes first, when it has any) and returns its exit status
+    if result.getError() is not None:
+        sink.write(result)
+        sink.flush()
+        return EXIT_ERROR
+    if result.RECORD_TYPE == IcmpHelperLibrary.IcmpTraceResult.RECORD_TYPE:
+        sink.begin("trace", result.getTarget(), result.getDestinationIpAddress())
+        for ttl, probeResults in result.getHops():
+            for probeResult in probeResults:
+                sink.write(probeResult)
+        reached = result.getStopReason() == IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION
+    elif result.RECORD_TYPE == IcmpHelperLibrary.IcmpPingResult.RECORD_TYPE:
+        sink.begin("ping", result.getTarget(), result.getDestinationIpAddress(), result.getPacketsSent())
+        for probeResult in result.getProbes():
+            sink.write(probeResult)
+        reached = result.getPacketsReceived() > 0
+    else:
+        reached = result.getPacketsReceived() > 0
+    sink.write(result)
+    sink.flush()
+    return EXIT_SUCCESS if reached else EXIT_UNREACHABLE
+
+async def writeResultsAsync(sink, results):
+    exitStatus = EXIT_SUCCESS
+    async for result in results:
+        exitStatus = max(exitStatus, writeResult(sink, result))
+    return exitStatus
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ICMP ping, trace route and sweep")
+    parser.add_argument("--transport", choices=("auto", "raw", "dgram", "simulated"), default="auto",
+                        help="raw socket (needs privileges), ping socket (no privileges) or a simulated network; "
+                             "auto falls back from raw to ping sockets")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve metrics on localhost at this port (/metrics for Prometheus, /metrics.json)")
+    parser.add_argument("--metrics-file", default=None, help="append a JSON metrics snapshot to this file periodically")
+    parser.add_argument("--metrics-interval", type=float, default=10, help="seconds between metrics snapshots")
+    parser.add_argument("--archive", default=None,
+                        help="also append every probe to this result archive (query it with the archive command)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pingParser = subparsers.add_parser("ping", help="ping targets, many at once over one socket")
+    addTargetArguments(pingParser, 256)
+    pingParser.add_argument("-c", "--count", type=int, default=4, help="probes per target")
+    pingParser.add_argument("-i", "--interval", type=float, default=1, help="seconds between probes to a target")
+    pingParser.add_argument("-t", "--timeout", type=float, default=1, help="seconds to wait for each reply")
+    traceParser = subparsers.add_parser("trace", help="trace the route to targets, many at once over one socket")
+    addTargetArguments(traceParser, 16)
+    traceParser.add_argument("-w", "--window", type=int, default=32, help="TTLs probed at once per target")
+    traceParser.add_argument("-q", "--queries", type=int, default=3, help="probes per hop")
+    traceParser.add_argument("-t", "--timeout", type=float, default=2, help="seconds to wait for the replies of a "
+                                                                           "window")
+    traceParser.add_argument("-d", "--deadline", type=float, default=None, help="seconds one trace may take at most")
+    sweepParser = subparsers.add_parser("sweep", help="ping many targets at once (fping style)")
+    addTargetArguments(sweepParser, 1024)
+    sweepParser.add_argument("-c", "--count", type=int, default=4, help="probes per target")
+    sweepParser.add_argument("-i", "--interval", type=float, default=1, help="seconds between probes to a target")
+    sweepParser.add_argument("-t", "--timeout", type=float, default=1, help="seconds to wait for each reply")
+    sweepParser.add_argument("-r", "--rate", type=float, default=1000, help="probes per second over all targets")
+    sweepParser.add_argument("--batch-size", type=int, default=64,
+                             help="probes per sendmmsg/recvmmsg call (1 sends and receives one at a time)")
+    sweepParser.add_argument("-w", "--workers", type=int, default=1,
+                             help="worker processes to split the targets over (0 for one per core)")
+    sweepParser.add_argument("-s", "--stats", action="store_true",
+                             help="print probes per second and syscalls per probe to stderr at the end")
+    monitorParser = subparsers.add_parser("monitor", help="probe targets at fixed intervals until interrupted "
+                                                          "(SIGHUP re-reads target files)")
+    monitorParser.add_argument("targets", nargs="*", help="host names, addresses or CIDR blocks")
+    monitorParser.add_argument("-f", "--file", action="append", default=[],
+                               help="read targets from a file, one per line")
+    monitorParser.add_argument("-i", "--interval", type=float, default=1, help="seconds between probes to a target")
+    monitorParser.add_argument("-t", "--timeout", type=float, default=1, help="seconds to wait for each reply")
+    monitorParser.add_argument("--report-interval", type=float, default=10, help="seconds between scheduler reports")
+    monitorParser.add_argument("-d", "--duration", type=float, default=None, help="stop after this many seconds")
+    benchmarkParser = subparsers.add_parser("benchmark", help="measure checksum, build, parse and probe rates "
+                                                              "(no network or privileges needed)")
+    benchmarkParser.add_argument("suites", nargs="*", help="suites to run: %s (default: all)" %
+                                                           ", ".join(IcmpHelperLibrary.IcmpBenchmark.SUITES))
+    benchmarkParser.add_argument("-r", "--repeat", type=int, default=5, help="runs per measurement")
+    benchmarkParser.add_argument("--min-time", type=float, default=0.2, help="seconds one run should take at least")
+    benchmarkParser.add_argument("--format", choices=("console", "jsonl", "csv"), default="console",
+                                 help="output format (jsonl and csv are meant for tracking results across versions)")
+    archiveParser = subparsers.add_parser("archive", help="loss, RTT percentiles and path changes per target and "
+                                                          "hour from a result archive")
+    archiveParser.add_argument("path", help="archive written with --archive")
+    archiveParser.add_argument("-t", "--target", default=None, help="only this target address")
+    archiveParser.add_argument("--start", type=parseTime, default=None,
+                               help="first time included (ISO 8601 or seconds since the epoch)")
+    archiveParser.add_argument("--end", type=parseTime, default=None,
+                               help="first time no longer included (ISO 8601 or seconds since the epoch)")
+    archiveParser.add_argument("--bucket", type=float, default=3600, help="seconds per aggregate")
+    args = parser.parse_args(argv)
+    if args.command in ("ping", "sweep") and args.count < 1:
+        parser.error("count must be at least 1")
+    if args.command in ("ping", "trace") and args.transport == IcmpHelperLibrary.IcmpSimulatedSocket.TRANSPORT_NAME:
+        parser.error("%s runs on an event loop, which cannot drive the simulated transport" % args.command)
+    targets = None
+    if args.command in ("ping", "trace", "sweep"):
+        targets = args.targets + args.file
+        if len(targets) == 0:
+            if sys.stdin.isatty():
+                parser.error("no targets: pass them as arguments, with -f or on stdin")
+            targets = ["-"]
+    icmpHelperPing = IcmpHelperLibrary(transport=args.transport)
+    if targets is not None:
+        recordTypes = {"ping": IcmpHelperLibrary.IcmpPingResult.RECORD_TYPE,
+                       "trace": IcmpHelperLibrary.IcmpTraceResult.RECORD_TYPE,
+                       "sweep": IcmpHelperLibrary.IcmpSweepTarget.RECORD_TYPE}
+        icmpHelperPing.setSink(createSink(args.format, recordTypes[args.command]))
+    if args.archive is not None and args.command != "archive":
+        icmpHelperPing.setSink(IcmpHelperLibrary.IcmpTeeSink(icmpHelperPing.getSink(),
+                                                             IcmpHelperLibrary.IcmpArchiveSink(args.archive)))
+
+    metricsExporters = []
+    if args.metrics_port is not None or args.metrics_file is not None:
+        metrics = IcmpHelperLibrary.IcmpMetrics()
+        IcmpHelperLibrary.IcmpMetrics.setActive(metrics)
+        if args.metrics_port is not None:
+            metricsExporters.append(IcmpHelperLibrary.IcmpMetricsServer(metrics, args.metrics_port))
+        if args.metrics_file is not None:
+            metricsExporters.append(IcmpHelperLibrary.IcmpMetricsSnapshotWriter(metrics, args.metrics_file,
+                                                                                args.metrics_interval))
+    try:
+        if args.command == "benchmark":
+            for suite in args.suites:
+                if suite not in IcmpHelperLibrary.IcmpBenchmark.SUITES:
+                    parser.error("unknown benchmark suite: %s" % suite)
+            sink = createSink(args.format, IcmpHelperLibrary.IcmpBenchmarkResult.RECORD_TYPE)
+            IcmpHelperLibrary.IcmpBenchmark(args.repeat, args.min_time, sink).run(
+                args.suites or IcmpHelperLibrary.IcmpBenchmark.SUITES)
+            sink.close()
+            return
+
+        if args.command == "archive":
+            sink = icmpHelperPing.getSink()
+            with IcmpHelperLibrary.IcmpResultArchive(args.path) as archive:
+                for aggregate in archive.aggregate(args.target, args.start, args.end, args.bucket):
+                    sink.write(aggregate)
+            sink.flush()
+            return
+
+        if args.command == "monitor":
+            icmpSocket = IcmpHelperLibrary.openTransport(args.transport)
+            try:
+                monitor = icmpHelperPing.createMonitor(args.targets + args.file, args.interval, args.timeout,
+                                                       args.report_interval, icmpSocket)
+                if hasattr(signal, "SIGHUP"):
+                    signal.signal(signal.SIGHUP, lambda signalNumber, frame: monitor.requestReload())
+                monitor.run(args.duration)
+            finally:
+                icmpSocket.close()
+            return
+
+        sink = icmpHelperPing.getSink()
+        if args.command == "ping":
+            return asyncio.run(writeResultsAsync(sink, icmpHelperPing.pingManyAsync(
+                targets, args.count, args.timeout, args.interval, args.max_in_flight)))
+
+        if args.command == "trace":
+            return asyncio.run(writeResultsAsync(sink, icmpHelperPing.traceRouteManyAsync(
+                targets, args.window, args.queries, args.timeout, args.deadline, args.max_in_flight)))
+
+        if args.workers == 1:
+            sweepTargets = icmpHelperPing.sweep(targets, args.count, args.timeout, args.interval, args.rate,
+                                                args.max_in_flight, args.batch_size)
+        else:
+            sweepTargets = icmpHelperPing.sweepSharded(targets, args.workers or None, args.count, args.timeout,
+                                                       args.interval, args.rate, args.max_in_flight, args.batch_size)
+        exitStatus = EXIT_SUCCESS
+        for sweepTarget in sweepTargets:
+            exitStatus = max(exitStatus, writeResult(sink, sweepTarget))
+        if args.stats and args.workers != 1 and icmpHelperPing.getLastShardReports() is not None:
+            for shardReport in icmpHelperPing.getLastShardReports():
+                print(shardReport.formatConsoleLine(), file=sys.stderr)
+        elif args.stats and icmpHelperPing.getLastIoReport() is not None:
+            print(icmpHelperPing.getLastIoReport().formatConsoleLine(), file=sys.stderr)
+        return exitStatus
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        icmpHelperPing.getSink().close()
+        for metricsExporter in metricsExporters:
+            metricsExporter.close()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
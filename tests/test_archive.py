@@ -0,0 +1,163 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpResultArchiveTest                                                                                          #
+#                                                                                                                      #
+# The numpy and the pure Python query paths over the same archive file must agree.                                     #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpResultArchiveTest(unittest.TestCase):
+    __START_NS = 1700000000 * 10 ** 9
+    __TARGETS = ("192.0.2.10", "192.0.2.20", "198.51.100.7")
+    __ROUTERS = ("10.0.0.1", "10.0.0.2", "10.0.1.1")
+
+    def setUp(self):
+        rng = random.Random(5)
+        archiveFile = tempfile.NamedTemporaryFile(suffix=".icmparch", delete=False)
+        self.__path = archiveFile.name
+        self.addCleanup(os.remove, self.__path)
+        records = [IcmpHelperLibrary.IcmpResultArchive.packHeader()]
+        for i in range(3000):
+            target = rng.choice(self.__TARGETS)
+            timeNs = self.__START_NS + rng.randrange(0, 6 * 3600 * 10 ** 9)
+            if rng.random() < 0.3:
+                # Trace hop answering from one of several routers, so the path changes
+                probeResult = IcmpHelperLibrary.IcmpProbeResult(target, target, 3, 1, i, "error",
+                                                                rng.choice(self.__ROUTERS), 11, 0,
+                                                                rng.randrange(10 ** 5, 10 ** 8))
+            elif rng.random() < 0.2:
+                probeResult = IcmpHelperLibrary.IcmpProbeResult(target, target, 255, 1, i, "timeout")
+            else:
+                probeResult = IcmpHelperLibrary.IcmpProbeResult(target, target, 255, 1, i, "reply", target, 0, 0,
+                                                                rng.randrange(10 ** 5, 10 ** 8))
+            records.append(IcmpHelperLibrary.IcmpResultArchive.packRecord(probeResult, timeNs))
+        archiveFile.write(b"".join(records))
+        archiveFile.close()
+
+    def __aggregate(self, withNumpy, **arguments):
+        if withNumpy:
+            with IcmpHelperLibrary.IcmpResultArchive(self.__path) as archive:
+                return [aggregate.toDict() for aggregate in archive.aggregate(**arguments)]
+        with mock.patch.object(icmpHelperModule, "numpy", None):
+            with IcmpHelperLibrary.IcmpResultArchive(self.__path) as archive:
+                return [aggregate.toDict() for aggregate in archive.aggregate(**arguments)]
+
+    def __assertSameAggregates(self, **arguments):
+        numpyAggregates = self.__aggregate(True, **arguments)
+        pythonAggregates = self.__aggregate(False, **arguments)
+        self.assertEqual(len(numpyAggregates), len(pythonAggregates))
+        for numpyAggregate, pythonAggregate in zip(numpyAggregates, pythonAggregates):
+            self.assertEqual(numpyAggregate.keys(), pythonAggregate.keys())
+            for key in numpyAggregate:
+                if isinstance(numpyAggregate[key], float):
+                    self.assertAlmostEqual(numpyAggregate[key], pythonAggregate[key], places=6, msg=key)
+                else:
+                    self.assertEqual(numpyAggregate[key], pythonAggregate[key], key)
+        return pythonAggregates
+
+    @unittest.skipIf(icmpHelperModule.numpy is None, "numpy is not installed")
+    def testAggregateAll(self):
+        aggregates = self.__assertSameAggregates()
+        self.assertGreater(sum(aggregate["sent"] for aggregate in aggregates), 0)
+
+    @unittest.skipIf(icmpHelperModule.numpy is None, "numpy is not installed")
+    def testAggregateTarget(self):
+        aggregates = self.__assertSameAggregates(target=self.__TARGETS[1], bucketSeconds=1800)
+        self.assertEqual({aggregate["target"] for aggregate in aggregates}, {self.__TARGETS[1]})
+
+    @unittest.skipIf(icmpHelperModule.numpy is None, "numpy is not installed")
+    def testAggregateTimeRange(self):
+        startTime = self.__START_NS / 1e9 + 3600
+        self.__assertSameAggregates(startTime=startTime, endTime=startTime + 7200, bucketSeconds=600)
+
+    @unittest.skipIf(icmpHelperModule.numpy is None, "numpy is not installed")
+    def testAggregateNothingSelected(self):
+        self.assertEqual(self.__assertSameAggregates(target="203.0.113.1"), [])
+
+    def testRecordsRoundTrip(self):
+        with mock.patch.object(icmpHelperModule, "numpy", None):
+            with IcmpHelperLibrary.IcmpResultArchive(self.__path) as archive:
+                self.assertEqual(archive.getRecordCount(), 3000)
+                records = list(archive.iterateRecords(target=self.__TARGETS[0]))
+        self.assertGreater(len(records), 0)
+        for timeSeconds, rttNs, target, responder, ttl, icmpType, icmpCode, status in records:
+            self.assertEqual(target, self.__TARGETS[0])
+            self.assertIn(status, IcmpHelperLibrary.IcmpResultArchive.STATUSES)
+            if status == "timeout":
+                self.assertIsNone(responder)
+
+
+
+# #################################################################################################################### #
+# Class IcmpArchiveSinkTest                                                                                            #
+#                                                                                                                      #
+# What IcmpArchiveSink stores: probes stamped with the time they were sent, and the probes of sweep records.           #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpArchiveSinkTest(unittest.TestCase):
+    __TARGETS = ["192.0.2.1", "192.0.2.2", "192.0.2.3"]
+
+    def setUp(self):
+        archiveFile = tempfile.NamedTemporaryFile(suffix=".icmparch", delete=False)
+        archiveFile.close()                 # Left empty, the sink writes the header
+        self.__path = archiveFile.name
+        self.addCleanup(os.remove, self.__path)
+
+    def __readRecords(self):
+        with mock.patch.object(icmpHelperModule, "numpy", None):
+            with IcmpHelperLibrary.IcmpResultArchive(self.__path) as archive:
+                return list(archive.iterateRecords())
+
+    def testProbeIsStampedWithItsSendTime(self):
+        sink = IcmpHelperLibrary.IcmpArchiveSink(self.__path)
+        sink.write(IcmpHelperLibrary.IcmpProbeResult("192.0.2.9", "192.0.2.9", 255, 1, 1, "reply", "192.0.2.9", 0, 0,
+                                                     2500000, timeSent=1700000000.25))
+        sink.close()
+        (timeSeconds, rttNs, target, responder, ttl, icmpType, icmpCode, status), = self.__readRecords()
+        self.assertAlmostEqual(timeSeconds, 1700000000.25, places=5)
+        self.assertEqual((rttNs, target, status), (2500000, "192.0.2.9", "reply"))
+
+    def testSweepProbesAreArchived(self):
+        sink = IcmpHelperLibrary.IcmpArchiveSink(self.__path)
+        icmpHelperLibrary = IcmpHelperLibrary(icmpSocket=IcmpHelperLibrary.IcmpSimulatedSocket(delay=0.002, seed=1),
+                                              sink=sink)
+        startTime = time.time()
+        for sweepTarget in icmpHelperLibrary.sweep(self.__TARGETS, count=2, timeout=1, interval=0.01):
+            sink.write(sweepTarget)
+        endTime = time.time()
+        sink.close()
+        records = self.__readRecords()
+        self.assertEqual(len(records), 6)
+        self.assertEqual(sorted(record[2] for record in records), sorted(self.__TARGETS * 2))
+        for timeSeconds, rttNs, target, responder, ttl, icmpType, icmpCode, status in records:
+            self.assertEqual((responder, ttl, status), (target, 255, "reply"))
+            self.assertTrue(startTime <= timeSeconds <= endTime)
+
+    def testSweepCommandFillsTheArchive(self):
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            exitStatus = icmpHelperModule.main(["--transport", "simulated", "--archive", self.__path, "sweep", "-c",
+                                                "2", "-i", "0.01"] + self.__TARGETS)
+        self.assertEqual(exitStatus, 0)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 3)
+        self.assertEqual(len(self.__readRecords()), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
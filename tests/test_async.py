@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpAsyncSessionTest                                                                                           #
+#                                                                                                                      #
+# Probes from an event loop over a simulated socket, which the session reads on timers instead of a descriptor.        #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpAsyncSessionTest(unittest.TestCase):
+    __DESTINATION = "192.0.2.9"
+
+    def testProbesAreAnsweredByTheirHop(self):
+        async def probeAll():
+            async with IcmpHelperLibrary.IcmpAsyncSession(transport=IcmpHelperLibrary.IcmpSimulatedSocket(
+                    delay=0.01, hopCount=3, seed=1)) as session:
+                return await asyncio.gather(*[session.probe(self.__DESTINATION, ttl, timeout=1) for ttl in (1, 2, 3)])
+
+        answers = asyncio.run(probeAll())
+        self.assertEqual([address for rtt, address, icmpType, icmpCode in answers],
+                         ["192.0.2.1", "192.0.2.2", self.__DESTINATION])
+        self.assertEqual([icmpType for rtt, address, icmpType, icmpCode in answers], [11, 11, 0])
+        self.assertTrue(all(rtt > 0 for rtt, address, icmpType, icmpCode in answers))
+
+    def testLostProbeTimesOut(self):
+        async def probeOnce():
+            async with IcmpHelperLibrary.IcmpAsyncSession(transport=IcmpHelperLibrary.IcmpSimulatedSocket(
+                    lossRate=1.0, seed=1)) as session:
+                probeResult = await session.probeResult("lost.example", self.__DESTINATION, timeout=0.05)
+                return probeResult, session.getPendingCount()
+
+        probeResult, pendingCount = asyncio.run(probeOnce())
+        self.assertEqual(probeResult.getStatus(), IcmpHelperLibrary.IcmpProbeResult.STATUS_TIMEOUT)
+        self.assertEqual(pendingCount, 0)
+
+    def testDescriptorlessTransportIsRefused(self):
+        class NoDescriptorSocket(IcmpHelperLibrary.IcmpTransport):
+            def setTtl(self, ttl):
+                pass
+
+            def sendTo(self, packetBytes, destinationIpAddress, ttl):
+                return len(packetBytes)
+
+            def receiveDatagram(self, bufferSize=1024):
+                raise BlockingIOError()
+
+        async def openSession():
+            IcmpHelperLibrary.IcmpAsyncSession(transport=NoDescriptorSocket())
+
+        with self.assertRaises(ValueError):
+            asyncio.run(openSession())
+
+
+# #################################################################################################################### #
+# Class IcmpAsyncPingTest                                                                                              #
+#                                                                                                                      #
+# The library's awaitable ping and trace open their sessions over the library's own transport.                         #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpAsyncPingTest(unittest.TestCase):
+    __DESTINATION = "192.0.2.9"
+
+    def testSendPingAsyncUsesTheLibraryTransport(self):
+        icmpSocket = IcmpHelperLibrary.IcmpSimulatedSocket(delay=0.002, seed=1)
+        icmpHelperLibrary = IcmpHelperLibrary(sink=IcmpHelperLibrary.IcmpQuietSink(), transport=icmpSocket)
+        pingResult = asyncio.run(icmpHelperLibrary.sendPingAsync(self.__DESTINATION, count=3, timeout=1))
+        self.assertEqual((pingResult.getPacketsSent(), pingResult.getPacketsReceived()), (3, 3))
+        self.assertEqual(icmpSocket.getPacketsSent(), 3)
+        self.assertTrue(icmpSocket.isClosed())
+
+    def testTraceRouteAsyncUsesTheLibraryTransport(self):
+        icmpSocket = IcmpHelperLibrary.IcmpSimulatedSocket(delay=0.003, hopCount=3, seed=1)
+        icmpHelperLibrary = IcmpHelperLibrary(sink=IcmpHelperLibrary.IcmpQuietSink(), transport=icmpSocket)
+        traceResult = asyncio.run(icmpHelperLibrary.traceRouteAsync(self.__DESTINATION, windowSize=8, probesPerHop=2,
+                                                                    timeout=1))
+        self.assertEqual(traceResult.getStopReason(), IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION)
+        self.assertEqual([ttl for ttl, probeResults in traceResult.getHops()], [1, 2, 3])
+        self.assertEqual([probeResult.getAddress() for probeResult in traceResult.getHops()[-1][1]],
+                         [self.__DESTINATION] * 2)
+        self.assertGreaterEqual(icmpSocket.getPacketsSent(), 6)
+
+    def testPingManyAsync(self):
+        targets = ["192.0.2.%d" % hostNumber for hostNumber in range(1, 6)]
+        icmpHelperLibrary = IcmpHelperLibrary(sink=IcmpHelperLibrary.IcmpQuietSink(), transport="simulated")
+
+        async def pingAll():
+            return [pingResult async for pingResult in icmpHelperLibrary.pingManyAsync(targets, count=2, timeout=1,
+                                                                                        interval=0.01)]
+
+        pingResults = asyncio.run(pingAll())
+        self.assertEqual(sorted(pingResult.getTarget() for pingResult in pingResults), targets)
+        self.assertTrue(all(pingResult.getPacketsReceived() == 2 for pingResult in pingResults))
+
+
+if __name__ == "__main__":
+    unittest.main()
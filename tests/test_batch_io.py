@@ -0,0 +1,125 @@
+import ctypes
+import errno
+import os
+import select
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpBatchIoFallbackTest                                                                                        #
+#                                                                                                                      #
+# The per-packet path over a simulated socket, which has no file descriptor to batch on.                               #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpBatchIoFallbackTest(unittest.TestCase):
+    __IDENTIFIER = 0x2345
+
+    def testOnlyMatchedRepliesCountAsReceived(self):
+        icmpSocket = IcmpHelperLibrary.IcmpSimulatedSocket(seed=1)
+        batchIo = IcmpHelperLibrary.IcmpBatchIo(icmpSocket, 16)
+        self.assertFalse(batchIo.isBatched())
+        packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(self.__IDENTIFIER)
+        finishedProbes = []
+        for sequenceNumber in range(10):
+            packetView = packetTemplate.build(sequenceNumber)
+            if sequenceNumber < 6:
+                icmpSocket.getDispatcher().register(self.__IDENTIFIER, sequenceNumber, time.time(), 1,
+                                                    finishedProbes.append)
+            batchIo.queueSend(packetView, "192.0.2.9", 64)
+        self.assertEqual(batchIo.flushSends(), 0)       # Already sent one by one
+        received = 0
+        while received < 10:
+            received += batchIo.receiveAvailable(1)
+        self.assertEqual(len(finishedProbes), 6)
+        ioReport = IcmpHelperLibrary.IcmpIoReport(batchIo, 1.0)
+        self.assertEqual((ioReport.getPacketsSent(), ioReport.getPacketsReceived()), (10, 6))
+        self.assertTrue(ioReport.isSyscallCountEstimated())
+        self.assertEqual(ioReport.getProbesPerSecond(), 10)
+
+
+# #################################################################################################################### #
+# Class IcmpBatchIoTest                                                                                                #
+#                                                                                                                      #
+# sendmmsg/recvmmsg over a raw socket to the loopback interface, which needs privileges; skipped without them. The     #
+# raw socket also reads our own echo requests back, which must not count as replies.                                   #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpBatchIoTest(unittest.TestCase):
+    __IDENTIFIER = 0x3456
+
+    def setUp(self):
+        if not IcmpHelperLibrary.IcmpBatchIo.isAvailable():
+            self.skipTest("sendmmsg/recvmmsg not available")
+        try:
+            self.__icmpSocket = IcmpHelperLibrary.IcmpSocket()
+        except PermissionError:
+            self.skipTest("raw sockets need privileges")
+        self.__batchIo = IcmpHelperLibrary.IcmpBatchIo(self.__icmpSocket, 8)
+        self.__packetTemplate = IcmpHelperLibrary.IcmpPacketTemplate(self.__IDENTIFIER)
+        self.__finishedProbes = []
+
+    def tearDown(self):
+        self.__icmpSocket.close()
+
+    def __queueProbes(self, count):
+        for sequenceNumber in range(count):
+            packetView = self.__packetTemplate.build(sequenceNumber)
+            self.__icmpSocket.getDispatcher().register(self.__IDENTIFIER, sequenceNumber, time.time(), 2,
+                                                       self.__finishedProbes.append)
+            self.__batchIo.queueSend(packetView, "127.0.0.1", 64)
+
+    def testBatchedRoundTrip(self):
+        self.assertTrue(self.__batchIo.isBatched())
+        self.__queueProbes(20)
+        deadline = time.monotonic() + 2
+        while len(self.__finishedProbes) < 20 and time.monotonic() < deadline:
+            self.__batchIo.receiveAvailable(deadline - time.monotonic())
+        self.assertEqual(len(self.__finishedProbes), 20)
+        self.assertTrue(all(pendingProbe.isAnswered() for pendingProbe in self.__finishedProbes))
+        self.assertEqual(self.__batchIo.getPacketsSent(), 20)
+        self.assertEqual(self.__batchIo.getPacketsReceived(), 20)
+        self.assertLess(self.__batchIo.getSyscallsPerProbe(), 1)
+
+    def testFullSendBufferIsWaitedFor(self):
+        sendmmsg, recvmmsg = IcmpHelperLibrary.IcmpBatchIo._IcmpBatchIo__loadLibc()
+        calls = []
+
+        def congestedSendmmsg(fileDescriptor, messages, length, flags):
+            calls.append(length)
+            return -1 if len(calls) == 1 else sendmmsg(fileDescriptor, messages, length, flags)
+
+        self.__queueProbes(4)
+        with mock.patch.object(IcmpHelperLibrary.IcmpBatchIo, "_IcmpBatchIo__libc", (congestedSendmmsg, recvmmsg)), \
+                mock.patch.object(ctypes, "get_errno", return_value=errno.EAGAIN):
+            self.assertEqual(self.__batchIo.flushSends(), 4)
+        self.assertEqual(calls, [4, 4])
+        self.assertEqual(self.__batchIo.getSendErrors(), 0)
+
+    def testSendBufferThatStaysFullDropsTheRest(self):
+        calls = []
+
+        def congestedSendmmsg(fileDescriptor, messages, length, flags):
+            calls.append(length)
+            return -1
+
+        self.__queueProbes(4)
+        with mock.patch.object(IcmpHelperLibrary.IcmpBatchIo, "_IcmpBatchIo__libc", (congestedSendmmsg, None)), \
+                mock.patch.object(ctypes, "get_errno", return_value=errno.EAGAIN), \
+                mock.patch.object(select, "select", return_value=([], [], [])):
+            self.assertEqual(self.__batchIo.flushSends(), 0)
+        self.assertEqual(calls, [4])
+        self.assertEqual(self.__batchIo.getSendErrors(), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
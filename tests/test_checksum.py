@@ -0,0 +1,77 @@
+import os
+import random
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpChecksumTest                                                                                               #
+#                                                                                                                      #
+# Incremental updates against the byte pair reference loop, over random buffers and random 16 bit field edits.         #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpChecksumTest(unittest.TestCase):
+    __ROUNDS = 2000
+
+    def __randomBuffer(self, rng, length):
+        packetBytes = bytearray(rng.getrandbits(8) for i in range(length))
+        if not any(packetBytes):
+            packetBytes[0] = 1          # update() differs from a full checksum only for an all zero buffer
+        return packetBytes
+
+    def testCalculateMatchesReference(self):
+        rng = random.Random(1)
+        for length in list(range(0, 70)) + [4095, 4096, 4097, 9001]:
+            packetBytes = bytes(rng.getrandbits(8) for i in range(length))
+            self.assertEqual(IcmpHelperLibrary.IcmpChecksum.calculate(packetBytes),
+                             IcmpHelperLibrary.IcmpChecksum.calculateReference(packetBytes), length)
+
+    def testCalculateWithoutNumpyMatchesReference(self):
+        rng = random.Random(2)
+        with mock.patch.object(icmpHelperModule, "numpy", None):
+            for length in (4096, 4097, 65535):
+                packetBytes = bytes(rng.getrandbits(8) for i in range(length))
+                self.assertEqual(IcmpHelperLibrary.IcmpChecksum.calculate(packetBytes),
+                                 IcmpHelperLibrary.IcmpChecksum.calculateReference(packetBytes), length)
+
+    def testUpdateMatchesReference(self):
+        rng = random.Random(3)
+        for i in range(self.__ROUNDS):
+            packetBytes = self.__randomBuffer(rng, rng.randint(2, 128))
+            checksum = IcmpHelperLibrary.IcmpChecksum.calculateReference(packetBytes)
+            for edit in range(rng.randint(1, 4)):
+                offset = rng.randrange(0, len(packetBytes) // 2) * 2
+                oldWord = packetBytes[offset] << 8 | packetBytes[offset + 1]
+                newWord = rng.choice((0, 0xffff, rng.getrandbits(16)))
+                packetBytes[offset:offset + 2] = newWord.to_bytes(2, "big")
+                if not any(packetBytes):
+                    break
+                checksum = IcmpHelperLibrary.IcmpChecksum.update(checksum, oldWord, newWord)
+                self.assertEqual(checksum, IcmpHelperLibrary.IcmpChecksum.calculateReference(packetBytes),
+                                 (bytes(packetBytes).hex(), offset, oldWord, newWord))
+
+    def testUpdateBytesMatchesReference(self):
+        rng = random.Random(4)
+        for i in range(self.__ROUNDS):
+            packetBytes = self.__randomBuffer(rng, rng.randint(10, 128))
+            checksum = IcmpHelperLibrary.IcmpChecksum.calculateReference(packetBytes)
+            offset = rng.randrange(0, (len(packetBytes) - 8) // 2) * 2
+            oldBytes = bytes(packetBytes[offset:offset + 8])
+            newBytes = bytes(rng.getrandbits(8) for position in range(8))
+            packetBytes[offset:offset + 8] = newBytes
+            if not any(packetBytes):
+                continue
+            self.assertEqual(IcmpHelperLibrary.IcmpChecksum.updateBytes(checksum, oldBytes, newBytes),
+                             IcmpHelperLibrary.IcmpChecksum.calculateReference(packetBytes))
+
+
+if __name__ == "__main__":
+    unittest.main()
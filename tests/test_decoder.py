@@ -0,0 +1,110 @@
+import os
+import socket
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpMessageDecoderTest                                                                                         #
+#                                                                                                                      #
+# Datagrams as a raw socket reads them (IP header first), for the types the decoder tables know and some they don't.   #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpMessageDecoderTest(unittest.TestCase):
+    __IDENTIFIER = 0xbeef
+    __SEQUENCE_NUMBER = 0x0102
+
+    def __ipHeader(self, payloadLength, source, destination, optionWords=0):
+        return struct.pack("!BBHHHBBH4s4s", 0x45 + optionWords, 0, 20 + 4 * optionWords + payloadLength, 0, 0, 64,
+                           socket.IPPROTO_ICMP, 0, socket.inet_aton(source), socket.inet_aton(destination)) + \
+            bytes(4 * optionWords)
+
+    def __errorDatagram(self, icmpType, icmpCode, restOfHeader=0, quotedProtocol=socket.IPPROTO_ICMP,
+                        source="10.0.0.1"):
+        # Error from source quoting an echo request of ours to 192.0.2.9
+        request = struct.pack("!BBHHH", 8, 0, 0, self.__IDENTIFIER, self.__SEQUENCE_NUMBER)
+        quoted = bytearray(self.__ipHeader(len(request), "127.0.0.1", "192.0.2.9") + request)
+        quoted[9] = quotedProtocol
+        message = struct.pack("!BBHI", icmpType, icmpCode, 0, restOfHeader) + bytes(quoted)
+        return self.__ipHeader(len(message), source, "127.0.0.1") + message
+
+    def testEchoReply(self):
+        request = bytes(IcmpHelperLibrary.IcmpPacketTemplate(self.__IDENTIFIER).build(self.__SEQUENCE_NUMBER))
+        message = IcmpHelperLibrary.IcmpMessageDecoder.decode(
+            IcmpHelperLibrary.IcmpSimulatedNetwork.buildEchoReply(request, "192.0.2.9"))
+        self.assertEqual((message.getIcmpType(), message.getIcmpCode()), (0, 0))
+        self.assertEqual((message.getIdentifier(), message.getSequenceNumber()),
+                         (self.__IDENTIFIER, self.__SEQUENCE_NUMBER))
+        self.assertTrue(message.isEchoReply())
+        self.assertTrue(message.isProbeReply())
+        self.assertFalse(message.isError())
+        self.assertEqual(message.getSourceAddress(), "192.0.2.9")
+        self.assertIsNone(message.getQuotedDestinationAddress())
+        self.assertEqual(message.getMessage(), "Echo Reply")
+
+    def testTimeExceededQuotesProbe(self):
+        message = IcmpHelperLibrary.IcmpMessageDecoder.decode(self.__errorDatagram(11, 0))
+        self.assertTrue(message.isError())
+        self.assertTrue(message.isProbeReply())
+        self.assertFalse(message.isEchoReply())
+        self.assertEqual((message.getIdentifier(), message.getSequenceNumber()),
+                         (self.__IDENTIFIER, self.__SEQUENCE_NUMBER))
+        self.assertEqual(message.getQuotedIcmpType(), 8)
+        self.assertEqual(message.getQuotedProtocol(), socket.IPPROTO_ICMP)
+        self.assertEqual(message.getQuotedDestinationAddress(), "192.0.2.9")
+        self.assertEqual(message.getSourceAddress(), "10.0.0.1")
+        self.assertEqual(message.getTypeName(), "Time Exceeded")
+        self.assertEqual(message.getMessage(), "Time to Live exceeded in Transit")
+
+    def testDestinationUnreachableCodes(self):
+        for icmpCode, text in ((0, "Net Unreachable"), (3, "Port Unreachable"),
+                               (13, "Communication Administratively Prohibited")):
+            message = IcmpHelperLibrary.IcmpMessageDecoder.decode(self.__errorDatagram(3, icmpCode))
+            self.assertEqual(message.getMessage(), text)
+            self.assertTrue(message.isProbeReply())
+
+    def testRedirectGatewayAndParameterProblemPointer(self):
+        gateway = struct.unpack("!I", socket.inet_aton("10.0.0.254"))[0]
+        redirect = IcmpHelperLibrary.IcmpMessageDecoder.decode(self.__errorDatagram(5, 1, gateway))
+        self.assertEqual(redirect.getGatewayAddress(), "10.0.0.254")
+        self.assertIsNone(redirect.getPointer())
+        parameterProblem = IcmpHelperLibrary.IcmpMessageDecoder.decode(self.__errorDatagram(12, 0, 9 << 24))
+        self.assertEqual(parameterProblem.getPointer(), 9)
+        self.assertIsNone(parameterProblem.getGatewayAddress())
+
+    def testErrorAboutOtherProtocolIsNoProbeReply(self):
+        message = IcmpHelperLibrary.IcmpMessageDecoder.decode(self.__errorDatagram(3, 3,
+                                                                                   quotedProtocol=socket.IPPROTO_UDP))
+        self.assertTrue(message.isError())
+        self.assertFalse(message.isProbeReply())
+        self.assertEqual((message.getIdentifier(), message.getSequenceNumber()), (-1, -1))
+
+    def testIpOptionsAreSkipped(self):
+        reply = struct.pack("!BBHHH", 0, 0, 0, self.__IDENTIFIER, self.__SEQUENCE_NUMBER) + bytes(8)
+        message = IcmpHelperLibrary.IcmpMessageDecoder.decode(self.__ipHeader(len(reply), "192.0.2.9", "127.0.0.1",
+                                                                              optionWords=2) + reply)
+        self.assertEqual(message.getIpHeaderLength(), 28)
+        self.assertEqual(message.getSequenceNumber(), self.__SEQUENCE_NUMBER)
+
+    def testUnknownTypeAndCode(self):
+        self.assertEqual(IcmpHelperLibrary.IcmpMessageDecoder.getTypeName(42), "Type 42")
+        self.assertEqual(IcmpHelperLibrary.IcmpMessageDecoder.getMessageText(42, 3), "Type 42 (Code 3)")
+        self.assertEqual(IcmpHelperLibrary.IcmpMessageDecoder.getMessageText(11, 7), "Time Exceeded (Code 7)")
+
+    def testTruncatedDatagramsAreRejected(self):
+        datagram = self.__errorDatagram(11, 0)
+        self.assertIsNone(IcmpHelperLibrary.IcmpMessageDecoder.decode(datagram[:27]))
+        self.assertIsNone(IcmpHelperLibrary.IcmpMessageDecoder.decode(datagram[:20 + 8 + 19]))
+        self.assertIsNotNone(IcmpHelperLibrary.IcmpMessageDecoder.decode(datagram))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpReplyDispatcherTest                                                                                        #
+#                                                                                                                      #
+# Replies built the way the simulated network builds them, routed to the probes registered for them.                   #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpReplyDispatcherTest(unittest.TestCase):
+    __IDENTIFIER = 0x1234
+    __DESTINATION = "192.0.2.9"
+
+    def setUp(self):
+        self.__dispatcher = IcmpHelperLibrary.IcmpReplyDispatcher()
+        self.__template = IcmpHelperLibrary.IcmpPacketTemplate(self.__IDENTIFIER)
+        self.__finished = []
+
+    def __register(self, sequenceNumber, timeout=1.0, expectedSource=None):
+        packetBytes = bytes(self.__template.build(sequenceNumber))
+        pendingProbe = self.__dispatcher.register(self.__IDENTIFIER, sequenceNumber, time.time(), timeout,
+                                                  self.__finished.append, "context %d" % sequenceNumber,
+                                                  expectedSource=expectedSource)
+        return pendingProbe, packetBytes
+
+    def __echoReply(self, packetBytes, source=None):
+        source = source if source is not None else self.__DESTINATION
+        return IcmpHelperLibrary.IcmpSimulatedNetwork.buildEchoReply(packetBytes, source), (source, 0)
+
+    def testEchoReplyIsMatched(self):
+        pendingProbe, packetBytes = self.__register(1)
+        self.assertTrue(self.__dispatcher.isPending(self.__IDENTIFIER, 1))
+        self.assertIs(self.__dispatcher.dispatch(*self.__echoReply(packetBytes), time.time()), pendingProbe)
+        self.assertTrue(pendingProbe.isAnswered())
+        self.assertEqual(pendingProbe.getAddress(), (self.__DESTINATION, 0))
+        self.assertEqual(pendingProbe.getIcmpType(), 0)
+        self.assertEqual(pendingProbe.getContext(), "context 1")
+        self.assertEqual(self.__finished, [pendingProbe])
+        self.assertEqual(self.__dispatcher.getPendingCount(), 0)
+
+    def testTimeExceededIsMatchedOnQuotedHeader(self):
+        pendingProbe, packetBytes = self.__register(2)
+        self.__register(3)
+        timeExceeded = IcmpHelperLibrary.IcmpSimulatedNetwork.buildTimeExceeded(packetBytes, self.__DESTINATION,
+                                                                                 "10.0.0.1")
+        self.assertIs(self.__dispatcher.dispatch(timeExceeded, ("10.0.0.1", 0), time.time()), pendingProbe)
+        self.assertEqual(pendingProbe.getIcmpType(), 11)
+        self.assertEqual(pendingProbe.getAddress()[0], "10.0.0.1")
+        self.assertEqual(self.__dispatcher.getPendingCount(), 1)
+
+    def testDuplicateAndStrayRepliesAreUnmatched(self):
+        pendingProbe, packetBytes = self.__register(4)
+        reply = self.__echoReply(packetBytes)
+        self.__dispatcher.dispatch(*reply, time.time())
+        self.assertIsNone(self.__dispatcher.dispatch(*reply, time.time()))
+        strayBytes = bytes(IcmpHelperLibrary.IcmpPacketTemplate(0x4321).build(4))
+        self.assertIsNone(self.__dispatcher.dispatch(*self.__echoReply(strayBytes), time.time()))
+        self.assertIsNone(self.__dispatcher.dispatch(b"\x45" + bytes(10), ("10.0.0.1", 0), time.time()))
+        self.assertEqual(self.__dispatcher.getUnmatchedCount(), 3)
+        self.assertEqual(len(self.__finished), 1)
+
+    def testEchoReplyFromOtherSourceIsUnmatched(self):
+        pendingProbe, packetBytes = self.__register(5, expectedSource=self.__DESTINATION)
+        self.assertIsNone(self.__dispatcher.dispatch(*self.__echoReply(packetBytes, "198.51.100.1"), time.time()))
+        self.assertTrue(pendingProbe.isPending())
+        self.assertIs(self.__dispatcher.dispatch(*self.__echoReply(packetBytes), time.time()), pendingProbe)
+
+    def testDeadlinesExpireInOrder(self):
+        early, packetBytes = self.__register(6, timeout=1.0)
+        late, packetBytes = self.__register(7, timeout=5.0)
+        self.assertAlmostEqual(self.__dispatcher.getNextDeadline(), early.getDeadline())
+        self.assertEqual(self.__dispatcher.expire(early.getDeadline() - 0.001), 0)
+        self.assertEqual(self.__dispatcher.expire(early.getDeadline()), 1)
+        self.assertEqual(early.getState(), IcmpHelperLibrary.IcmpPendingProbe.STATE_EXPIRED)
+        self.assertTrue(late.isPending())
+        self.assertAlmostEqual(self.__dispatcher.getNextDeadline(), late.getDeadline())
+        self.assertIsNone(self.__dispatcher.dispatch(*self.__echoReply(bytes(self.__template.build(6))),
+                                                     time.time()))
+        self.assertEqual(self.__dispatcher.getExpiredCount(), 1)
+
+    def testAnsweredProbeDoesNotExpire(self):
+        pendingProbe, packetBytes = self.__register(8, timeout=1.0)
+        self.__dispatcher.dispatch(*self.__echoReply(packetBytes), time.time())
+        self.assertEqual(self.__dispatcher.expire(pendingProbe.getDeadline() + 1), 0)
+        self.assertIsNone(self.__dispatcher.getNextDeadline())
+
+    def testReusedSequenceNumberCancelsOlderProbe(self):
+        older, packetBytes = self.__register(9)
+        newer, packetBytes = self.__register(9)
+        self.assertEqual(older.getState(), IcmpHelperLibrary.IcmpPendingProbe.STATE_CANCELLED)
+        self.assertIs(self.__dispatcher.dispatch(*self.__echoReply(packetBytes), time.time()), newer)
+
+    def testCancelAll(self):
+        probes = [self.__register(sequenceNumber)[0] for sequenceNumber in range(10, 15)]
+        self.__dispatcher.cancelAll()
+        self.assertEqual(self.__dispatcher.getPendingCount(), 0)
+        self.assertEqual([pendingProbe.getState() for pendingProbe in self.__finished],
+                         [IcmpHelperLibrary.IcmpPendingProbe.STATE_CANCELLED] * len(probes))
+        self.assertIsNone(self.__dispatcher.getNextDeadline())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import io
+import json
+import os
+import sys
+import unittest
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpMetricsTest                                                                                                #
+#                                                                                                                      #
+# Counters, gauges and phase timings as snapshot() and the Prometheus text format show them, and what a ping over a    #
+# simulated socket reports while metrics are active.                                                                   #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpMetricsTest(unittest.TestCase):
+    class RecordingHook(IcmpHelperLibrary.IcmpMetricsHook):
+        def __init__(self):
+            self.__updates = []
+
+        def getUpdates(self):
+            return self.__updates
+
+        def onCount(self, name, amount):
+            self.__updates.append(("count", name, amount))
+
+        def onTiming(self, phase, durationNs):
+            self.__updates.append(("timing", phase, durationNs))
+
+    def setUp(self):
+        self.__metrics = IcmpHelperLibrary.IcmpMetrics()
+        self.__metrics.count("probes_sent", 3)
+        self.__metrics.count("replies_received", 2)
+        self.__metrics.setGauge("probes_in_flight", 1)
+        for durationNs in (1000000, 2000000, 3000000):
+            self.__metrics.recordTiming("wait", durationNs)
+
+    def tearDown(self):
+        IcmpHelperLibrary.IcmpMetrics.setActive(None)
+
+    def testSnapshot(self):
+        snapshot = self.__metrics.snapshot()
+        self.assertEqual(snapshot["counters"]["probes_sent"], 3)
+        self.assertEqual(snapshot["counters"]["timeouts"], 0)
+        self.assertEqual(snapshot["gauges"], {"probes_in_flight": 1})
+        waitSnapshot = snapshot["phases"]["wait"]
+        self.assertEqual((waitSnapshot["count"], waitSnapshot["sum_s"]), (3, 0.006))
+        for key, value in (("p50_s", 0.002), ("p90_s", 0.003), ("p99_s", 0.003)):
+            self.assertAlmostEqual(waitSnapshot[key], value, delta=value / 128)     # Histogram bucket precision
+        self.assertEqual(snapshot["phases"]["send"], {"count": 0, "sum_s": 0.0, "p50_s": None, "p90_s": None,
+                                                      "p99_s": None})
+        self.assertEqual(json.loads(json.dumps(snapshot)), snapshot)
+
+    def testPrometheusFormat(self):
+        text = self.__metrics.formatPrometheus()
+        self.assertTrue(text.endswith("\n"))
+        lines = text.splitlines()
+        self.assertIn("# TYPE icmp_probes_sent_total counter", lines)
+        self.assertIn("icmp_probes_sent_total 3", lines)
+        self.assertIn("icmp_timeouts_total 0", lines)
+        self.assertIn("# TYPE icmp_probes_in_flight gauge", lines)
+        self.assertIn("icmp_probes_in_flight 1", lines)
+        values = dict(line.rsplit(" ", 1) for line in lines if not line.startswith("#"))
+        self.assertAlmostEqual(float(values['icmp_phase_duration_seconds{phase="wait",quantile="0.5"}']), 0.002,
+                               delta=0.002 / 128)
+        self.assertAlmostEqual(float(values['icmp_phase_duration_seconds{phase="wait",quantile="0.99"}']), 0.003,
+                               delta=0.003 / 128)
+        self.assertIn('icmp_phase_duration_seconds_sum{phase="wait"} 0.006', lines)
+        self.assertIn('icmp_phase_duration_seconds_count{phase="wait"} 3', lines)
+        self.assertIn('icmp_phase_duration_seconds{phase="send",quantile="0.9"} NaN', lines)
+        self.assertEqual(lines.count("# TYPE icmp_phase_duration_seconds summary"), 1)
+        for name, value in values.items():
+            self.assertRegex(name, r'^icmp_[a-z_]+(\{phase="[a-z_]+"(,quantile="[0-9.]+")?\})?$')
+            float(value)
+
+    def testHooksSeeEveryUpdate(self):
+        hook = self.RecordingHook()
+        self.__metrics.addHook(hook)
+        self.__metrics.count("timeouts")
+        self.__metrics.recordTiming("send", 500)
+        self.__metrics.removeHook(hook)
+        self.__metrics.count("timeouts")
+        self.assertEqual(hook.getUpdates(), [("count", "timeouts", 1), ("timing", "send", 500)])
+        self.assertEqual(self.__metrics.getCounter("timeouts"), 2)
+
+    def testPingReportsToActiveMetrics(self):
+        metrics = IcmpHelperLibrary.IcmpMetrics()
+        self.assertIsNone(IcmpHelperLibrary.IcmpMetrics.setActive(metrics))
+        icmpHelperLibrary = IcmpHelperLibrary(icmpSocket=IcmpHelperLibrary.IcmpSimulatedSocket(lossRate=0.5, seed=2),
+                                              sink=IcmpHelperLibrary.IcmpQuietSink())
+        icmpHelperLibrary.sendPing("192.0.2.9", count=6, timeout=0.05)
+        self.assertIs(IcmpHelperLibrary.IcmpMetrics.setActive(None), metrics)
+        self.assertEqual(metrics.getCounter("probes_sent"), 6)
+        self.assertEqual(metrics.getCounter("replies_received") + metrics.getCounter("timeouts"), 6)
+        self.assertGreater(metrics.getCounter("timeouts"), 0)
+        self.assertEqual(metrics.getHistogram("build").getTotalCount(), 6)
+
+
+# #################################################################################################################### #
+# Class IcmpMetricsExportTest                                                                                          #
+#                                                                                                                      #
+# The HTTP endpoint on a free localhost port and the JSON lines snapshot writer.                                       #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpMetricsExportTest(unittest.TestCase):
+    def setUp(self):
+        self.__metrics = IcmpHelperLibrary.IcmpMetrics()
+        self.__metrics.count("probes_sent", 5)
+
+    def __get(self, server, path):
+        address, port = server.getAddress()
+        with urllib.request.urlopen("http://%s:%d%s" % (address, port, path), timeout=5) as response:
+            return response.headers["Content-Type"], response.read().decode("utf-8")
+
+    def testServer(self):
+        with IcmpHelperLibrary.IcmpMetricsServer(self.__metrics, port=0) as server:
+            contentType, body = self.__get(server, "/metrics")
+            self.assertTrue(contentType.startswith("text/plain; version=0.0.4"))
+            self.assertIn("icmp_probes_sent_total 5\n", body)
+            contentType, body = self.__get(server, "/metrics.json")
+            self.assertEqual(contentType, "application/json")
+            self.assertEqual(json.loads(body)["counters"]["probes_sent"], 5)
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                self.__get(server, "/other")
+            self.assertEqual(context.exception.code, 404)
+            context.exception.close()
+
+    def testSnapshotWriterWritesLastSnapshotOnClose(self):
+        stream = io.StringIO()
+        writer = IcmpHelperLibrary.IcmpMetricsSnapshotWriter(self.__metrics, stream, interval=3600)
+        self.__metrics.count("probes_sent")
+        writer.close()
+        snapshots = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(snapshots[0]["counters"]["probes_sent"], 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
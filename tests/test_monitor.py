@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpTimingWheelTest                                                                                            #
+#                                                                                                                      #
+# A small wheel (4 slots, 2 levels, 1 s ticks from time 0) so that deadlines cascade and overflow with few entries.    #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpTimingWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.__wheel = IcmpHelperLibrary.IcmpTimingWheel(tickDuration=1, wheelSize=4, levels=2, startTime=0)
+
+    def __runUntil(self, lastTick):
+        # tick -> items that came due on it
+        fired = {}
+        for tick in range(1, lastTick + 1):
+            dueItems = self.__wheel.advance(tick)
+            if len(dueItems) > 0:
+                fired[tick] = dueItems
+        return fired
+
+    def testItemsFireOnTheFirstTickAtOrAfterTheirDeadline(self):
+        for deadline in (40, 0.5, 17, 3, 5, 16, 15.2):
+            self.__wheel.schedule(deadline, deadline)
+        self.assertEqual(self.__wheel.getCount(), 7)
+        self.assertEqual(self.__runUntil(45), {1: [0.5], 3: [3], 5: [5], 16: [16, 15.2], 17: [17], 40: [40]})
+        self.assertEqual(self.__wheel.getCount(), 0)
+
+    def testSameTickFiresInSchedulingOrder(self):
+        for item in ("a", "b", "c"):
+            self.__wheel.schedule(6, item)
+        self.assertEqual(self.__wheel.advance(10), ["a", "b", "c"])
+
+    def testPastDeadlineFiresOnNextTick(self):
+        self.__wheel.advance(7)
+        self.__wheel.schedule(2, "late")
+        self.assertEqual(self.__wheel.getNextTickTime(), 8)
+        self.assertEqual(self.__wheel.advance(7.5), [])
+        self.assertEqual(self.__wheel.advance(8), ["late"])
+
+    def testIdleWheelSkipsAhead(self):
+        self.assertEqual(self.__wheel.advance(1000), [])
+        self.__wheel.schedule(1003, "next")
+        self.assertEqual(self.__runUntil(1003)[1003], ["next"])
+
+
+# #################################################################################################################### #
+# Class IcmpMonitorTest                                                                                                #
+#                                                                                                                      #
+# Short monitor runs over a simulated socket: probes keep to the interval grid and every probe sent ends up in the     #
+# summaries, those still in flight when the monitor stops included.                                                    #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpMonitorTest(unittest.TestCase):
+    __TARGETS = ["192.0.2.1", "192.0.2.2", "192.0.2.3"]
+
+    def __run(self, icmpSocket, interval, timeout, duration):
+        sink = IcmpHelperLibrary.IcmpMemorySink()
+        monitor = IcmpHelperLibrary.IcmpMonitor(icmpSocket, self.__TARGETS, interval, timeout, reportInterval=60,
+                                                sink=sink, tickDuration=0.005)
+        monitor.run(duration)
+        return sink
+
+    def testProbesFollowTheGrid(self):
+        sink = self.__run(IcmpHelperLibrary.IcmpSimulatedSocket(delay=0.002, seed=1), 0.05, 0.05, 0.5)
+        pingResults = sink.getRecords(IcmpHelperLibrary.IcmpPingResult.RECORD_TYPE)
+        self.assertEqual(sorted(pingResult.getTarget() for pingResult in pingResults), self.__TARGETS)
+        for pingResult in pingResults:
+            self.assertIn(pingResult.getPacketsSent(), range(9, 12))
+            self.assertGreaterEqual(pingResult.getPacketsReceived(), pingResult.getPacketsSent() - 1)
+        monitorReport, = sink.getRecords(IcmpHelperLibrary.IcmpMonitorReport.RECORD_TYPE)
+        self.assertEqual(monitorReport.getTargetCount(), 3)
+        self.assertLess(monitorReport.getLagStatistics().getMaxRtt(), 50)
+        self.assertEqual(monitorReport.getOverruns(), 0)
+
+    def testProbesInFlightAtStopAreCountedAsLost(self):
+        sink = self.__run(IcmpHelperLibrary.IcmpSimulatedSocket(lossRate=1.0, seed=1), 0.2, 0.2, 0.3)
+        probeResults = sink.getRecords(IcmpHelperLibrary.IcmpProbeResult.RECORD_TYPE)
+        pingResults = sink.getRecords(IcmpHelperLibrary.IcmpPingResult.RECORD_TYPE)
+        monitorReport, = sink.getRecords(IcmpHelperLibrary.IcmpMonitorReport.RECORD_TYPE)
+        self.assertEqual(len(probeResults), monitorReport.getProbesSent())
+        self.assertEqual(sum(pingResult.getPacketsSent() for pingResult in pingResults), monitorReport.getProbesSent())
+        self.assertGreater(monitorReport.getProbesSent(), len(self.__TARGETS))
+        for probeResult in probeResults:
+            self.assertEqual(probeResult.getStatus(), IcmpHelperLibrary.IcmpProbeResult.STATUS_TIMEOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpMdaStoppingRuleTest                                                                                        #
+#                                                                                                                      #
+# n(k) against the union bound the class documents, which asks for a probe more than the exact tables of the MDA       #
+# papers at some k (39 rather than 38 at k = 7 for 95%).                                                               #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpMdaStoppingRuleTest(unittest.TestCase):
+    def testNinetyFivePercentTable(self):
+        stoppingRule = IcmpHelperLibrary.IcmpMdaStoppingRule()
+        self.assertEqual(stoppingRule.getConfidence(), 0.95)
+        self.assertEqual([stoppingRule.getProbesNeeded(k) for k in range(1, 11)],
+                         [6, 11, 16, 21, 27, 33, 39, 45, 51, 57])
+
+    def testNothingSeenNeedsAsManyAsOneNextHop(self):
+        stoppingRule = IcmpHelperLibrary.IcmpMdaStoppingRule()
+        self.assertEqual(stoppingRule.getProbesNeeded(0), stoppingRule.getProbesNeeded(1))
+
+    def testTableIsComputedAsFarAsAskedFor(self):
+        # Asking for a large k first fills in the entries below it the same way as asking for them one by one
+        stoppingRule = IcmpHelperLibrary.IcmpMdaStoppingRule(0.99)
+        stepwiseRule = IcmpHelperLibrary.IcmpMdaStoppingRule(0.99)
+        self.assertEqual(stoppingRule.getProbesNeeded(16), stepwiseRule.getProbesNeeded(16))
+        self.assertEqual([stoppingRule.getProbesNeeded(k) for k in range(17)],
+                         [stepwiseRule.getProbesNeeded(k) for k in range(17)])
+
+    def testFormula(self):
+        for confidence in (0.5, 0.9, 0.99, 0.999):
+            stoppingRule = IcmpHelperLibrary.IcmpMdaStoppingRule(confidence)
+            previous = 0
+            for k in range(1, 40):
+                probesNeeded = stoppingRule.getProbesNeeded(k)
+                # Just enough probes for all of them to miss a (k+1)th next hop with at most 1 - confidence
+                self.assertLessEqual((k + 1) * (k / (k + 1)) ** probesNeeded, 1 - confidence + 1e-12)
+                self.assertGreater((k + 1) * (k / (k + 1)) ** (probesNeeded - 1), 1 - confidence)
+                self.assertGreater(probesNeeded, previous)
+                previous = probesNeeded
+
+    def testHigherConfidenceNeedsMoreProbes(self):
+        lowerRule = IcmpHelperLibrary.IcmpMdaStoppingRule(0.9)
+        higherRule = IcmpHelperLibrary.IcmpMdaStoppingRule(0.99)
+        for k in range(1, 20):
+            self.assertGreater(higherRule.getProbesNeeded(k), lowerRule.getProbesNeeded(k))
+
+    def testConfidenceMustBeBetweenZeroAndOne(self):
+        for confidence in (0, 1, -0.5, 1.5):
+            with self.assertRaises(ValueError):
+                IcmpHelperLibrary.IcmpMdaStoppingRule(confidence)
+
+
+
+# #################################################################################################################### #
+# Class IcmpMultipathTraceTest                                                                                         #
+#                                                                                                                      #
+# A simulated route with a per-flow load balanced second hop: MDA finds all of its interfaces, and a Paris trace on    #
+# one flow keeps to a single one.                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpMultipathTraceTest(unittest.TestCase):
+    __DESTINATION = "198.51.100.7"
+    __BALANCED = ["10.0.1.1", "10.0.1.2", "10.0.1.3"]
+
+    def setUp(self):
+        network = IcmpHelperLibrary.IcmpSimulatedNetwork(seed=1)
+        network.addRoute("198.51.100.0/24", [IcmpHelperLibrary.IcmpSimulatedHop("10.0.0.1"),
+                                             IcmpHelperLibrary.IcmpSimulatedHop(self.__BALANCED),
+                                             IcmpHelperLibrary.IcmpSimulatedHop("10.0.2.1")])
+        self.__icmpHelperLibrary = IcmpHelperLibrary(icmpSocket=IcmpHelperLibrary.IcmpSimulatedSocket(
+            network=network, seed=1), sink=IcmpHelperLibrary.IcmpQuietSink())
+
+    def testMdaFindsEveryNextHop(self):
+        multipathResult = self.__icmpHelperLibrary.traceRouteMultipath(self.__DESTINATION, timeout=0.5)
+        self.assertEqual(multipathResult.getStopReason(), IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION)
+        self.assertEqual(multipathResult.getLastTtl(), 4)
+        self.assertEqual(multipathResult.getSuccessors(1, "10.0.0.1"), self.__BALANCED)
+        self.assertEqual(multipathResult.getInterfaces(2), self.__BALANCED)
+        for interface in self.__BALANCED:
+            self.assertEqual(multipathResult.getSuccessors(2, interface), ["10.0.2.1"])
+        self.assertEqual(multipathResult.getSuccessors(3, "10.0.2.1"), [self.__DESTINATION])
+        # Three next hops at TTL 2 take at least n(3) flows to rule out a fourth
+        self.assertGreaterEqual(multipathResult.getFlowCount(),
+                                IcmpHelperLibrary.IcmpMdaStoppingRule().getProbesNeeded(3))
+
+    def testParisTraceKeepsToOneFlow(self):
+        for flowId in range(1, 5):
+            traceResult = self.__icmpHelperLibrary.traceRouteParallel(self.__DESTINATION, probesPerHop=4, timeout=0.5,
+                                                                      flowId=flowId)
+            addresses = {probeResult.getAddress() for probeResult in traceResult.getHops()[1][1]}
+            self.assertEqual(len(addresses), 1)
+        traceResult = self.__icmpHelperLibrary.traceRouteParallel(self.__DESTINATION, probesPerHop=16, timeout=0.5)
+        self.assertGreater(len({probeResult.getAddress() for probeResult in traceResult.getHops()[1][1]}), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
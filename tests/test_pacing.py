@@ -0,0 +1,154 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpHopPacingTest                                                                                              #
+#                                                                                                                      #
+# The pacing state machine of one responder on a virtual clock: a sender that wants wantRate probes per second and is  #
+# held back by the pacing, and a responder losing lossRate of them at random and/or answering at most limitRate.       #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpHopPacingTest(unittest.TestCase):
+    def __run(self, hopPacing, seed=0, probes=400, lossRate=0.0, limitRate=None, wantRate=20.0, paced=True):
+        rng = random.Random(seed)
+        limiter = IcmpHelperLibrary.IcmpTokenBucket(limitRate, 2) if limitRate is not None else None
+        now = 0.0
+        for i in range(probes):
+            now = now + 1.0 / wantRate
+            if paced:
+                now = now + hopPacing.getWaitTime(now)
+            sendGap = hopPacing.recordSend(now)
+            answered = rng.random() >= lossRate
+            if limiter is not None:
+                answered = limiter.take(now) and answered
+            hopPacing.recordOutcome(answered, sendGap)
+        return now
+
+    def __newHopPacing(self):
+        return IcmpHelperLibrary.IcmpHopPacing(50.0, 8, 0.5, 1000.0)
+
+    def testAnswersRaiseRateToMaximum(self):
+        hopPacing = self.__newHopPacing()
+        now = 0.0
+        for i in range(hopPacing.INCREASE_AFTER):
+            hopPacing.recordOutcome(True, hopPacing.recordSend(now))
+            now = now + 0.001
+        self.assertEqual(hopPacing.getRate(), 100.0)
+        for i in range(10 * hopPacing.INCREASE_AFTER):
+            hopPacing.recordOutcome(True, hopPacing.recordSend(now))
+        self.assertEqual(hopPacing.getRate(), 1000.0)
+        self.assertFalse(hopPacing.isRateLimited())
+
+    def testNoTrialBeforeFullWindow(self):
+        hopPacing = self.__newHopPacing()
+        now = 0.0
+        for i in range(hopPacing.SAMPLE_WINDOW - 1):
+            now = now + 0.05
+            hopPacing.recordOutcome(i % 2 == 0, hopPacing.recordSend(now))
+            self.assertFalse(hopPacing.isTrialRunning())
+        now = now + 0.05
+        hopPacing.recordOutcome(False, hopPacing.recordSend(now))
+        self.assertTrue(hopPacing.isTrialRunning())
+        self.assertAlmostEqual(hopPacing.getRate(), 10.0)      # Half the 20 probes/s they went at
+        self.assertEqual(hopPacing.getBurst(), 1)
+
+    def testSilentResponderStartsNoTrial(self):
+        hopPacing = self.__newHopPacing()
+        self.__run(hopPacing, probes=200, lossRate=1.0)
+        self.assertFalse(hopPacing.isTrialRunning())
+        self.assertFalse(hopPacing.isRateLimited())
+        self.assertEqual(hopPacing.getRate(), 50.0)
+
+    def testRandomLossIsNotRateLimiting(self):
+        for lossRate in (0.1, 0.3, 0.5):
+            for seed in range(20):
+                hopPacing = self.__newHopPacing()
+                self.__run(hopPacing, seed, lossRate=lossRate)
+                self.assertFalse(hopPacing.isRateLimited(), (lossRate, seed))
+
+    def testRateLimitIsFound(self):
+        for limitRate in (5.0, 10.0, 15.0):
+            for seed in range(5):
+                hopPacing = self.__newHopPacing()
+                self.__run(hopPacing, seed, limitRate=limitRate)
+                self.assertTrue(hopPacing.isRateLimited(), (limitRate, seed))
+                # Paced at about what the responder answers, between the trial rate and the rate it was found at
+                self.assertGreaterEqual(hopPacing.getRate(), limitRate * 0.5)
+                self.assertLess(hopPacing.getRate(), 20.0)
+
+    def testRateLimitIsFoundWithLoss(self):
+        found = 0
+        for seed in range(20):
+            hopPacing = self.__newHopPacing()
+            self.__run(hopPacing, seed, lossRate=0.2, limitRate=5.0)
+            found += hopPacing.isRateLimited()
+        self.assertGreaterEqual(found, 18)
+
+    def testTrialAtCallerScheduleIsInconclusive(self):
+        # Probes that keep going faster than the trial rate say nothing about it; the trial gives up and the rate
+        # is restored
+        hopPacing = self.__newHopPacing()
+        self.__run(hopPacing, probes=hopPacing.SAMPLE_WINDOW + hopPacing.TRIAL_MAXIMUM + 1, limitRate=5.0,
+                   paced=False)
+        self.assertFalse(hopPacing.isRateLimited())
+        self.assertFalse(hopPacing.isTrialRunning())
+        self.assertEqual(hopPacing.getRate(), 50.0)
+        self.assertEqual(hopPacing.getBurst(), 8)
+
+    def testOutstandingProbesHoldBackVerdict(self):
+        # Answers come back before losses time out: a trial that only saw answers so far with probes still out
+        # must not conclude from them
+        hopPacing = self.__newHopPacing()
+        now = 0.0
+        for i in range(hopPacing.SAMPLE_WINDOW):
+            now = now + 0.05
+            hopPacing.recordOutcome(i % 4 == 0, hopPacing.recordSend(now))
+        self.assertTrue(hopPacing.isTrialRunning())
+        sendGaps = []
+        for i in range(64):
+            now = now + 1.0 / hopPacing.getRate()
+            sendGaps.append(hopPacing.recordSend(now))
+        for sendGap in sendGaps[:16]:
+            self.assertFalse(hopPacing.recordOutcome(True, sendGap))
+        self.assertTrue(hopPacing.isTrialRunning())
+        self.assertFalse(hopPacing.isRateLimited())
+
+
+# #################################################################################################################### #
+# Class IcmpPacerTest                                                                                                  #
+#                                                                                                                      #
+#                                                                                                                      #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpPacerTest(unittest.TestCase):
+    def testHopPacingCanBeLeftOut(self):
+        pacer = IcmpHelperLibrary.IcmpPacer(hopRate=1, hopBurst=1, minimumHopRate=0.5)
+        pacer.take("192.0.2.1", now=100.0)
+        self.assertAlmostEqual(pacer.getDelay("192.0.2.1", now=100.0), 1.0)
+        self.assertEqual(pacer.getDelay("192.0.2.1", now=100.0, hopPacing=False), 0)
+
+    def testGlobalRateStaysWithoutHopPacing(self):
+        pacer = IcmpHelperLibrary.IcmpPacer(rate=2, hopRate=1000, hopBurst=1000, maximumHopRate=1000)
+        pacer.take("192.0.2.1", now=100.0)
+        pacer.take("192.0.2.1", now=100.0)
+        self.assertAlmostEqual(pacer.getDelay("192.0.2.1", now=100.0, hopPacing=False), 0.5)
+
+    def testHopRatesMustBeOrdered(self):
+        with self.assertRaises(ValueError):
+            IcmpHelperLibrary.IcmpPacer(hopRate=10, minimumHopRate=20)
+        with self.assertRaises(ValueError):
+            IcmpHelperLibrary.IcmpPacer(hopRate=10, maximumHopRate=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpResolverTest                                                                                               #
+#                                                                                                                      #
+# The cache in front of stub lookup functions that count their calls, so nothing here touches the system resolver.     #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpResolverTest(unittest.TestCase):
+    __HOSTS = {"one.example": "192.0.2.1", "two.example": "192.0.2.2", "three.example": "192.0.2.3"}
+    __NAMES = {"192.0.2.1": "one.example"}
+
+    def setUp(self):
+        self.__forwardCalls = []
+        self.__reverseCalls = []
+        self.__resolvers = []
+
+    def tearDown(self):
+        for resolver in self.__resolvers:
+            resolver.close()
+
+    def __forward(self, host):
+        self.__forwardCalls.append(host)
+        if host not in self.__HOSTS:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return self.__HOSTS[host]
+
+    def __reverse(self, address):
+        self.__reverseCalls.append(address)
+        if address not in self.__NAMES:
+            raise socket.herror(1, "Unknown host")
+        return self.__NAMES[address]
+
+    def __createResolver(self, **arguments):
+        resolver = IcmpHelperLibrary.IcmpResolver(forwardResolver=self.__forward, reverseResolver=self.__reverse,
+                                                  **arguments)
+        self.__resolvers.append(resolver)
+        return resolver
+
+    def testRepeatedLookupIsCached(self):
+        resolver = self.__createResolver()
+        self.assertEqual(resolver.resolve("one.example"), "192.0.2.1")
+        self.assertEqual(resolver.resolve(" one.example "), "192.0.2.1")
+        self.assertEqual(self.__forwardCalls, ["one.example"])
+        self.assertEqual((resolver.getHits(), resolver.getMisses()), (1, 1))
+
+    def testFailureIsCachedForNegativeTtl(self):
+        resolver = self.__createResolver()
+        for attempt in range(2):
+            self.assertRaises(socket.gaierror, resolver.resolve, "missing.example")
+        self.assertEqual(self.__forwardCalls, ["missing.example"])
+        resolver = self.__createResolver(negativeTtl=0)
+        for attempt in range(2):
+            self.assertRaises(socket.gaierror, resolver.resolve, "missing.example")
+        self.assertEqual(self.__forwardCalls, ["missing.example"] * 3)
+
+    def testExpiredEntryIsLookedUpAgain(self):
+        resolver = self.__createResolver(ttl=0)
+        resolver.resolve("one.example")
+        resolver.resolve("one.example")
+        self.assertEqual(self.__forwardCalls, ["one.example"] * 2)
+
+    def testLeastRecentlyUsedEntryIsEvicted(self):
+        resolver = self.__createResolver(maxEntries=2)
+        resolver.resolve("one.example")
+        resolver.resolve("two.example")
+        resolver.resolve("one.example")
+        resolver.resolve("three.example")
+        self.assertEqual(resolver.getSize(), 2)
+        resolver.resolve("one.example")
+        resolver.resolve("two.example")
+        self.assertEqual(self.__forwardCalls, ["one.example", "two.example", "three.example", "two.example"])
+
+    def testReverseLookup(self):
+        resolver = self.__createResolver()
+        self.assertEqual(resolver.reverse("192.0.2.1"), "one.example")
+        self.assertIsNone(resolver.reverse("192.0.2.2"))
+        self.assertIsNone(resolver.reverse("192.0.2.2"))
+        self.assertEqual(self.__reverseCalls, ["192.0.2.1", "192.0.2.2"])
+
+    def testBackgroundLookups(self):
+        resolver = self.__createResolver()
+        literal = resolver.resolveInBackground("192.0.2.7")
+        self.assertTrue(literal.done())
+        self.assertEqual(literal.result(), "192.0.2.7")
+        futures = [resolver.resolveInBackground(host) for host in self.__HOSTS]
+        self.assertEqual([future.result(5) for future in futures], list(self.__HOSTS.values()))
+        self.assertEqual(resolver.reverseInBackground("192.0.2.1").result(5), "one.example")
+        self.assertEqual(sorted(self.__forwardCalls), sorted(self.__HOSTS))
+
+    def testClear(self):
+        resolver = self.__createResolver()
+        resolver.resolve("one.example")
+        resolver.clear()
+        self.assertEqual(resolver.getSize(), 0)
+        resolver.resolve("one.example")
+        self.assertEqual(len(self.__forwardCalls), 2)
+
+    def testLibraryResolvesThroughItsResolver(self):
+        resolver = self.__createResolver()
+        icmpHelperLibrary = IcmpHelperLibrary(icmpSocket=IcmpHelperLibrary.IcmpSimulatedSocket(seed=1),
+                                              resolver=resolver, sink=IcmpHelperLibrary.IcmpQuietSink())
+        pingResult = icmpHelperLibrary.sendPing("one.example", count=2, timeout=1)
+        self.assertEqual(pingResult.getDestinationIpAddress(), "192.0.2.1")
+        self.assertEqual(pingResult.getPacketsReceived(), 2)
+        sweepTargets = list(icmpHelperLibrary.sweep(["two.example", "missing.example", "two.example"], count=1,
+                                                    timeout=1, interval=0))
+        self.assertEqual(sorted(sweepTarget.getTarget() for sweepTarget in sweepTargets),
+                         ["missing.example", "two.example", "two.example"])
+        for sweepTarget in sweepTargets:
+            self.assertEqual(sweepTarget.getError() is None, sweepTarget.getTarget() == "two.example")
+        self.assertEqual(self.__forwardCalls.count("two.example"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
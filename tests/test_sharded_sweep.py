@@ -0,0 +1,70 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpShardReportTest                                                                                            #
+#                                                                                                                      #
+# Rows of a shard that had nothing to send, and of one merged from two others.                                         #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpShardReportTest(unittest.TestCase):
+    def testEmptyShardHasNoLoss(self):
+        shardReport = IcmpHelperLibrary.IcmpShardReport(0, range(16, 32))
+        row = shardReport.toDict()
+        self.assertEqual((row["shard"], row["identifiers"], row["sent"]), (0, "16-31", 0))
+        self.assertIsNone(row["packet_loss"])
+        self.assertIsNone(row["average_ms"])
+        self.assertIn("Packet_Loss=0.00", shardReport.formatConsoleLine())
+
+    def testMergedReportAddsUp(self):
+        totalReport = IcmpHelperLibrary.IcmpShardReport(None, range(0, 32))
+        for shardIndex, lossRate in ((0, 0.0), (1, 1.0)):
+            sweepTarget = IcmpHelperLibrary.IcmpSweepTarget("192.0.2.%d" % shardIndex, "192.0.2.%d" % shardIndex)
+            statistics = sweepTarget.getStatistics()
+            statistics.recordSent(2)
+            if lossRate == 0.0:
+                statistics.recordRtt(10000000)
+                statistics.recordRtt(20000000)
+            shardReport = IcmpHelperLibrary.IcmpShardReport(shardIndex, range(shardIndex * 16, shardIndex * 16 + 16))
+            shardReport.recordTarget(sweepTarget)
+            totalReport.merge(shardReport)
+        row = totalReport.toDict()
+        self.assertEqual((row["shard"], row["targets"], row["sent"], row["received"]), ("total", 2, 4, 2))
+        self.assertEqual(row["packet_loss"], 0.5)
+        self.assertEqual(row["average_ms"], 15)
+
+
+# #################################################################################################################### #
+# Class IcmpSweepShardedTest                                                                                           #
+#                                                                                                                      #
+# Sweeps over simulated transports in worker processes: a short target list is split over every worker and the shard   #
+# reports are kept on the library rather than written to its sink.                                                     #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpSweepShardedTest(unittest.TestCase):
+    __TARGETS = ["192.0.2.%d" % hostNumber for hostNumber in range(1, 9)]
+
+    def testShortTargetListIsSplitOverEveryWorker(self):
+        sink = IcmpHelperLibrary.IcmpMemorySink()
+        icmpHelperLibrary = IcmpHelperLibrary(sink=sink, transport="simulated")
+        sweepTargets = list(icmpHelperLibrary.sweepSharded(self.__TARGETS, workers=4, count=2, timeout=1,
+                                                            interval=0.01))
+        self.assertEqual(sorted(sweepTarget.getTarget() for sweepTarget in sweepTargets), sorted(self.__TARGETS))
+        self.assertEqual(sink.getRecords(IcmpHelperLibrary.IcmpShardReport.RECORD_TYPE), [])
+        shardReports = icmpHelperLibrary.getLastShardReports()
+        self.assertEqual([shardReport.getShardIndex() for shardReport in shardReports], [0, 1, 2, 3, None])
+        self.assertEqual([shardReport.getTargetCount() for shardReport in shardReports], [2, 2, 2, 2, 8])
+        self.assertEqual(shardReports[-1].getStatistics().getPacketsSent(), 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
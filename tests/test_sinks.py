@@ -0,0 +1,142 @@
+import csv
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpResultSinkTest                                                                                             #
+#                                                                                                                      #
+# What each sink makes of the same probe and ping records, written to an in-memory stream.                             #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpResultSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.__reply = IcmpHelperLibrary.IcmpProbeResult("host.example", "192.0.2.9", 255, 7, 1,
+                                                         IcmpHelperLibrary.IcmpProbeResult.STATUS_REPLY, "192.0.2.9",
+                                                         0, 0, 12500000)
+        self.__timeout = IcmpHelperLibrary.IcmpProbeResult("host.example", "192.0.2.9", 255, 7, 2,
+                                                           IcmpHelperLibrary.IcmpProbeResult.STATUS_TIMEOUT)
+        self.__pingResult = IcmpHelperLibrary.IcmpPingResult("host.example", "192.0.2.9")
+        self.__pingResult.addProbe(self.__reply)
+        self.__pingResult.addProbe(self.__timeout)
+
+    def __writeAll(self, sink):
+        sink.begin("ping", "host.example", "192.0.2.9", 2)
+        for record in (self.__reply, self.__timeout, self.__pingResult):
+            sink.write(record)
+        sink.flush()
+
+    def testJsonLinesSink(self):
+        stream = io.StringIO()
+        self.__writeAll(IcmpHelperLibrary.IcmpJsonLinesSink(stream))
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([record["record"] for record in records], ["probe", "probe", "ping"])
+        self.assertEqual(records[0], self.__reply.toDict())
+        self.assertEqual(records[0]["rtt_ms"], 12.5)
+        self.assertIsNone(records[1]["rtt_ms"])
+        self.assertEqual(records[2]["received"], 1)
+
+    def testCsvSinkWritesOneRecordType(self):
+        stream = io.StringIO()
+        self.__writeAll(IcmpHelperLibrary.IcmpCsvSink(stream))
+        rows = list(csv.reader(io.StringIO(stream.getvalue())))
+        self.assertEqual(rows[0], list(IcmpHelperLibrary.IcmpProbeResult.FIELDS))
+        self.assertEqual([row[5] for row in rows[1:]], ["1", "2"])
+        stream = io.StringIO()
+        self.__writeAll(IcmpHelperLibrary.IcmpCsvSink(stream, IcmpHelperLibrary.IcmpPingResult.RECORD_TYPE))
+        rows = list(csv.reader(io.StringIO(stream.getvalue())))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0], list(IcmpHelperLibrary.IcmpPingResult.FIELDS))
+
+    def testConsoleSink(self):
+        stream = io.StringIO()
+        self.__writeAll(IcmpHelperLibrary.IcmpConsoleSink(stream))
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines[0], "Ping 2 packets to  192.0.2.9")
+        self.assertEqual(lines[1:], [self.__reply.formatConsoleLine(), self.__timeout.formatConsoleLine(),
+                                     self.__pingResult.formatConsoleLine()])
+
+    def testQuietSinkWritesNothing(self):
+        stream = io.StringIO()
+        self.__writeAll(IcmpHelperLibrary.IcmpQuietSink(stream))
+        self.assertEqual(stream.getvalue(), "")
+
+    def testOutputIsBatched(self):
+        stream = io.StringIO()
+        sink = IcmpHelperLibrary.IcmpJsonLinesSink(stream, batchSize=3, flushInterval=3600)
+        sink.write(self.__reply)
+        sink.write(self.__timeout)
+        self.assertEqual(stream.getvalue(), "")
+        sink.write(self.__pingResult)
+        self.assertEqual(len(stream.getvalue().splitlines()), 3)
+        sink.write(self.__reply)
+        sink.close()
+        self.assertEqual(len(stream.getvalue().splitlines()), 4)
+
+    def testTeeSink(self):
+        memorySink = IcmpHelperLibrary.IcmpMemorySink()
+        stream = io.StringIO()
+        self.__writeAll(IcmpHelperLibrary.IcmpTeeSink(memorySink, IcmpHelperLibrary.IcmpConsoleSink(stream)))
+        self.assertEqual(memorySink.getRecords("probe"), [self.__reply, self.__timeout])
+        self.assertEqual(len(stream.getvalue().splitlines()), 4)
+
+
+# #################################################################################################################### #
+# Class IcmpTraceOutputTest                                                                                            #
+#                                                                                                                      #
+# The records trace routes over a simulated network hand their sink, and the result objects they return.               #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpTraceOutputTest(unittest.TestCase):
+    __DESTINATION = "192.0.2.9"
+
+    class RecordingSink(IcmpHelperLibrary.IcmpMemorySink):
+        def __init__(self):
+            super().__init__()
+            self.__begins = []
+
+        def getBegins(self):
+            return self.__begins
+
+        def begin(self, command, target, destinationIpAddress, count=None):
+            self.__begins.append((command, target, destinationIpAddress))
+
+    def setUp(self):
+        self.__sink = self.RecordingSink()
+        self.__icmpHelperLibrary = IcmpHelperLibrary(icmpSocket=IcmpHelperLibrary.IcmpSimulatedSocket(hopCount=3,
+                                                                                                     seed=1),
+                                                     sink=self.__sink)
+
+    def testTraceRouteBeginsOnce(self):
+        hops = self.__icmpHelperLibrary.traceRoute(self.__DESTINATION, probesPerHop=2, timeout=1)
+        self.assertEqual(len(hops), 3)
+        self.assertEqual(self.__sink.getBegins(), [("trace", self.__DESTINATION, self.__DESTINATION)])
+        self.assertEqual(len(self.__sink.getRecords("probe")), 6)
+        self.assertEqual(len(self.__sink.getRecords("ping")), 3)
+
+    def testTraceRouteParallelReturnsTraceResult(self):
+        traceResult = self.__icmpHelperLibrary.traceRouteParallel(self.__DESTINATION, windowSize=8, probesPerHop=2,
+                                                                  timeout=1)
+        self.assertEqual(traceResult.getStopReason(), IcmpHelperLibrary.IcmpTraceResult.STOP_DESTINATION)
+        self.assertEqual([ttl for ttl, probeResults in traceResult.getHops()], [1, 2, 3])
+        self.assertEqual([probeResult.getAddress() for probeResult in traceResult.getHops()[-1][1]],
+                         [self.__DESTINATION] * 2)
+        self.assertEqual(traceResult.getProbesSent(), 6)
+        self.assertEqual(self.__sink.getBegins(), [("trace", self.__DESTINATION, self.__DESTINATION)])
+        self.assertEqual(self.__sink.getRecords("trace"), [traceResult])
+        self.assertEqual(len(self.__sink.getRecords("probe")), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import random
+import statistics
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IcmpHelperLibrary as icmpHelperModule
+
+IcmpHelperLibrary = icmpHelperModule.IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpRttHistogramTest                                                                                           #
+#                                                                                                                      #
+# Percentiles against the exact ones of the same samples, and the memory the buckets take for many samples.            #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpRttHistogramTest(unittest.TestCase):
+    def setUp(self):
+        generator = random.Random(3)
+        self.__samples = [int(generator.lognormvariate(17, 1.5)) for i in range(20000)]   # Around 24 ms
+
+    def testPercentilesAreWithinBucketPrecision(self):
+        histogram = IcmpHelperLibrary.IcmpRttHistogram()
+        for sample in self.__samples:
+            histogram.record(sample)
+        samples = sorted(self.__samples)
+        for percentile in (1, 10, 50, 90, 99, 99.9):
+            exact = samples[int(max(1, -(-len(samples) * percentile // 100))) - 1]
+            self.assertAlmostEqual(histogram.getValueAtPercentile(percentile), exact,
+                                   delta=exact / (1 << IcmpHelperLibrary.IcmpRttHistogram.SUB_BUCKET_BITS))
+        self.assertEqual(histogram.getTotalCount(), len(samples))
+        self.assertLess(histogram.getBucketCount(), 3000)
+
+    def testSmallValuesAreExact(self):
+        histogram = IcmpHelperLibrary.IcmpRttHistogram()
+        for value in range(256):
+            histogram.record(value)
+        self.assertEqual(histogram.getValueAtPercentile(50), 127)
+        self.assertEqual(histogram.getValueAtPercentile(100), 255)
+        self.assertIsNone(IcmpHelperLibrary.IcmpRttHistogram().getValueAtPercentile(50))
+
+    def testMergeAddsCounts(self):
+        merged = IcmpHelperLibrary.IcmpRttHistogram()
+        whole = IcmpHelperLibrary.IcmpRttHistogram()
+        for part in (self.__samples[:5000], self.__samples[5000:]):
+            histogram = IcmpHelperLibrary.IcmpRttHistogram()
+            for sample in part:
+                histogram.record(sample)
+                whole.record(sample)
+            merged.merge(histogram)
+        self.assertEqual(merged.getCounts(), whole.getCounts())
+        self.assertEqual(merged.copy().getTotalCount(), whole.getTotalCount())
+
+
+# #################################################################################################################### #
+# Class IcmpRttStatisticsTest                                                                                          #
+#                                                                                                                      #
+# Running mean, deviation, jitter and loss against the same figures worked out over the whole sample list.             #
+#                                                                                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpRttStatisticsTest(unittest.TestCase):
+    def __record(self, rttsNs):
+        rttStatistics = IcmpHelperLibrary.IcmpRttStatistics()
+        for rttNs in rttsNs:
+            rttStatistics.recordSent()
+            rttStatistics.recordRtt(rttNs)
+        return rttStatistics
+
+    def testMomentsMatchTheStatisticsModule(self):
+        generator = random.Random(5)
+        rttsNs = [generator.randrange(1000000, 90000000) for i in range(5000)]
+        rttStatistics = self.__record(rttsNs)
+        rttsMs = [rttNs / 1000000 for rttNs in rttsNs]
+        self.assertAlmostEqual(rttStatistics.getAverageRtt(), statistics.fmean(rttsMs), places=6)
+        self.assertAlmostEqual(rttStatistics.getStandardDeviation(), statistics.stdev(rttsMs), places=6)
+        self.assertEqual(rttStatistics.getMinRtt(), min(rttsMs))
+        self.assertEqual(rttStatistics.getMaxRtt(), max(rttsMs))
+        self.assertEqual(rttStatistics.getPercentile(0), min(rttsMs))
+        self.assertEqual(rttStatistics.getPercentile(100), max(rttsMs))
+        self.assertAlmostEqual(rttStatistics.getPercentile(50), statistics.median(rttsMs),
+                               delta=statistics.median(rttsMs) / 64)
+
+    def testJitterFollowsRfc3550(self):
+        rttStatistics = self.__record([10000000, 20000000, 10000000])
+        jitterMs = 10 / 16
+        jitterMs += (10 - jitterMs) / 16
+        self.assertAlmostEqual(rttStatistics.getJitter(), jitterMs)
+
+    def testErrorsCountAsLost(self):
+        rttStatistics = self.__record([10000000])
+        rttStatistics.recordSent(2)
+        rttStatistics.recordRtt(5000000, isReply=False)
+        self.assertEqual((rttStatistics.getPacketsSent(), rttStatistics.getPacketsReceived()), (3, 1))
+        self.assertAlmostEqual(rttStatistics.getPacketLoss(), 2 / 3)
+        self.assertEqual(rttStatistics.getMinRtt(), 5)
+
+    def testMergeMatchesOneStream(self):
+        generator = random.Random(7)
+        rttsNs = [generator.randrange(1000000, 50000000) for i in range(3000)]
+        merged = self.__record(rttsNs[:1000])
+        merged.merge(self.__record(rttsNs[1000:]))
+        merged.merge(IcmpHelperLibrary.IcmpRttStatistics())
+        whole = self.__record(rttsNs)
+        self.assertEqual(merged.getPacketsSent(), whole.getPacketsSent())
+        self.assertAlmostEqual(merged.getAverageRtt(), whole.getAverageRtt(), places=6)
+        self.assertAlmostEqual(merged.getVariance(), whole.getVariance(), places=3)
+        self.assertEqual((merged.getMinRtt(), merged.getMaxRtt()), (whole.getMinRtt(), whole.getMaxRtt()))
+        self.assertEqual(merged.getPercentile(90), whole.getPercentile(90))
+
+    def testRowWithoutSamples(self):
+        rttStatistics = IcmpHelperLibrary.IcmpRttStatistics()
+        rttStatistics.recordSent(4)
+        self.assertEqual(rttStatistics.toRow(), (4, 0, 1.0) + (None,) * 8)
+
+
+if __name__ == "__main__":
+    unittest.main()